@@ -23,22 +23,21 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
 import functools
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 # Importar desde nueva ubicación
 from core.security_utils import pwd_context
+from core.field_encryption import get_field_encryption
 from core.config import settings # Importar settings
 from database.d1_client import get_user_by_username, update_user_auth_status, get_user_by_id, update_db_user, create_db_user, get_all_db_users, delete_db_user # Corregido: get_db_user_by_id -> get_user_by_id
 from database.d1_client import get_all_patients, get_all_appointments, get_all_notifications # Corregido: get_all_citas -> get_all_appointments
+from database.d1_client import list_appointments_page, list_patients_page # Listados paginados
 from database.d1_client import get_patient_by_id, insert_patient as d1_insert_patient, update_patient as d1_update_patient, delete_patient as d1_delete_patient # Pacientes
 from database.d1_client import get_pending_notifications as d1_get_pending_notifications, update_notification_status as d1_update_notification_status, insert_notification as d1_insert_notification # Notificaciones - get_all_notifications ya está arriba
 from database.d1_client import get_system_config as d1_get_system_config, set_system_config as d1_set_system_config, get_all_configs # Configuración
 from database.d1_client import insert_audit_log # Para auditoría
 
-# Importar nuevas funciones de conteo
-from database.d1_client import count_users, count_patients, count_appointments_today, count_pending_notifications
+# Estadísticas agregadas del dashboard
+from database.d1_client import get_dashboard_stats
 
 # Importar funciones de appointments y crear alias para sessions
 from database.d1_client import (
@@ -261,6 +260,20 @@ def parse_iso_date_flexible(date_str: Optional[str], default_offset_days: int =
         logger.warning(f"Error parseando fecha '{date_str}': {e}")
         return datetime.now(timezone.utc) + timedelta(days=default_offset_days)
 
+def _encode_page_cursor(row: Dict[str, Any], sort_by: str) -> str:
+    """Cursor opaco (base64 URL-safe) con el valor de ordenación y el id de una fila."""
+    payload = json.dumps({"value": row.get(sort_by), "id": row.get("id")}, default=str)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_page_cursor(token: str) -> Optional[Dict[str, Any]]:
+    """Decodifica un cursor de _encode_page_cursor; None si está manipulado o corrupto."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        logger.warning("Cursor de paginación inválido, se muestra la primera página")
+        return None
+    return data if isinstance(data, dict) and data.get("id") is not None else None
+
 # --- Constantes ---
 MAX_LOGIN_ATTEMPTS = getattr(settings, 'MAX_LOGIN_ATTEMPTS', 5)  # Valor por defecto: 5
 LOGIN_LOCKOUT_MINUTES = getattr(settings, 'LOGIN_LOCKOUT_MINUTES', 15)  # Valor por defecto: 15
@@ -410,7 +423,18 @@ class AuditLog(BaseModel):
 # --- Funciones de Seguridad (Actualizadas) ---
 
 # Funciones síncronas internas (prefijo _) para operaciones CPU-bound
-# Serán llamadas usando run_in_executor desde código async
+# Se ejecutan en el executor de criptografía (field_encryption.run) desde código async
+field_encryption = get_field_encryption()
+
+@app.on_event("startup")
+async def startup_field_encryption() -> None:
+    """Deriva la clave de cifrado de campos una sola vez al arrancar el panel."""
+    try: await field_encryption.startup()
+    except ValueError as e: logger.error(f"Cifrado de campos no disponible: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_field_encryption() -> None:
+    field_encryption.shutdown()
 
 def _verify_password_sync(plain_password, hashed_password):
     """Verifica contraseña (síncrono). USA EL pwd_context importado."""
@@ -430,24 +454,15 @@ def _get_password_hash_sync(password):
     # Usar el pwd_context importado de core.security_utils
     return pwd_context.hash(password)
 
-def _derive_key_sync(password: bytes, salt: bytes) -> bytes:
-    logger.debug("Derivando clave..."); kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=480000); return base64.urlsafe_b64encode(kdf.derive(password))
-
-def _get_encryption_key_sync() -> Fernet:
-    logger.debug("Obteniendo clave Fernet...")
-    if not settings.ENCRYPTION_KEY or not settings.ENCRYPTION_SALT: logger.critical("¡ENCRYPTION_KEY y ENCRYPTION_SALT deben estar configurados!"); raise ValueError("Configuración encriptación incompleta.")
-    try: key_bytes = settings.ENCRYPTION_KEY.encode(); salt_bytes = settings.ENCRYPTION_SALT.encode(); derived_key = _derive_key_sync(key_bytes, salt_bytes); return Fernet(derived_key)
-    except Exception as e: logger.exception("Error al derivar/crear clave Fernet"); raise ValueError("Error config encriptación") from e
-
 def _encrypt_data_sync(data: str) -> str:
     if not data: return data
-    try: fernet = _get_encryption_key_sync(); encrypted = fernet.encrypt(data.encode()).decode(); logger.debug(f"Encriptado: {encrypted[:10]}..."); return encrypted
+    try: encrypted = field_encryption.encrypt_sync(data); logger.debug(f"Encriptado: {encrypted[:10]}..."); return encrypted
     except Exception as e: logger.error(f"Error encriptando: {e}", exc_info=True); return "Error de encriptación"
 
 def _decrypt_data_sync(encrypted_data: str) -> str:
     if not encrypted_data: return encrypted_data
     if not isinstance(encrypted_data, str) or len(encrypted_data) < 20: logger.warning(f"Intento desencriptar dato no válido (tipo: {type(encrypted_data)}, len: {len(encrypted_data)})."); return encrypted_data
-    try: fernet = _get_encryption_key_sync(); decrypted = fernet.decrypt(encrypted_data.encode()).decode(); logger.debug("Desencriptado OK."); return decrypted
+    try: decrypted = field_encryption.decrypt_sync(encrypted_data); logger.debug("Desencriptado OK."); return decrypted
     except Exception as e: logger.error(f"Error desencriptando (len: {len(encrypted_data)}): {e}"); return "Error al desencriptar"
 
 # --- Funciones de Usuario y Autenticación (Refactorizadas) ---
@@ -483,8 +498,8 @@ async def authenticate_user(username: str, password: str) -> Optional[Dict[str,
     if is_locked: logger.warning(f"Auth Fail: Usuario '{username}' (ID: {user_id}) BLOQUEADO."); await log_audit_event(None, username, "failed_login_locked", "auth", details={"reason": "Account locked"}); return None
     if not hashed_password_from_db: logger.error(f"Auth Fail: Usuario '{username}' (ID: {user_id}) sin hashed_password."); return None
 
-    loop = asyncio.get_running_loop(); is_valid_password = False
-    try: is_valid_password = await loop.run_in_executor(None, _verify_password_sync, password, hashed_password_from_db)
+    is_valid_password = False
+    try: is_valid_password = await field_encryption.run(_verify_password_sync, password, hashed_password_from_db)
     except Exception as e: logger.error(f"Error verificando password para '{username}': {e}", exc_info=True)
 
     if not is_valid_password:
@@ -773,69 +788,45 @@ async def dashboard(request: Request):
     """Muestra el dashboard principal del panel de administración."""
     logger.info(f"Accediendo al dashboard sin autenticación.")
     
-    # Obtener datos reales de la base de datos
+    # Obtener los contadores en una sola consulta agregada (cacheada unos segundos)
+    stats = {"total_usuarios": 0, "total_pacientes": 0, "citas_hoy": 0, "notificaciones_pendientes": 0}
     try:
-        # Ejecutar todas las consultas de conteo en paralelo para mejor rendimiento
-        tasks = [
-            count_users(),
-            count_patients(),
-            count_appointments_today(),
-            count_pending_notifications()
-        ]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Procesar resultados con valores por defecto en caso de error
-        total_usuarios = 0
-        total_pacientes = 0
-        citas_hoy = 0
-        notificaciones_pendientes = 0
-        
-        # Usuarios
-        if isinstance(results[0], dict) and results[0].get("success"):
-            total_usuarios = results[0].get("count", 0)
-        else:
-            logger.error(f"Error obteniendo conteo de usuarios: {results[0]}")
-            
-        # Pacientes
-        if isinstance(results[1], dict) and results[1].get("success"):
-            total_pacientes = results[1].get("count", 0)
-        else:
-            logger.error(f"Error obteniendo conteo de pacientes: {results[1]}")
-            
-        # Citas hoy
-        if isinstance(results[2], dict) and results[2].get("success"):
-            citas_hoy = results[2].get("count", 0)
-        else:
-            logger.error(f"Error obteniendo conteo de citas hoy: {results[2]}")
-            
-        # Notificaciones pendientes
-        if isinstance(results[3], dict) and results[3].get("success"):
-            notificaciones_pendientes = results[3].get("count", 0)
-        else:
-            logger.error(f"Error obteniendo conteo de notificaciones: {results[3]}")
+        result = await get_dashboard_stats()
+        if result.get("stats"):
+            stats.update(result["stats"])
+        if not result.get("success"):
+            logger.error(f"Error obteniendo contadores del dashboard: {result.get('error')}")
             
-        logger.info(f"Dashboard - Usuarios: {total_usuarios}, Pacientes: {total_pacientes}, "
-                   f"Citas hoy: {citas_hoy}, Notificaciones: {notificaciones_pendientes}")
+        logger.info(f"Dashboard - Usuarios: {stats['total_usuarios']}, Pacientes: {stats['total_pacientes']}, "
+                   f"Citas hoy: {stats['citas_hoy']}, Notificaciones: {stats['notificaciones_pendientes']}"
+                   f"{' (caché)' if result.get('cached') else ''}")
         
     except Exception as e:
         logger.error(f"Error obteniendo datos para el dashboard: {e}", exc_info=True)
-        # Usar valores por defecto si hay un error general
-        total_usuarios = 0
-        total_pacientes = 0
-        citas_hoy = 0
-        notificaciones_pendientes = 0
     
     # Devolver la plantilla HTML del dashboard con los datos reales
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
-        "total_usuarios": total_usuarios,
-        "total_pacientes": total_pacientes,
-        "citas_hoy": citas_hoy,
-        "notificaciones_pendientes": notificaciones_pendientes,
+        **stats,
         # "current_user": current_user # Comentado
     })
 
+@app.get("/dashboard/stats")
+@require_permission("view_dashboard")
+async def dashboard_stats(
+    request: Request,
+    refresh: bool = False,
+    current_user: UserWithRoles = Depends(get_current_active_user_with_roles)
+):
+    """Devuelve los contadores del dashboard en JSON (refresh=true ignora la caché; solo administradores)."""
+    if refresh and "admin" not in {role.lower() for role in current_user.roles}:
+        logger.warning(f"Usuario '{current_user.username}' sin rol admin intentó recalcular las estadísticas del dashboard")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Solo un administrador puede recalcular las estadísticas.")
+    result = await get_dashboard_stats(use_cache=not refresh)
+    if not result.get("success") and not result.get("stats"):
+        return JSONResponse(status_code=503, content={"status": "error", "error": result.get("error")})
+    return {"status": "success", "stats": result.get("stats"), "cached": result.get("cached", False)}
+
 
 # --- Rutas de gestión de pacientes ---
 # (Esta sección debe ser idéntica a la original, solo depende de la nueva auth)
@@ -855,20 +846,72 @@ def process_patient_data_for_display(patient_data: Dict[str, Any]) -> Dict[str,
     processed["metadata_processed"] = metadata_dict
     return processed
 
+PATIENTS_PER_PAGE = 25
+PATIENT_DISPLAY_CHUNK = 8  # Pacientes por tarea del pool al preparar una página
+
+def _prepare_patients_for_list_sync(patients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Desencripta el teléfono y enmascara los datos de un bloque de pacientes. VERSIÓN SÍNCRONA."""
+    # Teléfonos antiguos en claro (cortos) o ilegibles se quedan con la máscara del valor almacenado
+    phones = [p.get("phone") if isinstance(p.get("phone"), str) and len(p.get("phone")) >= 20 else None for p in patients]
+    try: decrypted_phones = field_encryption.decrypt_many_sync(phones)
+    except ValueError: decrypted_phones = [None] * len(patients)  # Encriptación sin configurar
+    processed = []
+    for patient, phone in zip(patients, decrypted_phones):
+        item = process_patient_data_for_display(patient)
+        if phone: item["phone_masked"] = mask_sensitive_data(phone)
+        processed.append(item)
+    return processed
+
+async def prepare_patients_for_list(patients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Prepara solo la página visible, repartida en bloques por el executor de criptografía."""
+    if not patients: return []
+    chunks = [patients[i:i + PATIENT_DISPLAY_CHUNK] for i in range(0, len(patients), PATIENT_DISPLAY_CHUNK)]
+    results = await asyncio.gather(*(field_encryption.run(_prepare_patients_for_list_sync, chunk) for chunk in chunks))
+    return [patient for chunk in results for patient in chunk]
+
 @app.get("/patients", response_class=HTMLResponse)
 # @require_permission("read")  # Comentado temporalmente para acceso directo
-async def list_patients(request: Request):  # Removido current_user parameter
-    """Lista todos los pacientes."""
-    logger.info("Listando pacientes (sin autenticación temporal).")
+async def list_patients(
+    request: Request, search: Optional[str] = None, sort_by: str = "nombre", sort_order: str = "asc", page: int = 1,
+    after: Optional[str] = None, before: Optional[str] = None, total: Optional[int] = None,
+):  # Removido current_user parameter
+    """Lista los pacientes paginando en la base de datos (keyset, ver list_sessions)."""
+    logger.info(f"Listando pacientes (sin autenticación temporal): search={search}, page={page}")
     # (Asegúrate que la plantilla patients/list.html existe)
     try:
-        patients_data = await get_all_patients()
-        patients_raw = patients_data.get("results", [])
-        processed_patients = [process_patient_data_for_display(p) for p in patients_raw]
+        backwards = bool(before) and not after
+        cursor_token = before if backwards else after
+        cursor = _decode_page_cursor(cursor_token) if cursor_token else None
+        sort_desc = (sort_order.lower() == "desc")
+
+        patients_data = await list_patients_page(
+            search=search, sort_by=sort_by, sort_desc=(not sort_desc) if backwards else sort_desc,
+            cursor=cursor, limit=PATIENTS_PER_PAGE, with_total=(total is None or cursor is None),
+        )
+        if not patients_data.get("success"):
+            raise RuntimeError(patients_data.get("error") or "Error consultando pacientes")
+        patients_raw = patients_data["patients"]
+        if backwards:
+            patients_raw.reverse()
+        processed_patients = await prepare_patients_for_list(patients_raw)
+
+        total_items = patients_data["total"] if patients_data.get("total") is not None else (total or 0)
+        total_pages = (total_items + PATIENTS_PER_PAGE - 1) // PATIENTS_PER_PAGE
+        page = 1 if cursor is None else max(1, min(page, total_pages or 1))
+        has_prev = patients_data["has_more"] if backwards else cursor is not None
+        has_next = True if backwards else patients_data["has_more"]
+        cursor_field = sort_by if sort_by in ("nombre", "created_at") else "nombre"
+        prev_cursor = _encode_page_cursor(patients_raw[0], cursor_field) if patients_raw and has_prev else None
+        next_cursor = _encode_page_cursor(patients_raw[-1], cursor_field) if patients_raw and has_next else None
+
         # await log_audit_event(request=request, user_id="anonymous", action="view_list", resource_type="patient", details={"count": len(processed_patients)})
         user_permissions_set = {"read", "write", "delete"}  # Permisos temporales
         mock_user = {"username": "admin_temp", "roles": ["admin"]}
-        return templates.TemplateResponse("patients/list.html", {"request": request, "patients": processed_patients, "user": mock_user, "user_permissions": list(user_permissions_set)})
+        return templates.TemplateResponse("patients/list.html", {
+            "request": request, "patients": processed_patients, "user": mock_user, "user_permissions": list(user_permissions_set),
+            "current_page": page, "total_pages": total_pages, "total_items": total_items,
+            "prev_cursor": prev_cursor, "next_cursor": next_cursor, "search": search or "",
+        })
     except Exception as e:
         logger.error(f"Error al listar pacientes: {e}", exc_info=True)
         return templates.TemplateResponse("error.html", {"request": request, "error": f"Error al listar pacientes: {e}"}, status_code=500)
@@ -891,18 +934,8 @@ async def create_new_patient(
     """Crea un nuevo paciente."""
     logger.info(f"Creando paciente: {name} (sin autenticación temporal)")
     try:
-        loop = asyncio.get_running_loop()
-        encrypted_phone, encrypted_email = phone, email
-        tasks, phone_idx, email_idx = [], -1, -1
-        if phone: tasks.append(loop.run_in_executor(None, _encrypt_data_sync, phone)); phone_idx = len(tasks) - 1
-        if email: tasks.append(loop.run_in_executor(None, _encrypt_data_sync, email)); email_idx = len(tasks) - 1
-        if tasks:
-            try:
-                results = await asyncio.gather(*tasks)
-                if phone_idx != -1: encrypted_phone = results[phone_idx]
-                if email_idx != -1: encrypted_email = results[email_idx]
-                if "Error de encriptación" in results: raise ValueError("Fallo encriptación al crear paciente.")
-            except Exception as enc_error: logger.error(f"Error encriptando nuevo paciente {name}: {enc_error}", exc_info=True); raise HTTPException(status_code=500, detail="Error procesando datos paciente.")
+        try: encrypted_phone, encrypted_email = await field_encryption.encrypt_many([phone, email])
+        except Exception as enc_error: logger.error(f"Error encriptando nuevo paciente {name}: {enc_error}", exc_info=True); raise HTTPException(status_code=500, detail="Error procesando datos paciente.")
 
         metadata = {}
         if encrypted_email: metadata["email"] = encrypted_email
@@ -960,22 +993,19 @@ async def edit_patient_form(request: Request, patient_id: str, current_user: Use
         if not patient_raw: logger.warning(f"Intento editar paciente no encontrado (ID: {patient_id}) por '{current_user.username}'."); raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente no encontrado")
 
         patient_for_form = process_patient_data_for_display(patient_raw)
-        loop = asyncio.get_running_loop()
         phone_to_decrypt = patient_raw.get("phone")
         email_to_decrypt = patient_for_form.get("metadata_processed", {}).get("email")
-        tasks, phone_idx, email_idx = [], -1, -1
-        if phone_to_decrypt: tasks.append(loop.run_in_executor(None, _decrypt_data_sync, phone_to_decrypt)); phone_idx = len(tasks) - 1
-        if email_to_decrypt: tasks.append(loop.run_in_executor(None, _decrypt_data_sync, email_to_decrypt)); email_idx = len(tasks) - 1
-
-        decrypted_phone, decrypted_email = "", ""
-        if tasks:
-            try:
-                results = await asyncio.gather(*tasks)
-                if phone_idx != -1: decrypted_phone = results[phone_idx]
-                if email_idx != -1: decrypted_email = results[email_idx]
-                if decrypted_phone == "Error al desencriptar": logger.warning(f"Fallo desencriptar teléfono form paciente {patient_id}"); decrypted_phone = ""
-                if decrypted_email == "Error al desencriptar": logger.warning(f"Fallo desencriptar email form paciente {patient_id}"); decrypted_email = ""
-            except Exception as dec_error: logger.error(f"Error desencriptando form paciente {patient_id}: {dec_error}", exc_info=True)
+
+        # Valores antiguos en claro (cortos) se muestran tal cual, como en _decrypt_data_sync
+        legacy = [value if isinstance(value, str) and len(value) < 20 else None for value in (phone_to_decrypt, email_to_decrypt)]
+        decrypted_phone, decrypted_email = legacy[0] or "", legacy[1] or ""
+        try:
+            # Los campos ilegibles se devuelven como "" (se registra el fallo en el servicio)
+            tokens = [None if plain else value for plain, value in zip(legacy, (phone_to_decrypt, email_to_decrypt))]
+            if any(tokens):
+                phone_result, email_result = await field_encryption.decrypt_many(tokens, on_error="")
+                decrypted_phone, decrypted_email = legacy[0] or phone_result or "", legacy[1] or email_result or ""
+        except Exception as dec_error: logger.error(f"Error desencriptando form paciente {patient_id}: {dec_error}", exc_info=True)
 
         patient_for_form["phone_decrypted"] = decrypted_phone
         patient_for_form["email_decrypted"] = decrypted_email
@@ -1002,21 +1032,10 @@ async def update_patient_data(
         try: current_metadata = json.loads(current_patient_data["results"][0].get("metadata", "{}"))
         except: pass
 
-        loop = asyncio.get_running_loop()
-        encrypted_phone, encrypted_email = phone, email
-        tasks, phone_idx, email_idx = [], -1, -1
-        if phone: tasks.append(loop.run_in_executor(None, _encrypt_data_sync, phone)); phone_idx = len(tasks) - 1
         # Solo encriptar email si se proporcionó un valor
-        if email is not None: tasks.append(loop.run_in_executor(None, _encrypt_data_sync, email)); email_idx = len(tasks) - 1
-        else: encrypted_email = current_metadata.get("email") # Mantener email antiguo si no se envió nuevo
-
-        if tasks:
-            try:
-                results = await asyncio.gather(*tasks)
-                if phone_idx != -1: encrypted_phone = results[phone_idx]
-                if email_idx != -1: encrypted_email = results[email_idx] # Solo si se encriptó
-                if "Error de encriptación" in results: raise ValueError("Fallo encriptación al actualizar paciente.")
-            except Exception as enc_error: logger.error(f"Error encriptando actualización paciente {patient_id}: {enc_error}", exc_info=True); raise HTTPException(status_code=500, detail="Error procesando datos actualización.")
+        try: encrypted_phone, encrypted_email = await field_encryption.encrypt_many([phone, email])
+        except Exception as enc_error: logger.error(f"Error encriptando actualización paciente {patient_id}: {enc_error}", exc_info=True); raise HTTPException(status_code=500, detail="Error procesando datos actualización.")
+        if email is None: encrypted_email = current_metadata.get("email") # Mantener email antiguo si no se envió nuevo
 
         # Actualizar metadata combinada
         updated_metadata = current_metadata.copy()
@@ -1062,6 +1081,8 @@ async def delete_patient_data(request: Request, patient_id: str, current_user: U
 
 # --- Rutas de gestión de sesiones ---
 # (Esta sección debe ser idéntica a la original)
+SESSIONS_PER_PAGE = 15
+
 @app.get("/sessions", response_class=HTMLResponse)
 # @require_permission("read")  # Comentado temporalmente para acceso directo
 async def list_sessions(
@@ -1070,57 +1091,66 @@ async def list_sessions(
     date_from: Optional[str] = None, date_to: Optional[str] = None,
     search: Optional[str] = None, modality_filter: Optional[str] = None,
     sort_by: str = "scheduled_at", sort_order: str = "desc", page: int = 1,
+    after: Optional[str] = None, before: Optional[str] = None, total: Optional[int] = None,
     # current_user: UserWithRoles = Depends(get_current_active_user_with_roles)  # Comentado temporalmente
 ):
+    """
+    Lista las sesiones filtrando, ordenando y paginando en la base de datos.
+
+    La paginación es keyset: 'after'/'before' son cursores opacos de la última/primera
+    fila de la página actual. 'page' y 'total' solo se arrastran en los enlaces para
+    mostrar "página X de Y" sin volver a contar en cada página.
+    """
     logger.info(f"Listando sesiones con filtros: status={status_filter}, type={session_type_filter}, search={search}, page={page}")
     # (Asegúrate que la plantilla sessions/list.html existe)
     try:
-        sessions_data_task = get_all_appointments()
-        patients_data_task = get_all_patients()
-        sessions_data, patients_data = await asyncio.gather(sessions_data_task, patients_data_task)
-        all_sessions = sessions_data.get("results", [])
-        patients_dict = {p.get("id"): p for p in patients_data.get("results", [])}
-        filtered_sessions = []; now_utc = datetime.now(timezone.utc)
-        for session in all_sessions:
-            patient_id = session.get("patient_id"); patient_info = patients_dict.get(patient_id)
-            session["patient_name"] = patient_info.get("name", "Paciente Desconocido") if patient_info else "Paciente Desconocido"
+        backwards = bool(before) and not after
+        cursor_token = before if backwards else after
+        cursor = _decode_page_cursor(cursor_token) if cursor_token else None
+        sort_desc = (sort_order.lower() == "desc")
+        date_from_dt = parse_iso_date_flexible(date_from + "T00:00:00", 0) if date_from else None
+        date_until_dt = parse_iso_date_flexible(date_to + "T00:00:00", 0) + timedelta(days=1) if date_to else None
+
+        result = await list_appointments_page(
+            status=status_filter.lower() if status_filter else None,
+            session_type=session_type_filter.lower() if session_type_filter else None,
+            modality=modality_filter.lower() if modality_filter else None,
+            date_from=date_from_dt, date_until=date_until_dt, search=search,
+            sort_by=sort_by, sort_desc=(not sort_desc) if backwards else sort_desc,
+            cursor=cursor, limit=SESSIONS_PER_PAGE, with_total=(total is None or cursor is None),
+        )
+        if not result.get("success"):
+            raise RuntimeError(result.get("error") or "Error consultando sesiones")
+
+        sessions = result["appointments"]
+        if backwards:
+            sessions.reverse()
+        for session in sessions:
             session["scheduled_at_dt"] = parse_iso_date_flexible(session.get("scheduled_at"))
-            try: session["metadata_parsed"] = json.loads(session.get("metadata", "{}"))
-            except json.JSONDecodeError: session["metadata_parsed"] = {"error": "Invalid JSON"}
-            keep = True
-            if status_filter and session.get("status", "").lower() != status_filter.lower(): keep = False
-            if session_type_filter and session.get("session_type", "").lower() != session_type_filter.lower(): keep = False
-            if modality_filter and session["metadata_parsed"].get("modality", "").lower() != modality_filter.lower(): keep = False
-            if date_from:
-                 date_from_dt = parse_iso_date_flexible(date_from + "T00:00:00", 0)
-                 if session["scheduled_at_dt"] < date_from_dt: keep = False
-            if date_to:
-                 date_to_dt = parse_iso_date_flexible(date_to + "T23:59:59", 0)
-                 if session["scheduled_at_dt"] > date_to_dt: keep = False
-            if search:
-                search_lower = search.lower()
-                if not (search_lower in session["patient_name"].lower() or search_lower in session.get("session_type", "").lower() or search_lower in session.get("status", "").lower()): keep = False
-            if keep: filtered_sessions.append(session)
-
-        reverse_sort = (sort_order.lower() == "desc")
-        def sort_key_func(s):
-            if sort_by == "patient_name": return s.get("patient_name", "")
-            elif sort_by == "status": return s.get("status", "")
-            else: return s.get("scheduled_at_dt", now_utc - timedelta(days=365*10))
-        filtered_sessions.sort(key=sort_key_func, reverse=reverse_sort)
-
-        items_per_page = 15; total_items = len(filtered_sessions); total_pages = (total_items + items_per_page - 1) // items_per_page
-        page = max(1, min(page, total_pages or 1))
-        start_idx = (page - 1) * items_per_page; end_idx = start_idx + items_per_page
-        paginated_sessions = filtered_sessions[start_idx:end_idx]
-
-        # await log_audit_event(request=request, user_id=current_user.username, action="view_list", resource_type="session", details={"filters": {"status": status_filter, "type": session_type_filter, "search": search, "page": page}, "count": len(paginated_sessions), "total_found": total_items})
+            metadata = session.get("metadata") or {}
+            if isinstance(metadata, str):
+                try: metadata = json.loads(metadata or "{}")
+                except json.JSONDecodeError: metadata = {"error": "Invalid JSON"}
+            session["metadata_parsed"] = metadata
+            session.setdefault("modality", metadata.get("modality"))
+
+        total_items = result["total"] if result.get("total") is not None else (total or 0)
+        total_pages = (total_items + SESSIONS_PER_PAGE - 1) // SESSIONS_PER_PAGE
+        page = 1 if cursor is None else max(1, min(page, total_pages or 1))
+        has_prev = result["has_more"] if backwards else cursor is not None
+        has_next = True if backwards else result["has_more"]
+        cursor_field = result.get("sort_by", sort_by)
+        prev_cursor = _encode_page_cursor(sessions[0], cursor_field) if sessions and has_prev else None
+        next_cursor = _encode_page_cursor(sessions[-1], cursor_field) if sessions and has_next else None
+
+        # await log_audit_event(request=request, user_id=current_user.username, action="view_list", resource_type="session", details={"filters": {"status": status_filter, "type": session_type_filter, "search": search, "page": page}, "count": len(sessions), "total_found": total_items})
         
         # Mock user temporal
         mock_user = {"username": "admin_temp", "roles": ["admin"]}
         
         return templates.TemplateResponse("sessions/list.html", {
-            "request": request, "sessions": paginated_sessions, "current_page": page, "total_pages": total_pages, "total_items": total_items,
+            "request": request, "sessions": sessions, "current_page": page, "total_pages": total_pages, "total_items": total_items,
+            "prev_cursor": prev_cursor, "next_cursor": next_cursor,
             "filters": {"status_filter": status_filter, "session_type_filter": session_type_filter, "date_from": date_from, "date_to": date_to, "search": search, "modality_filter": modality_filter, "sort_by": sort_by, "sort_order": sort_order},
             "user": mock_user  # Cambiado de current_user a mock_user
         })
@@ -1153,7 +1183,7 @@ async def create_new_session(
         scheduled_at = f"{session_date}T{session_time}:00" # Considerar validación y zona horaria
         # Encriptar notas si es necesario
         encrypted_notes = notes
-        if notes: encrypted_notes = await asyncio.get_running_loop().run_in_executor(None, _encrypt_data_sync, notes)
+        if notes: encrypted_notes = await field_encryption.run(_encrypt_data_sync, notes)
         if encrypted_notes == "Error de encriptación": raise ValueError("Fallo encriptando notas de sesión.")
 
         metadata = {"modality": modality, "duration": duration, "therapist_name": therapist_name}
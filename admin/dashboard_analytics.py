@@ -5,18 +5,22 @@ Proporciona estadísticas y visualizaciones para el seguimiento de las interacci
 import logging
 import json
 from typing import Dict, List, Optional, Any, Tuple, Union
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import asyncio
 import calendar
 import os
 
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
 from core.config import settings
 from admin.auth import get_current_admin_user
+from database.analytics_rollup import (
+    EVENT_MESSAGE_IN, EVENT_MESSAGE_OUT, EVENT_CRISIS_ALERT, EVENT_APPOINTMENT, EVENT_SENTIMENT
+)
+from admin.export_stream import EXPORT_MEDIA_TYPES, encode_ndjson, encode_csv, gzip_stream
 
 # Configurar logging
 logger = logging.getLogger("mark.dashboard-analytics")
@@ -42,6 +46,19 @@ ANALYTICS_TYPES = {
     "peak_hours": "Horas pico de actividad"
 }
 
+# Exportación en streaming: tipos de evento por data_type y columnas de cada fuente
+EXPORT_EVENT_TYPES = {
+    "all": None,
+    "messages": [EVENT_MESSAGE_IN, EVENT_MESSAGE_OUT],
+    "playbooks": [EVENT_MESSAGE_IN],
+    "languages": [EVENT_MESSAGE_IN],
+    "crisis": [EVENT_CRISIS_ALERT],
+    "appointments": [EVENT_APPOINTMENT],
+}
+ROLLUP_KEY_COLUMNS = ["bucket_date", "event_type", "language", "playbook", "category"]
+ROLLUP_EXPORT_COLUMNS = ROLLUP_KEY_COLUMNS + ["event_count", "value_sum", "value_count"]
+EVENT_EXPORT_COLUMNS = ["id", "event_type", "occurred_at", "language", "playbook", "category", "session_id", "value"]
+
 @router.get("/", response_class=HTMLResponse)
 async def analytics_dashboard(request: Request, current_user = Depends(get_current_admin_user)):
     """Página principal del dashboard analítico"""
@@ -183,11 +200,21 @@ async def export_analytics_data(
     end_date: Optional[str] = None,
     data_type: Optional[str] = "all",
     format: Optional[str] = "json",
+    compress: bool = False,
     current_user = Depends(get_current_admin_user)
 ):
-    """Exporta datos analíticos en diferentes formatos"""
-    # Implementar exportación de datos
-    # Esta es una versión simplificada que devuelve JSON
+    """
+    Exporta datos analíticos.
+
+    - format=json: resumen de los gráficos en un único documento JSON.
+    - format=ndjson|csv: exportación en streaming de los buckets diarios
+      (o de los eventos en bruto con data_type=events), paginada por keyset y
+      opcionalmente comprimida con gzip (compress=true).
+    """
+    if format != "json" and format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Formato de exportación no soportado: '{format}'")
+    if format != "json" and data_type != "events" and data_type not in EXPORT_EVENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Tipo de datos no soportado: '{data_type}'")
     
     # Determinar fechas
     today = datetime.now().date()
@@ -208,6 +235,9 @@ async def export_analytics_data(
         except ValueError:
             raise HTTPException(status_code=400, detail="Formato de fecha inválido para start_date (YYYY-MM-DD)")
     
+    if format in EXPORT_MEDIA_TYPES:
+        return stream_analytics_export(start_date_obj, end_date_obj, data_type, format, compress)
+    
     # Recopilar todos los datos necesarios
     export_data = {
         "metadata": {
@@ -232,17 +262,109 @@ async def export_analytics_data(
     if data_type == "all" or data_type == "crisis":
         export_data["crisis_alerts"] = await get_crisis_alerts_data(start_date_obj, end_date_obj, "day")
     
-    # Solo formato JSON implementado en esta versión
     return export_data
 
+def stream_analytics_export(start_date: date, end_date: date, data_type: str, format: str, compress: bool) -> StreamingResponse:
+    """Construye la respuesta en streaming; las páginas se leen a medida que se envían."""
+    from database.d1_client import iter_table_keyset, TABLE_ANALYTICS_EVENTS, TABLE_ANALYTICS_DAILY
+
+    range_end = (end_date + timedelta(days=1)).isoformat()
+    if data_type == "events":
+        pages = iter_table_keyset(TABLE_ANALYTICS_EVENTS, ["id"], "occurred_at", start_date.isoformat(), range_end)
+        columns = EVENT_EXPORT_COLUMNS
+    else:
+        pages = iter_table_keyset(
+            TABLE_ANALYTICS_DAILY, ROLLUP_KEY_COLUMNS, "bucket_date", start_date.isoformat(), range_end,
+            event_types=EXPORT_EVENT_TYPES[data_type]
+        )
+        columns = ROLLUP_EXPORT_COLUMNS
+
+    body = encode_ndjson(pages) if format == "ndjson" else encode_csv(pages, columns)
+    media_type = EXPORT_MEDIA_TYPES[format]
+    filename = f"analytics_{data_type}_{start_date.isoformat()}_{end_date.isoformat()}.{format}"
+    if compress:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    logger.info(f"Exportación en streaming de analítica: {filename}")
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# Lectura de los agregados (tablas analytics_rollup_*, ver database/analytics_rollup.py)
+
+PLAYBOOK_NAMES = {
+    "1": "General", "2": "Crisis", "3": "Citas y pagos", "4": "Información",
+    "general": "General", "identity": "Identidad", "crisis": "Crisis", "appointment": "Citas", "security": "Seguridad",
+}
+LANGUAGE_NAMES = {"es": "Español", "ca": "Catalán", "en": "Inglés", "ar": "Árabe"}
+
+async def _load_buckets(start_date: date, end_date: date, event_types: List[str], granularity: str = "day") -> List[Dict]:
+    """Lee los buckets agregados del rango; lanza excepción si la consulta falla."""
+    from database.d1_client import get_analytics_buckets
+    result = await get_analytics_buckets(start_date, end_date, "hour" if granularity == "hour" else "day", event_types)
+    if not result.get("success"):
+        raise RuntimeError(result.get("error"))
+    return result["buckets"]
+
+def _period_start(day: date, start_date: date, granularity: str) -> date:
+    """Inicio del periodo (día, semana o mes) al que pertenece 'day' dentro del rango."""
+    if granularity == "week":
+        return start_date + timedelta(days=((day - start_date).days // 7) * 7)
+    if granularity == "month":
+        return max(day.replace(day=1), start_date)
+    return day
+
+def _period_range(start_date: date, end_date: date, granularity: str) -> List[date]:
+    periods = []
+    current = start_date
+    while current <= end_date:
+        periods.append(current)
+        if granularity == "week":
+            current += timedelta(days=7)
+        elif granularity == "month":
+            current = date(current.year + (current.month == 12), current.month % 12 + 1, 1)
+        else:
+            current += timedelta(days=1)
+    return periods
+
+def _sum_count(buckets: List[Dict], event_type: Optional[str] = None, category: Optional[str] = None) -> int:
+    return sum(
+        int(b.get("event_count") or 0) for b in buckets
+        if (event_type is None or b.get("event_type") == event_type) and (category is None or b.get("category") == category)
+    )
+
+def _avg_value(buckets: List[Dict], event_type: str) -> float:
+    rows = [b for b in buckets if b.get("event_type") == event_type]
+    value_count = sum(int(b.get("value_count") or 0) for b in rows)
+    return round(sum(float(b.get("value_sum") or 0) for b in rows) / value_count, 1) if value_count else 0.0
+
+def _series(buckets: List[Dict], start_date: date, end_date: date, granularity: str, row_fn) -> List[Dict]:
+    """Agrupa los buckets diarios por periodo y aplica 'row_fn' a cada grupo (incluidos los vacíos)."""
+    grouped: Dict[date, List[Dict]] = {}
+    for bucket in buckets:
+        day = date.fromisoformat(str(bucket["bucket_date"])[:10])
+        grouped.setdefault(_period_start(day, start_date, granularity), []).append(bucket)
+    return [{"date": period.isoformat(), **row_fn(grouped.get(period, []))} for period in _period_range(start_date, end_date, granularity)]
+
+def _distribution(buckets: List[Dict], dimension: str) -> List[Tuple[str, int, float]]:
+    """Devuelve [(valor, conteo, porcentaje)] de una dimensión, de mayor a menor."""
+    counts: Dict[str, int] = {}
+    for bucket in buckets:
+        key = bucket.get(dimension) or "unknown"
+        counts[key] = counts.get(key, 0) + int(bucket.get("event_count") or 0)
+    total = sum(counts.values())
+    return [
+        (key, count, round(count / total * 100, 1) if total else 0.0)
+        for key, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    ]
+
 # Funciones auxiliares para obtener datos
 
 async def get_message_count(start_date: datetime.date, end_date: datetime.date) -> int:
     """Obtiene el número de mensajes en un periodo"""
     try:
-        from database.d1_client import db_client
-        count = await db_client.count_messages(start_date, end_date)
-        return count
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN, EVENT_MESSAGE_OUT])
+        return _sum_count(buckets)
     except Exception as e:
         logger.error(f"Error al obtener conteo de mensajes: {e}")
         # Datos de ejemplo para desarrollo
@@ -252,9 +374,11 @@ async def get_message_count(start_date: datetime.date, end_date: datetime.date)
 async def get_active_users_count(start_date: datetime.date, end_date: datetime.date) -> int:
     """Obtiene el número de usuarios activos en un periodo"""
     try:
-        from database.d1_client import db_client
-        count = await db_client.count_active_users(start_date, end_date)
-        return count
+        from database.d1_client import count_active_sessions
+        result = await count_active_sessions(start_date, end_date)
+        if not result.get("success"):
+            raise RuntimeError(result.get("error"))
+        return result["count"]
     except Exception as e:
         logger.error(f"Error al obtener conteo de usuarios activos: {e}")
         # Datos de ejemplo para desarrollo
@@ -264,9 +388,8 @@ async def get_active_users_count(start_date: datetime.date, end_date: datetime.d
 async def get_avg_response_time(start_date: datetime.date, end_date: datetime.date) -> float:
     """Obtiene el tiempo promedio de respuesta en segundos"""
     try:
-        from database.d1_client import db_client
-        avg_time = await db_client.get_avg_response_time(start_date, end_date)
-        return avg_time
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_OUT])
+        return _avg_value(buckets, EVENT_MESSAGE_OUT)
     except Exception as e:
         logger.error(f"Error al obtener tiempo promedio de respuesta: {e}")
         # Datos de ejemplo para desarrollo
@@ -275,9 +398,8 @@ async def get_avg_response_time(start_date: datetime.date, end_date: datetime.da
 async def get_crisis_count(start_date: datetime.date, end_date: datetime.date) -> int:
     """Obtiene el número de alertas de crisis en un periodo"""
     try:
-        from database.d1_client import db_client
-        count = await db_client.count_crisis_alerts(start_date, end_date)
-        return count
+        buckets = await _load_buckets(start_date, end_date, [EVENT_CRISIS_ALERT])
+        return _sum_count(buckets)
     except Exception as e:
         logger.error(f"Error al obtener conteo de alertas de crisis: {e}")
         # Datos de ejemplo para desarrollo
@@ -287,9 +409,11 @@ async def get_crisis_count(start_date: datetime.date, end_date: datetime.date) -
 async def get_top_languages(start_date: datetime.date, end_date: datetime.date, limit: int = 3) -> List[Dict]:
     """Obtiene los idiomas más utilizados"""
     try:
-        from database.d1_client import db_client
-        languages = await db_client.get_top_languages(start_date, end_date, limit)
-        return languages
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN])
+        return [
+            {"language": language, "count": count, "percentage": percentage}
+            for language, count, percentage in _distribution(buckets, "language")[:limit]
+        ]
     except Exception as e:
         logger.error(f"Error al obtener top de idiomas: {e}")
         # Datos de ejemplo para desarrollo
@@ -302,9 +426,11 @@ async def get_top_languages(start_date: datetime.date, end_date: datetime.date,
 async def get_top_playbooks(start_date: datetime.date, end_date: datetime.date, limit: int = 3) -> List[Dict]:
     """Obtiene los playbooks más utilizados"""
     try:
-        from database.d1_client import db_client
-        playbooks = await db_client.get_top_playbooks(start_date, end_date, limit)
-        return playbooks
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN])
+        return [
+            {"playbook": playbook, "count": count, "percentage": percentage}
+            for playbook, count, percentage in _distribution(buckets, "playbook")[:limit]
+        ]
     except Exception as e:
         logger.error(f"Error al obtener top de playbooks: {e}")
         # Datos de ejemplo para desarrollo
@@ -332,8 +458,12 @@ def calculate_trend(current: Union[int, float], previous: Union[int, float], inv
 async def get_message_volume_data(start_date: datetime.date, end_date: datetime.date, granularity: str) -> Dict:
     """Genera datos de volumen de mensajes"""
     try:
-        from database.d1_client import db_client
-        data = await db_client.get_message_volume(start_date, end_date, granularity)
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN, EVENT_MESSAGE_OUT])
+        data = _series(buckets, start_date, end_date, granularity, lambda rows: {
+            "total": _sum_count(rows),
+            "user_messages": _sum_count(rows, EVENT_MESSAGE_IN),
+            "mark_responses": _sum_count(rows, EVENT_MESSAGE_OUT),
+        })
         return {"success": True, "data": data}
     except Exception as e:
         logger.error(f"Error al obtener datos de volumen de mensajes: {e}")
@@ -373,6 +503,18 @@ async def get_message_volume_data(start_date: datetime.date, end_date: datetime.
 
 async def get_response_time_data(start_date: datetime.date, end_date: datetime.date, granularity: str) -> Dict:
     """Genera datos de tiempo de respuesta"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_OUT])
+        # La mediana y el percentil 90 no se pueden obtener de agregados sumables
+        data = _series(buckets, start_date, end_date, granularity, lambda rows: {
+            "avg_seconds": _avg_value(rows, EVENT_MESSAGE_OUT),
+            "median_seconds": None,
+            "90th_percentile": None,
+        })
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de tiempo de respuesta: {e}")
+    
     # Implementación similar a get_message_volume_data pero con tiempos de respuesta
     # Datos de ejemplo para desarrollo
     import random
@@ -410,6 +552,16 @@ async def get_response_time_data(start_date: datetime.date, end_date: datetime.d
 
 async def get_playbook_usage_data(start_date: datetime.date, end_date: datetime.date) -> Dict:
     """Genera datos de uso de playbooks"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN])
+        data = [
+            {"playbook_id": playbook, "playbook_name": PLAYBOOK_NAMES.get(playbook, playbook), "count": count, "percentage": percentage}
+            for playbook, count, percentage in _distribution(buckets, "playbook")
+        ]
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de uso de playbooks: {e}")
+    
     # Datos de ejemplo para desarrollo
     playbooks = [
         {"id": "identity", "name": "Identidad"},
@@ -450,6 +602,20 @@ async def get_playbook_usage_data(start_date: datetime.date, end_date: datetime.
 
 async def get_sentiment_trends_data(start_date: datetime.date, end_date: datetime.date, granularity: str) -> Dict:
     """Genera datos de tendencias de sentimiento"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_SENTIMENT])
+
+        def sentiment_row(rows: List[Dict]) -> Dict:
+            total = _sum_count(rows)
+            return {
+                label: round(_sum_count(rows, category=label) / total, 2) if total else 0.0
+                for label in ("positive", "neutral", "negative")
+            }
+
+        return {"success": True, "data": _series(buckets, start_date, end_date, granularity, sentiment_row)}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de tendencias de sentimiento: {e}")
+    
     # Implementación similar a get_message_volume_data pero con sentimientos
     # Datos de ejemplo para desarrollo
     import random
@@ -500,6 +666,18 @@ async def get_sentiment_trends_data(start_date: datetime.date, end_date: datetim
 
 async def get_crisis_alerts_data(start_date: datetime.date, end_date: datetime.date, granularity: str) -> Dict:
     """Genera datos de alertas de crisis"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_CRISIS_ALERT])
+        data = _series(buckets, start_date, end_date, granularity, lambda rows: {
+            "total": _sum_count(rows),
+            "high_severity": _sum_count(rows, category="high"),
+            "medium_severity": _sum_count(rows, category="medium"),
+            "low_severity": _sum_count(rows, category="low"),
+        })
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de alertas de crisis: {e}")
+    
     # Implementación similar a los anteriores pero con datos de crisis
     # Datos de ejemplo para desarrollo
     import random
@@ -547,6 +725,16 @@ async def get_crisis_alerts_data(start_date: datetime.date, end_date: datetime.d
 
 async def get_language_usage_data(start_date: datetime.date, end_date: datetime.date) -> Dict:
     """Genera datos de uso de idiomas"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN])
+        data = [
+            {"language_code": code, "language_name": LANGUAGE_NAMES.get(code, code), "count": count, "percentage": percentage}
+            for code, count, percentage in _distribution(buckets, "language")
+        ]
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de uso de idiomas: {e}")
+    
     # Datos de ejemplo para desarrollo
     languages = [
         {"code": "es", "name": "Español"},
@@ -624,6 +812,15 @@ async def get_topic_distribution_data(start_date: datetime.date, end_date: datet
 
 async def get_appointment_trends_data(start_date: datetime.date, end_date: datetime.date, granularity: str) -> Dict:
     """Genera datos de tendencias de citas"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_APPOINTMENT])
+        data = _series(buckets, start_date, end_date, granularity, lambda rows: {
+            status: _sum_count(rows, category=status) for status in ("scheduled", "canceled", "rescheduled", "completed")
+        })
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de tendencias de citas: {e}")
+    
     # Implementación similar a los anteriores pero con datos de citas
     # Datos de ejemplo para desarrollo
     import random
@@ -737,6 +934,21 @@ async def get_user_satisfaction_data(start_date: datetime.date, end_date: dateti
 
 async def get_peak_hours_data(start_date: datetime.date, end_date: datetime.date) -> Dict:
     """Genera datos de horas pico de actividad"""
+    try:
+        buckets = await _load_buckets(start_date, end_date, [EVENT_MESSAGE_IN], granularity="hour")
+        counts = [0] * 24
+        for bucket in buckets:
+            counts[int(bucket.get("hour_of_day") or 0) % 24] += int(bucket.get("event_count") or 0)
+        total = sum(counts)
+        data = [
+            {"hour": hour, "formatted_hour": f"{hour:02d}:00", "count": count,
+             "percentage": round(count / total * 100, 1) if total else 0.0}
+            for hour, count in enumerate(counts)
+        ]
+        return {"success": True, "data": data}
+    except Exception as e:
+        logger.error(f"Error al obtener datos de horas pico: {e}")
+    
     # Datos de ejemplo para desarrollo
     hours = list(range(24))
     data = []
@@ -0,0 +1,49 @@
+"""
+Codificadores en streaming para las exportaciones del dashboard analítico.
+
+Transforman un flujo asíncrono de páginas de filas en fragmentos de bytes
+NDJSON o CSV (opcionalmente comprimidos con gzip) a medida que llegan, para
+usarlos con StreamingResponse sin construir la exportación completa en memoria.
+"""
+import csv
+import io
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, List
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+async def encode_ndjson(pages: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """Una línea JSON por fila; un fragmento por página."""
+    async for page in pages:
+        if page:
+            yield "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in page).encode("utf-8")
+
+
+async def encode_csv(pages: AsyncIterator[List[Dict[str, Any]]], columns: List[str]) -> AsyncIterator[bytes]:
+    """Cabecera con 'columns' y una fila CSV por registro; las columnas extra se ignoran."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue().encode("utf-8")
+    async for page in pages:
+        if not page:
+            continue
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(page)
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Comprime un flujo de bytes en formato gzip de forma incremental."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: cabecera gzip
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,184 @@
+"""
+Ventana de contexto con presupuesto de tokens para el historial de conversación.
+
+El historial completo crecía sin límite y se enviaba entero al LLM en cada
+turno. Ahora el prompt se compone de:
+
+- el prompt del sistema,
+- un resumen acumulado de los turnos antiguos (si existe), y
+- los mensajes más recientes, literales, hasta agotar el presupuesto de tokens
+  del PlayBook (CONTEXT_TOKEN_BUDGETS).
+
+Los tokens de cada texto se cuentan una sola vez (caché LRU), con tiktoken si
+está instalado o con una aproximación por bytes si no.
+
+El resumen no se calcula mientras el paciente espera. Tras enviar la respuesta,
+`fold_into_summary` incorpora al resumen anterior los mensajes que han quedado
+fuera de la ventana, en una sola llamada y solo cuando se han acumulado
+CONTEXT_SUMMARY_MIN_MESSAGES. Hasta entonces esos mensajes se siguen enviando
+literales (la ventana nunca empieza después de lo ya resumido), aunque superen
+el presupuesto. Los índices son válidos porque el historial solo crece por el final.
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger("mark-assistant.context-window")
+
+# Claves en ConversationState.context
+SUMMARY_KEY = "conversation_summary"
+SUMMARIZED_COUNT_KEY = "summarized_messages"
+WINDOW_START_KEY = "context_window_start"
+
+# Tokens extra por mensaje (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """
+Eres el sistema de memoria de Mark, asistente del Centre de Psicologia Jaume I.
+Actualiza el resumen de la conversación incorporando los nuevos turnos.
+Conserva los datos relevantes para continuar la atención: motivo de consulta, emociones y situaciones
+mencionadas, riesgos detectados, citas, pagos y compromisos acordados. Omite saludos y detalles triviales.
+Escribe en {language_name}, en un máximo de {max_words} palabras, sin encabezados.
+
+Resumen anterior:
+{summary}
+
+Nuevos turnos:
+{transcript}
+
+Responde solo con el resumen actualizado.
+"""
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Número de tokens de un texto (cacheado por contenido)."""
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        return len(_ENCODING.encode(text))
+    # Aproximación: ~4 bytes UTF-8 por token (≈4 caracteres latinos, ≈2 árabes)
+    return max(1, (len(text.encode("utf-8")) + 3) // 4)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_token_budget(playbook: str) -> int:
+    """Presupuesto de tokens del prompt para el PlayBook (el de 'general' si no tiene uno propio)."""
+    from core.config import settings
+
+    budgets = settings.CONTEXT_TOKEN_BUDGETS
+    return budgets.get(playbook, budgets.get("general", 3000))
+
+
+class ContextWindow(NamedTuple):
+    """
+    Mensajes que se envían al LLM y posición en el historial de la ventana que
+    cabe en el presupuesto ('start'); lo anterior a 'start' es lo que se resume.
+    """
+    messages: List[Dict[str, str]]
+    summary: Optional[str]
+    start: int
+    tokens: int
+
+
+def build_context_window(
+    messages: Sequence[Dict[str, str]],
+    system_prompt: str,
+    budget: int,
+    summary: Optional[str] = None,
+    summarized: Optional[int] = None,
+) -> ContextWindow:
+    """
+    Selecciona los mensajes más recientes que caben en el presupuesto.
+
+    El último mensaje se incluye siempre aunque por sí solo lo supere, y la
+    ventana empieza siempre en un mensaje del usuario. Con 'summarized' (número
+    de mensajes ya incorporados al resumen) también se envían los mensajes que
+    han salido de la ventana pero todavía no están en el resumen.
+    """
+    fixed = count_tokens(system_prompt)
+    if summary:
+        fixed += count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+    available = budget - fixed
+
+    start = len(messages)
+    used = 0
+    while start > 0:
+        cost = message_tokens(messages[start - 1])
+        if used + cost > available and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    while start < len(messages) - 1 and messages[start].get("role") != "user":
+        used -= message_tokens(messages[start])
+        start += 1
+    sent_from = start
+    if summarized is not None and summarized < start:
+        sent_from = summarized
+        used += sum(message_tokens(message) for message in messages[summarized:start])
+    return ContextWindow(list(messages[sent_from:]), summary, start, fixed + used)
+
+
+def _transcript(messages: Sequence[Dict[str, str]]) -> str:
+    speakers = {"user": "Paciente", "assistant": "Mark"}
+    return "\n".join(f"{speakers.get(m.get('role'), m.get('role'))}: {m.get('content', '')}" for m in messages)
+
+
+async def fold_into_summary(
+    messages: Sequence[Dict[str, str]],
+    context: Dict[str, Any],
+    language: str = "es",
+) -> Optional[Dict[str, Any]]:
+    """
+    Incorpora al resumen los mensajes que han quedado fuera de la ventana.
+
+    Args:
+        messages: Historial completo.
+        context: ConversationState.context, con la posición de la última ventana
+            (WINDOW_START_KEY) y el resumen actual.
+        language: Idioma del resumen.
+
+    Returns:
+        Claves a actualizar en el contexto, o None si no hay nada que resumir
+        todavía o la llamada al LLM falla (se reintentará en el siguiente turno).
+    """
+    from ai.claude.client import claude
+    from core.config import settings
+
+    summarized = context.get(SUMMARIZED_COUNT_KEY, 0)
+    window_start = min(context.get(WINDOW_START_KEY, 0), len(messages))
+    pending = messages[summarized:window_start]
+    if len(pending) < settings.CONTEXT_SUMMARY_MIN_MESSAGES:
+        return None
+
+    prompt = SUMMARY_PROMPT.format(
+        language_name=settings.LANGUAGE_NAMES.get(language, settings.LANGUAGE_NAMES["es"]),
+        max_words=int(settings.CONTEXT_SUMMARY_MAX_TOKENS * 0.6),
+        summary=context.get(SUMMARY_KEY) or "(sin resumen previo)",
+        transcript=_transcript(pending),
+    )
+    try:
+        summary = await claude.get_response_text(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS
+        )
+    except Exception as e:
+        logger.error(f"Error al actualizar el resumen de la conversación: {e}")
+        return None
+    summary = (summary or "").strip()
+    if not summary:
+        return None
+    logger.debug(f"Resumen actualizado con {len(pending)} mensajes ({count_tokens(summary)} tokens)")
+    return {SUMMARY_KEY: summary, SUMMARIZED_COUNT_KEY: window_start}
@@ -4,12 +4,14 @@ Permite recordar detalles importantes de las conversaciones con los pacientes.
 """
 import logging
 import json
+import re
 import time
 from typing import Dict, List, Optional, Any, Tuple, Set
 from datetime import datetime, timedelta
 
 import asyncio
 from core.config import settings
+from core.state_store import BoundedStateStore
 
 # Configurar logging
 logger = logging.getLogger("mark.enhanced-memory")
@@ -26,6 +28,10 @@ except ImportError as e:
     logger.warning(f"Could not import vector store components. Vector memory disabled: {e}")
     VECTOR_DB_AVAILABLE = False
 
+# Bytes aproximados del embedding de cada documento (1536 float32 de OpenAI)
+EMBEDDING_BYTES_PER_DOCUMENT = 1536 * 4
+_COLLECTION_NAME_RE = re.compile(r"[^a-zA-Z0-9_-]")
+
 class PatientMemory:
     """
     Clase para almacenar y gestionar la memoria de un paciente específico.
@@ -188,9 +194,24 @@ class EnhancedMemoryService:
     
     def __init__(self):
         """Inicializar el servicio de memoria mejorada"""
-        self.patient_memories = {}
+        # Memorias acotadas: las no guardadas se persisten antes de desalojarse
+        self.patient_memories = BoundedStateStore(
+            "patient_memories",
+            max_entries=settings.PATIENT_MEMORY_MAX_ENTRIES,
+            max_bytes=settings.PATIENT_MEMORY_MAX_BYTES,
+            ttl_seconds=settings.PATIENT_MEMORY_TTL_SECONDS,
+            writer=self._persist_patient_memory,
+        )
         self.vector_enabled = VECTOR_DB_AVAILABLE
-        self.vector_stores = {}
+        # El tamaño de cada almacén se actualiza al añadir documentos
+        self.vector_stores = BoundedStateStore(
+            "vector_stores",
+            max_entries=settings.VECTOR_STORE_MAX_ENTRIES,
+            max_bytes=settings.VECTOR_STORE_MAX_BYTES,
+            ttl_seconds=settings.VECTOR_STORE_TTL_SECONDS,
+            sizer=lambda vector_store: 0,
+            on_evict=self._release_vector_store,
+        )
         self.embeddings = None # Initialize embeddings attribute
 
         # Inicializar embeddings si están disponibles
@@ -225,7 +246,10 @@ class EnhancedMemoryService:
         Returns:
             Objeto PatientMemory con la memoria del paciente
         """
-        if user_id not in self.patient_memories:
+        memory = self.patient_memories.get(user_id)
+        if memory is None:
+            # Si se está persistiendo una versión desalojada, leerla después y no antes
+            await self.patient_memories.wait_for_write(user_id)
             # Intentar cargar desde la base de datos
             try:
                 # Assuming db_client is correctly set up elsewhere or imported
@@ -233,40 +257,60 @@ class EnhancedMemoryService:
                 memory_data = await db_client.get_patient_memory(user_id)
                 
                 if memory_data:
-                    self.patient_memories[user_id] = PatientMemory.from_dict(memory_data)
+                    memory = PatientMemory.from_dict(memory_data)
                     logger.info(f"Loaded memory for patient {user_id} from DB.")
                 else:
                     # Crear nueva memoria si no existe
                     logger.info(f"No existing memory found for patient {user_id}. Creating new memory.")
-                    self.patient_memories[user_id] = PatientMemory(user_id)
+                    memory = PatientMemory(user_id)
             except ImportError:
                  logger.error("Could not import db_client. Cannot load patient memory from DB.")
-                 self.patient_memories[user_id] = PatientMemory(user_id) # Create new memory as fallback
+                 memory = PatientMemory(user_id) # Create new memory as fallback
             except Exception as e:
                 logger.error(f"Error loading memory for patient {user_id}: {e}. Creating new memory.")
                 # Crear nueva memoria si hay error
-                self.patient_memories[user_id] = PatientMemory(user_id)
+                memory = PatientMemory(user_id)
+            # Otra petición pudo cargarla o modificarla durante la consulta
+            current = self.patient_memories.get(user_id)
+            if current is not None:
+                return current
+            self.patient_memories.put(user_id, memory)
         
-        return self.patient_memories[user_id]
+        return memory
     
-    async def save_patient_memory(self, user_id: str) -> bool:
+    async def save_patient_memory(self, user_id: str, memory: Optional[PatientMemory] = None) -> bool:
         """
         Guarda la memoria del paciente en la base de datos.
         
         Args:
             user_id: ID del usuario/paciente
+            memory: Memoria modificada (la obtenida con get_patient_memory). Si se
+                desalojó mientras se modificaba, se vuelve a guardar en memoria para
+                no perder los cambios.
             
         Returns:
             True si se guardó correctamente, False en caso contrario
         """
-        if user_id not in self.patient_memories:
-             logger.warning(f"Attempted to save memory for non-loaded user_id: {user_id}")
-             return False
-
+        if memory is None:
+            memory = self.patient_memories.get(user_id)
+            if memory is None:
+                 logger.warning(f"Attempted to save memory for non-loaded user_id: {user_id}")
+                 return False
+        elif self.patient_memories.get(user_id) is not memory:
+            self.patient_memories.put(user_id, memory, dirty=True)
+
+        # Se escribe detrás de cualquier escritura en curso del mismo paciente; si
+        # falla queda pendiente y se reintenta antes de desalojarla o en flush()
+        success = await self.patient_memories.write(user_id)
+        self.patient_memories.resize(user_id)
+        return success
+    
+    async def _persist_patient_memory(self, user_id: str, memory: PatientMemory) -> bool:
+        """Escribe la memoria del paciente en la base de datos"""
         try:
             # Assuming db_client is correctly set up elsewhere or imported
             from database.d1_client import db_client # Keep import local if not always needed
-            memory_dict = self.patient_memories[user_id].to_dict()
+            memory_dict = memory.to_dict()
             success = await db_client.save_patient_memory(user_id, memory_dict)
             if success:
                  logger.info(f"Successfully saved memory for patient {user_id} to DB.")
@@ -281,6 +325,15 @@ class EnhancedMemoryService:
             logger.error(f"Error saving memory for patient {user_id}: {e}")
             return False
     
+    def _release_vector_store(self, user_id: str, vector_store: Any) -> None:
+        """Libera la colección en memoria de un almacén vectorial desalojado"""
+        vector_store.delete_collection()
+        logger.info(f"Released in-memory vector store for user {user_id}")
+    
+    async def flush(self) -> int:
+        """Persiste las memorias de pacientes pendientes (p. ej. al cerrar la aplicación)"""
+        return await self.patient_memories.flush()
+    
     async def extract_entities_from_message(self, message: str) -> Dict[str, Any]:
         """
         Extrae entidades relevantes (nombre, edad, etc.) de un mensaje.
@@ -339,7 +392,7 @@ class EnhancedMemoryService:
             await self.update_vector_store(user_id, messages)
 
         # Guardar cambios en la memoria estructurada
-        await self.save_patient_memory(user_id)
+        await self.save_patient_memory(user_id, memory)
 
     async def update_vector_store(self, user_id: str, messages: List[Dict[str, Any]]) -> None:
         """
@@ -352,7 +405,8 @@ class EnhancedMemoryService:
         logger.info(f"Updating vector store for user {user_id}.")
         try:
             # Crear o obtener el vector store para el usuario
-            if user_id not in self.vector_stores:
+            vector_store = self.vector_stores.get(user_id)
+            if vector_store is None:
                 # TODO: Consider persistence for ChromaDB
                 # persist_directory = f"./vector_store/{user_id}" # Example path
                 # os.makedirs(persist_directory, exist_ok=True)
@@ -360,12 +414,14 @@ class EnhancedMemoryService:
                 #     persist_directory=persist_directory,
                 #     embedding_function=self.embeddings
                 # )
-                # Using in-memory Chroma for now
-                self.vector_stores[user_id] = Chroma(embedding_function=self.embeddings)
+                # Using in-memory Chroma for now, one collection per user so it can be released on eviction
+                vector_store = Chroma(
+                    collection_name=f"memory_{_COLLECTION_NAME_RE.sub('_', user_id)}"[:63],
+                    embedding_function=self.embeddings
+                )
+                self.vector_stores.put(user_id, vector_store)
                 logger.info(f"Created new in-memory vector store for user {user_id}")
 
-            vector_store = self.vector_stores[user_id]
-
             # Preparar documentos para añadir
             documents_to_add = []
             for msg in messages:
@@ -392,6 +448,10 @@ class EnhancedMemoryService:
                 # If Chroma API is sync:
                 try:
                     vector_store.add_documents(documents_to_add) # Assuming sync add_documents
+                    added_bytes = sum(
+                        len(doc.page_content.encode("utf-8")) + EMBEDDING_BYTES_PER_DOCUMENT for doc in documents_to_add
+                    )
+                    self.vector_stores.resize(user_id, self.vector_stores.size_of(user_id) + added_bytes)
                     logger.info(f"Added {len(documents_to_add)} documents to vector store for user {user_id}.")
                     # TODO: Add persistence call if using persistent Chroma
                     # vector_store.persist()
@@ -407,13 +467,13 @@ class EnhancedMemoryService:
         """
         Busca en el almacén vectorial memorias relevantes para una consulta.
         """
-        if not self.vector_enabled or user_id not in self.vector_stores:
+        vector_store = self.vector_stores.get(user_id) if self.vector_enabled else None
+        if vector_store is None:
             logger.debug("Vector store query skipped: vector features disabled or store not found.")
             return []
 
         logger.info(f"Querying vector store for user {user_id} with query: '{query[:50]}...'")
         try:
-            vector_store = self.vector_stores[user_id]
             # Perform similarity search
             # Assuming Chroma API is sync:
             results = vector_store.similarity_search_with_score(query, k=limit)
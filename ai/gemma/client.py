@@ -6,7 +6,7 @@ Proporciona funciones para generar respuestas de chat.
 import os
 import json
 import logging
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Dict, List, Optional, Any
 from datetime import datetime
 
 # Langchain imports
@@ -17,6 +17,7 @@ from langchain_core.output_parsers import StrOutputParser
 
 # Config
 from core.config import settings, logger
+from ai.llm_client import llm_clients, build_system_message, PROVIDER_OPENROUTER
 
 # Detección de idioma (mantenemos la librería externa)
 try:
@@ -30,7 +31,8 @@ except ImportError:
 
 def get_llm_client(model: Optional[str] = None, temperature: Optional[float] = None) -> Optional[ChatOpenAI]:
     """
-    Crea y configura una instancia del cliente LLM usando Langchain (ChatOpenAI) para OpenRouter.
+    Devuelve el cliente LLM (ChatOpenAI para OpenRouter) compartido para el modelo y la temperatura.
+    Se crea una sola vez en el registro de ai/llm_client.py y reutiliza su pool de conexiones.
     """
     if not settings.OPENROUTER_API_KEY:
         logger.error("Clave de API de OpenRouter no configurada.")
@@ -41,27 +43,64 @@ def get_llm_client(model: Optional[str] = None, temperature: Optional[float] = N
         logger.error("Modelo de OpenRouter no configurado.")
         return None
 
-    # Usar OPENROUTER_API_KEY y configurar base_url
     try:
-        llm = ChatOpenAI(
-            model=model_name,
-            openai_api_key=settings.OPENROUTER_API_KEY,
-            openai_api_base="https://openrouter.ai/api/v1",
-            temperature=temperature if temperature is not None else 0.7, # Valor por defecto si no se pasa
-            max_tokens=1024, # Establecer un max_tokens razonable por defecto
-            timeout=settings.OPENROUTER_TIMEOUT,
-            # Añadir headers personalizados para OpenRouter
-            default_headers={
-                "HTTP-Referer": settings.OPENROUTER_HTTP_REFERER or "",
-                "X-Title": settings.APP_NAME or ""
-            }
+        return llm_clients.get_client(
+            PROVIDER_OPENROUTER,
+            model_name,
+            temperature if temperature is not None else 0.7 # Valor por defecto si no se pasa
         )
-        return llm
     except Exception as e:
          logger.error(f"Error al inicializar ChatOpenAI para OpenRouter: {e}", exc_info=True)
          return None
 
 
+def _build_lc_messages(messages: List[Dict[str, str]], system_prompt: Optional[str] = None) -> List[Any]:
+    """Convierte los mensajes [{"role", "content"}] al formato de Langchain."""
+    lc_messages = []
+    if system_prompt:
+        # El prompt del PlayBook se repite en cada turno: se marca como cacheable
+        lc_messages.append(build_system_message(system_prompt))
+    for msg in messages:
+        role = msg.get("role")
+        content = msg.get("content")
+        if role == "user" and content:
+            lc_messages.append(HumanMessage(content=content))
+        elif role == "assistant" and content:
+            lc_messages.append(SystemMessage(content=content))
+        else:
+            logger.warning(f"Mensaje omitido por rol/contenido inválido: {msg}")
+    return lc_messages
+
+
+async def stream_chat_response(
+    messages: List[Dict[str, str]],
+    system_prompt: Optional[str] = None,
+    temperature: Optional[float] = None,
+    model: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Variante en streaming de generate_chat_response: devuelve el texto a medida
+    que el modelo lo genera (ver services/reply_streaming.py).
+
+    Raises:
+        RuntimeError: Si no se puede inicializar el cliente LLM.
+        ValueError: Si no hay ningún mensaje del usuario.
+        Exception: Los errores del proveedor se propagan para que el llamante
+            recurra a generate_chat_response.
+    """
+    llm = get_llm_client(model=model, temperature=temperature)
+    if not llm:
+        raise RuntimeError("Failed to initialize LLM Client")
+
+    lc_messages = _build_lc_messages(messages, system_prompt)
+    if not any(isinstance(m, HumanMessage) for m in lc_messages):
+        raise ValueError("No user message provided.")
+
+    logger.info(f"Enviando petición en streaming a OpenRouter con el modelo {llm.model_name}...")
+    async for text in llm_clients.astream(PROVIDER_OPENROUTER, llm.model_name, lc_messages, llm.temperature):
+        yield text
+
+
 async def generate_chat_response(
     messages: List[Dict[str, str]],
     system_prompt: Optional[str] = None,
@@ -89,18 +128,7 @@ async def generate_chat_response(
         return {"success": False, "error": "Failed to initialize LLM Client"}
 
     # Construir la lista de mensajes para Langchain
-    lc_messages = []
-    if system_prompt:
-        lc_messages.append(SystemMessage(content=system_prompt))
-    for msg in messages:
-        role = msg.get("role")
-        content = msg.get("content")
-        if role == "user" and content:
-            lc_messages.append(HumanMessage(content=content))
-        elif role == "assistant" and content:
-            lc_messages.append(SystemMessage(content=content))
-        else:
-            logger.warning(f"Mensaje omitido por rol/contenido inválido: {msg}")
+    lc_messages = _build_lc_messages(messages, system_prompt)
     # Log de depuración para ver los mensajes enviados a la IA
     logger.info(f"Enviando a la IA la siguiente lista de mensajes: {[{'role': getattr(m, 'type', type(m).__name__), 'content': m.content[:100]} for m in lc_messages]}")
 
@@ -112,8 +140,8 @@ async def generate_chat_response(
     logger.info(f"Enviando petición a OpenRouter con el modelo {llm.model_name}...")
 
     try:
-        # Usar el método invoke de Langchain
-        response = await llm.ainvoke(lc_messages)
+        # Usar el método invoke de Langchain, registrando llamadas en curso, latencia y uso de la caché de prompts
+        response = await llm_clients.ainvoke(PROVIDER_OPENROUTER, llm.model_name, lc_messages, llm.temperature)
         end_time = datetime.now()
         duration_ms = (end_time - start_time).total_seconds() * 1000
 
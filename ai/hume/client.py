@@ -5,9 +5,9 @@ Gestiona el reconocimiento y síntesis de voz
 import os
 import json
 import base64
-import httpx
 from typing import Dict, List, Any, Optional, BinaryIO, Union
 from core.config import settings
+from core.http_client import get_http_client
 
 class HumeEVIClient:
     """Cliente para interactuar con la API de Hume EVI"""
@@ -68,18 +68,19 @@ class HumeEVIClient:
             "language": whisper_language
         }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.base_url}/speech-to-text",
-                headers=self.headers,
-                json=payload
-            )
+        client = get_http_client(self.base_url)
+        response = await client.post(
+            f"{self.base_url}/speech-to-text",
+            headers=self.headers,
+            json=payload,
+            timeout=60.0
+        )
             
-            if response.status_code != 200:
-                error_detail = response.json() if response.content else "No error details"
-                raise Exception(f"Error en la API de Hume EVI (STT): {response.status_code} - {error_detail}")
+        if response.status_code != 200:
+            error_detail = response.json() if response.content else "No error details"
+            raise Exception(f"Error en la API de Hume EVI (STT): {response.status_code} - {error_detail}")
                 
-            return response.json()
+        return response.json()
     
     async def text_to_speech(
         self,
@@ -117,22 +118,23 @@ class HumeEVIClient:
             "config_id": self.config_id
         }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.base_url}/text-to-speech",
-                headers=self.headers,
-                json=payload
-            )
+        client = get_http_client(self.base_url)
+        response = await client.post(
+            f"{self.base_url}/text-to-speech",
+            headers=self.headers,
+            json=payload,
+            timeout=60.0
+        )
             
-            if response.status_code != 200:
-                error_detail = response.json() if response.content else "No error details"
-                raise Exception(f"Error en la API de Hume EVI (TTS): {response.status_code} - {error_detail}")
+        if response.status_code != 200:
+            error_detail = response.json() if response.content else "No error details"
+            raise Exception(f"Error en la API de Hume EVI (TTS): {response.status_code} - {error_detail}")
                 
-            # La respuesta contiene los datos de audio en base64
-            response_data = response.json()
-            audio_data = base64.b64decode(response_data["audio"])
+        # La respuesta contiene los datos de audio en base64
+        response_data = response.json()
+        audio_data = base64.b64decode(response_data["audio"])
             
-            return audio_data
+        return audio_data
     
     async def detect_language(self, audio_file: Union[str, BinaryIO]) -> str:
         """
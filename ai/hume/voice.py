@@ -8,9 +8,10 @@ import json
 import asyncio
 import base64
 from typing import Dict, List, Optional, Any, Union
-import httpx
 import uuid
 
+from core.http_client import get_http_client
+
 # Configurar logging
 logger = logging.getLogger("mark.hume")
 
@@ -102,44 +103,45 @@ class HumeVoice:
         logger.debug(f"Enviando solicitud a Hume EVI: {text[:50]}...")
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/speech/synthesis",
-                    headers=self.headers,
-                    json=payload
-                )
+            client = get_http_client(self.base_url)
+            response = await client.post(
+                f"{self.base_url}/speech/synthesis",
+                headers=self.headers,
+                json=payload,
+                timeout=60.0
+            )
                 
-                # Verificar respuesta
-                if response.status_code != 200:
-                    logger.error(f"Error en la API de Hume: {response.status_code} - {response.text}")
-                    return ""
+            # Verificar respuesta
+            if response.status_code != 200:
+                logger.error(f"Error en la API de Hume: {response.status_code} - {response.text}")
+                return ""
                 
-                # Procesar respuesta
-                response_data = response.json()
-                audio_data = response_data.get("audio", {}).get("data")
+            # Procesar respuesta
+            response_data = response.json()
+            audio_data = response_data.get("audio", {}).get("data")
                 
-                if not audio_data:
-                    logger.error("No se recibieron datos de audio de Hume")
-                    return ""
+            if not audio_data:
+                logger.error("No se recibieron datos de audio de Hume")
+                return ""
                 
-                # Decodificar datos de audio
-                audio_bytes = base64.b64decode(audio_data)
+            # Decodificar datos de audio
+            audio_bytes = base64.b64decode(audio_data)
                 
-                # Guardar en archivo si se solicita
-                if save_to_file:
-                    file_name = f"{uuid.uuid4()}.{output_format}"
-                    file_path = os.path.join(self.audio_dir, file_name)
+            # Guardar en archivo si se solicita
+            if save_to_file:
+                file_name = f"{uuid.uuid4()}.{output_format}"
+                file_path = os.path.join(self.audio_dir, file_name)
                     
-                    with open(file_path, "wb") as f:
-                        f.write(audio_bytes)
+                with open(file_path, "wb") as f:
+                    f.write(audio_bytes)
                     
-                    # Construir URL relativa
-                    audio_url = f"/static/audio/{file_name}"
-                    logger.info(f"Audio guardado en {file_path}")
-                    return audio_url
-                else:
-                    # Devolver datos codificados en base64
-                    return f"data:audio/{output_format};base64,{audio_data}"
+                # Construir URL relativa
+                audio_url = f"/static/audio/{file_name}"
+                logger.info(f"Audio guardado en {file_path}")
+                return audio_url
+            else:
+                # Devolver datos codificados en base64
+                return f"data:audio/{output_format};base64,{audio_data}"
                 
         except Exception as e:
             logger.error(f"Error al comunicarse con la API de Hume: {e}")
@@ -8,6 +8,8 @@ from typing import Dict, List, Optional, Any, Callable, TypedDict, Literal, Unio
 import asyncio
 import json
 
+from core.state_store import BoundedStateStore
+
 # Configurar logging
 logger = logging.getLogger("mark.langgraph")
 
@@ -19,7 +21,14 @@ class ConversationEngine:
     
     def __init__(self):
         """Inicializar el motor de conversación"""
-        self.active_conversations = {}
+        from core.config import settings
+
+        # Acotado por número e inactividad: el estado completo ya se guarda en las sesiones
+        self.active_conversations = BoundedStateStore(
+            "active_conversations",
+            max_entries=settings.ACTIVE_CONVERSATIONS_MAX_ENTRIES,
+            ttl_seconds=settings.ACTIVE_CONVERSATIONS_TTL_SECONDS,
+        )
         logger.info("Motor de conversación inicializado")
         
         # Intentar importar componentes necesarios
@@ -172,7 +181,7 @@ class ConversationEngine:
                         break
                 
                 # Guardar la conversación activa
-                self.active_conversations[conversation_id] = result
+                self.active_conversations.put(conversation_id, result)
                 
                 return {
                     "response": response,
@@ -6,12 +6,20 @@ from typing import Dict, List, Any, Literal, TypedDict, Optional, Tuple, Union
 from langgraph.graph import StateGraph, END
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import HumanMessage, AIMessage
 from ai.claude.client import claude
+from ai.llm_client import llm_clients, build_system_message, PROVIDER_ANTHROPIC
+from ai.context_window import (
+    ContextWindow, build_context_window, get_token_budget, SUMMARY_KEY, SUMMARIZED_COUNT_KEY, WINDOW_START_KEY,
+)
+from ai.response_cache import get_response_cache
 from ai.serper.search import serper
 from ai.langsmith.tracing import langsmith
+from ai.language_ngram_model import get_ngram_language_model
+from ai.security.pattern_matcher import PhraseMatcher
+from ai.security.threat_detection import threat_detector
 from core.config import settings
+import json
 import re
 
 # Definición de tipos para el estado del grafo
@@ -165,6 +173,137 @@ async def check_web_search_needed(state: ConversationState) -> Dict[str, Any]:
         print(f"Error al determinar si se necesita búsqueda web: {e}")
         return {"needs_web_search": False}
 
+# --- Enrutado en un solo paso ---
+
+VALID_PLAYBOOKS = ["general", "crisis", "appointment", "payment", "info"]
+
+# Expresiones inequívocas de cita o pago (comparadas sin acentos y por palabra completa)
+ROUTING_KEYWORDS = {
+    "appointment": [
+        "cita", "citas", "pedir cita", "reservar cita", "cambiar la cita", "cancelar la cita", "anular la cita",
+        "cites", "demanar cita", "canviar la cita",
+        "appointment", "booking", "reschedule",
+        "موعد", "حجز",
+    ],
+    "payment": [
+        "pago", "pagar", "factura", "precio", "tarifa", "cuánto cuesta", "bizum", "transferencia",
+        "pagament", "preu", "quant costa",
+        "payment", "pay", "invoice", "price", "how much",
+        "دفع", "فاتورة", "سعر",
+    ],
+}
+_routing_matcher = PhraseMatcher(
+    (phrase, playbook) for playbook, phrases in ROUTING_KEYWORDS.items() for phrase in phrases
+)
+
+ROUTER_PROMPT = """
+Analiza el siguiente mensaje de un usuario del Centre de Psicologia Jaume I y devuelve un objeto JSON con:
+- "language": código del idioma del mensaje: "es" (Español), "ca" (Catalán), "en" (Inglés) o "ar" (Árabe). Si no estás seguro, "es".
+- "playbook": "general" (conversación estándar y apoyo emocional), "crisis" (requiere apoyo inmediato y estabilización emocional), "appointment" (programar, cambiar o cancelar citas), "payment" (pagos, precios o facturas) o "info" (preguntas sobre el centro). Si el mensaje menciona suicidio, autolesiones o hacer daño a alguien, usa "crisis" aunque también pida una cita o hable de pagos.
+- "needs_web_search": true solo si hace falta información actualizada de internet para responder.
+
+Mensaje: {message}
+
+Responde solo con el JSON, sin explicaciones.
+"""
+
+def _local_language(text: str) -> Optional[str]:
+    """Idioma según el clasificador local por n-gramas, solo si es fiable"""
+    model = get_ngram_language_model()
+    if model is None:
+        return None
+    prediction = model.predict(text)
+    if prediction.language in settings.SUPPORTED_LANGUAGES and prediction.confidence >= settings.LANGUAGE_NGRAM_MIN_CONFIDENCE:
+        return prediction.language
+    return None
+
+def _has_risk_phrases(scan: Dict[str, Any]) -> bool:
+    return bool(scan["high_risk_keywords"] or scan["contextual_indicators"])
+
+def _local_playbook(text: str, scan: Dict[str, Any]) -> Optional[str]:
+    """
+    PlayBook evidente sin LLM: crisis si el riesgo preliminar es alto, o cita/pago
+    por palabras clave solo si el mensaje no contiene ninguna frase de riesgo
+    (una sola frase de riesgo da nivel "medio": entonces decide el LLM)
+    """
+    if threat_detector.preliminary_risk_level(scan) in ("alto", "crítico"):
+        return "crisis"
+    if _has_risk_phrases(scan):
+        return None
+    playbooks = {match.payload for match in _routing_matcher.find_all(text)}
+    if len(playbooks) == 1:
+        return playbooks.pop()
+    return None
+
+def _parse_router_response(response: str) -> Dict[str, Any]:
+    """Extrae el objeto JSON de la respuesta del LLM; {} si no es válido"""
+    match = re.search(r"\{.*\}", response or "", re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+def _routing_updates(state: ConversationState, language: str, playbook: str, needs_web_search: bool, source: str) -> Dict[str, Any]:
+    updates = {
+        "language": language,
+        "current_playbook": playbook,
+        "needs_web_search": needs_web_search,
+        "metadata": {**state.metadata, "routing": source},
+    }
+    # Actualizar flags según el PlayBook seleccionado
+    if playbook == "appointment":
+        updates["appointment_requested"] = True
+    elif playbook == "payment":
+        updates["payment_requested"] = True
+    return updates
+
+async def route_message(state: ConversationState) -> Dict[str, Any]:
+    """
+    Decide idioma, PlayBook y necesidad de búsqueda web en un solo paso.
+
+    Si los clasificadores locales son concluyentes (idioma fiable y PlayBook de
+    crisis, cita o pago, que nunca necesitan búsqueda web) no se llama al LLM.
+    En otro caso se hace una única llamada que devuelve las tres decisiones en JSON;
+    si falla y el mensaje contiene frases de riesgo, se elige crisis.
+    """
+    if not state.messages:
+        return _routing_updates(state, settings.DEFAULT_LANGUAGE, "general", False, "default")
+
+    last_user_message = next((m for m in reversed(state.messages) if m["role"] == "user"), None)
+    if not last_user_message:
+        return _routing_updates(state, state.language, state.current_playbook, False, "default")
+
+    text = last_user_message["content"]
+    local_language = _local_language(text)
+    scan = threat_detector.scan_message(text)
+    local_playbook = _local_playbook(text, scan)
+    if local_language and local_playbook:
+        return _routing_updates(state, local_language, local_playbook, False, "local")
+
+    try:
+        routing_response = await claude.get_response_text(
+            messages=[{"role": "user", "content": ROUTER_PROMPT.format(message=text)}],
+            temperature=0.0,
+            max_tokens=60
+        )
+        decision = _parse_router_response(routing_response)
+    except Exception as e:
+        print(f"Error al enrutar el mensaje: {e}")
+        decision = {}
+
+    # El idioma local fiable prevalece; el resto lo decide el LLM si respondió bien
+    language = local_language or str(decision.get("language", "")).strip().lower()
+    if language not in settings.SUPPORTED_LANGUAGES:
+        language = settings.DEFAULT_LANGUAGE
+    playbook = str(decision.get("playbook", "")).strip().lower()
+    if playbook not in VALID_PLAYBOOKS:
+        playbook = local_playbook or ("crisis" if _has_risk_phrases(scan) else "general")
+    needs_web_search = decision.get("needs_web_search") is True
+    return _routing_updates(state, language, playbook, needs_web_search, "llm" if decision else "fallback")
+
 async def perform_web_search(state: ConversationState) -> Dict[str, Any]:
     """Realiza una búsqueda web si es necesario"""
     if not state.needs_web_search:
@@ -190,52 +329,114 @@ async def perform_web_search(state: ConversationState) -> Dict[str, Any]:
         print(f"Error al realizar búsqueda web: {e}")
         return {"search_results": None}
 
-async def generate_response(state: ConversationState) -> Dict[str, Any]:
-    """Genera una respuesta utilizando el PlayBook actual"""
-    # Construir el sistema prompt basado en el PlayBook y el idioma
-    system_prompts = {
-        "general": {
-            "es": """Eres Mark, un asistente psicológico virtual del Centre de Psicologia Jaume I. Tu objetivo es proporcionar apoyo emocional y orientación de manera empática y profesional. Responde siempre en español.""",
-            "ca": """Ets Mark, un assistent psicològic virtual del Centre de Psicologia Jaume I. El teu objectiu és proporcionar suport emocional i orientació de manera empàtica i professional. Respon sempre en català.""",
-            "en": """You are Mark, a virtual psychological assistant from the Centre de Psicologia Jaume I. Your goal is to provide emotional support and guidance in an empathetic and professional manner. Always respond in English.""",
-            "ar": """أنت مارك، مساعد نفسي افتراضي من مركز علم النفس خاومي الأول. هدفك هو تقديم الدعم العاطفي والتوجيه بطريقة متعاطفة ومهنية. قم دائمًا بالرد باللغة العربية."""
-        },
-        "crisis": {
-            "es": """Eres Mark, un asistente psicológico virtual del Centre de Psicologia Jaume I especializado en intervención en crisis. Tu prioridad es la seguridad del usuario y proporcionar apoyo inmediato. Responde siempre en español.""",
-            "ca": """Ets Mark, un assistent psicològic virtual del Centre de Psicologia Jaume I especialitzat en intervenció en crisis. La teva prioritat és la seguretat de l'usuari i proporcionar suport immediat. Respon sempre en català.""",
-            "en": """You are Mark, a virtual psychological assistant from the Centre de Psicologia Jaume I specialized in crisis intervention. Your priority is the user's safety and providing immediate support. Always respond in English.""",
-            "ar": """أنت مارك، مساعد نفسي افتراضي من مركز علم النفس خاومي الأول متخصص في التدخل في الأزمات. أولويتك هي سلامة المستخدم وتقديم الدعم الفوري. قم دائمًا بالرد باللغة العربية."""
-        },
-        "appointment": {
-            "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I encargado de gestionar citas. Ayuda al usuario a programar, modificar o cancelar citas con los psicólogos del centro. Responde siempre en español.""",
-            "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I encarregat de gestionar cites. Ajuda a l'usuari a programar, modificar o cancel·lar cites amb els psicòlegs del centre. Respon sempre en català.""",
-            "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I in charge of managing appointments. Help the user schedule, modify, or cancel appointments with the center's psychologists. Always respond in English.""",
-            "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول مسؤول عن إدارة المواعيد. ساعد المستخدم في جدولة أو تعديل أو إلغاء المواعيد مع أخصائيي علم النفس في المركز. قم دائمًا بالرد باللغة العربية."""
-        },
-        "payment": {
-            "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I encargado de gestionar pagos. Ayuda al usuario con información sobre precios, métodos de pago y facturación. Responde siempre en español.""",
-            "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I encarregat de gestionar pagaments. Ajuda a l'usuari amb informació sobre preus, mètodes de pagament i facturació. Respon sempre en català.""",
-            "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I in charge of managing payments. Help the user with information about prices, payment methods, and billing. Always respond in English.""",
-            "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول مسؤول عن إدارة المدفوعات. ساعد المستخدم بمعلومات حول الأسعار وطرق الدفع والفواتير. قم دائمًا بالرد باللغة العربية."""
-        },
-        "info": {
-            "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I. Proporciona información precisa sobre los servicios, horarios, ubicación y profesionales del centro. Responde siempre en español.""",
-            "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I. Proporciona informació precisa sobre els serveis, horaris, ubicació i professionals del centre. Respon sempre en català.""",
-            "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I. Provide accurate information about the center's services, hours, location, and professionals. Always respond in English.""",
-            "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول. قدم معلومات دقيقة حول خدمات المركز وساعات العمل والموقع والمهنيين. قم دائمًا بالرد باللغة العربية."""
-        }
+# Prompts del sistema por PlayBook e idioma
+PLAYBOOK_SYSTEM_PROMPTS = {
+    "general": {
+        "es": """Eres Mark, un asistente psicológico virtual del Centre de Psicologia Jaume I. Tu objetivo es proporcionar apoyo emocional y orientación de manera empática y profesional. Responde siempre en español.""",
+        "ca": """Ets Mark, un assistent psicològic virtual del Centre de Psicologia Jaume I. El teu objectiu és proporcionar suport emocional i orientació de manera empàtica i professional. Respon sempre en català.""",
+        "en": """You are Mark, a virtual psychological assistant from the Centre de Psicologia Jaume I. Your goal is to provide emotional support and guidance in an empathetic and professional manner. Always respond in English.""",
+        "ar": """أنت مارك، مساعد نفسي افتراضي من مركز علم النفس خاومي الأول. هدفك هو تقديم الدعم العاطفي والتوجيه بطريقة متعاطفة ومهنية. قم دائمًا بالرد باللغة العربية."""
+    },
+    "crisis": {
+        "es": """Eres Mark, un asistente psicológico virtual del Centre de Psicologia Jaume I especializado en intervención en crisis. Tu prioridad es la seguridad del usuario y proporcionar apoyo inmediato. Responde siempre en español.""",
+        "ca": """Ets Mark, un assistent psicològic virtual del Centre de Psicologia Jaume I especialitzat en intervenció en crisis. La teva prioritat és la seguretat de l'usuari i proporcionar suport immediat. Respon sempre en català.""",
+        "en": """You are Mark, a virtual psychological assistant from the Centre de Psicologia Jaume I specialized in crisis intervention. Your priority is the user's safety and providing immediate support. Always respond in English.""",
+        "ar": """أنت مارك، مساعد نفسي افتراضي من مركز علم النفس خاومي الأول متخصص في التدخل في الأزمات. أولويتك هي سلامة المستخدم وتقديم الدعم الفوري. قم دائمًا بالرد باللغة العربية."""
+    },
+    "appointment": {
+        "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I encargado de gestionar citas. Ayuda al usuario a programar, modificar o cancelar citas con los psicólogos del centro. Responde siempre en español.""",
+        "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I encarregat de gestionar cites. Ajuda a l'usuari a programar, modificar o cancel·lar cites amb els psicòlegs del centre. Respon sempre en català.""",
+        "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I in charge of managing appointments. Help the user schedule, modify, or cancel appointments with the center's psychologists. Always respond in English.""",
+        "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول مسؤول عن إدارة المواعيد. ساعد المستخدم في جدولة أو تعديل أو إلغاء المواعيد مع أخصائيي علم النفس في المركز. قم دائمًا بالرد باللغة العربية."""
+    },
+    "payment": {
+        "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I encargado de gestionar pagos. Ayuda al usuario con información sobre precios, métodos de pago y facturación. Responde siempre en español.""",
+        "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I encarregat de gestionar pagaments. Ajuda a l'usuari amb informació sobre preus, mètodes de pagament i facturació. Respon sempre en català.""",
+        "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I in charge of managing payments. Help the user with information about prices, payment methods, and billing. Always respond in English.""",
+        "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول مسؤول عن إدارة المدفوعات. ساعد المستخدم بمعلومات حول الأسعار وطرق الدفع والفواتير. قم دائمًا بالرد باللغة العربية."""
+    },
+    "info": {
+        "es": """Eres Mark, un asistente virtual del Centre de Psicologia Jaume I. Proporciona información precisa sobre los servicios, horarios, ubicación y profesionales del centro. Responde siempre en español.""",
+        "ca": """Ets Mark, un assistent virtual del Centre de Psicologia Jaume I. Proporciona informació precisa sobre els serveis, horaris, ubicació i professionals del centre. Respon sempre en català.""",
+        "en": """You are Mark, a virtual assistant from the Centre de Psicologia Jaume I. Provide accurate information about the center's services, hours, location, and professionals. Always respond in English.""",
+        "ar": """أنت مارك، مساعد افتراضي من مركز علم النفس خاومي الأول. قدم معلومات دقيقة حول خدمات المركز وساعات العمل والموقع والمهنيين. قم دائمًا بالرد باللغة العربية."""
     }
+}
+
+def build_system_prompt(state: ConversationState) -> str:
+    """Prompt del sistema según el PlayBook y el idioma (parte estática, cacheable)"""
+    # Si no existe el playbook o idioma específico, usar el general en español
+    system_prompts = PLAYBOOK_SYSTEM_PROMPTS
+    return system_prompts.get(state.current_playbook, system_prompts["general"]).get(state.language, system_prompts["general"]["es"])
+
+def build_response_messages(state: ConversationState) -> Tuple[List[Any], ContextWindow]:
+    """
+    Construye los mensajes en formato LangChain dentro del presupuesto de tokens del PlayBook:
+    prompt del sistema, resumen de los turnos antiguos y los mensajes recientes que quepan
+    """
+    system_prompt = build_system_prompt(state)
+    
+    # Añadir información de búsqueda web si está disponible (detrás del prefijo cacheable)
+    dynamic_context = []
+    if state.search_results:
+        dynamic_context.append(f"Información adicional de búsqueda web:\n{state.search_results}")
     
-    # Obtener el sistema prompt adecuado
+    window = build_context_window(
+        state.messages,
+        "\n\n".join([system_prompt, *dynamic_context]),
+        get_token_budget(state.current_playbook),
+        summary=state.context.get(SUMMARY_KEY),
+        summarized=state.context.get(SUMMARIZED_COUNT_KEY, 0)
+    )
+    if window.summary:
+        dynamic_context.append(f"Resumen de la conversación anterior:\n{window.summary}")
+    
+    # Convertir mensajes al formato de LangChain Core
+    langchain_messages = []
+    langchain_messages.append(build_system_message(system_prompt, "\n\n".join(dynamic_context) or None))
+    
+    for msg in window.messages:
+        if msg["role"] == "user":
+            langchain_messages.append(HumanMessage(content=msg["content"]))
+        elif msg["role"] == "assistant":
+            langchain_messages.append(AIMessage(content=msg["content"]))
+    return langchain_messages, window
+
+def _cacheable_question(state: ConversationState) -> Optional[str]:
+    """
+    Pregunta del usuario si su respuesta puede reutilizarse (caché semántica): solo
+    el primer mensaje de la conversación, sin resumen previo, para que la respuesta
+    no dependa del historial de un paciente ni se sirva a un seguimiento ("¿y con tarjeta?")
+    """
+    if not settings.RESPONSE_CACHE_ENABLED or state.current_playbook not in settings.RESPONSE_CACHE_PLAYBOOKS:
+        return None
+    if len(state.messages) != 1 or state.messages[0]["role"] != "user" or state.context.get(SUMMARY_KEY):
+        return None
+    return state.messages[0]["content"]
+
+def _store_cached_response(state: ConversationState, question: Optional[str], response_text: str) -> None:
+    """Guarda la respuesta generada si no depende de una búsqueda web y la pregunta es corta"""
+    if not question or not response_text or state.search_results:
+        return
+    if len(question) > settings.RESPONSE_CACHE_MAX_QUESTION_CHARS:
+        return
+    get_response_cache().store(question, response_text, state.language, state.current_playbook)
+
+async def generate_response(state: ConversationState) -> Dict[str, Any]:
+    """Genera una respuesta utilizando el PlayBook actual"""
     playbook = state.current_playbook
     language = state.language
     
-    # Si no existe el playbook o idioma específico, usar el general en español
-    system_prompt = system_prompts.get(playbook, system_prompts["general"]).get(language, system_prompts["general"]["es"])
-    
-    # Añadir información de búsqueda web si está disponible
-    if state.search_results:
-        system_prompt += f"\n\nInformación adicional de búsqueda web:\n{state.search_results}"
+    # Preguntas frecuentes ya respondidas: reutilizar la respuesta sin llamar al LLM
+    question = _cacheable_question(state)
+    cached = get_response_cache().lookup(question, language, playbook) if question else None
+    if cached:
+        updated_messages = state.messages.copy()
+        updated_messages.append({"role": "assistant", "content": cached.answer})
+        return {
+            "messages": updated_messages,
+            "metadata": {**state.metadata, "response_cache": {"entry_id": cached.entry_id, "similarity": cached.similarity}}
+        }
     
     # Generar respuesta con Claude
     try:
@@ -243,25 +444,19 @@ async def generate_response(state: ConversationState) -> Dict[str, Any]:
         tracer = langsmith.get_tracer(run_name=f"mark_response_{playbook}_{language}")
         callbacks = [tracer] if tracer else []
         
-        # Configurar el modelo de Claude con LangChain para trazabilidad
-        model = ChatAnthropic(
-            model=settings.CLAUDE_MODEL,
-            anthropic_api_key=settings.CLAUDE_API_KEY,
-            temperature=0.7,
-        )
-        
-        # Convertir mensajes al formato de LangChain Core
-        langchain_messages = []
-        langchain_messages.append(SystemMessage(content=system_prompt))
-        
-        for msg in state.messages:
-            if msg["role"] == "user":
-                langchain_messages.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                langchain_messages.append(AIMessage(content=msg["content"]))
+        # Construir el sistema prompt basado en el PlayBook y el idioma,
+        # con el historial recortado al presupuesto de tokens
+        langchain_messages, window = build_response_messages(state)
         
         # Generar respuesta usando ainvoke con callbacks
-        response = await model.ainvoke(langchain_messages, config={"callbacks": callbacks})
+        # (cliente de Claude compartido del registro de ai/llm_client.py)
+        response = await llm_clients.ainvoke(
+            PROVIDER_ANTHROPIC,
+            settings.CLAUDE_MODEL,
+            langchain_messages,
+            temperature=0.7,
+            config={"callbacks": callbacks}
+        )
         response_text = response.content
         
         # Evaluar la calidad de la respuesta
@@ -285,8 +480,10 @@ async def generate_response(state: ConversationState) -> Dict[str, Any]:
         # Actualizar los mensajes con la respuesta del asistente
         updated_messages = state.messages.copy()
         updated_messages.append(assistant_message)
+        _store_cached_response(state, question, response_text)
         
-        return {"messages": updated_messages}
+        # Guardar dónde empieza la ventana para resumir después lo que quedó fuera
+        return {"messages": updated_messages, "context": {**state.context, WINDOW_START_KEY: window.start}}
     except Exception as e:
         print(f"Error al generar respuesta: {e}")
         
@@ -324,23 +521,18 @@ def build_conversation_graph() -> StateGraph:
     """Construye y compila el grafo de conversación"""
     graph = StateGraph(ConversationState)
 
-    # Añadir nodos
-    graph.add_node("detect_language", detect_language)
-    graph.add_node("select_playbook", select_playbook)
-    graph.add_node("check_web_search", check_web_search_needed)
+    # Añadir nodos: un único paso de enrutado (idioma, PlayBook y búsqueda web)
+    # en lugar de tres llamadas secuenciales al LLM
+    graph.add_node("route_message", route_message)
     graph.add_node("perform_web_search", perform_web_search)
     graph.add_node("generate_response", generate_response)
 
     # Definir punto de entrada
-    graph.set_entry_point("detect_language")
+    graph.set_entry_point("route_message")
 
-    # Añadir bordes
-    graph.add_edge("detect_language", "select_playbook")
-    graph.add_edge("select_playbook", "check_web_search")
-
-    # Borde condicional después de verificar si se necesita búsqueda web
+    # Borde condicional después de decidir si se necesita búsqueda web
     graph.add_conditional_edges(
-        "check_web_search",
+        "route_message",
         should_search_web,
         {
             "perform_web_search": "perform_web_search",
@@ -358,4 +550,7 @@ def build_conversation_graph() -> StateGraph:
     return graph.compile()
 
 # Crear instancia del grafo compilado
-playbook_graph = build_conversation_graph() 
\ No newline at end of file
+playbook_graph = build_conversation_graph()
+
+# Nombre usado por backend/services/conversation.py y los tests
+conversation_graph = playbook_graph 
\ No newline at end of file
@@ -2,9 +2,10 @@
 Módulo para la detección del idioma en los mensajes de usuario.
 Garantiza que Mark responda siempre en el idioma adecuado.
 """
+import asyncio
 import logging
 import re
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 import unicodedata
 
 # Importación condicional de langdetect
@@ -17,8 +18,13 @@ try:
 except ImportError:
     LANGDETECT_AVAILABLE = False
 
-from core.config import LanguageConfig
-from ai.claude.client import generate_claude_response
+from langchain_core.messages import HumanMessage
+
+from core.config import settings
+from ai.llm_client import llm_clients, PROVIDER_ANTHROPIC
+from ai.language_ngram_model import get_ngram_language_model
+from ai.language_scoring import LanguageScore, LanguageScorer
+from ai.language_utils import get_language_executor
 
 logger = logging.getLogger("mark-assistant.language")
 
@@ -54,6 +60,30 @@ LANGUAGE_SPECIFIC_WORDS = {
     "ar": ["لأن", "رغم أن", "ثم", "لكن", "الآن", "دائما", "أبدا", "هنا", "اليوم", "غدا", "أمس", "هذا", "ذلك"]
 }
 
+# Puntuador compilado una sola vez a partir de las listas anteriores (ver ai/language_scoring.py)
+language_scorer = LanguageScorer(LANGUAGE_PATTERNS, LANGUAGE_SPECIFIC_WORDS, settings.SUPPORTED_LANGUAGES)
+
+# Saludos para textos muy cortos (sobre texto normalizado)
+SHORT_TEXT_PATTERNS = [
+    ("en", re.compile(r'\b(hello|hi|hey|good morning|good afternoon)\b')),
+    ("es", re.compile(r'\b(hola|buenos dias|buenas tardes|buenas noches)\b')),
+    ("ca", re.compile(r'\b(bon dia|hola|bona tarda|bona nit)\b')),
+]
+SHORT_TEXT_ARABIC = ("مرحبا", "صباح الخير", "مساء الخير")
+
+def score_language(text: str) -> LanguageScore:
+    """
+    Puntúa el texto para todos los idiomas en una sola pasada.
+    
+    Args:
+        text: Texto a analizar
+        
+    Returns:
+        LanguageScore con el idioma más probable, la confianza (proporción de la
+        puntuación total) y las puntuaciones por idioma
+    """
+    return language_scorer.score(text)
+
 def normalize_text(text: str) -> str:
     """
     Normaliza el texto eliminando acentos y caracteres especiales
@@ -84,15 +114,7 @@ def count_pattern_matches(text: str, language: str) -> int:
     Returns:
         Número de coincidencias encontradas
     """
-    if language not in LANGUAGE_PATTERNS:
-        return 0
-    
-    count = 0
-    for pattern in LANGUAGE_PATTERNS[language]:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        count += len(matches)
-    
-    return count
+    return score_language(text).pattern_scores.get(language, 0)
 
 def count_specific_words(text: str, language: str) -> int:
     """
@@ -105,17 +127,7 @@ def count_specific_words(text: str, language: str) -> int:
     Returns:
         Número de palabras específicas encontradas
     """
-    if language not in LANGUAGE_SPECIFIC_WORDS:
-        return 0
-    
-    count = 0
-    words = text.lower().split()
-    
-    for word in LANGUAGE_SPECIFIC_WORDS[language]:
-        if word in words:
-            count += 1
-    
-    return count
+    return score_language(text).word_scores.get(language, 0)
 
 def detect_language_with_langdetect(text: str) -> Optional[str]:
     """
@@ -148,17 +160,8 @@ def detect_language_with_langdetect(text: str) -> Optional[str]:
         logger.error(f"Error al detectar idioma con langdetect: {e}")
         return None
 
-def detect_language_with_claude(text: str) -> Optional[str]:
-    """
-    Detecta el idioma usando Claude
-    
-    Args:
-        text: Texto a analizar
-        
-    Returns:
-        Código del idioma detectado o None si no se pudo detectar
-    """
-    prompt = f"""
+def _build_language_prompt(text: str) -> str:
+    return f"""
 Por favor, analiza el siguiente texto y determina si está escrito en español (es), catalán (ca), inglés (en) o árabe (ar).
 Responde únicamente con el código de dos letras correspondiente: "es", "ca", "en" o "ar".
 
@@ -169,29 +172,155 @@ Texto a analizar:
 
 Código de idioma (solo responde con uno de estos: "es", "ca", "en", "ar"):
 """
+
+def _parse_language_code(response: str) -> Optional[str]:
+    response = response.strip().lower()
     
-    try:
-        response = generate_claude_response(prompt, max_tokens=10)
-        response = response.strip().lower()
-        
-        # Verificar que la respuesta sea un código de idioma válido
-        if response in LanguageConfig.SUPPORTED_LANGUAGES:
-            return response
+    # Verificar que la respuesta sea un código de idioma válido
+    if response in settings.SUPPORTED_LANGUAGES:
+        return response
+    
+    # Intentar extraer un código válido de la respuesta
+    for lang in settings.SUPPORTED_LANGUAGES:
+        if lang in response:
+            return lang
+    
+    return None
+
+def _language_messages(text: str) -> List[Any]:
+    return [HumanMessage(content=_build_language_prompt(text))]
+
+def _claude_language_client() -> Any:
+    """Cliente de Claude compartido (registro de ai/llm_client.py), sin aleatoriedad."""
+    return llm_clients.get_client(PROVIDER_ANTHROPIC, settings.CLAUDE_MODEL, 0.0)
+
+def detect_language_with_claude(text: str) -> Optional[str]:
+    """
+    Detecta el idioma usando Claude
+    
+    Args:
+        text: Texto a analizar
         
-        # Intentar extraer un código válido de la respuesta
-        for lang in LanguageConfig.SUPPORTED_LANGUAGES:
-            if lang in response:
-                return lang
+    Returns:
+        Código del idioma detectado o None si no se pudo detectar
+    """
+    try:
+        response = _claude_language_client().invoke(_language_messages(text))
+        return _parse_language_code(response.content)
+    except Exception as e:
+        logger.error(f"Error al detectar idioma con Claude: {e}")
+        return None
+
+async def detect_language_with_claude_async(text: str, timeout: Optional[float] = None) -> Optional[str]:
+    """
+    Detecta el idioma usando Claude sin bloquear el event loop.
+    
+    Args:
+        text: Texto a analizar
+        timeout: Segundos máximos de espera (por defecto LANGUAGE_LLM_TIMEOUT_SECONDS)
         
+    Returns:
+        Código del idioma detectado o None si no se pudo detectar a tiempo
+    """
+    timeout = settings.LANGUAGE_LLM_TIMEOUT_SECONDS if timeout is None else timeout
+    try:
+        response = await asyncio.wait_for(
+            llm_clients.ainvoke(PROVIDER_ANTHROPIC, settings.CLAUDE_MODEL, _language_messages(text), temperature=0.0),
+            timeout=timeout,
+        )
+        return _parse_language_code(response.content)
+    except asyncio.TimeoutError:
+        logger.warning(f"Claude no respondió en {timeout}s al detectar el idioma")
         return None
     except Exception as e:
         logger.error(f"Error al detectar idioma con Claude: {e}")
         return None
 
+class LanguageDecision(NamedTuple):
+    """Idioma decidido, confianza (0-1) y origen de la decisión."""
+    language: str
+    confidence: float
+    source: str
+
+def _short_text_language(text: str) -> Optional[str]:
+    """Saludos reconocibles en textos muy cortos."""
+    if len(text.strip()) >= 15:
+        return None
+    normalized_text = normalize_text(text)
+    
+    # Verificar saludos y expresiones comunes
+    for language, pattern in SHORT_TEXT_PATTERNS:
+        if pattern.search(normalized_text):
+            return language
+    if any(greeting in text for greeting in SHORT_TEXT_ARABIC):
+        return "ar"
+    return None
+
+def _decide_language(heuristic: LanguageScore, langdetect_result: Optional[str]) -> Tuple[Optional[LanguageDecision], bool]:
+    """
+    Combina las heurísticas con el resultado de langdetect.
+    
+    Returns:
+        (decisión o None si no hay ninguna, True si conviene consultar a Claude)
+    """
+    pattern_scores = heuristic.pattern_scores
+    word_scores = heuristic.word_scores
+    has_evidence = max(pattern_scores.values(), default=0) > 0 or max(word_scores.values(), default=0) > 0
+    pattern_best = max(pattern_scores.items(), key=lambda x: x[1]) if pattern_scores else (None, 0)
+    word_best = max(word_scores.items(), key=lambda x: x[1]) if word_scores else (None, 0)
+    
+    if langdetect_result:
+        # Sin evidencia de heurísticas, confiar en langdetect
+        if not has_evidence:
+            return LanguageDecision(langdetect_result, 0.7, "langdetect"), False
+        
+        # Si hay consenso entre métodos, usar ese resultado
+        if langdetect_result == pattern_best[0] or langdetect_result == word_best[0]:
+            return LanguageDecision(langdetect_result, 0.95, "langdetect+heuristic"), False
+        
+        # Si no hay consenso y las heurísticas son fuertes, consultar a Claude;
+        # si no, confiar en langdetect
+        strong_heuristics = pattern_best[1] > 2 or word_best[1] > 1
+        return LanguageDecision(langdetect_result, 0.5, "langdetect"), strong_heuristics
+    
+    if has_evidence:
+        # Si hay consenso entre heurísticas, usar ese resultado; si no, el más fuerte
+        if pattern_best[0] and word_best[0] and pattern_best[0] == word_best[0]:
+            language = pattern_best[0]
+        elif pattern_best[1] > word_best[1]:
+            language = pattern_best[0]
+        else:
+            language = word_best[0]
+        confidence = heuristic.scores[language] / (sum(heuristic.scores.values()) or 1)
+        return LanguageDecision(language, confidence, "heuristic"), False
+    
+    # Como último recurso, consultar a Claude
+    return None, True
+
+def _ngram_decision(text: str) -> Optional[LanguageDecision]:
+    """
+    Clasificador local por n-gramas (ai/language_ngram_model.py): resuelve la
+    mayoría de dudas entre catalán y castellano sin consultar a Claude.
+    """
+    model = get_ngram_language_model()
+    if model is None:
+        return None
+    prediction = model.predict(text)
+    if prediction.language in settings.SUPPORTED_LANGUAGES and prediction.confidence >= settings.LANGUAGE_NGRAM_MIN_CONFIDENCE:
+        return LanguageDecision(prediction.language, prediction.confidence, "ngram")
+    return None
+
+def _default_decision() -> LanguageDecision:
+    logger.warning(f"No se pudo detectar el idioma, usando idioma por defecto: {settings.DEFAULT_LANGUAGE}")
+    return LanguageDecision(settings.DEFAULT_LANGUAGE, 0.0, "default")
+
 def detect_language(text: str, user_id: Optional[str] = None, session_data: Optional[Dict] = None) -> str:
     """
     Detecta el idioma del texto proporcionado usando múltiples métodos.
     
+    Versión síncrona: bloquea mientras se ejecutan langdetect y Claude. Desde
+    código asíncrono usar `detect_language_async`.
+    
     Args:
         text: Texto a analizar
         user_id: ID del usuario (para persistencia de idioma)
@@ -206,83 +335,117 @@ def detect_language(text: str, user_id: Optional[str] = None, session_data: Opti
         return session_data["language"]
     
     # Si el texto es muy corto, usar heurísticas simples
-    if len(text.strip()) < 15:
-        normalized_text = normalize_text(text)
-        
-        # Verificar saludos y expresiones comunes
-        if re.search(r'\b(hello|hi|hey|good morning|good afternoon)\b', normalized_text):
-            return "en"
-        elif re.search(r'\b(hola|buenos dias|buenas tardes|buenas noches)\b', normalized_text):
-            return "es"
-        elif re.search(r'\b(bon dia|hola|bona tarda|bona nit)\b', normalized_text):
-            return "ca"
-        elif "مرحبا" in text or "صباح الخير" in text or "مساء الخير" in text:
-            return "ar"
-    
-    # Método 1: Contar coincidencias de patrones
-    pattern_scores = {}
-    for lang in LanguageConfig.SUPPORTED_LANGUAGES:
-        pattern_scores[lang] = count_pattern_matches(text, lang)
-    
-    # Método 2: Contar palabras específicas del idioma
-    word_scores = {}
-    for lang in LanguageConfig.SUPPORTED_LANGUAGES:
-        word_scores[lang] = count_specific_words(text, lang)
+    short_text_result = _short_text_language(text)
+    if short_text_result:
+        return short_text_result
+    
+    # Métodos 1 y 2: coincidencias de patrones y palabras específicas, en una sola pasada
+    heuristic = score_language(text)
     
     # Método 3: Usar langdetect si está disponible
     langdetect_result = detect_language_with_langdetect(text)
     
     # Método 4: Usar Claude para detección definitiva si es necesario
-    if langdetect_result:
-        # Si langdetect da un resultado, combinarlo con nuestras heurísticas
-        pattern_max = max(pattern_scores.values()) if pattern_scores else 0
-        word_max = max(word_scores.values()) if word_scores else 0
-        
-        if pattern_max > 0 or word_max > 0:
-            # Hay evidencia de heurísticas
-            pattern_best = max(pattern_scores.items(), key=lambda x: x[1]) if pattern_scores else (None, 0)
-            word_best = max(word_scores.items(), key=lambda x: x[1]) if word_scores else (None, 0)
-            
-            # Si hay consenso entre métodos, usar ese resultado
-            if langdetect_result == pattern_best[0] or langdetect_result == word_best[0]:
-                return langdetect_result
-            
-            # Si no hay consenso y las heurísticas son fuertes, consultar a Claude
-            if pattern_best[1] > 2 or word_best[1] > 1:
-                claude_result = detect_language_with_claude(text)
-                if claude_result:
-                    return claude_result
-            
-            # Si no, confiar en langdetect
-            return langdetect_result
-        else:
-            # Sin evidencia de heurísticas, confiar en langdetect
-            return langdetect_result
+    decision, needs_llm = _decide_language(heuristic, langdetect_result)
+    if needs_llm:
+        # Antes de Claude, el clasificador local
+        ngram_decision = _ngram_decision(text)
+        if ngram_decision:
+            return ngram_decision.language
+        claude_result = detect_language_with_claude(text)
+        if claude_result:
+            return claude_result
     
-    # Si llegamos aquí, no tenemos resultado de langdetect
-    pattern_max = max(pattern_scores.values()) if pattern_scores else 0
-    word_max = max(word_scores.values()) if word_scores else 0
+    # Si todo falla, usar el idioma por defecto
+    return (decision or _default_decision()).language
+
+# --- Detección asíncrona ---
+
+# Las heurísticas bastan (sin langdetect) si el mejor idioma suma al menos
+# HEURISTIC_ACCEPT_SCORE coincidencias y HEURISTIC_ACCEPT_CONFIDENCE de la puntuación total
+HEURISTIC_ACCEPT_SCORE = 3
+HEURISTIC_ACCEPT_CONFIDENCE = 0.75
+
+def _stored_decision(session_data: Optional[Dict[str, Any]]) -> Optional[LanguageDecision]:
+    """Decisión guardada en la sesión, si es lo bastante fiable para reutilizarla."""
+    if not session_data or not session_data.get("language"):
+        return None
+    confidence = session_data.get("language_confidence")
+    if confidence is None:
+        # Idioma fijado explícitamente (sin confianza asociada)
+        return LanguageDecision(session_data["language"], 1.0, "session")
+    if confidence >= settings.LANGUAGE_REUSE_MIN_CONFIDENCE:
+        return LanguageDecision(session_data["language"], confidence, "session")
+    return None
+
+async def _run_detection(text: str, use_llm: bool) -> LanguageDecision:
+    short_text_result = _short_text_language(text)
+    if short_text_result:
+        return LanguageDecision(short_text_result, 0.9, "heuristic")
     
-    if pattern_max > 0 or word_max > 0:
-        # Tomar el mejor resultado de heurísticas
-        pattern_best = max(pattern_scores.items(), key=lambda x: x[1]) if pattern_scores else (None, 0)
-        word_best = max(word_scores.items(), key=lambda x: x[1]) if word_scores else (None, 0)
-        
-        # Si hay consenso entre heurísticas, usar ese resultado
-        if pattern_best[0] and word_best[0] and pattern_best[0] == word_best[0]:
-            return pattern_best[0]
+    # Heurísticas baratas primero: si son claras no hace falta nada más
+    heuristic = score_language(text)
+    if heuristic.scores[heuristic.language] >= HEURISTIC_ACCEPT_SCORE and heuristic.confidence >= HEURISTIC_ACCEPT_CONFIDENCE:
+        return LanguageDecision(heuristic.language, heuristic.confidence, "heuristic")
+    
+    langdetect_result = None
+    if LANGDETECT_AVAILABLE:
+        loop = asyncio.get_running_loop()
+        langdetect_result = await loop.run_in_executor(get_language_executor(), detect_language_with_langdetect, text)
+    
+    decision, needs_llm = _decide_language(heuristic, langdetect_result)
+    if needs_llm:
+        # Antes de Claude, el clasificador local
+        ngram_decision = _ngram_decision(text)
+        if ngram_decision:
+            return ngram_decision
+    if needs_llm and use_llm:
+        claude_result = await detect_language_with_claude_async(text)
+        if claude_result:
+            return LanguageDecision(claude_result, 0.9, "claude")
+    return decision or _default_decision()
+
+async def detect_language_async(
+    text: str,
+    session_id: Optional[str] = None,
+    session_data: Optional[Dict[str, Any]] = None,
+    use_llm: bool = True,
+) -> LanguageDecision:
+    """
+    Detecta el idioma sin bloquear el event loop.
+    
+    Orden: idioma ya guardado en la sesión, heurísticas, langdetect en el pool
+    de detección de idioma y, solo si las señales se contradicen o no hay
+    ninguna, Claude con tiempo máximo. La decisión y su confianza se guardan en
+    la sesión ('language', 'language_confidence', 'language_source'), de modo que
+    los siguientes mensajes no vuelven a detectar mientras la confianza sea suficiente.
+    
+    Args:
+        text: Texto a analizar
+        session_id: Sesión de conversación donde leer y guardar la decisión
+        session_data: Datos de sesión ya cargados (se actualizan en el sitio)
+        use_llm: Permitir la consulta a Claude
         
-        # Si no hay consenso, usar el más fuerte
-        if pattern_best[1] > word_best[1]:
-            return pattern_best[0]
-        else:
-            return word_best[0]
+    Returns:
+        LanguageDecision(language, confidence, source)
+    """
+    if session_data is None and session_id:
+        from database.d1_client import get_session_data
+        session_data = await get_session_data(session_id)
     
-    # Como último recurso, consultar a Claude
-    claude_result = detect_language_with_claude(text)
-    if claude_result:
-        return claude_result
+    stored = _stored_decision(session_data)
+    if stored:
+        return stored
     
-    # Si todo falla, usar el idioma por defecto
-    logger.warning(f"No se pudo detectar el idioma, usando idioma por defecto: {LanguageConfig.DEFAULT_LANGUAGE}")
-    return LanguageConfig.DEFAULT_LANGUAGE 
\ No newline at end of file
+    decision = await _run_detection(text or "", use_llm)
+    fields = {
+        "language": decision.language,
+        "language_confidence": round(decision.confidence, 3),
+        "language_source": decision.source,
+    }
+    if session_data is not None:
+        session_data.update(fields)
+    if session_id:
+        from database.d1_client import save_session_data
+        await save_session_data(session_id, session_data if session_data is not None else fields)
+    return decision
@@ -1,22 +1,31 @@
 """
 Módulo mejorado para la detección del idioma en los mensajes de usuario.
 Implementa un sistema basado en Machine Learning para una detección más precisa.
+
+Los modelos (FastText y el pipeline de transformers) se cargan la primera vez
+que se necesitan, o en el arranque con `warm_up`, y se comparten en todo el
+proceso mediante `get_language_detector_ml()`. Las peticiones concurrentes que
+llegan al modelo de transformers se agrupan en micro-lotes, de modo que varias
+detecciones comparten una sola pasada del modelo en CPU. En modo rápido solo se
+usa FastText. En la versión asíncrona ninguna carga ni inferencia se ejecuta en
+el event loop.
 """
+import asyncio
+import importlib.util
 import logging
-from typing import Dict, List, Optional, Any, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import unicodedata
 
-# Importaciones para ML
-try:
-    import fasttext
-    import numpy as np
-    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-    ML_LIBRARIES_AVAILABLE = True
-except ImportError:
-    ML_LIBRARIES_AVAILABLE = False
+# Las librerías de ML se importan al cargar cada modelo: importar transformers
+# cuesta segundos y no debe pagarse al importar este módulo
+ML_LIBRARIES_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None for name in ("fasttext", "transformers")
+)
 
 # Fallback
-from ai.language_detection import detect_language as legacy_detect_language
+from ai.language_detection import detect_language as legacy_detect_language, detect_language_async as legacy_detect_language_async
 
 logger = logging.getLogger("mark-assistant.language-ml")
 
@@ -26,32 +35,192 @@ FASTTEXT_MODEL_PATH = "models/lid.176.bin"
 # Modelo de Hugging Face para detección de idioma
 HF_MODEL_NAME = "papluca/xlm-roberta-base-language-detection"
 
+SUPPORTED_CODES = ('es', 'ca', 'en', 'ar')
+
+# Mapear ISO 639-1 codes
+FASTTEXT_LANGUAGE_MAP = {
+    'es': 'es',
+    'ca': 'ca',
+    'en': 'en',
+    'ar': 'ar',
+    'spa': 'es',
+    'cat': 'ca',
+    'eng': 'en',
+    'ara': 'ar'
+}
+
+# Mapear etiquetas al formato requerido
+TRANSFORMER_LANGUAGE_MAP = {
+    'spanish': 'es',
+    'catalan': 'ca',
+    'english': 'en',
+    'arabic': 'ar',
+    'es': 'es',
+    'ca': 'ca',
+    'en': 'en',
+    'ar': 'ar'
+}
+
+FASTTEXT_MIN_SCORE = 0.6
+TRANSFORMER_MIN_SCORE = 0.75
+
+
+class MicroBatcher:
+    """
+    Agrupa las peticiones concurrentes en lotes: la primera petición abre una
+    ventana de 'max_wait' segundos (o hasta 'max_batch_size' elementos) y el lote
+    completo se procesa con una sola llamada a 'process_batch' en el executor.
+
+    Args:
+        process_batch: Función síncrona lista de entradas -> lista de resultados (mismo orden).
+        executor: Executor donde ejecutar 'process_batch'.
+        max_batch_size: Tamaño máximo de lote.
+        max_wait: Segundos que se espera a más peticiones antes de procesar.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        executor: Callable[[], ThreadPoolExecutor],
+        max_batch_size: int = 16,
+        max_wait: float = 0.01,
+    ):
+        self.process_batch = process_batch
+        self._get_executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._get_executor(), self.process_batch, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
 class LanguageDetectorML:
-    """Detector de idioma basado en técnicas de Machine Learning"""
-    
-    def __init__(self):
-        """Inicializa el detector de idioma con modelos ML"""
-        self.models_loaded = False
+    """
+    Detector de idioma basado en técnicas de Machine Learning.
+
+    Args:
+        fast_mode: Usar solo FastText (sin transformers) antes del método legacy.
+        batch_size: Tamaño máximo de los micro-lotes del modelo de transformers.
+        batch_wait_ms: Milisegundos que se espera a más peticiones para formar un lote.
+    """
+
+    def __init__(self, fast_mode: bool = False, batch_size: int = 16, batch_wait_ms: float = 10.0):
+        """Prepara el detector; los modelos no se cargan hasta que se necesitan"""
+        self.fast_mode = fast_mode
         self.fasttext_model = None
         self.transformer_pipeline = None
-        
-        if ML_LIBRARIES_AVAILABLE:
-            try:
-                # Intentar cargar el modelo FastText
-                self.fasttext_model = fasttext.load_model(FASTTEXT_MODEL_PATH)
-                
-                # Configurar pipeline de transformers
-                self.transformer_pipeline = pipeline(
-                    "text-classification", 
-                    model=HF_MODEL_NAME,
-                    tokenizer=HF_MODEL_NAME
-                )
-                
-                self.models_loaded = True
-                logger.info("Modelos de ML para detección de idioma cargados correctamente")
-            except Exception as e:
-                logger.error(f"Error al cargar modelos de ML para detección de idioma: {e}")
-    
+        self._fasttext_failed = False
+        self._transformer_failed = False
+        self._load_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._batcher = MicroBatcher(
+            self._classify_batch_with_transformers,
+            executor=self._get_executor,
+            max_batch_size=batch_size,
+            max_wait=batch_wait_ms / 1000,
+        )
+
+    @property
+    def models_loaded(self) -> bool:
+        return self.fasttext_model is not None and (self.fast_mode or self.transformer_pipeline is not None)
+
+    # --- Carga de modelos ---
+
+    def _load_fasttext(self):
+        if self.fasttext_model is not None or self._fasttext_failed or not ML_LIBRARIES_AVAILABLE:
+            return self.fasttext_model
+        with self._load_lock:
+            if self.fasttext_model is None and not self._fasttext_failed:
+                try:
+                    import fasttext
+                    self.fasttext_model = fasttext.load_model(FASTTEXT_MODEL_PATH)
+                    logger.info("Modelo FastText para detección de idioma cargado correctamente")
+                except Exception as e:
+                    self._fasttext_failed = True
+                    logger.error(f"Error al cargar el modelo FastText para detección de idioma: {e}")
+        return self.fasttext_model
+
+    def _load_transformer(self):
+        if self.transformer_pipeline is not None or self._transformer_failed or not ML_LIBRARIES_AVAILABLE:
+            return self.transformer_pipeline
+        with self._load_lock:
+            if self.transformer_pipeline is None and not self._transformer_failed:
+                try:
+                    from transformers import pipeline
+                    # Configurar pipeline de transformers
+                    self.transformer_pipeline = pipeline(
+                        "text-classification",
+                        model=HF_MODEL_NAME,
+                        tokenizer=HF_MODEL_NAME
+                    )
+                    logger.info("Pipeline de transformers para detección de idioma cargado correctamente")
+                except Exception as e:
+                    self._transformer_failed = True
+                    logger.error(f"Error al cargar el pipeline de transformers para detección de idioma: {e}")
+        return self.transformer_pipeline
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Un solo hilo: la inferencia ya usa varios núcleos internamente y los
+        # lotes se procesan de uno en uno
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="language-ml")
+        return self._executor
+
+    def warm_up(self) -> None:
+        """Carga los modelos y hace una inferencia de prueba (llamar en el arranque)."""
+        self._load_fasttext()
+        self.detect_with_fasttext("hola, bon dia")
+        if not self.fast_mode:
+            self._load_transformer()
+            self._classify_batch_with_transformers(["hola, bon dia"])
+
+    async def warm_up_async(self) -> None:
+        """`warm_up` en el executor del detector, sin bloquear el event loop."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._get_executor(), self.warm_up)
+
+    def shutdown(self) -> None:
+        """Libera el hilo de inferencia (llamar en el shutdown de la aplicación)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # --- Detección ---
+
     def normalize_text(self, text: str) -> str:
         """Normaliza el texto para mejorar la detección"""
         # Eliminar acentos
@@ -60,87 +229,88 @@ class LanguageDetectorML:
         # Convertir a minúsculas
         text = text.lower()
         return text
-    
+
     def detect_with_fasttext(self, text: str) -> Optional[str]:
         """Detecta el idioma usando FastText"""
-        if not self.models_loaded or not self.fasttext_model:
+        model = self._load_fasttext()
+        if not model:
             return None
-        
+
         try:
             # FastText requiere texto con al menos algunos caracteres
             if len(text.strip()) < 3:
                 return None
-                
+
             # Obtener predicción de FastText
-            predictions = self.fasttext_model.predict(text, k=3)
+            predictions = model.predict(text, k=3)
             languages = [lang.replace('__label__', '') for lang in predictions[0]]
             scores = predictions[1]
-            
-            # Mapear ISO 639-1 codes
-            language_map = {
-                'es': 'es',
-                'ca': 'ca',
-                'en': 'en',
-                'ar': 'ar',
-                'spa': 'es',
-                'cat': 'ca',
-                'eng': 'en',
-                'ara': 'ar'
-            }
-            
+
             # Retornar el idioma con mayor confianza (si supera un umbral)
-            if scores[0] > 0.6:
+            if scores[0] > FASTTEXT_MIN_SCORE:
                 detected = languages[0].lower()
-                return language_map.get(detected, detected)
-            
+                return FASTTEXT_LANGUAGE_MAP.get(detected, detected)
+
             return None
         except Exception as e:
             logger.error(f"Error en detección con FastText: {e}")
             return None
-    
+
+    async def detect_with_fasttext_async(self, text: str) -> Optional[str]:
+        """
+        `detect_with_fasttext` en el pool de detección de idioma: la primera llamada
+        carga lid.176.bin (si no se hizo warm-up) y no debe bloquear el event loop.
+        """
+        from ai.language_utils import get_language_executor
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_language_executor(), self.detect_with_fasttext, text)
+
+    def _classify_batch_with_transformers(self, texts: List[str]) -> List[Optional[str]]:
+        """Una sola pasada del modelo de transformers para todo el lote."""
+        pipeline = self._load_transformer()
+        if not pipeline:
+            return [None] * len(texts)
+        results = pipeline(texts, top_k=3, batch_size=len(texts), truncation=True)
+        detected: List[Optional[str]] = []
+        for result in results:
+            # Verificar resultado y retornar si la confianza es alta
+            if result and result[0]['score'] > TRANSFORMER_MIN_SCORE:
+                detected.append(TRANSFORMER_LANGUAGE_MAP.get(result[0]['label'].lower(), None))
+            else:
+                detected.append(None)
+        return detected
+
     def detect_with_transformers(self, text: str) -> Optional[str]:
         """Detecta el idioma usando Transformers"""
-        if not self.models_loaded or not self.transformer_pipeline:
+        # Transformers funciona mejor con textos más largos
+        if self.fast_mode or len(text.strip()) < 5:
             return None
-        
         try:
-            # Transformers funciona mejor con textos más largos
-            if len(text.strip()) < 5:
-                return None
-                
-            # Obtener predicción con el pipeline de transformers
-            result = self.transformer_pipeline(text, top_k=3)
-            
-            # Verificar resultado y retornar si la confianza es alta
-            if result and result[0]['score'] > 0.75:
-                # Mapear etiquetas al formato requerido
-                language_map = {
-                    'spanish': 'es',
-                    'catalan': 'ca',
-                    'english': 'en',
-                    'arabic': 'ar',
-                    'es': 'es',
-                    'ca': 'ca',
-                    'en': 'en',
-                    'ar': 'ar'
-                }
-                detected = result[0]['label'].lower()
-                return language_map.get(detected, None)
-            
+            return self._classify_batch_with_transformers([text])[0]
+        except Exception as e:
+            logger.error(f"Error en detección con Transformers: {e}")
+            return None
+
+    async def detect_with_transformers_async(self, text: str) -> Optional[str]:
+        """Como `detect_with_transformers`, agrupando peticiones concurrentes en micro-lotes"""
+        if self.fast_mode or len(text.strip()) < 5:
             return None
+        try:
+            return await self._batcher.submit(text)
         except Exception as e:
             logger.error(f"Error en detección con Transformers: {e}")
             return None
-    
+
     def detect_language(self, text: str, user_id: Optional[str] = None, session_data: Optional[Dict] = None) -> str:
         """
         Detecta el idioma del texto utilizando múltiples modelos y técnicas.
-        
+
         Args:
             text: Texto para detectar el idioma
             user_id: ID del usuario (opcional)
             session_data: Datos de la sesión (opcional)
-            
+
         Returns:
             Código ISO 639-1 del idioma detectado ('es', 'ca', 'en', 'ar')
             Por defecto 'es' si no se puede determinar
@@ -151,41 +321,94 @@ class LanguageDetectorML:
             if session_data and 'language' in session_data:
                 return session_data['language']
             return 'es'  # Valor por defecto
-        
+
         # Normalizar texto
         normalized_text = self.normalize_text(text)
-        
+
         # Intentar con FastText (rápido y eficiente)
         fasttext_result = self.detect_with_fasttext(normalized_text)
-        if fasttext_result in ['es', 'ca', 'en', 'ar']:
+        if fasttext_result in SUPPORTED_CODES:
             logger.debug(f"Idioma detectado con FastText: {fasttext_result}")
             return fasttext_result
-            
+
         # Intentar con Transformers (más preciso pero más lento)
         transformer_result = self.detect_with_transformers(normalized_text)
-        if transformer_result in ['es', 'ca', 'en', 'ar']:
+        if transformer_result in SUPPORTED_CODES:
             logger.debug(f"Idioma detectado con Transformers: {transformer_result}")
             return transformer_result
-        
+
         # Si los modelos ML no pueden determinar el idioma, usar el método legacy
         legacy_result = legacy_detect_language(text, user_id, session_data)
         logger.debug(f"Fallback a detección legacy: {legacy_result}")
         return legacy_result
 
-# Instanciar el detector
-language_detector_ml = LanguageDetectorML()
+    async def detect_language_async(self, text: str, session_id: Optional[str] = None, session_data: Optional[Dict] = None) -> str:
+        """
+        Versión asíncrona de `detect_language`: FastText en el pool de detección de
+        idioma, transformers en micro-lotes compartidos y, como último recurso, la
+        detección asíncrona de ai/language_detection.py.
+        """
+        if not text or len(text.strip()) < 3:
+            if session_data and 'language' in session_data:
+                return session_data['language']
+            return 'es'  # Valor por defecto
+
+        normalized_text = self.normalize_text(text)
+
+        fasttext_result = await self.detect_with_fasttext_async(normalized_text)
+        if fasttext_result in SUPPORTED_CODES:
+            return fasttext_result
+
+        transformer_result = await self.detect_with_transformers_async(normalized_text)
+        if transformer_result in SUPPORTED_CODES:
+            return transformer_result
+
+        decision = await legacy_detect_language_async(text, session_id=session_id, session_data=session_data)
+        return decision.language
+
+
+_language_detector_ml: Optional[LanguageDetectorML] = None
+_detector_lock = threading.Lock()
+
+
+def get_language_detector_ml() -> LanguageDetectorML:
+    """Detector compartido por todo el proceso (los modelos se cargan una sola vez)."""
+    global _language_detector_ml
+    if _language_detector_ml is None:
+        with _detector_lock:
+            if _language_detector_ml is None:
+                from core.config import settings
+
+                _language_detector_ml = LanguageDetectorML(
+                    fast_mode=settings.LANGUAGE_ML_FAST_MODE,
+                    batch_size=settings.LANGUAGE_ML_BATCH_SIZE,
+                    batch_wait_ms=settings.LANGUAGE_ML_BATCH_WAIT_MS,
+                )
+    return _language_detector_ml
+
+
+def shutdown_language_detector_ml() -> None:
+    """Libera el hilo de inferencia del detector compartido, si llegó a crearse (shutdown de la aplicación)."""
+    if _language_detector_ml is not None:
+        _language_detector_ml.shutdown()
+
 
 # Función principal para exportar
 def detect_language_ml(text: str, user_id: Optional[str] = None, session_data: Optional[Dict] = None) -> str:
     """
     Función principal para detectar el idioma del texto.
-    
+
     Args:
         text: Texto para detectar el idioma
         user_id: ID del usuario (opcional)
         session_data: Datos de la sesión (opcional)
-        
+
     Returns:
         Código ISO 639-1 del idioma detectado ('es', 'ca', 'en', 'ar')
     """
-    return language_detector_ml.detect_language(text, user_id, session_data) 
\ No newline at end of file
+    return get_language_detector_ml().detect_language(text, user_id, session_data)
+
+
+async def detect_language_ml_async(text: str, session_id: Optional[str] = None, session_data: Optional[Dict] = None) -> str:
+    """Versión asíncrona de `detect_language_ml`, con micro-lotes para transformers."""
+    return await get_language_detector_ml().detect_language_async(text, session_id, session_data)
@@ -0,0 +1,198 @@
+"""
+Clasificador local de idioma (es/ca/en/ar) por n-gramas de caracteres.
+
+Naive Bayes multinomial sobre n-gramas de 1 a 3 caracteres, entrenado fuera de
+línea con los catálogos de i18n y los textos de los prompts
+(scripts/train_language_ngram_model.py). El modelo se distribuye comprimido junto
+al código y se carga una sola vez en arrays compactos: un diccionario
+n-grama -> fila y una matriz float32 de log-probabilidades (filas x idiomas).
+
+Distingue bien catalán y castellano, que es justo donde langdetect y las
+heurísticas discrepan, así que la consulta a Claude queda para textos
+realmente ambiguos. `predict_batch` vectoriza con numpy si está disponible.
+"""
+import base64
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger("mark-assistant.language-ngram")
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "language_ngrams.json.gz")
+MODEL_FORMAT_VERSION = 1
+
+# Se conservan letras (con acentos), apóstrofo y punto volado catalán ("col·legi")
+_NON_LETTERS = re.compile(r"[^\w'·]+|[\d_]+")
+
+
+class LanguagePrediction(NamedTuple):
+    language: str
+    confidence: float
+    probabilities: Dict[str, float]
+
+
+def normalize_for_ngrams(text: str) -> str:
+    """Minúsculas y un solo espacio entre palabras, con espacio inicial y final."""
+    return " " + " ".join(_NON_LETTERS.sub(" ", text.lower()).split()) + " "
+
+
+def extract_ngrams(text: str, orders: Sequence[int] = (1, 2, 3)) -> List[str]:
+    normalized = normalize_for_ngrams(text)
+    if normalized == "  ":
+        return []
+    length = len(normalized)
+    return [normalized[i:i + n] for n in orders for i in range(length - n + 1)]
+
+
+class NgramLanguageModel:
+    """
+    Modelo ya entrenado.
+
+    Args:
+        languages: Idiomas, en el orden de las columnas de 'weights'.
+        ngrams: N-gramas, en el orden de las filas de 'weights'.
+        weights: log P(n-grama | idioma), float32, fila a fila.
+        orders: Longitudes de n-grama usadas al entrenar.
+    """
+
+    def __init__(self, languages: Sequence[str], ngrams: Sequence[str], weights: array, orders: Sequence[int]) -> None:
+        if len(weights) != len(ngrams) * len(languages):
+            raise ValueError("Dimensiones del modelo de n-gramas incoherentes")
+        self.languages = tuple(languages)
+        self.orders = tuple(orders)
+        self.index = {ngram: row for row, ngram in enumerate(ngrams)}
+        self.weights = weights
+        width = len(self.languages)
+        # Fila de pesos por n-grama para la predicción individual sin numpy
+        self._rows = {ngram: tuple(weights[row * width:(row + 1) * width]) for ngram, row in self.index.items()}
+        self._matrix = None
+
+    # --- Entrenamiento y persistencia ---
+
+    @classmethod
+    def train(
+        cls,
+        corpus: Dict[str, Iterable[str]],
+        orders: Sequence[int] = (1, 2, 3),
+        max_ngrams_per_language: int = 3000,
+        alpha: float = 0.5,
+    ) -> "NgramLanguageModel":
+        """
+        Entrena el modelo con textos por idioma (suavizado de Laplace 'alpha').
+        Solo se conservan los n-gramas más frecuentes de cada idioma.
+        """
+        languages = sorted(corpus)
+        counts = {lang: Counter(g for text in corpus[lang] for g in extract_ngrams(text, orders)) for lang in languages}
+        vocabulary = sorted({g for lang in languages for g, _ in counts[lang].most_common(max_ngrams_per_language)})
+        weights = array("f")
+        totals = {lang: sum(counts[lang][g] for g in vocabulary) + alpha * len(vocabulary) for lang in languages}
+        for ngram in vocabulary:
+            weights.extend(math.log((counts[lang][ngram] + alpha) / totals[lang]) for lang in languages)
+        return cls(languages, vocabulary, weights, orders)
+
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        weights = array("f", self.weights)
+        if weights.itemsize != 4:
+            raise ValueError("Se requieren float32 de 4 bytes para guardar el modelo")
+        payload = {
+            "version": MODEL_FORMAT_VERSION,
+            "languages": list(self.languages),
+            "orders": list(self.orders),
+            "ngrams": sorted(self.index, key=self.index.__getitem__),
+            "weights": base64.b64encode(weights.tobytes()).decode("ascii"),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "NgramLanguageModel":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != MODEL_FORMAT_VERSION:
+            raise ValueError(f"Versión de modelo de n-gramas no soportada: {payload.get('version')}")
+        weights = array("f")
+        weights.frombytes(base64.b64decode(payload["weights"]))
+        return cls(payload["languages"], payload["ngrams"], weights, payload["orders"])
+
+    # --- Predicción ---
+
+    def _probabilities(self, scores: Sequence[float], matched: int) -> Dict[str, float]:
+        # La suma de log-probabilidades crece con la longitud y daría confianzas
+        # de 1.0 casi siempre; se escala por la raíz del nº de n-gramas reconocidos
+        scale = 1.0 / math.sqrt(matched) if matched else 0.0
+        top = max(scores)
+        exps = [math.exp((score - top) * scale) for score in scores]
+        total = sum(exps)
+        return {lang: value / total for lang, value in zip(self.languages, exps)}
+
+    def _prediction(self, probabilities: Dict[str, float]) -> LanguagePrediction:
+        best = max(self.languages, key=probabilities.__getitem__)
+        return LanguagePrediction(best, probabilities[best], probabilities)
+
+    def predict(self, text: str) -> LanguagePrediction:
+        """Idioma más probable, su probabilidad y la distribución completa."""
+        rows = [row for row in map(self._rows.get, extract_ngrams(text, self.orders)) if row is not None]
+        scores = [math.fsum(column) for column in zip(*rows)] if rows else [0.0] * len(self.languages)
+        return self._prediction(self._probabilities(scores, len(rows)))
+
+    def predict_batch(self, texts: Sequence[str]) -> List[LanguagePrediction]:
+        """
+        Predice varios textos a la vez. Con numpy se hace una sola suma
+        segmentada sobre la matriz de pesos para todo el lote.
+        """
+        if not NUMPY_AVAILABLE or not texts:
+            return [self.predict(text) for text in texts]
+        if self._matrix is None:
+            self._matrix = np.frombuffer(self.weights, dtype=np.float32).reshape(len(self.index), len(self.languages))
+
+        index = self.index
+        rows = [[index[g] for g in extract_ngrams(text, self.orders) if g in index] for text in texts]
+        lengths = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+        scores = np.zeros((len(texts), len(self.languages)), dtype=np.float64)
+        non_empty = lengths > 0
+        if non_empty.any():
+            flat = np.fromiter((row for r in rows for row in r), dtype=np.int64, count=int(lengths.sum()))
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[non_empty]
+            scores[non_empty] = np.add.reduceat(self._matrix[flat].astype(np.float64), starts, axis=0)
+
+        scale = np.where(non_empty, 1.0 / np.sqrt(np.maximum(lengths, 1)), 0.0)[:, None]
+        scaled = (scores - scores.max(axis=1, keepdims=True)) * scale
+        probabilities = np.exp(scaled)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return [
+            self._prediction(dict(zip(self.languages, map(float, row))))
+            for row in probabilities
+        ]
+
+
+_model: Optional[NgramLanguageModel] = None
+_model_lock = threading.Lock()
+
+
+def get_ngram_language_model() -> Optional[NgramLanguageModel]:
+    """Modelo compartido, cargado la primera vez; None si el fichero no está disponible."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    _model = NgramLanguageModel.load()
+                    logger.info(f"Modelo de n-gramas de idioma cargado ({len(_model.index)} n-gramas)")
+                except (OSError, ValueError) as e:
+                    logger.error(f"No se pudo cargar el modelo de n-gramas de idioma: {e}")
+                    return None
+    return _model
@@ -0,0 +1,132 @@
+"""
+Puntuación heurística de idioma en una sola pasada.
+
+Las listas de expresiones (LANGUAGE_PATTERNS) y de palabras indicadoras
+(LANGUAGE_SPECIFIC_WORDS) de ai/language_detection.py se compilan una única vez en:
+
+- una tabla congelada palabra -> ((idioma, origen), ...) para las expresiones de
+  una sola palabra, consultada con cada token del texto, y
+- una única expresión regular con todas las expresiones de varias palabras (y las
+  árabes, que se buscan como subcadena igual que antes).
+
+Puntuar un mensaje es tokenizarlo una vez, consultar la tabla por token y
+recorrer el texto una vez con la regex combinada.
+"""
+import re
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Sequence, Tuple
+
+PATTERN = "pattern"
+WORD = "word"
+
+_TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+_ALTERNATION_RE = re.compile(r"^(\\b)?\((.*)\)(\\b)?$")
+
+
+class LanguageScore(NamedTuple):
+    """Resultado de puntuar un texto; los diccionarios tienen una clave por idioma."""
+    language: str
+    confidence: float
+    scores: Dict[str, float]
+    pattern_scores: Dict[str, int]
+    word_scores: Dict[str, int]
+
+
+def _split_pattern(pattern: str) -> Tuple[List[str], bool]:
+    """Separa una regex de la forma '\\b(a|b c|d)\\b' en sus expresiones literales."""
+    match = _ALTERNATION_RE.match(pattern)
+    if not match:
+        raise ValueError(f"Patrón de idioma no soportado: {pattern}")
+    return [phrase.lower() for phrase in match.group(2).split("|")], bool(match.group(1))
+
+
+class LanguageScorer:
+    """
+    Puntuador precompilado.
+
+    Args:
+        patterns: Idioma -> lista de regex de alternativas literales ('\\b(a|b)\\b' o '(a|b)').
+        specific_words: Idioma -> palabras o expresiones indicadoras.
+        languages: Orden de los idiomas; en caso de empate gana el primero.
+        weights: Peso de cada origen en la puntuación combinada.
+    """
+
+    def __init__(
+        self,
+        patterns: Mapping[str, Sequence[str]],
+        specific_words: Mapping[str, Iterable[str]],
+        languages: Sequence[str] = ("es", "ca", "en", "ar"),
+        weights: Mapping[str, float] = MappingProxyType({PATTERN: 1.0, WORD: 1.0}),
+    ) -> None:
+        self.languages = tuple(languages)
+        self.weights = dict(weights)
+        table: Dict[str, List[Tuple[str, str]]] = {}
+        phrases: Dict[str, List[Tuple[str, str]]] = {}
+        bounded: List[str] = []
+        unbounded: List[str] = []
+
+        def add(phrase: str, entry: Tuple[str, str], word_bounded: bool) -> None:
+            tokens = _TOKEN_RE.findall(phrase)
+            if word_bounded and len(tokens) == 1 and tokens[0] == phrase:
+                table.setdefault(phrase, []).append(entry)
+                return
+            if phrase not in phrases:
+                (bounded if word_bounded else unbounded).append(phrase)
+            phrases.setdefault(phrase, []).append(entry)
+
+        for language in self.languages:
+            for pattern in patterns.get(language, ()):
+                literals, word_bounded = _split_pattern(pattern)
+                for phrase in literals:
+                    add(phrase, (language, PATTERN), word_bounded)
+            for word in specific_words.get(language, ()):
+                # Las palabras indicadoras se comparan siempre como palabras completas
+                add(word.lower(), (language, WORD), True)
+
+        self._table = MappingProxyType({key: tuple(entries) for key, entries in table.items()})
+        self._phrases = MappingProxyType({key: tuple(entries) for key, entries in phrases.items()})
+        alternatives = []
+        if bounded:
+            # Las más largas primero para que "good morning" gane a un prefijo más corto
+            alternatives.append(r"(?<!\w)(?:" + "|".join(re.escape(p) for p in sorted(bounded, key=len, reverse=True)) + r")(?!\w)")
+        if unbounded:
+            alternatives.append("|".join(re.escape(p) for p in sorted(unbounded, key=len, reverse=True)))
+        self._phrase_re = re.compile("|".join(alternatives)) if alternatives else None
+
+    def score(self, text: str) -> LanguageScore:
+        """Puntúa el texto para todos los idiomas en una pasada."""
+        lowered = text.lower()
+        pattern_scores = dict.fromkeys(self.languages, 0)
+        word_scores = dict.fromkeys(self.languages, 0)
+        # Las palabras indicadoras cuentan una vez por palabra distinta
+        seen_words = set()
+
+        table = self._table
+        for token in _TOKEN_RE.findall(lowered):
+            entries = table.get(token)
+            if entries is None:
+                continue
+            for language, origin in entries:
+                if origin == PATTERN:
+                    pattern_scores[language] += 1
+                elif (token, language) not in seen_words:
+                    seen_words.add((token, language))
+                    word_scores[language] += 1
+
+        if self._phrase_re is not None:
+            phrases = self._phrases
+            for match in self._phrase_re.finditer(lowered):
+                phrase = match.group(0)
+                for language, origin in phrases[phrase]:
+                    if origin == PATTERN:
+                        pattern_scores[language] += 1
+                    elif (phrase, language) not in seen_words:
+                        seen_words.add((phrase, language))
+                        word_scores[language] += 1
+
+        pattern_weight, word_weight = self.weights[PATTERN], self.weights[WORD]
+        scores = {lang: pattern_scores[lang] * pattern_weight + word_scores[lang] * word_weight for lang in self.languages}
+        best = max(self.languages, key=scores.__getitem__)
+        total = sum(scores.values())
+        confidence = scores[best] / total if total else 0.0
+        return LanguageScore(best, confidence, scores, pattern_scores, word_scores)
@@ -1,9 +1,10 @@
 import asyncio
 # import logging # No usado
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 # Config & Logger
-from core.config import logger
+from core.config import settings, logger
 
 # Detección de idioma
 try:
@@ -13,9 +14,31 @@ except ImportError:
     logger.warning("Librería 'langdetect' no encontrada. La detección de idioma no funcionará. Instalar con: pip install langdetect")
     LANGDETECT_AVAILABLE = False
 
+_language_executor: Optional[ThreadPoolExecutor] = None
+
+def get_language_executor() -> ThreadPoolExecutor:
+    """
+    Pool de hilos compartido y acotado para la detección de idioma (langdetect),
+    separado del executor por defecto del event loop.
+    """
+    global _language_executor
+    if _language_executor is None:
+        _language_executor = ThreadPoolExecutor(
+            max_workers=settings.LANGUAGE_DETECTION_WORKERS,
+            thread_name_prefix="langdetect",
+        )
+    return _language_executor
+
+def shutdown_language_executor() -> None:
+    """Libera los hilos del pool de detección de idioma (llamar en el shutdown de la aplicación)."""
+    global _language_executor
+    if _language_executor is not None:
+        _language_executor.shutdown(wait=False)
+        _language_executor = None
+
 async def detect_language(text: Optional[str]) -> str:
     """
-    Detecta el idioma de un texto de forma asíncrona usando langdetect en un executor.
+    Detecta el idioma de un texto de forma asíncrona usando langdetect en el pool compartido.
     
     Args:
         text: Texto a analizar.
@@ -29,9 +52,9 @@ async def detect_language(text: Optional[str]) -> str:
     loop = asyncio.get_running_loop()
     
     try:
-        # Ejecutar la función síncrona detect() en el executor por defecto (ThreadPoolExecutor)
+        # Ejecutar la función síncrona detect() en el pool de detección de idioma
         lang_code = await loop.run_in_executor(
-            None, # Usa el executor por defecto
+            get_language_executor(),
             detect, # La función síncrona a llamar
             text    # El argumento para la función
         )
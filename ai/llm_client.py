@@ -1 +1,461 @@
- 
\ No newline at end of file
+"""
+Registro de clientes de modelos de lenguaje (LangChain) compartidos.
+
+Antes se creaba un ChatAnthropic o un ChatOpenAI nuevo en cada mensaje, cada
+uno con su propio cliente HTTP. Aquí se mantiene una única instancia por
+(proveedor, modelo, temperatura), creada la primera vez que se pide:
+
+- los clientes de OpenRouter usan el httpx.AsyncClient compartido del host
+  (core/http_client.py), así que todos los modelos comparten pool de conexiones;
+- cada cliente de Anthropic conserva su propio cliente del SDK, reutilizado
+  entre llamadas en lugar de recrearse.
+
+`ainvoke` y `astream` registran por modelo las llamadas en curso, los errores,
+un histograma de latencias y los tokens de entrada servidos desde la caché de
+prompts del proveedor (`get_stats`). `warm_up` crea en el arranque los
+clientes de los modelos configurados.
+
+Las versiones fijadas (langchain-core 0.1.28, langchain-anthropic 0.1.0,
+langchain-openai 0.0.8) no exponen `usage_metadata`: el uso se lee del
+`llm_output` de cada llamada con un callback. En streaming solo Anthropic
+informa del uso (al final, con el mensaje completo).
+
+Caché de prompts: `build_system_message` separa el prompt del sistema en una
+parte estática (el PlayBook, la información del centro) marcada con
+`cache_control` y una parte variable que va detrás. Anthropic, y OpenRouter para
+los modelos que lo soportan, reutilizan entonces el prefijo ya procesado en los
+turnos siguientes (menos latencia hasta el primer token y menor coste). Los
+proveedores solo cachean prefijos largos (LLM_PROMPT_CACHE_MIN_TOKENS); los
+prompts más cortos se envían como texto normal. ChatAnthropic 0.1.0 solo acepta
+contenido de texto, así que los clientes de Anthropic usan una subclase que
+pasa los bloques del mensaje de sistema tal cual al SDK.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("mark-assistant.llm-client")
+
+PROVIDER_ANTHROPIC = "anthropic"
+PROVIDER_OPENROUTER = "openrouter"
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Límites superiores (ms) de los cubos del histograma; el último cubo es "+inf"
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+ClientKey = Tuple[str, str, float]
+
+# Clave de additional_kwargs con el uso de tokens del último fragmento en streaming
+USAGE_KWARG = "usage"
+
+
+class LatencyHistogram:
+    """Histograma acumulado de latencias con cubos fijos."""
+
+    __slots__ = ("counts", "total_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        observations = sum(self.counts)
+        labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["le_inf"]
+        return {
+            "buckets_ms": dict(zip(labels, self.counts)),
+            "avg_ms": round(self.total_ms / observations, 2) if observations else None,
+            "max_ms": round(self.max_ms, 2) if observations else None,
+        }
+
+
+class _ModelStats:
+    """Contadores de uso de un cliente de modelo."""
+
+    __slots__ = (
+        "in_flight", "calls", "errors", "latency", "first_token",
+        "input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens", "created_at",
+    )
+
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        # Solo llamadas en streaming: tiempo hasta el primer fragmento de texto
+        self.first_token = LatencyHistogram()
+        # Tokens de entrada (incluidos los de caché); cache_read son los servidos desde la caché de prompts
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+        self.created_at = time.time()
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        details = usage.get("input_token_details") or {}
+        self.input_tokens += usage.get("input_tokens") or 0
+        self.output_tokens += usage.get("output_tokens") or 0
+        self.cache_read_tokens += details.get("cache_read") or 0
+        self.cache_creation_tokens += details.get("cache_creation") or 0
+
+
+def _chunk_text(chunk: Any) -> str:
+    """Texto de un fragmento de streaming (contenido como cadena o como lista de bloques)."""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def _field(obj: Any, name: str) -> Any:
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _usage_from_llm_output(llm_output: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Uso de tokens normalizado a partir del llm_output de LangChain.
+
+    Anthropic devuelve el mensaje del SDK (con 'usage', cuyos input_tokens no
+    incluyen los de caché) y OpenAI/OpenRouter un dict 'token_usage'.
+    """
+    if not llm_output:
+        return None
+    usage = llm_output.get("usage")
+    if usage is not None:
+        cache_read = _field(usage, "cache_read_input_tokens") or 0
+        cache_creation = _field(usage, "cache_creation_input_tokens") or 0
+        return {
+            "input_tokens": (_field(usage, "input_tokens") or 0) + cache_read + cache_creation,
+            "output_tokens": _field(usage, "output_tokens") or 0,
+            "input_token_details": {"cache_read": cache_read, "cache_creation": cache_creation},
+        }
+    token_usage = llm_output.get("token_usage")
+    if token_usage:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return {
+            "input_tokens": token_usage.get("prompt_tokens") or 0,
+            "output_tokens": token_usage.get("completion_tokens") or 0,
+            "input_token_details": {"cache_read": details.get("cached_tokens") or 0, "cache_creation": 0},
+        }
+    return None
+
+
+def _usage_collector() -> Any:
+    """Callback que guarda en '.usage' el uso de tokens de la llamada."""
+    from langchain_core.callbacks import AsyncCallbackHandler
+
+    class UsageCollector(AsyncCallbackHandler):
+        usage: Optional[Dict[str, Any]] = None
+
+        async def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+            self.usage = _merge_usage(self.usage, _usage_from_llm_output(response.llm_output))
+
+    return UsageCollector()
+
+
+def _merge_usage(total: Optional[Dict[str, Any]], usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Suma el uso de tokens de los fragmentos de un streaming."""
+    if not usage:
+        return total
+    merged = dict(total or {})
+    for field in ("input_tokens", "output_tokens", "total_tokens"):
+        merged[field] = merged.get(field, 0) + (usage.get(field) or 0)
+    details = dict(merged.get("input_token_details") or {})
+    for field, value in (usage.get("input_token_details") or {}).items():
+        details[field] = details.get(field, 0) + (value or 0)
+    merged["input_token_details"] = details
+    return merged
+
+
+def build_system_message(static_prompt: str, dynamic_context: Optional[str] = None) -> Any:
+    """
+    Mensaje de sistema con el prompt estático marcado como cacheable.
+
+    Args:
+        static_prompt: Parte que no cambia entre turnos (PlayBook, información del centro).
+        dynamic_context: Parte variable (resultados de búsqueda, resumen...), después del prefijo cacheado.
+    """
+    from langchain_core.messages import SystemMessage
+    from ai.context_window import count_tokens
+    from core.config import settings
+
+    if not settings.LLM_PROMPT_CACHE or count_tokens(static_prompt) < settings.LLM_PROMPT_CACHE_MIN_TOKENS:
+        return SystemMessage(content=static_prompt + (f"\n\n{dynamic_context}" if dynamic_context else ""))
+    blocks = [{"type": "text", "text": static_prompt, "cache_control": {"type": "ephemeral"}}]
+    if dynamic_context:
+        blocks.append({"type": "text", "text": dynamic_context})
+    return SystemMessage(content=blocks)
+
+
+@lru_cache(maxsize=None)
+def _cache_aware_chat_anthropic() -> Any:
+    """Subclase de ChatAnthropic que admite el sistema en bloques (cache_control) e informa del uso en streaming."""
+    from langchain_anthropic import ChatAnthropic
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    class CacheAwareChatAnthropic(ChatAnthropic):
+        def _format_params(self, *, messages: List[Any], stop: Optional[List[str]] = None, **kwargs: Any) -> Dict:
+            system = None
+            if messages and messages[0].type == "system" and not isinstance(messages[0].content, str):
+                system, messages = messages[0].content, messages[1:]
+            params = super()._format_params(messages=messages, stop=stop, **kwargs)
+            if system is not None:
+                params["system"] = system
+            return params
+
+        async def _astream(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any):
+            params = self._format_params(messages=messages, stop=stop, **kwargs)
+            async with self._async_client.messages.stream(**params) as stream:
+                async for text in stream.text_stream:
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                    if run_manager:
+                        await run_manager.on_llm_new_token(text, chunk=chunk)
+                    yield chunk
+                final = await stream.get_final_message()
+            usage = _usage_from_llm_output({"usage": final.usage})
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs={USAGE_KWARG: usage}))
+
+    return CacheAwareChatAnthropic
+
+
+def _build_anthropic_client(model: str, temperature: float) -> Any:
+    from core.config import settings
+
+    return _cache_aware_chat_anthropic()(
+        model=model,
+        anthropic_api_key=settings.CLAUDE_API_KEY,
+        temperature=temperature,
+    )
+
+
+def _build_openrouter_client(model: str, temperature: float) -> Any:
+    import openai
+    from langchain_openai import ChatOpenAI
+    from core.config import settings
+    from core.http_client import http_clients
+
+    if not settings.OPENROUTER_API_KEY:
+        raise ValueError("Clave de API de OpenRouter no configurada.")
+    default_headers = {
+        "HTTP-Referer": settings.OPENROUTER_HTTP_REFERER or "",
+        "X-Title": settings.APP_NAME or ""
+    }
+    # Cliente del SDK sobre el pool de conexiones compartido con el resto de
+    # peticiones a OpenRouter (langchain-openai 0.0.8 no acepta http_async_client)
+    async_client = openai.AsyncOpenAI(
+        api_key=settings.OPENROUTER_API_KEY,
+        base_url=OPENROUTER_BASE_URL,
+        timeout=settings.OPENROUTER_TIMEOUT,
+        default_headers=default_headers,
+        http_client=http_clients.get_client(OPENROUTER_BASE_URL),
+    )
+    return ChatOpenAI(
+        model=model,
+        openai_api_key=settings.OPENROUTER_API_KEY,
+        openai_api_base=OPENROUTER_BASE_URL,
+        temperature=temperature,
+        max_tokens=1024,
+        timeout=settings.OPENROUTER_TIMEOUT,
+        default_headers=default_headers,
+        async_client=async_client.chat.completions,
+    )
+
+
+DEFAULT_FACTORIES: Dict[str, Callable[[str, float], Any]] = {
+    PROVIDER_ANTHROPIC: _build_anthropic_client,
+    PROVIDER_OPENROUTER: _build_openrouter_client,
+}
+
+
+class LLMClientRegistry:
+    """
+    Registro de clientes LangChain por (proveedor, modelo, temperatura).
+
+    Args:
+        factories: Proveedor -> función (modelo, temperatura) que crea el cliente.
+    """
+
+    def __init__(self, factories: Optional[Dict[str, Callable[[str, float], Any]]] = None) -> None:
+        self._factories = dict(factories if factories is not None else DEFAULT_FACTORIES)
+        self._clients: Dict[ClientKey, Any] = {}
+        self._stats: Dict[ClientKey, _ModelStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(provider: str, model: str, temperature: float) -> ClientKey:
+        return (provider, model, round(float(temperature), 3))
+
+    def get_client(self, provider: str, model: str, temperature: float = 0.7) -> Any:
+        """
+        Devuelve el cliente compartido para (proveedor, modelo, temperatura), creándolo si no existe.
+
+        Raises:
+            ValueError: Si el proveedor no está registrado o falta su configuración.
+        """
+        key = self._key(provider, model, temperature)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        factory = self._factories.get(provider)
+        if factory is None:
+            raise ValueError(f"Proveedor de LLM desconocido: {provider}")
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory(key[1], key[2])
+                self._clients[key] = client
+                self._stats.setdefault(key, _ModelStats())
+                logger.info(f"Cliente LLM creado para {provider}:{key[1]} (temperature={key[2]})")
+        return client
+
+    @asynccontextmanager
+    async def track(self, provider: str, model: str, temperature: float = 0.7) -> AsyncIterator[None]:
+        """Cuenta una llamada en curso y registra su latencia y si falló."""
+        key = self._key(provider, model, temperature)
+        stats = self._stats.setdefault(key, _ModelStats())
+        stats.in_flight += 1
+        stats.calls += 1
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.latency.observe((time.perf_counter() - started_at) * 1000)
+
+    async def ainvoke(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Any],
+        temperature: float = 0.7,
+        config: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Invoca el modelo con el cliente compartido, registrando métricas y uso de tokens."""
+        client = self.get_client(provider, model, temperature)
+        collector = _usage_collector()
+        config = dict(config or {})
+        config["callbacks"] = [*(config.get("callbacks") or []), collector]
+        async with self.track(provider, model, temperature):
+            response = await client.ainvoke(messages, config=config)
+        self._record_usage(provider, model, temperature, collector.usage)
+        return response
+
+    async def astream(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Any],
+        temperature: float = 0.7,
+        config: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Invoca el modelo en streaming y devuelve el texto de cada fragmento.
+        Además de la latencia total registra el tiempo hasta el primer fragmento.
+        """
+        client = self.get_client(provider, model, temperature)
+        stats = self._stats[self._key(provider, model, temperature)]
+        usage = None
+        async with self.track(provider, model, temperature):
+            started_at = time.perf_counter()
+            first = True
+            async for chunk in client.astream(messages, config=config):
+                usage = _merge_usage(usage, (getattr(chunk, "additional_kwargs", None) or {}).get(USAGE_KWARG))
+                text = _chunk_text(chunk)
+                if not text:
+                    continue
+                if first:
+                    stats.first_token.observe((time.perf_counter() - started_at) * 1000)
+                    first = False
+                yield text
+        self._record_usage(provider, model, temperature, usage)
+
+    def _record_usage(self, provider: str, model: str, temperature: float, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        self._stats[self._key(provider, model, temperature)].record_usage(usage)
+        details = usage.get("input_token_details") or {}
+        logger.debug(
+            f"Uso de {provider}:{model}: {usage.get('input_tokens')} tokens de entrada "
+            f"({details.get('cache_read') or 0} desde caché, {details.get('cache_creation') or 0} escritos en caché), "
+            f"{usage.get('output_tokens')} de salida"
+        )
+
+    def warm_up(self, specs: Optional[Iterable[ClientKey]] = None) -> int:
+        """
+        Crea por adelantado los clientes indicados (o los de los modelos configurados).
+
+        Returns:
+            Número de clientes disponibles tras el precalentamiento.
+        """
+        for provider, model, temperature in specs if specs is not None else default_client_specs():
+            try:
+                self.get_client(provider, model, temperature)
+            except Exception as e:
+                logger.warning(f"No se pudo precalentar el cliente LLM {provider}:{model}: {e}")
+        return len(self._clients)
+
+    def clear(self) -> None:
+        """Descarta los clientes creados; los pools HTTP compartidos se cierran con core.http_client."""
+        with self._lock:
+            self._clients.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Devuelve las métricas por modelo.
+
+        Returns:
+            Diccionario {"proveedor:modelo@temperatura": métricas} con llamadas en
+            curso, totales, errores, histograma de latencias y tokens (con la
+            proporción de tokens de entrada servidos desde la caché de prompts).
+        """
+        return {
+            f"{provider}:{model}@{temperature}": {
+                "active": (provider, model, temperature) in self._clients,
+                "in_flight": stats.in_flight,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "latency": stats.latency.snapshot(),
+                "first_token_latency": stats.first_token.snapshot(),
+                "tokens": {
+                    "input": stats.input_tokens,
+                    "output": stats.output_tokens,
+                    "cache_read": stats.cache_read_tokens,
+                    "cache_creation": stats.cache_creation_tokens,
+                    "cache_hit_ratio": round(stats.cache_read_tokens / stats.input_tokens, 3)
+                    if stats.input_tokens else None,
+                },
+            }
+            for (provider, model, temperature), stats in self._stats.items()
+        }
+
+
+def default_client_specs() -> List[ClientKey]:
+    """Clientes que usa la aplicación con la configuración actual."""
+    from core.config import settings
+
+    specs: List[ClientKey] = []
+    if settings.CLAUDE_API_KEY and settings.CLAUDE_MODEL:
+        specs.append((PROVIDER_ANTHROPIC, settings.CLAUDE_MODEL, 0.7))
+    if settings.OPENROUTER_API_KEY and settings.OPENROUTER_MODEL:
+        specs.append((PROVIDER_OPENROUTER, settings.OPENROUTER_MODEL, 0.7))
+    return specs
+
+
+# Instancia global del registro
+llm_clients = LLMClientRegistry()
@@ -0,0 +1,334 @@
+"""
+Caché semántica de respuestas para preguntas frecuentes (PlayBooks "info" y "payment").
+
+Preguntas como el horario, los precios o la dirección del centro se repiten
+mucho con pequeñas variaciones ("¿a qué hora abrís?", "a que hora abren").
+En lugar de generar cada vez la respuesta con el LLM:
+
+1. La pregunta se normaliza (minúsculas, sin acentos ni signos) y se convierte
+   en un vector disperso de n-gramas de caracteres y palabras con hashing,
+   normalizado (L2). Se calcula en local, sin llamadas externas, y tolera
+   erratas y cambios de orden. Se puede sustituir por otro `embed`.
+2. Cada (idioma, PlayBook) tiene su índice invertido característica -> entradas,
+   de modo que la similitud coseno solo se acumula sobre las entradas que
+   comparten algún n-grama con la pregunta.
+3. Si la entrada más parecida supera el umbral y no ha caducado, se devuelve su
+   respuesta sin llamar al LLM. Una pregunta negada ("¿no puedo pagar con
+   tarjeta?") solo se compara con preguntas negadas, y viceversa: la negación
+   cambia poco los n-gramas pero invierte la respuesta.
+
+Solo se sirven respuestas "validadas": con RESPONSE_CACHE_REQUIRE_APPROVAL (por
+defecto) las aprueba un administrador; si no, se validan automáticamente al
+guardarse. Solo se guardan respuestas generadas con éxito, sin búsqueda web, a
+preguntas cortas que abren la conversación (sin historial del paciente). Los
+administradores pueden listar, aprobar e invalidar entradas.
+"""
+import logging
+import re
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from ai.security.pattern_matcher import fold_text
+
+logger = logging.getLogger("mark-assistant.response-cache")
+
+SparseVector = Dict[int, float]
+
+_NON_WORD = re.compile(r"[^\w]+")
+# Palabras vacías: cuentan solo por sus n-gramas, no como palabra
+_STOPWORDS = frozenset({
+    "el", "la", "los", "las", "un", "una", "de", "del", "que", "y", "a", "en", "por", "para", "me", "mi", "se",
+    "els", "les", "i", "per", "em", "the", "an", "of", "to", "is", "are", "do", "you", "my",
+})
+# Saludos y fórmulas de cortesía: no cambian la pregunta y se ignoran
+_COURTESY = frozenset({
+    "hola", "buenas", "buenos", "dias", "tardes", "gracias", "favor", "bon", "dia", "bona", "tarda", "gracies",
+    "sisplau", "hi", "hello", "thanks", "thank", "please", "مرحبا", "شكرا",
+})
+# Negaciones ("t" es lo que queda de "can't" o "don't" al normalizar)
+_NEGATIONS = frozenset({
+    "no", "ni", "nunca", "jamas", "ningun", "ninguna", "nada", "sin", "mai", "cap", "res", "sense",
+    "not", "never", "none", "nothing", "without", "cannot", "t", "لا", "لم", "لن", "ليس",
+})
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sin acentos ni signos de puntuación y con un solo espacio entre palabras."""
+    return " ".join(_NON_WORD.sub(" ", fold_text(text)).split())
+
+
+def is_negated(normalized: str) -> bool:
+    """True si la pregunta normalizada contiene alguna negación."""
+    return not _NEGATIONS.isdisjoint(normalized.split())
+
+
+class HashedNgramEmbedder:
+    """
+    Vectores dispersos de n-gramas de caracteres (por palabra) y de palabras,
+    proyectados con hashing a 'dimensions' posiciones.
+
+    Args:
+        dimensions: Tamaño del espacio de hashing.
+        orders: Longitudes de los n-gramas de caracteres.
+        word_weight: Peso de cada palabra (sin palabras vacías) respecto a un n-grama.
+    """
+
+    def __init__(self, dimensions: int = 1 << 18, orders: Tuple[int, ...] = (3, 4), word_weight: float = 3.0) -> None:
+        self.dimensions = dimensions
+        self.orders = orders
+        self.word_weight = word_weight
+
+    def _index(self, feature: str) -> int:
+        # crc32 en lugar de hash(): estable entre procesos
+        return zlib.crc32(feature.encode("utf-8")) % self.dimensions
+
+    def __call__(self, normalized: str) -> SparseVector:
+        vector: Dict[int, float] = defaultdict(float)
+        for word in normalized.split():
+            if word in _COURTESY:
+                continue
+            padded = f" {word} "
+            for n in self.orders:
+                for i in range(len(padded) - n + 1):
+                    vector[self._index(padded[i:i + n])] += 1.0
+            if word not in _STOPWORDS:
+                vector[self._index("w:" + word)] += self.word_weight
+        norm = sum(value * value for value in vector.values()) ** 0.5
+        return {index: value / norm for index, value in vector.items()} if norm else {}
+
+
+class CacheEntry:
+    __slots__ = ("entry_id", "language", "playbook", "question", "answer", "vector", "negated", "created_at", "approved", "hits")
+
+    def __init__(
+        self, language: str, playbook: str, question: str, answer: str, vector: SparseVector, negated: bool, approved: bool
+    ) -> None:
+        self.entry_id = uuid.uuid4().hex
+        self.language = language
+        self.playbook = playbook
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.negated = negated
+        self.created_at = time.time()
+        self.approved = approved
+        self.hits = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.entry_id,
+            "language": self.language,
+            "playbook": self.playbook,
+            "question": self.question,
+            "answer": self.answer,
+            "created_at": self.created_at,
+            "approved": self.approved,
+            "hits": self.hits,
+        }
+
+
+class CacheHit(NamedTuple):
+    entry_id: str
+    answer: str
+    similarity: float
+    question: str
+
+
+class _Bucket:
+    """Entradas de un (idioma, PlayBook) con su índice invertido."""
+
+    __slots__ = ("entries", "postings")
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, CacheEntry] = {}
+        self.postings: Dict[int, Set[str]] = defaultdict(set)
+
+    def add(self, entry: CacheEntry) -> None:
+        self.entries[entry.entry_id] = entry
+        for index in entry.vector:
+            self.postings[index].add(entry.entry_id)
+
+    def remove(self, entry_id: str) -> Optional[CacheEntry]:
+        entry = self.entries.pop(entry_id, None)
+        if entry is not None:
+            for index in entry.vector:
+                ids = self.postings.get(index)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del self.postings[index]
+        return entry
+
+    def nearest(
+        self, vector: SparseVector, negated: bool, approved_only: bool = False
+    ) -> Optional[Tuple[CacheEntry, float]]:
+        """
+        Entrada más parecida con la misma polaridad (negada o no) y su similitud.
+        Con 'approved_only' se ignoran las entradas pendientes de aprobación.
+        """
+        scores: Dict[str, float] = defaultdict(float)
+        postings = self.postings
+        for index, weight in vector.items():
+            for entry_id in postings.get(index, ()):
+                entry = self.entries[entry_id]
+                if entry.negated == negated and (entry.approved or not approved_only):
+                    scores[entry_id] += weight * entry.vector[index]
+        if not scores:
+            return None
+        best = max(scores, key=scores.__getitem__)
+        return self.entries[best], scores[best]
+
+
+class SemanticResponseCache:
+    """
+    Caché semántica de respuestas por (idioma, PlayBook).
+
+    Args:
+        threshold: Similitud coseno mínima para reutilizar una respuesta.
+        ttl: Segundos de validez de cada respuesta.
+        max_entries: Entradas máximas por (idioma, PlayBook); se descartan las más antiguas.
+        require_approval: Si es True solo se sirven entradas aprobadas por un administrador.
+        embed: Función texto normalizado -> vector disperso normalizado.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        ttl: float = 86400.0,
+        max_entries: int = 500,
+        require_approval: bool = False,
+        embed: Optional[Callable[[str], SparseVector]] = None,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.require_approval = require_approval
+        self.embed = embed or HashedNgramEmbedder()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = defaultdict(_Bucket)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "invalidated": 0}
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def lookup(self, question: str, language: str, playbook: str) -> Optional[CacheHit]:
+        """Respuesta validada de la pregunta más parecida, o None si ninguna supera el umbral."""
+        bucket = self._buckets.get((language, playbook))
+        normalized = normalize_question(question) if bucket else ""
+        vector = self.embed(normalized) if normalized else None
+        while bucket and vector:
+            # Una entrada pendiente de aprobación no oculta a otra aprobada casi igual
+            match = bucket.nearest(vector, is_negated(normalized), approved_only=self.require_approval)
+            if match is None or match[1] < self.threshold:
+                break
+            entry, similarity = match
+            if self._expired(entry, time.time()):
+                bucket.remove(entry.entry_id)
+                self.stats["expired"] += 1
+                continue
+            entry.hits += 1
+            self.stats["hits"] += 1
+            return CacheHit(entry.entry_id, entry.answer, round(similarity, 4), entry.question)
+        self.stats["misses"] += 1
+        return None
+
+    def store(self, question: str, answer: str, language: str, playbook: str) -> Optional[str]:
+        """
+        Guarda una respuesta generada. Si ya existe una pregunta equivalente no se
+        duplica: se devuelve la entrada aprobada equivalente o, si no hay, la pendiente.
+
+        Returns:
+            ID de la entrada, o None si la pregunta no tiene contenido.
+        """
+        normalized = normalize_question(question)
+        vector = self.embed(normalized)
+        if not vector:
+            return None
+        negated = is_negated(normalized)
+        bucket = self._buckets[(language, playbook)]
+        now = time.time()
+        for approved_only in ((True, False) if self.require_approval else (False,)):
+            match = bucket.nearest(vector, negated, approved_only=approved_only)
+            if match is not None and match[1] >= self.threshold and not self._expired(match[0], now):
+                return match[0].entry_id
+        if len(bucket.entries) >= self.max_entries:
+            oldest = min(bucket.entries.values(), key=lambda e: e.created_at)
+            bucket.remove(oldest.entry_id)
+        entry = CacheEntry(language, playbook, question, answer, vector, negated, approved=not self.require_approval)
+        bucket.add(entry)
+        self.stats["stores"] += 1
+        return entry.entry_id
+
+    def _find(self, entry_id: str) -> Optional[Tuple[_Bucket, CacheEntry]]:
+        for bucket in self._buckets.values():
+            entry = bucket.entries.get(entry_id)
+            if entry is not None:
+                return bucket, entry
+        return None
+
+    def approve(self, entry_id: str) -> bool:
+        found = self._find(entry_id)
+        if found is None:
+            return False
+        found[1].approved = True
+        return True
+
+    def invalidate(self, entry_id: Optional[str] = None, language: Optional[str] = None, playbook: Optional[str] = None) -> int:
+        """
+        Elimina una entrada concreta, o todas las que coincidan con idioma/PlayBook
+        (sin filtros, toda la caché).
+
+        Returns:
+            Número de entradas eliminadas.
+        """
+        removed = 0
+        if entry_id is not None:
+            found = self._find(entry_id)
+            if found is not None:
+                found[0].remove(entry_id)
+                removed = 1
+        else:
+            for (bucket_language, bucket_playbook) in list(self._buckets):
+                if language not in (None, bucket_language) or playbook not in (None, bucket_playbook):
+                    continue
+                removed += len(self._buckets.pop((bucket_language, bucket_playbook)).entries)
+        self.stats["invalidated"] += removed
+        return removed
+
+    def list_entries(self, language: Optional[str] = None, playbook: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [
+            entry.to_dict()
+            for (bucket_language, bucket_playbook), bucket in self._buckets.items()
+            if language in (None, bucket_language) and playbook in (None, bucket_playbook)
+            for entry in bucket.entries.values()
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "entries": sum(len(bucket.entries) for bucket in self._buckets.values()),
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+        }
+
+
+_response_cache: Optional[SemanticResponseCache] = None
+
+
+def get_response_cache() -> SemanticResponseCache:
+    """Caché compartida, creada la primera vez con la configuración actual."""
+    global _response_cache
+    if _response_cache is None:
+        from core.config import settings
+
+        _response_cache = SemanticResponseCache(
+            threshold=settings.RESPONSE_CACHE_SIMILARITY,
+            ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            require_approval=settings.RESPONSE_CACHE_REQUIRE_APPROVAL,
+        )
+    return _response_cache
@@ -0,0 +1,192 @@
+"""
+Búsqueda multipatrón en una sola pasada para el detector de amenazas.
+
+Todas las frases (palabras clave de alto riesgo e indicadores contextuales de
+todos los idiomas) se compilan una única vez en una expresión regular
+factorizada como un trie sobre texto normalizado (minúsculas, sin acentos ni
+diacríticos, apóstrofos unificados). Cada mensaje se recorre una vez en el
+motor de regex y se obtienen todas las coincidencias, incluidas las solapadas
+("kill" dentro de "kill myself"), con su posición en el texto original. Solo se
+aceptan coincidencias en límites de palabra, de modo que "arma" no salta dentro
+de "alarma". Las frases que terminan en '*' son raíces: su última palabra
+admite cualquier terminación ("suicid*" encuentra "suicidal" y "suicidarse").
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Marca de raíz al final de una frase
+STEM_MARKER = "*"
+
+# Apóstrofos tipográficos y tatweel árabe
+_CHAR_REPLACEMENTS = {"’": "'", "‘": "'", "ʼ": "'", "ـ": ""}
+
+
+def _fold_char(char: str) -> str:
+    if char in _CHAR_REPLACEMENTS:
+        return _CHAR_REPLACEMENTS[char]
+    decomposed = unicodedata.normalize("NFKD", char.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class _FoldTable(dict):
+    """Tabla para str.translate que calcula y memoriza la normalización de cada carácter nuevo."""
+
+    def __missing__(self, codepoint: int) -> str:
+        folded = _fold_char(chr(codepoint))
+        self[codepoint] = folded
+        if len(folded) != 1:
+            _VARIABLE_WIDTH.add(chr(codepoint))
+        return folded
+
+
+_FOLD_TABLE = _FoldTable()
+# Caracteres cuya normalización no ocupa exactamente un carácter (diacríticos árabes, 'ß', ligaduras...)
+_VARIABLE_WIDTH: Set[str] = set()
+
+
+def fold_text(text: str) -> str:
+    """Normaliza un texto para comparar: minúsculas, sin acentos/diacríticos."""
+    if text.isascii():
+        return text.lower()
+    return text.translate(_FOLD_TABLE)
+
+
+def fold_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """
+    Como fold_text, pero devuelve además, para cada carácter del texto
+    normalizado, el índice del carácter original del que procede.
+    """
+    if text.isascii():
+        return text.lower(), list(range(len(text)))
+    folded = text.translate(_FOLD_TABLE)
+    if _VARIABLE_WIDTH.isdisjoint(text):
+        return folded, list(range(len(text)))
+    parts = [_FOLD_TABLE[ord(char)] for char in text]
+    offsets = [index for index, part in enumerate(parts) for _ in part]
+    return "".join(parts), offsets
+
+
+_WORD_CHAR = re.compile(r"\w")
+
+
+def _is_word_char(char: str) -> bool:
+    return _WORD_CHAR.match(char) is not None
+
+
+def _trie_regex(keys: List[str]) -> str:
+    """
+    Alternancia factorizada por prefijos comunes: en cada posición el motor
+    de regex descarta de golpe todas las frases que no comparten el primer carácter.
+    """
+    trie: Dict[str, Any] = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        alternation = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # El cuantificador codicioso prueba primero la frase más larga
+        return "(?:" + alternation + ")?" if "" in node else alternation
+
+    return build(trie)
+
+
+class PatternMatch(NamedTuple):
+    """
+    Coincidencia de una frase; start/end son posiciones en el texto original.
+    'key' es la frase normalizada: frases distintas que normalizan igual
+    ("suicid*" y "suïcid*") comparten clave.
+    """
+    phrase: str
+    start: int
+    end: int
+    payload: Any
+    key: str
+
+
+class PhraseMatcher:
+    """
+    Buscador de frases literales sobre texto normalizado con fold_text.
+
+    Args:
+        entries: Pares (frase, payload). La misma frase normalizada puede tener
+            varios payloads (p. ej. "matar" en español y en catalán). Una frase
+            acabada en STEM_MARKER es una raíz y se reporta sin la marca.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Any]]) -> None:
+        self._entries: Dict[str, List[Tuple[str, Any]]] = {}
+        self._stems: Dict[str, List[Tuple[str, Any]]] = {}
+        for phrase, payload in entries:
+            target = self._entries
+            if phrase.endswith(STEM_MARKER):
+                phrase, target = phrase[:-1], self._stems
+            key = fold_text(phrase).strip()
+            if key:
+                target.setdefault(key, []).append((phrase, payload))
+        keys = sorted(self._entries)
+        self.size = sum(len(items) for table in (self._entries, self._stems) for items in table.values())
+        # Frases más cortas que empiezan igual y acaban en límite de palabra
+        # ("kill" dentro de "kill myself"): se reportan junto a la más larga
+        self._nested = {
+            key: [other for other in keys if other != key and key.startswith(other) and not _is_word_char(key[len(other)])]
+            for key in keys
+        }
+        # Lookahead de ancho cero: se prueba cada inicio de palabra, así que
+        # también aparecen las coincidencias que empiezan dentro de otra. Una
+        # frase exacta tiene prioridad sobre una raíz en la misma posición
+        alternatives = []
+        if keys:
+            alternatives.append("(?P<exact>" + _trie_regex(keys) + r")(?!\w)")
+        if self._stems:
+            alternatives.append("(?P<word>(?P<stem>" + _trie_regex(sorted(self._stems)) + r")\w*)")
+        self._pattern = re.compile(r"(?<!\w)(?=" + "|".join(alternatives) + ")") if alternatives else None
+
+    def find_all(self, text: str, folded: Optional[str] = None) -> List[PatternMatch]:
+        """
+        Devuelve todas las coincidencias en límites de palabra, ordenadas por posición.
+        'folded' permite reutilizar fold_text(text) si el llamador ya lo ha calculado.
+        """
+        if self._pattern is None or not text:
+            return []
+        found: List[Tuple[int, int, str, List[Tuple[str, Any]]]] = []
+        for match in self._pattern.finditer(folded if folded is not None else fold_text(text)):
+            start, key = match.start(), match.group("exact") if self._entries else None
+            if key is None:
+                # Raíz: la coincidencia abarca la palabra completa
+                stem = match.group("stem")
+                found.append((start, start + len(match.group("word")), stem, self._stems[stem]))
+                continue
+            for key in (key, *self._nested[key]):
+                found.append((start, start + len(key), key, self._entries[key]))
+        if not found:
+            return []
+
+        # Las posiciones solo se traducen al texto original si la normalización cambió longitudes
+        offsets = None if text.isascii() or _VARIABLE_WIDTH.isdisjoint(text) else fold_with_offsets(text)[1]
+        matches: List[PatternMatch] = []
+        for start, end, key, items in found:
+            if offsets is not None:
+                start, end = offsets[start], offsets[end - 1] + 1
+            for phrase, payload in items:
+                matches.append(PatternMatch(phrase, start, end, payload, key))
+        if len(matches) > 1:
+            matches.sort(key=lambda m: (m.start, -m.end))
+        return matches
+
+
+def compile_folded_patterns(patterns: Iterable[str]) -> Optional["re.Pattern[str]"]:
+    """
+    Combina varias expresiones regulares (escritas con acentos) en una sola
+    alternancia compilada sobre texto normalizado y con límites de palabra.
+    """
+    folded = [f"(?:{fold_text(p)})" for p in patterns]
+    if not folded:
+        return None
+    return re.compile(r"(?<!\w)(?:" + "|".join(folded) + r")(?!\w)")
@@ -0,0 +1,308 @@
+"""
+Reevaluación retrospectiva del riesgo en conversaciones guardadas.
+
+Cuando cambian las listas de palabras clave o indicadores del detector de
+amenazas, permite volver a cribar el histórico de conversaciones:
+
+1. Las sesiones se leen por páginas (paginación keyset, sin OFFSET); mientras
+   se procesa una página ya se está pidiendo la siguiente.
+2. El escaneo local de frases (`ThreatDetector.scan_message`) se reparte en un
+   pool de procesos, ya que es trabajo de CPU puro.
+3. Solo los mensajes marcados (riesgo preliminar medio o superior) pasan a la
+   evaluación de severidad con Claude, con concurrencia acotada.
+4. Tras cada página se añaden los hallazgos al informe (JSON Lines) y se guarda
+   un checkpoint con la última sesión procesada y el tamaño del informe, de modo
+   que una ejecución interrumpida se reanuda exactamente donde quedó.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from ai.security.threat_detection import ThreatDetector
+
+logger = logging.getLogger("mark-assistant.risk_rescan")
+
+RISK_LEVELS = ("bajo", "medio", "alto", "crítico")
+# Claves de los datos de sesión donde se guarda el historial de mensajes
+HISTORY_KEYS = ("messages", "conversation_history", "history")
+EXCERPT_LENGTH = 200
+# Mensajes mínimos por tarea enviada al pool (por debajo, el coste de IPC domina)
+MIN_CHUNK_SIZE = 200
+
+# (session_id, índice del mensaje, idioma, texto)
+MessageItem = Tuple[str, int, str, str]
+PageSource = Callable[[Optional[Dict[str, Any]]], AsyncIterator[List[Dict[str, Any]]]]
+
+_worker_detector: Optional[ThreatDetector] = None
+
+
+def extract_user_messages(record: Dict[str, Any]) -> List[MessageItem]:
+    """Extrae los mensajes del usuario de una fila de la tabla de sesiones."""
+    data = record.get("data") or {}
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return []
+    if not isinstance(data, dict):
+        return []
+    session_id = str(record.get("session_id"))
+    language = data.get("language") or "es"
+    history = next((data[key] for key in HISTORY_KEYS if isinstance(data.get(key), list)), [])
+
+    items: List[MessageItem] = []
+    for index, message in enumerate(history):
+        if isinstance(message, str):
+            text = message
+        elif isinstance(message, dict) and message.get("role", "user") == "user":
+            text = message.get("content") or message.get("text")
+        else:
+            continue
+        if isinstance(text, str) and text.strip():
+            items.append((session_id, index, language, text))
+    return items
+
+
+def _init_scan_worker() -> None:
+    # Cada proceso compila los patrones una sola vez
+    global _worker_detector
+    _worker_detector = ThreatDetector()
+
+
+def scan_messages(items: List[MessageItem], detector: Optional[ThreatDetector] = None) -> List[Dict[str, Any]]:
+    """
+    Etapa local: escanea los mensajes y devuelve solo los marcados (riesgo medio o superior).
+    Se ejecuta dentro de los procesos del pool, o en línea si se pasa 'detector'.
+    """
+    detector = detector or _worker_detector
+    if detector is None:
+        _init_scan_worker()
+        detector = _worker_detector
+    flagged = []
+    for session_id, index, language, text in items:
+        scan = detector.scan_message(text)
+        risk_level = detector.preliminary_risk_level(scan)
+        if risk_level == "bajo":
+            continue
+        flagged.append({
+            "session_id": session_id,
+            "message_index": index,
+            "language": language,
+            "risk_level": risk_level,
+            "high_risk_keywords": scan["high_risk_keywords"],
+            "contextual_indicators": scan["contextual_indicators"],
+            "temporal_urgency": scan["temporal_urgency"],
+            "text": text,
+        })
+    return flagged
+
+
+class RetrospectiveRiskScanner:
+    """
+    Recorre las conversaciones guardadas y escribe un informe de riesgo reanudable.
+
+    Args:
+        report_path: Fichero JSON Lines de hallazgos; junto a él se crean
+            '<report_path>.checkpoint.json' y '<report_path>.summary.json'.
+        page_source: Función que recibe el cursor de reanudación ({"session_id": ...} o None)
+            y devuelve un iterador asíncrono de páginas de sesiones.
+        workers: Procesos del pool de escaneo local (0 = escanear en el propio proceso).
+        llm_concurrency: Evaluaciones de severidad simultáneas con Claude.
+        escalate_from: Nivel preliminar mínimo para pasar a la evaluación con Claude
+            (None desactiva la etapa de Claude).
+        resume: Continuar desde el checkpoint si existe.
+    """
+
+    def __init__(
+        self,
+        report_path: str,
+        page_source: PageSource,
+        workers: Optional[int] = None,
+        llm_concurrency: int = 4,
+        escalate_from: Optional[str] = "medio",
+        resume: bool = True,
+    ) -> None:
+        self.report_path = report_path
+        self.checkpoint_path = f"{report_path}.checkpoint.json"
+        self.summary_path = f"{report_path}.summary.json"
+        self.page_source = page_source
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.escalate_from = escalate_from
+        self.resume = resume
+        self._detector = ThreatDetector()
+        # Detector propio para la etapa de Claude: espera un hueco en lugar de
+        # responder con la evaluación local cuando todas las llamadas están ocupadas
+        self._severity_detector = ThreatDetector(
+            max_concurrent_severity_calls=llm_concurrency,
+            severity_queue_timeout=None,
+        )
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    # --- Checkpoint ---
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if not self.resume or not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Checkpoint ilegible ({self.checkpoint_path}), se empieza de cero: {e}")
+            return {}
+        logger.info(f"Reanudando tras la sesión {checkpoint.get('last_session_id')}")
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        # Escritura atómica: nunca queda un checkpoint a medias
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _open_report(self, checkpoint: Dict[str, Any]):
+        """Abre el informe; al reanudar descarta lo escrito después del último checkpoint."""
+        if not checkpoint:
+            return open(self.report_path, "wb")
+        report = open(self.report_path, "ab")
+        report.truncate(checkpoint.get("report_bytes", 0))
+        report.seek(0, os.SEEK_END)
+        return report
+
+    # --- Etapas ---
+
+    async def _scan_local(self, items: List[MessageItem]) -> List[Dict[str, Any]]:
+        if not items:
+            return []
+        if self.workers <= 0:
+            return scan_messages(items, self._detector)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_scan_worker)
+        loop = asyncio.get_running_loop()
+        chunk_size = max(MIN_CHUNK_SIZE, -(-len(items) // self.workers))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = await asyncio.gather(*[loop.run_in_executor(self._pool, scan_messages, chunk) for chunk in chunks])
+        return [finding for result in results for finding in result]
+
+    def _should_escalate(self, finding: Dict[str, Any]) -> bool:
+        if self.escalate_from is None:
+            return False
+        return RISK_LEVELS.index(finding["risk_level"]) >= RISK_LEVELS.index(self.escalate_from)
+
+    async def _escalate(self, findings: List[Dict[str, Any]]) -> int:
+        """Etapa de Claude para los hallazgos que la requieren; la concurrencia la limita el detector."""
+        selected = [finding for finding in findings if self._should_escalate(finding)]
+        if not selected:
+            return 0
+        assessments = await asyncio.gather(
+            *[self._severity_detector.evaluate_severity_with_claude(finding["text"]) for finding in selected]
+        )
+        for finding, assessment in zip(selected, assessments):
+            finding["detailed_assessment"] = assessment
+        return len(selected)
+
+    # --- Ejecución ---
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Ejecuta (o reanuda) la reevaluación completa.
+
+        Returns:
+            {"success", "sessions_scanned", "messages_scanned", "flagged", "escalated",
+             "by_risk_level", "report_path", "elapsed_seconds", "error"}
+        """
+        started = time.monotonic()
+        checkpoint = self._load_checkpoint()
+        stats = checkpoint.get("stats") or {
+            "sessions_scanned": 0,
+            "messages_scanned": 0,
+            "flagged": 0,
+            "escalated": 0,
+            "by_risk_level": {level: 0 for level in RISK_LEVELS[1:]},
+        }
+        start_after = {"session_id": checkpoint["last_session_id"]} if checkpoint.get("last_session_id") else None
+
+        report = self._open_report(checkpoint)
+        pages = self.page_source(start_after).__aiter__()
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(pages.__anext__())
+        try:
+            while next_page is not None:
+                try:
+                    page = await next_page
+                except StopAsyncIteration:
+                    break
+                # Pedir la siguiente página mientras se procesa esta
+                next_page = asyncio.ensure_future(pages.__anext__())
+
+                items = [item for record in page for item in extract_user_messages(record)]
+                findings = await self._scan_local(items)
+                stats["escalated"] += await self._escalate(findings)
+
+                for finding in findings:
+                    text = finding.pop("text")
+                    finding["excerpt"] = text[:EXCERPT_LENGTH]
+                    report.write((json.dumps(finding, ensure_ascii=False) + "\n").encode("utf-8"))
+                    stats["by_risk_level"][finding["risk_level"]] += 1
+                report.flush()
+                os.fsync(report.fileno())
+
+                stats["sessions_scanned"] += len(page)
+                stats["messages_scanned"] += len(items)
+                stats["flagged"] += len(findings)
+                self._save_checkpoint({
+                    "last_session_id": page[-1].get("session_id"),
+                    "report_bytes": report.tell(),
+                    "stats": stats,
+                })
+                logger.info(
+                    f"Reevaluación de riesgo: {stats['sessions_scanned']} sesiones, "
+                    f"{stats['messages_scanned']} mensajes, {stats['flagged']} marcados"
+                )
+        except Exception as e:
+            logger.error(f"Error en la reevaluación de riesgo (se puede reanudar): {e}", exc_info=True)
+            return {"success": False, **stats, "report_path": self.report_path,
+                    "elapsed_seconds": round(time.monotonic() - started, 2), "error": str(e)}
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+            report.close()
+            self.shutdown()
+
+        summary = {**stats, "report_path": self.report_path, "elapsed_seconds": round(time.monotonic() - started, 2),
+                   "severity": self._severity_detector.get_severity_stats()}
+        with open(self.summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        # Recorrido completo: el checkpoint ya no es necesario
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return {"success": True, **summary, "error": None}
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def create_session_page_source(
+    updated_from: Optional[str] = None,
+    updated_until: Optional[str] = None,
+    page_size: int = 500,
+) -> PageSource:
+    """Fuente de páginas sobre la tabla de sesiones de conversación, en orden de session_id."""
+    from database.d1_client import iter_table_keyset, TABLE_SESSIONS_CONVERSATION
+
+    def source(start_after: Optional[Dict[str, Any]]) -> AsyncIterator[List[Dict[str, Any]]]:
+        return iter_table_keyset(
+            TABLE_SESSIONS_CONVERSATION,
+            ["session_id"],
+            range_column="updated_at" if updated_from or updated_until else None,
+            range_start=updated_from,
+            range_end=updated_until,
+            page_size=page_size,
+            start_after=start_after,
+        )
+
+    return source
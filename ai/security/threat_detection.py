@@ -2,11 +2,16 @@
 Sistema de detección de amenazas para el asistente Mark.
 Identifica situaciones donde un paciente podría representar un peligro para sí mismo o para otros.
 """
+import asyncio
+import hashlib
 import logging
 import json
-import re
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any, Set, Tuple
 
+from ai.security.pattern_matcher import PhraseMatcher, compile_folded_patterns, fold_text
+
 # Configurar logging
 logger = logging.getLogger("mark.threat-detection")
 
@@ -16,13 +21,29 @@ class ThreatDetector:
     Analiza mensajes para detectar indicios de autolesión, suicidio, daño a terceros, etc.
     """
     
-    def __init__(self):
-        """Inicializar el detector de amenazas"""
-        # Palabras clave de alto riesgo (multilingüe)
+    def __init__(
+        self,
+        severity_cache_ttl: float = 600.0,
+        severity_cache_size: int = 512,
+        max_concurrent_severity_calls: int = 4,
+        severity_queue_timeout: Optional[float] = 0.25,
+    ):
+        """
+        Inicializar el detector de amenazas
+        
+        Args:
+            severity_cache_ttl: Segundos que se reutiliza una evaluación de Claude para el mismo texto
+            severity_cache_size: Número máximo de evaluaciones en caché
+            max_concurrent_severity_calls: Llamadas simultáneas a Claude para evaluar severidad
+            severity_queue_timeout: Espera máxima por un hueco antes de usar la evaluación local
+                (None = esperar siempre, para procesos por lotes)
+        """
+        # Palabras clave de alto riesgo (multilingüe). Se buscan por palabra
+        # completa: las formas flexionadas se añaden aparte o como raíz ('*')
         self.high_risk_keywords = {
             # Español
             "es": [
-                "suicidio", "suicidarme", "quitarme la vida", "acabar con todo", "matarme",
+                "suicidio", "suicidarme", "suicid*", "quitarme la vida", "acabar con todo", "matarme",
                 "cortarme", "no quiero vivir más", "sobredosis", "pastillas", "saltar",
                 "ahorcarme", "colgarme", "despedirme", "última oportunidad", "última voluntad",
                 "nadie me echará de menos", "mejor sin mí", "no puedo más",
@@ -31,7 +52,7 @@ class ThreatDetector:
             ],
             # Catalán
             "ca": [
-                "suïcidi", "suïcidar-me", "treure'm la vida", "acabar amb tot", "matar-me",
+                "suïcidi", "suïcidar-me", "suïcid*", "treure'm la vida", "acabar amb tot", "matar-me",
                 "tallar-me", "no vull viure més", "sobredosi", "pastilles", "saltar",
                 "penjar-me", "acomiadar-me", "última oportunitat", "última voluntat",
                 "ningú em trobarà a faltar", "millor sense mi", "no puc més",
@@ -40,12 +61,14 @@ class ThreatDetector:
             ],
             # Inglés
             "en": [
-                "suicide", "kill myself", "end my life", "end it all", "take my life",
-                "cutting myself", "don't want to live", "overdose", "pills", "jump",
-                "hang myself", "goodbye letter", "last chance", "last will",
-                "nobody will miss me", "better off without me", "can't take it anymore",
-                "threat", "kill", "murder", "weapon", "gun", "knife", "bomb",
-                "revenge", "get revenge", "hurt", "shoot", "attack"
+                "suicide", "suicid*", "kill myself", "killing myself", "end my life", "ending my life",
+                "end it all", "take my life", "taking my life", "cut myself", "cutting myself",
+                "hurt myself", "hurting myself", "don't want to live", "overdose", "overdos*",
+                "pills", "jump", "jumping", "hang myself", "hanging myself", "goodbye letter",
+                "last chance", "last will", "nobody will miss me", "better off without me",
+                "can't take it anymore", "threat", "kill", "killing", "murder", "weapon", "gun",
+                "knife", "bomb", "revenge", "get revenge", "hurt", "hurting", "shoot", "shooting",
+                "attack"
             ],
             # Árabe (transliteración)
             "ar": [
@@ -118,6 +141,28 @@ class ThreatDetector:
             ]
         }
         
+        # Buscador único con las frases de todos los idiomas (mensajes con cambio de idioma)
+        # y una sola expresión regular para los indicadores temporales
+        self._phrase_matcher = PhraseMatcher(
+            [(keyword, ("high_risk", lang)) for lang, keywords in self.high_risk_keywords.items() for keyword in keywords]
+            + [(indicator, ("contextual", lang)) for lang, indicators in self.contextual_indicators.items() for indicator in indicators]
+        )
+        self._temporal_pattern = compile_folded_patterns(
+            pattern for patterns in self.temporal_indicators.values() for pattern in patterns
+        )
+        
+        # Evaluaciones de severidad: caché LRU+TTL por hash del texto normalizado,
+        # peticiones en curso (para agrupar textos idénticos) y límite de concurrencia
+        self.severity_cache_ttl = severity_cache_ttl
+        self.severity_cache_size = severity_cache_size
+        self.max_concurrent_severity_calls = max_concurrent_severity_calls
+        self.severity_queue_timeout = severity_queue_timeout
+        self._severity_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._severity_inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._severity_semaphore: Optional[asyncio.Semaphore] = None
+        self._severity_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.severity_stats = {"cache_hits": 0, "coalesced": 0, "llm_calls": 0, "llm_errors": 0, "local_fallbacks": 0}
+        
         # Inicializar modelo de análisis de severidad (mock)
         self.severity_model_ready = False
         try:
@@ -128,31 +173,49 @@ class ThreatDetector:
         except:
             logger.error("No se pudo cargar el modelo de evaluación de severidad")
     
+    def scan_message(self, text: str) -> Dict[str, Any]:
+        """
+        Recorre el mensaje una sola vez buscando palabras clave, indicadores
+        contextuales y temporales de todos los idiomas.
+        
+        Args:
+            text: Texto a analizar
+            
+        Returns:
+            Diccionario con las frases encontradas por tipo (sin duplicados, en orden
+            de aparición), si hay urgencia temporal y las coincidencias con posiciones
+        """
+        folded = fold_text(text)
+        # Frase normalizada -> (tipo, frase reportada). Las variantes que normalizan
+        # igual ("suicid*"/"suïcid*", la misma frase árabe con y sin hamza) cuentan
+        # una sola vez, con el tipo más grave
+        found: Dict[str, Tuple[str, str]] = {}
+        matches = []
+        for match in self._phrase_matcher.find_all(text, folded):
+            kind, lang = match.payload
+            if match.key not in found or (kind == "high_risk" and found[match.key][0] != kind):
+                found[match.key] = (kind, match.phrase)
+            matches.append({"type": kind, "phrase": match.phrase, "language": lang, "start": match.start, "end": match.end})
+        
+        return {
+            "high_risk_keywords": [phrase for kind, phrase in found.values() if kind == "high_risk"],
+            "contextual_indicators": [phrase for kind, phrase in found.values() if kind == "contextual"],
+            "temporal_urgency": bool(self._temporal_pattern and self._temporal_pattern.search(folded)),
+            "matches": matches,
+        }
+    
     def _contains_high_risk_keywords(self, text: str, language: str) -> List[str]:
         """
         Verifica si el texto contiene palabras clave de alto riesgo.
         
         Args:
             text: Texto a analizar
-            language: Código de idioma
+            language: Código de idioma (se buscan todos los idiomas; se mantiene por compatibilidad)
             
         Returns:
             Lista de palabras clave encontradas
         """
-        # Normalizar texto
-        text = text.lower()
-        
-        # Si no tenemos el idioma específico, usar español por defecto
-        if language not in self.high_risk_keywords:
-            language = "es"
-            
-        # Buscar palabras clave
-        found_keywords = []
-        for keyword in self.high_risk_keywords[language]:
-            if keyword in text:
-                found_keywords.append(keyword)
-                
-        return found_keywords
+        return self.scan_message(text)["high_risk_keywords"]
     
     def _contains_contextual_indicators(self, text: str, language: str) -> List[str]:
         """
@@ -160,25 +223,12 @@ class ThreatDetector:
         
         Args:
             text: Texto a analizar
-            language: Código de idioma
+            language: Código de idioma (se buscan todos los idiomas; se mantiene por compatibilidad)
             
         Returns:
             Lista de indicadores contextuales encontrados
         """
-        # Normalizar texto
-        text = text.lower()
-        
-        # Si no tenemos el idioma específico, usar español por defecto
-        if language not in self.contextual_indicators:
-            language = "es"
-            
-        # Buscar indicadores contextuales
-        found_indicators = []
-        for indicator in self.contextual_indicators[language]:
-            if indicator in text:
-                found_indicators.append(indicator)
-                
-        return found_indicators
+        return self.scan_message(text)["contextual_indicators"]
     
     def _contains_temporal_indicators(self, text: str, language: str) -> bool:
         """
@@ -186,34 +236,67 @@ class ThreatDetector:
         
         Args:
             text: Texto a analizar
-            language: Código de idioma
+            language: Código de idioma (se buscan todos los idiomas; se mantiene por compatibilidad)
             
         Returns:
             True si se encuentran indicadores temporales, False en caso contrario
         """
-        # Normalizar texto
-        text = text.lower()
-        
-        # Si no tenemos el idioma específico, usar español por defecto
-        if language not in self.temporal_indicators:
-            language = "es"
-            
-        # Buscar patrones temporales
-        for pattern in self.temporal_indicators[language]:
-            if re.search(pattern, text):
-                return True
-                
-        return False
+        return bool(self._temporal_pattern and self._temporal_pattern.search(fold_text(text)))
     
-    async def evaluate_severity_with_claude(self, text: str) -> Dict[str, Any]:
+    @staticmethod
+    def _severity_cache_key(text: str) -> str:
+        """Hash del texto normalizado (sin acentos, mayúsculas ni espacios repetidos)."""
+        return hashlib.sha256(" ".join(fold_text(text).split()).encode("utf-8")).hexdigest()
+    
+    def _get_severity_semaphore(self) -> asyncio.Semaphore:
+        # El semáforo se crea dentro del loop en ejecución (asyncio.Semaphore queda ligado a él)
+        loop = asyncio.get_running_loop()
+        if self._severity_semaphore is None or self._severity_semaphore_loop is not loop:
+            self._severity_semaphore = asyncio.Semaphore(self.max_concurrent_severity_calls)
+            self._severity_semaphore_loop = loop
+        return self._severity_semaphore
+    
+    def _get_cached_severity(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = self._severity_cache.get(key)
+        if cached is None:
+            return None
+        expires_at, assessment = cached
+        if expires_at <= time.monotonic():
+            del self._severity_cache[key]
+            return None
+        self._severity_cache.move_to_end(key)
+        return assessment
+    
+    def _store_severity(self, key: str, assessment: Dict[str, Any]) -> None:
+        self._severity_cache[key] = (time.monotonic() + self.severity_cache_ttl, assessment)
+        self._severity_cache.move_to_end(key)
+        while len(self._severity_cache) > self.severity_cache_size:
+            self._severity_cache.popitem(last=False)
+    
+    def _local_severity_assessment(self, text: str) -> Dict[str, Any]:
         """
-        Evalúa la severidad del riesgo utilizando Claude.
-        
-        Args:
-            text: Texto a analizar
-            
-        Returns:
-            Diccionario con evaluación de riesgo
+        Evaluación local a partir del escaneo de frases, con la misma estructura que
+        la de Claude. Se usa cuando Claude falla o no hay hueco para otra llamada.
+        """
+        scan = self.scan_message(text)
+        indicators, temporal = scan["contextual_indicators"], scan["temporal_urgency"]
+        alert = self.preliminary_risk_level(scan)
+        if alert == "bajo":
+            alert = "medio"  # Por precaución: solo se evalúa severidad a partir de riesgo medio
+        return {
+            "riesgo_autolesion": "desconocido",
+            "riesgo_daño_terceros": "desconocido",
+            "urgencia": "inmediata" if temporal else "indeterminada",
+            "plan_concreto": bool(indicators),
+            "acceso_medios": "desconocido",
+            "nivel_alerta": alert,
+            "notificar_autoridades": False,
+            "origen": "local"
+        }
+    
+    async def _request_severity_from_claude(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Pide la evaluación a Claude. Devuelve None si la llamada o el parseo fallan.
         """
         try:
             from ai.claude.client import generate_claude_response
@@ -242,34 +325,97 @@ class ThreatDetector:
             }}
             """
             
+            self.severity_stats["llm_calls"] += 1
             response = await generate_claude_response(prompt, max_tokens=500, temperature=0.1)
             
             try:
                 # Intentar parsear el JSON
-                return json.loads(response)
-            except:
+                assessment = json.loads(response)
+            except (TypeError, ValueError):
                 logger.error(f"No se pudo parsear la respuesta como JSON: {response}")
-                return {
-                    "riesgo_autolesion": "desconocido",
-                    "riesgo_daño_terceros": "desconocido",
-                    "urgencia": "indeterminada",
-                    "plan_concreto": False,
-                    "acceso_medios": "desconocido",
-                    "nivel_alerta": "medio",  # Por precaución
-                    "notificar_autoridades": False
-                }
+                return None
+            return assessment if isinstance(assessment, dict) else None
                 
         except Exception as e:
             logger.error(f"Error al evaluar severidad con Claude: {e}")
-            return {
-                "riesgo_autolesion": "desconocido",
-                "riesgo_daño_terceros": "desconocido",
-                "urgencia": "indeterminada",
-                "plan_concreto": False,
-                "acceso_medios": "desconocido",
-                "nivel_alerta": "medio",  # Por precaución
-                "notificar_autoridades": False
-            }
+            return None
+    
+    async def evaluate_severity_with_claude(self, text: str) -> Dict[str, Any]:
+        """
+        Evalúa la severidad del riesgo utilizando Claude.
+        
+        Las evaluaciones correctas se guardan en caché por texto normalizado; las
+        peticiones simultáneas del mismo texto comparten una sola llamada; y si
+        todas las llamadas permitidas están ocupadas se responde con la evaluación
+        local en lugar de esperar. Las evaluaciones de respaldo no se guardan.
+        
+        Args:
+            text: Texto a analizar
+            
+        Returns:
+            Diccionario con evaluación de riesgo
+        """
+        key = self._severity_cache_key(text)
+        cached = self._get_cached_severity(key)
+        if cached is not None:
+            self.severity_stats["cache_hits"] += 1
+            return dict(cached)
+        
+        # Agrupar con una evaluación en curso del mismo texto
+        pending = self._severity_inflight.get(key)
+        if pending is not None:
+            self.severity_stats["coalesced"] += 1
+            return dict(await asyncio.shield(pending))
+        
+        future = asyncio.get_running_loop().create_future()
+        self._severity_inflight[key] = future
+        try:
+            assessment = None
+            semaphore = self._get_severity_semaphore()
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.severity_queue_timeout)
+                acquired = True
+            except asyncio.TimeoutError:
+                acquired = False
+                logger.warning("Límite de evaluaciones de severidad simultáneas alcanzado, usando evaluación local")
+            
+            if acquired:
+                try:
+                    assessment = await self._request_severity_from_claude(text)
+                finally:
+                    semaphore.release()
+                if assessment is None:
+                    self.severity_stats["llm_errors"] += 1
+                else:
+                    self._store_severity(key, assessment)
+            
+            if assessment is None:
+                self.severity_stats["local_fallbacks"] += 1
+                assessment = self._local_severity_assessment(text)
+            future.set_result(assessment)
+            return dict(assessment)
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # Evitar el aviso de "exception never retrieved" si nadie más esperaba
+                future.exception()
+            raise
+        finally:
+            self._severity_inflight.pop(key, None)
+    
+    def get_severity_stats(self) -> Dict[str, Any]:
+        """Contadores de la caché y del limitador de evaluaciones de severidad."""
+        return {**self.severity_stats, "cached": len(self._severity_cache), "in_flight": len(self._severity_inflight)}
+    
+    @staticmethod
+    def preliminary_risk_level(scan: Dict[str, Any]) -> str:
+        """Nivel de riesgo preliminar ("bajo", "medio", "alto", "crítico") a partir de scan_message."""
+        keywords = scan["high_risk_keywords"]
+        if not keywords:
+            return "bajo"
+        if len(keywords) >= 2 or scan["contextual_indicators"]:
+            return "crítico" if scan["temporal_urgency"] else "alto"
+        return "medio"
     
     async def analyze_message(self, message: str, language: str = "es") -> Dict[str, Any]:
         """
@@ -282,23 +428,14 @@ class ThreatDetector:
         Returns:
             Diccionario con resultados del análisis
         """
-        # Buscar palabras clave de alto riesgo
-        high_risk_keywords = self._contains_high_risk_keywords(message, language)
-        
-        # Buscar indicadores contextuales
-        contextual_indicators = self._contains_contextual_indicators(message, language)
-        
-        # Buscar indicadores temporales
-        temporal_urgency = self._contains_temporal_indicators(message, language)
+        # Palabras clave, indicadores contextuales y temporales en una sola pasada
+        scan = self.scan_message(message)
+        high_risk_keywords = scan["high_risk_keywords"]
+        contextual_indicators = scan["contextual_indicators"]
+        temporal_urgency = scan["temporal_urgency"]
         
         # Determinar nivel de riesgo preliminar
-        risk_level = "bajo"
-        if high_risk_keywords:
-            risk_level = "medio"
-            if len(high_risk_keywords) >= 2 or (high_risk_keywords and contextual_indicators):
-                risk_level = "alto"
-                if temporal_urgency:
-                    risk_level = "crítico"
+        risk_level = self.preliminary_risk_level(scan)
         
         # Si hay riesgo medio o superior, hacer análisis detallado
         detailed_assessment = {}
@@ -311,6 +448,7 @@ class ThreatDetector:
             "high_risk_keywords": high_risk_keywords,
             "contextual_indicators": contextual_indicators,
             "temporal_urgency": temporal_urgency,
+            "matches": scan["matches"],
             "requires_notification": risk_level in ["alto", "crítico"],
             "requires_immediate_action": risk_level == "crítico",
             "detailed_assessment": detailed_assessment
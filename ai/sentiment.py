@@ -0,0 +1,73 @@
+"""
+Clasificación local del sentimiento de un mensaje para la analítica del panel
+(eventos EVENT_SENTIMENT de database/analytics_rollup.py).
+
+Léxico multilingüe de expresiones positivas y negativas buscado en una sola
+pasada con PhraseMatcher; una negación en las dos palabras anteriores a una expresión
+invierte su polaridad ("no estoy bien"). Solo alimenta las tendencias agregadas: la
+evaluación de riesgo sigue en ai/security/threat_detection.py.
+"""
+from typing import Dict, List
+
+from ai.security.pattern_matcher import PhraseMatcher, fold_text
+
+POSITIVE = "positive"
+NEUTRAL = "neutral"
+NEGATIVE = "negative"
+
+SENTIMENT_LEXICON: Dict[str, Dict[str, List[str]]] = {
+    POSITIVE: {
+        "es": ["gracias", "bien", "mejor", "genial", "contento", "contenta", "feliz", "tranquilo", "tranquila",
+               "perfecto", "me ayuda", "me ha ayudado", "agradecido", "agradecida", "aliviado", "aliviada"],
+        "ca": ["gràcies", "millor", "genial", "contenta", "feliç", "tranquil", "tranquil·la",
+               "perfecte", "m'ajuda", "m'ha ajudat", "agraït", "agraïda", "alleujat", "alleujada"],
+        "en": ["thanks", "thank you", "good", "better", "great", "happy", "calm", "relieved", "perfect",
+               "helpful", "it helps", "grateful"],
+        "ar": ["شكرا", "جيد", "أفضل", "سعيد", "مرتاح", "ممتاز"],
+    },
+    NEGATIVE: {
+        "es": ["mal", "peor", "triste", "ansiedad", "angustia", "deprimido", "deprimida", "miedo",
+               "llorar", "horrible", "agobiado", "agobiada", "nervioso", "nerviosa", "no puedo más", "desesperado",
+               "desesperada", "enfadado", "enfadada"],
+        "ca": ["malament", "pitjor", "trist", "trista", "ansietat", "angoixa", "deprimit", "deprimida",
+               "plorar", "horrible", "agobiat", "agobiada", "nerviós", "nerviosa", "no puc més", "desesperat",
+               "desesperada", "enfadat", "enfadada"],
+        "en": ["bad", "worse", "sad", "anxiety", "anxious", "depressed", "scared", "afraid", "lonely", "alone",
+               "crying", "horrible", "awful", "overwhelmed", "nervous", "hopeless", "angry", "can't take it anymore"],
+        "ar": ["سيء", "أسوأ", "حزين", "قلق", "مكتئب", "خائف", "وحيد", "يائس", "غاضب"],
+    },
+}
+
+# Palabras que invierten la polaridad de la expresión siguiente
+NEGATIONS = frozenset({"no", "ni", "nunca", "gens", "mai", "not", "never", "don't", "isn't", "لا", "لست"})
+
+_sentiment_matcher = PhraseMatcher(
+    (phrase, polarity) for polarity, languages in SENTIMENT_LEXICON.items()
+    for phrases in languages.values() for phrase in phrases
+)
+
+
+def _negated(folded: str, start: int) -> bool:
+    """True si alguna de las dos palabras anteriores a 'start' es una negación."""
+    return not NEGATIONS.isdisjoint(folded[:start].split()[-2:])
+
+
+def classify_sentiment(text: str) -> str:
+    """
+    Sentimiento del mensaje: "positive", "neutral" (sin expresiones o empate) o "negative".
+    """
+    folded = fold_text(text or "")
+    score = 0
+    seen = set()
+    for match in _sentiment_matcher.find_all(folded, folded):
+        # Una misma expresión de varios idiomas cuenta una vez
+        if (match.start, match.end) in seen:
+            continue
+        seen.add((match.start, match.end))
+        sign = 1 if match.payload == POSITIVE else -1
+        score += -sign if _negated(folded, match.start) else sign
+    if score > 0:
+        return POSITIVE
+    if score < 0:
+        return NEGATIVE
+    return NEUTRAL
@@ -10,6 +10,7 @@ from typing import Dict, List, Optional, Any, Union
 import httpx
 
 from core.config import ApiConfig
+from core.http_client import get_http_client
 from ai.langsmith.client import trace_function
 
 logger = logging.getLogger("mark-assistant.serper")
@@ -81,25 +82,25 @@ async def search_web(
     
     try:
         logger.info(f"Realizando búsqueda: '{query}' en {search_type}, idioma: {search_language}")
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                endpoint,
-                headers=headers,
-                json=payload,
-                timeout=timeout
-            )
+        client = get_http_client(endpoint)
+        response = await client.post(
+            endpoint,
+            headers=headers,
+            json=payload,
+            timeout=timeout
+        )
             
-            # Verificar si la respuesta es exitosa
-            response.raise_for_status()
+        # Verificar si la respuesta es exitosa
+        response.raise_for_status()
             
-            # Parsear respuesta JSON
-            results = response.json()
+        # Parsear respuesta JSON
+        results = response.json()
             
-            return {
-                "query": query,
-                "type": search_type,
-                "results": results
-            }
+        return {
+            "query": query,
+            "type": search_type,
+            "results": results
+        }
     
     except httpx.HTTPStatusError as e:
         logger.error(f"Error HTTP al buscar: {e}")
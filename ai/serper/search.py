@@ -7,7 +7,8 @@ import logging
 import json
 import asyncio
 from typing import Dict, List, Optional, Any, Union
-import httpx
+
+from core.http_client import get_http_client
 
 # Configurar logging
 logger = logging.getLogger("mark.serper")
@@ -106,33 +107,34 @@ class SerperSearch:
         logger.debug(f"Enviando búsqueda a Serper: {query}")
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/search",
-                    headers=self.headers,
-                    json=payload
-                )
+            client = get_http_client(self.base_url)
+            response = await client.post(
+                f"{self.base_url}/search",
+                headers=self.headers,
+                json=payload,
+                timeout=30.0
+            )
                 
-                # Verificar respuesta
-                if response.status_code != 200:
-                    logger.error(f"Error en la API de Serper: {response.status_code} - {response.text}")
-                    raise Exception(f"Error al realizar búsqueda: {response.status_code}")
+            # Verificar respuesta
+            if response.status_code != 200:
+                logger.error(f"Error en la API de Serper: {response.status_code} - {response.text}")
+                raise Exception(f"Error al realizar búsqueda: {response.status_code}")
                 
-                # Procesar respuesta
-                results = response.json()
+            # Procesar respuesta
+            results = response.json()
                 
-                # Filtrar resultados según parámetros
-                if not include_knowledge_graph and "knowledgeGraph" in results:
-                    del results["knowledgeGraph"]
+            # Filtrar resultados según parámetros
+            if not include_knowledge_graph and "knowledgeGraph" in results:
+                del results["knowledgeGraph"]
                     
-                if not include_organic_results and "organic" in results:
-                    del results["organic"]
+            if not include_organic_results and "organic" in results:
+                del results["organic"]
                     
-                if not include_related_searches and "relatedSearches" in results:
-                    del results["relatedSearches"]
+            if not include_related_searches and "relatedSearches" in results:
+                del results["relatedSearches"]
                 
-                logger.info(f"Búsqueda completada: {query}")
-                return results
+            logger.info(f"Búsqueda completada: {query}")
+            return results
                 
         except Exception as e:
             logger.error(f"Error al comunicarse con la API de Serper: {e}")
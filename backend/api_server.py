@@ -23,6 +23,10 @@ import subprocess
 
 # Configuración y logging
 from core.config import settings, logger
+from core.http_client import http_clients
+from core.state_store import get_state_store_stats
+from ai.llm_client import llm_clients
+from ai.response_cache import get_response_cache
 
 # Cliente LLM (asumiendo que está en ai/llm_client.py)
 try:
@@ -44,8 +48,11 @@ from database.d1_client import (
     get_session_data, save_session_data, delete_expired_sessions,
     insert_notification, get_pending_notifications, update_notification_status,
     get_system_config,
-    insert_appointment, get_appointment_by_calendly_uri, update_appointment_status, update_appointment_zoom_details
+    insert_appointment, get_appointment_by_calendly_uri, update_appointment_status, update_appointment_zoom_details,
+    session_cache
 )
+from database.query_executor import get_query_stats
+from database.analytics_rollup import track_event, EVENT_APPOINTMENT
 
 # Servicios
 from services.whatsapp import send_whatsapp_message, send_whatsapp_message_meta, verify_meta_webhook_signature, handle_meta_webhook, download_media_meta
@@ -274,6 +281,84 @@ async def trigger_keys_backup(background_tasks: BackgroundTasks):
     background_tasks.add_task(run_backup)
     return {"status": "success", "message": "Encryption keys backup process initiated in background."}
 
+@apirouter.get("/admin/metrics/http-pools", dependencies=[Depends(verify_internal_api_key)])
+async def get_http_pool_metrics():
+    """
+    Devuelve métricas de ocupación de los pools HTTP compartidos por host.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "pools": http_clients.get_pool_stats()}
+
+@apirouter.get("/admin/metrics/llm", dependencies=[Depends(verify_internal_api_key)])
+async def get_llm_client_metrics():
+    """
+    Devuelve llamadas en curso, errores e histograma de latencias por modelo LLM.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "models": llm_clients.get_stats()}
+
+@apirouter.get("/admin/metrics/db", dependencies=[Depends(verify_internal_api_key)])
+async def get_db_query_metrics():
+    """
+    Devuelve la duración media/máxima y el tiempo en cola de las consultas a Supabase por operación.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "queries": get_query_stats()}
+
+@apirouter.get("/admin/metrics/session-cache", dependencies=[Depends(verify_internal_api_key)])
+async def get_session_cache_metrics():
+    """
+    Devuelve aciertos, fallos, desalojos y ocupación de la caché de sesiones.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "session_cache": session_cache.get_stats()}
+
+@apirouter.get("/admin/metrics/state-stores", dependencies=[Depends(verify_internal_api_key)])
+async def get_state_store_metrics():
+    """
+    Devuelve ocupación (entradas, bytes, pendientes) y desalojos del estado en memoria de los servicios.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "state_stores": get_state_store_stats()}
+
+@apirouter.get("/admin/response-cache", dependencies=[Depends(verify_internal_api_key)])
+async def list_response_cache(language: Optional[str] = Query(None), playbook: Optional[str] = Query(None)):
+    """
+    Lista las respuestas de la caché semántica (filtrables por idioma y PlayBook) y sus estadísticas.
+    Protegido por INTERNAL_API_KEY.
+    """
+    cache = get_response_cache()
+    return {"status": "success", "stats": cache.get_stats(), "entries": cache.list_entries(language, playbook)}
+
+@apirouter.post("/admin/response-cache/{entry_id}/approve", dependencies=[Depends(verify_internal_api_key)])
+async def approve_response_cache_entry(entry_id: str):
+    """
+    Aprueba una respuesta de la caché para que se sirva con RESPONSE_CACHE_REQUIRE_APPROVAL.
+    Protegido por INTERNAL_API_KEY.
+    """
+    if not get_response_cache().approve(entry_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entrada de caché no encontrada")
+    return {"status": "success", "entry_id": entry_id}
+
+@apirouter.delete("/admin/response-cache/{entry_id}", dependencies=[Depends(verify_internal_api_key)])
+async def delete_response_cache_entry(entry_id: str):
+    """
+    Invalida una respuesta de la caché.
+    Protegido por INTERNAL_API_KEY.
+    """
+    if not get_response_cache().invalidate(entry_id=entry_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entrada de caché no encontrada")
+    return {"status": "success", "removed": 1}
+
+@apirouter.delete("/admin/response-cache", dependencies=[Depends(verify_internal_api_key)])
+async def clear_response_cache(language: Optional[str] = Query(None), playbook: Optional[str] = Query(None)):
+    """
+    Invalida las respuestas de un idioma y/o PlayBook (sin filtros, toda la caché),
+    p. ej. tras cambiar horarios o precios.
+    Protegido por INTERNAL_API_KEY.
+    """
+    return {"status": "success", "removed": get_response_cache().invalidate(language=language, playbook=playbook)}
+
 @apirouter.post("/admin/cleanup_sessions", status_code=status.HTTP_204_NO_CONTENT)
 async def cleanup_expired_sessions():
     # ... (código existente)
@@ -417,6 +502,7 @@ async def calendly_webhook(request: Request, background_tasks: BackgroundTasks):
                 )
                 if not appointment_insert_res.get("success"):
                     logger.error("No se pudo guardar la información de la cita en la base de datos.")
+                track_event(EVENT_APPOINTMENT, language=patient_lang, category="scheduled", session_id=patient_phone)
                 
                 # 3. Crear reunión de Zoom
                 topic = f"Consulta Psicológica - {invitee_name}"
@@ -509,6 +595,7 @@ async def calendly_webhook(request: Request, background_tasks: BackgroundTasks):
                     
                         # 3. Actualizar estado de la cita en la BD a 'canceled'
                         update_status_success = await update_appointment_status(calendly_event_uri, "canceled")
+                        track_event(EVENT_APPOINTMENT, category="canceled")
                         if not update_status_success:
                              logger.error(f"Fallo al actualizar estado a 'canceled' para cita {calendly_event_uri}")
                              
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from ai.langgraph.playbook_graph import conversation_graph, ConversationState, ConversationMessage
 from ai.claude.client import claude
+from ai.context_window import fold_into_summary
 from core.config import settings
 import uuid
 import time
@@ -67,6 +68,8 @@ async def process_message(request: MessageRequest, background_tasks: BackgroundT
     
     # Programar tarea en segundo plano para guardar la conversación en la base de datos
     background_tasks.add_task(save_conversation_to_db, conversation_id, result)
+    # Resumir los turnos que han quedado fuera de la ventana de contexto, tras responder
+    background_tasks.add_task(refresh_conversation_summary, conversation_id)
     
     # Devolver la respuesta
     return MessageResponse(
@@ -100,6 +103,28 @@ async def get_conversation(conversation_id: str):
         metadata=state.metadata
     )
 
+# Conversaciones con un resumen en curso (para no resumir dos veces lo mismo)
+summaries_in_progress = set()
+
+async def refresh_conversation_summary(conversation_id: str):
+    """
+    Actualiza el resumen acumulado de la conversación con los mensajes que ya no
+    caben en la ventana de contexto. Se ejecuta después de enviar la respuesta.
+    """
+    state = conversations.get(conversation_id)
+    if state is None or conversation_id in summaries_in_progress:
+        return
+    summaries_in_progress.add(conversation_id)
+    try:
+        updates = await fold_into_summary(state.messages, state.context, state.language)
+    finally:
+        summaries_in_progress.discard(conversation_id)
+    if updates:
+        # Aplicar sobre el estado vigente, que puede haber cambiado durante la llamada
+        current = conversations.get(conversation_id)
+        if current is not None:
+            current.context = {**current.context, **updates}
+
 async def save_conversation_to_db(conversation_id: str, state: ConversationState):
     """
     Guarda la conversación en la base de datos (simulado)
@@ -12,13 +12,13 @@ import os
 import asyncio
 from urllib.parse import urlparse, parse_qs
 
-import httpx
 from twilio.rest import Client
 from twilio.request_validator import RequestValidator
 from pydantic import BaseModel
 
 from core.config import settings, VIRTUAL_ASSISTANT_NAME, VIRTUAL_ASSISTANT_NUMBER
-from ai.language_detection import detect_language
+from core.http_client import get_http_client
+from ai.language_detection import detect_language_async
 from ai.claude.client import handle_conversation
 from ai.hume.voice_handler import process_voice_message
 from database.d1_client import get_patient_by_phone, update_patient_last_contact
@@ -141,10 +141,10 @@ async def download_media(media_url: str) -> Optional[bytes]:
     auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(media_url, auth=auth)
-            response.raise_for_status()
-            return response.content
+        client = get_http_client(media_url)
+        response = await client.get(media_url, auth=auth)
+        response.raise_for_status()
+        return response.content
     except Exception as e:
         logger.error(f"Error al descargar multimedia desde {media_url}: {e}")
         return None
@@ -265,8 +265,9 @@ async def process_whatsapp_message(message: WhatsAppMessage) -> Dict[str, Any]:
         if not message_text.strip():
             message_text = "[Mensaje sin texto]"
         
-        # Detectar el idioma del mensaje
-        language = detect_language(message_text)
+        # Detectar el idioma del mensaje (o reutilizar el ya decidido para este número)
+        language_decision = await detect_language_async(message_text, session_id=phone)
+        language = language_decision.language
         
         # Construir contexto
         context = ""
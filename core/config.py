@@ -43,6 +43,8 @@ class Settings(BaseSettings):
     # Encryption Settings
     ENCRYPTION_KEY: str # ¡Obligatoria! Clave principal para derivación
     ENCRYPTION_SALT: str # ¡Obligatoria! Salt único para derivación
+    ENCRYPTION_KDF_ITERATIONS: int = 480000 # Iteraciones PBKDF2 (la clave se deriva una sola vez)
+    CRYPTO_EXECUTOR_WORKERS: int = 2 # Hilos dedicados a Fernet y bcrypt (core/field_encryption.py)
 
     # Admin Panel Credentials (Obsoleto)
     ADMIN_USERNAME: Optional[str] = None 
@@ -54,6 +56,11 @@ class Settings(BaseSettings):
     WHATSAPP_TOKEN: Optional[str] = None # Alias para WHATSAPP_ACCESS_TOKEN
     WHATSAPP_PHONE_NUMBER_ID: Optional[str] = None # Hacer opcional para desarrollo
     WHATSAPP_APP_SECRET: Optional[str] = None # Opcional pero recomendada
+    # Respuestas en streaming por fragmentos (services/reply_streaming.py)
+    WHATSAPP_STREAM_REPLIES: bool = True # Enviar la respuesta del LLM por frases a medida que se genera
+    WHATSAPP_STREAM_FIRST_CHUNK_CHARS: int = 40 # Longitud mínima del primer mensaje
+    WHATSAPP_STREAM_MIN_CHUNK_CHARS: int = 200 # Longitud mínima de los mensajes siguientes
+    WHATSAPP_STREAM_MAX_CHUNK_CHARS: int = 1500 # Corte forzado si no aparece fin de frase
 
     # OpenRouter / AI Model
     OPENROUTER_API_KEY: Optional[str] = None # Hacer opcional para desarrollo
@@ -61,6 +68,13 @@ class Settings(BaseSettings):
     OPENROUTER_TIMEOUT: float = 60.0 # Timeout para llamadas a la API
     OPENROUTER_HTTP_REFERER: Optional[str] = None # Opcional: URL de tu sitio
 
+    # Anthropic (Claude) vía LangChain
+    CLAUDE_API_KEY: Optional[str] = None # Hacer opcional para desarrollo
+    CLAUDE_MODEL: str = "claude-3-5-sonnet-latest" # Modelo para generar las respuestas de los PlayBooks
+    LLM_WARMUP: bool = True # Crear en el arranque los clientes LLM de los modelos configurados (ai/llm_client.py)
+    LLM_PROMPT_CACHE: bool = True # Marcar el prompt estático del sistema como cacheable en el proveedor
+    LLM_PROMPT_CACHE_MIN_TOKENS: int = 1024 # Por debajo de este tamaño los proveedores no cachean el prefijo
+
     # Stripe
     STRIPE_API_KEY: Optional[str] = None # Hacer opcional para desarrollo
     STRIPE_SECRET_KEY: Optional[str] = None # Alias para STRIPE_API_KEY
@@ -77,6 +91,39 @@ class Settings(BaseSettings):
     SUPABASE_KEY: Optional[str] = None # Hacer opcional para desarrollo
     SUPABASE_SERVICE_KEY: Optional[str] = None # Hacer opcional para desarrollo
     DATABASE_URL: Optional[str] = None
+    SUPABASE_MAX_CONCURRENT_QUERIES: int = 10 # Consultas PostgREST simultáneas (pool de hilos)
+    SUPABASE_SLOW_QUERY_MS: float = 500.0 # Umbral para registrar consultas lentas
+
+    # Caché de sesiones de conversación (database/session_cache.py)
+    SESSION_CACHE_MAX_ENTRIES: int = 1000
+    SESSION_CACHE_MAX_BYTES: int = 16 * 1024 * 1024 # 16 MB aproximados (JSON)
+    SESSION_CACHE_TTL_SECONDS: float = 900.0
+    SESSION_CACHE_FLUSH_INTERVAL: float = 2.0 # Segundos entre volcados de escrituras agrupadas
+    # Estado en memoria de los servicios (core/state_store.py)
+    ACTIVE_CONVERSATIONS_MAX_ENTRIES: int = 500 # Conversaciones activas del motor LangGraph
+    ACTIVE_CONVERSATIONS_TTL_SECONDS: float = 3600.0 # Inactividad tras la que se descarta una conversación
+    PATIENT_MEMORY_MAX_ENTRIES: int = 1000 # Memorias de pacientes en memoria
+    PATIENT_MEMORY_MAX_BYTES: int = 32 * 1024 * 1024 # 32 MB aproximados (JSON)
+    PATIENT_MEMORY_TTL_SECONDS: float = 3600.0
+    VECTOR_STORE_MAX_ENTRIES: int = 100 # Almacenes vectoriales por paciente en memoria
+    VECTOR_STORE_MAX_BYTES: int = 256 * 1024 * 1024 # Texto más embeddings aproximados
+    VECTOR_STORE_TTL_SECONDS: float = 1800.0
+
+    # Caché de los contadores del dashboard del panel de administración
+    DASHBOARD_STATS_CACHE_TTL: float = 30.0
+
+    # Agregados de analítica (database/analytics_rollup.py)
+    ANALYTICS_ROLLUP_INTERVAL: float = 60.0 # Segundos entre ejecuciones del job
+    ANALYTICS_ROLLUP_BATCH_SIZE: int = 5000
+    ANALYTICS_TIMEZONE: str = "Europe/Madrid" # Zona horaria de los buckets diarios y horas pico
+
+    # Despachador de notificaciones (services/notification_dispatcher.py)
+    NOTIFICATION_BATCH_SIZE: int = 100 # Notificaciones reclamadas por ciclo
+    NOTIFICATION_WORKERS: int = 8 # Destinatarios atendidos en paralelo
+    NOTIFICATION_LEASE_SECONDS: int = 300 # Tras este tiempo una notificación 'procesando' vuelve a ser reclamable
+    NOTIFICATION_POLL_MIN_INTERVAL: float = 1.0
+    NOTIFICATION_POLL_MAX_INTERVAL: float = 60.0
+    NOTIFICATION_WHATSAPP_RATE_PER_SECOND: float = 20.0 # Envíos por segundo a la API de WhatsApp
 
     # Calendly
     CALENDLY_API_KEY: Optional[str] = None
@@ -113,6 +160,34 @@ class Settings(BaseSettings):
         "en": "English",
         "ar": "العربية"
     }
+    # Detección de idioma asíncrona (ai/language_detection.py)
+    LANGUAGE_DETECTION_WORKERS: int = 2 # Hilos para langdetect
+    LANGUAGE_LLM_TIMEOUT_SECONDS: float = 4.0 # Tiempo máximo de la consulta de idioma a Claude
+    LANGUAGE_REUSE_MIN_CONFIDENCE: float = 0.6 # Confianza mínima guardada en la sesión para no volver a detectar
+    LANGUAGE_NGRAM_MIN_CONFIDENCE: float = 0.8 # Confianza mínima del clasificador por n-gramas para no consultar a Claude
+    # Detector de idioma con modelos ML (ai/language_detection_ml.py)
+    LANGUAGE_ML_FAST_MODE: bool = False # Solo FastText, sin el modelo de transformers
+    LANGUAGE_ML_BATCH_SIZE: int = 16 # Peticiones máximas por pasada del modelo de transformers
+    LANGUAGE_ML_BATCH_WAIT_MS: float = 10.0 # Espera para agrupar peticiones concurrentes
+    LANGUAGE_ML_WARMUP: bool = False # Cargar los modelos en el arranque
+    # Ventana de contexto del historial (ai/context_window.py)
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+        "general": 3000,
+        "crisis": 4000,
+        "appointment": 1500,
+        "payment": 1500,
+        "info": 2000
+    } # Tokens máximos del prompt por PlayBook
+    CONTEXT_SUMMARY_MIN_MESSAGES: int = 6 # Mensajes fuera de la ventana necesarios para actualizar el resumen
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 400 # Longitud máxima del resumen acumulado
+    # Caché semántica de respuestas frecuentes (ai/response_cache.py)
+    RESPONSE_CACHE_ENABLED: bool = True # Reutilizar respuestas a preguntas equivalentes sin llamar al LLM
+    RESPONSE_CACHE_PLAYBOOKS: List[str] = ["info", "payment"] # PlayBooks cuyas respuestas se pueden reutilizar
+    RESPONSE_CACHE_SIMILARITY: float = 0.9 # Similitud coseno mínima entre preguntas
+    RESPONSE_CACHE_TTL_SECONDS: int = 86400 # Validez de cada respuesta (horarios y precios pueden cambiar)
+    RESPONSE_CACHE_MAX_ENTRIES: int = 500 # Entradas máximas por idioma y PlayBook
+    RESPONSE_CACHE_REQUIRE_APPROVAL: bool = True # Servir solo respuestas aprobadas por un administrador
+    RESPONSE_CACHE_MAX_QUESTION_CHARS: int = 200 # Las preguntas más largas no se guardan
 
     # Validador para SUPPORTED_LANGUAGES para intentar parsear desde env como JSON
     @validator('SUPPORTED_LANGUAGES', pre=True)
@@ -158,6 +233,11 @@ class Settings(BaseSettings):
         extra = 'ignore'
 
     HTTPX_TIMEOUT: float = 30.0
+    # Pools de conexiones compartidos (core/http_client.py)
+    HTTPX_MAX_CONNECTIONS: int = 50
+    HTTPX_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTPX_KEEPALIVE_EXPIRY: float = 30.0
+    HTTPX_HTTP2: bool = True
 
 # Instanciar la configuración global
 # Pydantic leerá las variables de entorno y .env al crear la instancia
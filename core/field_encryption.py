@@ -0,0 +1,178 @@
+"""
+Cifrado de campos sensibles (teléfono, email, notas) del panel de administración.
+
+La clave Fernet se deriva con PBKDF2-HMAC-SHA256 (480.000 iteraciones) a partir de
+ENCRYPTION_KEY/ENCRYPTION_SALT. Esa derivación cuesta cientos de milisegundos, así
+que se hace una sola vez (en el arranque o en el primer uso) y se conserva en
+memoria; cifrar o descifrar un campo pasa a costar microsegundos. El trabajo de CPU
+(Fernet y verificación bcrypt) se ejecuta en un pool de hilos propio y acotado para
+no competir con el executor por defecto del event loop.
+"""
+import asyncio
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+logger = logging.getLogger("mark-assistant.field_encryption")
+
+DEFAULT_KDF_ITERATIONS = 480000
+
+
+def derive_fernet_key(key: str, salt: str, iterations: int = DEFAULT_KDF_ITERATIONS) -> bytes:
+    """Deriva una clave Fernet (base64 URL-safe de 32 bytes) desde una clave y un salt."""
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt.encode(), iterations=iterations)
+    return base64.urlsafe_b64encode(kdf.derive(key.encode()))
+
+
+class FieldEncryptionService:
+    """
+    Servicio de cifrado de campos con clave cacheada y executor dedicado.
+
+    Args:
+        key_provider: Devuelve (clave, salt) para la derivación inicial; se llama solo una vez.
+        iterations: Iteraciones de PBKDF2.
+        max_workers: Hilos del executor de criptografía.
+    """
+
+    def __init__(
+        self,
+        key_provider: Callable[[], Tuple[str, str]],
+        iterations: int = DEFAULT_KDF_ITERATIONS,
+        max_workers: int = 2,
+    ) -> None:
+        self._key_provider = key_provider
+        self.iterations = iterations
+        self.max_workers = max_workers
+        self._fernet: Optional[MultiFernet] = None
+        self._keys: List[Fernet] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # --- Gestión de claves ---
+
+    def initialize(self) -> None:
+        """Deriva la clave si aún no existe. Es idempotente y seguro entre hilos."""
+        if self._fernet is not None:
+            return
+        with self._lock:
+            if self._fernet is not None:
+                return
+            key, salt = self._key_provider()
+            if not key or not salt:
+                logger.critical("¡ENCRYPTION_KEY y ENCRYPTION_SALT deben estar configurados!")
+                raise ValueError("Configuración encriptación incompleta.")
+            self._keys = [Fernet(derive_fernet_key(key, salt, self.iterations))]
+            self._fernet = MultiFernet(self._keys)
+            logger.info("Clave de cifrado de campos derivada y cacheada")
+
+    def rekey(self, key: str, salt: str, keep_previous: bool = True) -> None:
+        """
+        Cambia la clave activa. Con keep_previous=True las claves anteriores se
+        conservan solo para descifrar, de modo que los datos existentes siguen
+        siendo legibles hasta que se re-cifren con `rotate_sync`.
+        """
+        new_key = Fernet(derive_fernet_key(key, salt, self.iterations))
+        with self._lock:
+            self._keys = [new_key] + (self._keys if keep_previous else [])
+            self._fernet = MultiFernet(self._keys)
+        logger.info(f"Clave de cifrado de campos rotada ({len(self._keys)} claves activas para descifrar)")
+
+    def _get_fernet(self) -> MultiFernet:
+        if self._fernet is None:
+            self.initialize()
+        return self._fernet
+
+    # --- Operaciones síncronas (para ejecutar en el executor) ---
+
+    def encrypt_sync(self, value: str) -> str:
+        return self._get_fernet().encrypt(value.encode()).decode()
+
+    def decrypt_sync(self, token: str) -> str:
+        """Descifra un campo; lanza InvalidToken si no corresponde a ninguna clave."""
+        return self._get_fernet().decrypt(token.encode()).decode()
+
+    def rotate_sync(self, token: str) -> str:
+        """Re-cifra un valor con la clave activa (tras `rekey`)."""
+        return self._get_fernet().rotate(token.encode()).decode()
+
+    def encrypt_many_sync(self, values: List[Optional[str]]) -> List[Optional[str]]:
+        fernet = self._get_fernet()
+        return [fernet.encrypt(v.encode()).decode() if v else v for v in values]
+
+    def decrypt_many_sync(self, tokens: List[Optional[str]], on_error: Optional[str] = None) -> List[Optional[str]]:
+        fernet = self._get_fernet()
+        results: List[Optional[str]] = []
+        for token in tokens:
+            if not token:
+                results.append(token)
+                continue
+            try:
+                results.append(fernet.decrypt(token.encode()).decode())
+            except (InvalidToken, AttributeError, TypeError):
+                logger.warning(f"No se pudo descifrar un campo (len: {len(token) if isinstance(token, str) else 'n/a'})")
+                results.append(on_error)
+        return results
+
+    # --- Executor y API asíncrona ---
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crypto")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Ejecuta una función de CPU (Fernet, bcrypt...) en el executor de criptografía."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def startup(self) -> None:
+        """Deriva la clave en el arranque para que la primera petición no pague el coste."""
+        await self.run(self.initialize)
+
+    async def encrypt(self, value: str) -> str:
+        return await self.run(self.encrypt_sync, value)
+
+    async def decrypt(self, token: str) -> str:
+        return await self.run(self.decrypt_sync, token)
+
+    async def encrypt_many(self, values: List[Optional[str]]) -> List[Optional[str]]:
+        """Cifra una lista de campos en un único salto al executor; vacíos y None se devuelven tal cual."""
+        if not values:
+            return []
+        return await self.run(self.encrypt_many_sync, list(values))
+
+    async def decrypt_many(self, tokens: List[Optional[str]], on_error: Optional[str] = None) -> List[Optional[str]]:
+        """Descifra una lista de campos en un único salto; los ilegibles se sustituyen por 'on_error'."""
+        if not tokens:
+            return []
+        return await self.run(self.decrypt_many_sync, list(tokens), on_error)
+
+    def shutdown(self) -> None:
+        """Libera los hilos del executor (llamar en el shutdown de la aplicación)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_field_encryption: Optional[FieldEncryptionService] = None
+
+
+def get_field_encryption() -> FieldEncryptionService:
+    """Devuelve el servicio compartido, configurado con ENCRYPTION_KEY/ENCRYPTION_SALT."""
+    global _field_encryption
+    if _field_encryption is None:
+        from core.config import settings
+
+        _field_encryption = FieldEncryptionService(
+            key_provider=lambda: (settings.ENCRYPTION_KEY, settings.ENCRYPTION_SALT),
+            iterations=settings.ENCRYPTION_KDF_ITERATIONS,
+            max_workers=settings.CRYPTO_EXECUTOR_WORKERS,
+        )
+    return _field_encryption
@@ -0,0 +1,199 @@
+"""
+Registro de clientes HTTP asíncronos compartidos para las integraciones salientes.
+
+Mantiene un único httpx.AsyncClient por host de destino (Meta Graph API, Serper,
+Hume, Zoom, Calendly...) para reutilizar conexiones TCP/TLS entre peticiones en
+lugar de abrir un cliente nuevo en cada llamada. Los clientes se crean bajo
+demanda, se precalientan en el arranque y se cierran en el evento de shutdown.
+"""
+import time
+from typing import Dict, Any, Iterable, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from core.config import settings, logger
+
+# HTTP/2 requiere el paquete 'h2'; si no está instalado usamos HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Hosts que se precalientan al arrancar la aplicación
+DEFAULT_WARMUP_HOSTS = [
+    "https://graph.facebook.com",
+]
+
+
+def _origin(url: str) -> str:
+    """Normaliza una URL a su origen (esquema://host[:puerto]) para usarla como clave."""
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        raise ValueError(f"URL sin esquema u host, no se puede asignar un cliente HTTP: '{url}'")
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+class _HostStats:
+    """Contadores de uso de un cliente HTTP asociado a un host."""
+
+    __slots__ = ("requests", "responses", "errors", "transport_errors", "in_flight", "total_latency", "created_at")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0
+        self.transport_errors = 0
+        self.in_flight = 0
+        self.total_latency = 0.0
+        self.created_at = time.time()
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte que delega en el del pool y actualiza los contadores del host.
+    Las peticiones en curso se descuentan también cuando fallan sin respuesta
+    (timeouts, conexiones rechazadas), que los event hooks de httpx no ven.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: _HostStats) -> None:
+        self._transport = transport
+        self._stats = stats
+
+    @property
+    def pool(self) -> Any:
+        # httpx no expone el pool públicamente; se lee del transporte si está disponible
+        return getattr(self._transport, "_pool", None)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self._stats
+        stats.requests += 1
+        stats.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            stats.transport_errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.responses += 1
+        stats.total_latency += time.perf_counter() - started_at
+        if response.status_code >= 500:
+            stats.errors += 1
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HTTPClientRegistry:
+    """
+    Registro de clientes httpx.AsyncClient por host de destino.
+
+    Cada host obtiene su propio pool de conexiones con límites configurables
+    (HTTPX_MAX_CONNECTIONS, HTTPX_MAX_KEEPALIVE_CONNECTIONS, HTTPX_KEEPALIVE_EXPIRY)
+    y HTTP/2 cuando está disponible y habilitado (HTTPX_HTTP2).
+    """
+
+    def __init__(self) -> None:
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, _HostStats] = {}
+
+    def _build_client(self, origin: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.HTTPX_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTPX_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTPX_KEEPALIVE_EXPIRY,
+        )
+        stats = self._stats.setdefault(origin, _HostStats())
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=settings.HTTPX_HTTP2 and HTTP2_AVAILABLE)
+        client = httpx.AsyncClient(
+            timeout=settings.HTTPX_TIMEOUT,
+            transport=_InstrumentedTransport(transport, stats),
+        )
+        logger.info(
+            f"Cliente HTTP compartido creado para {origin} "
+            f"(http2={settings.HTTPX_HTTP2 and HTTP2_AVAILABLE}, max_connections={limits.max_connections}, "
+            f"max_keepalive={limits.max_keepalive_connections})"
+        )
+        return client
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """
+        Devuelve el cliente compartido para el host de la URL, creándolo si no existe.
+
+        Args:
+            url: URL completa o base del servicio de destino.
+
+        Returns:
+            Cliente httpx.AsyncClient reutilizable. No debe cerrarse desde el código llamante.
+        """
+        origin = _origin(url)
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            client = self._build_client(origin)
+            self._clients[origin] = client
+        return client
+
+    async def startup(self, hosts: Optional[Iterable[str]] = None) -> None:
+        """Precalienta los clientes de los hosts indicados (o los predeterminados)."""
+        for host in hosts if hosts is not None else DEFAULT_WARMUP_HOSTS:
+            try:
+                self.get_client(host)
+            except ValueError as e:
+                logger.warning(f"No se pudo precalentar el cliente HTTP: {e}")
+
+    async def aclose(self) -> None:
+        """Cierra todos los clientes registrados y libera sus conexiones."""
+        clients = list(self._clients.items())
+        self._clients.clear()
+        for origin, client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error al cerrar el cliente HTTP de {origin}: {e}")
+        if clients:
+            logger.info(f"Cerrados {len(clients)} clientes HTTP compartidos")
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas de ocupación de los pools por host.
+
+        Returns:
+            Diccionario {origen: métricas} con peticiones en curso, conexiones
+            abiertas/ociosas del pool y latencia media.
+        """
+        stats: Dict[str, Any] = {}
+        for origin, host_stats in self._stats.items():
+            client = self._clients.get(origin)
+            connections = idle = None
+            pool = getattr(getattr(client, "_transport", None), "pool", None) if client else None
+            if pool is not None and hasattr(pool, "connections"):
+                pool_connections = list(pool.connections)
+                connections = len(pool_connections)
+                idle = sum(1 for conn in pool_connections if conn.is_idle())
+            stats[origin] = {
+                "active": client is not None and not client.is_closed,
+                "requests": host_stats.requests,
+                "responses": host_stats.responses,
+                "in_flight": host_stats.in_flight,
+                "server_errors": host_stats.errors,
+                "transport_errors": host_stats.transport_errors,
+                "avg_latency_ms": round(host_stats.total_latency / host_stats.responses * 1000, 2)
+                if host_stats.responses else None,
+                "pool_connections": connections,
+                "pool_idle_connections": idle,
+                "max_connections": settings.HTTPX_MAX_CONNECTIONS,
+            }
+        return stats
+
+
+# Instancia global del registro
+http_clients = HTTPClientRegistry()
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """Atajo para obtener el cliente compartido del host de 'url'."""
+    return http_clients.get_client(url)
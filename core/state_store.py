@@ -0,0 +1,301 @@
+"""
+Almacén en proceso acotado (LRU + TTL) para estado que vive en memoria de los servicios.
+
+Sustituye a los diccionarios que crecían sin límite en un worker de larga
+duración (conversaciones activas del motor, memorias de pacientes, almacenes
+vectoriales). Las entradas se desalojan por número, por tamaño aproximado en
+bytes o por inactividad (TTL desde el último acceso). Las entradas marcadas
+como pendientes ("dirty") se persisten con 'writer' antes de desalojarse y en
+`flush()`; 'on_evict' permite liberar recursos externos del valor desalojado.
+Las escrituras de una misma clave se encadenan en orden de llegada y quien vaya
+a cargar una clave de la BD debe esperar antes a `wait_for_write(clave)`, para
+no leer la versión anterior a un desalojo que todavía se está persistiendo.
+
+A diferencia de database/session_cache.py, guarda los objetos tal cual (sin
+copias), porque los servicios los modifican en su sitio.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger("mark-assistant.state_store")
+
+StateWriter = Callable[[str, Any], Awaitable[bool]]
+StateSizer = Callable[[Any], int]
+EvictionCallback = Callable[[str, Any], None]
+
+# Almacenes creados en el proceso, para las métricas de ocupación
+_stores: "weakref.WeakSet[BoundedStateStore]" = weakref.WeakSet()
+
+
+def estimate_size(value: Any) -> int:
+    """Tamaño aproximado en bytes (serialización JSON; to_dict() si el objeto lo tiene)."""
+    if value is None:
+        return 0
+    if hasattr(value, "to_dict"):
+        value = value.to_dict()
+    try:
+        return len(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "dirty")
+
+    def __init__(self, value: Any, size: int, expires_at: float) -> None:
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.dirty = False
+
+
+class BoundedStateStore:
+    """
+    Diccionario acotado con desalojo LRU/TTL y write-back de entradas pendientes.
+
+    Args:
+        name: Nombre para logs y métricas.
+        max_entries: Número máximo de entradas en memoria.
+        max_bytes: Tamaño máximo aproximado del total de entradas.
+        ttl_seconds: Inactividad tras la que una entrada caduca (None: sin TTL).
+        writer: Corrutina (clave, valor) -> bool que persiste una entrada pendiente.
+        sizer: Función que estima el tamaño en bytes de un valor.
+        on_evict: Función (clave, valor) llamada al desalojar o caducar una entrada.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1000,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl_seconds: Optional[float] = 3600.0,
+        writer: Optional[StateWriter] = None,
+        sizer: StateSizer = estimate_size,
+        on_evict: Optional[EvictionCallback] = None,
+    ) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._writer = writer
+        self._sizer = sizer
+        self._on_evict = on_evict
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        # Última escritura encadenada de cada clave (espera a las anteriores)
+        self._writes: Dict[str, asyncio.Task] = {}
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "write_backs": 0,
+            "write_back_errors": 0,
+        }
+        _stores.add(self)
+
+    def _expiry(self) -> float:
+        return time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else float("inf")
+
+    # --- Acceso ---
+
+    def get(self, key: str) -> Optional[Any]:
+        """Devuelve el valor (renovando su posición LRU y su TTL) o None si no está o ha caducado."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self.stats["expirations"] += 1
+            self._remove(key, evicted=True)
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        entry.expires_at = self._expiry()
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: str, value: Any, dirty: bool = False, size: Optional[int] = None) -> None:
+        """Guarda el valor como entrada más reciente y aplica los límites."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old.size
+            # Una escritura pendiente anterior sigue pendiente con el nuevo valor
+            dirty = dirty or old.dirty
+        entry = _Entry(value, self._sizer(value) if size is None else size, self._expiry())
+        entry.dirty = dirty
+        self._entries[key] = entry
+        self._total_bytes += entry.size
+        self._enforce_limits()
+
+    def resize(self, key: str, size: Optional[int] = None) -> None:
+        """Recalcula el tamaño de una entrada modificada en su sitio."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        new_size = self._sizer(entry.value) if size is None else size
+        self._total_bytes += new_size - entry.size
+        entry.size = new_size
+        self._enforce_limits()
+
+    def size_of(self, key: str) -> int:
+        entry = self._entries.get(key)
+        return entry.size if entry is not None else 0
+
+    def mark_dirty(self, key: str, dirty: bool = True) -> None:
+        """Marca (o desmarca tras persistirla) una entrada como pendiente de escribir."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.dirty = dirty
+
+    async def write(self, key: str) -> bool:
+        """
+        Persiste ya la entrada, detrás de las escrituras en curso de la misma clave.
+        Si falla sigue pendiente y se reintenta al desalojarla o en `flush()`.
+        """
+        entry = self._entries.get(key)
+        if entry is None or self._writer is None:
+            return False
+        entry.dirty = True
+        ok = await self._chain_write(key, entry.value)
+        if ok and self._entries.get(key) is entry:
+            entry.dirty = False
+        return ok
+
+    async def wait_for_write(self, key: str) -> None:
+        """Espera a que terminen las escrituras en curso de la clave (antes de cargarla de la BD)."""
+        write = self._writes.get(key)
+        if write is not None:
+            await asyncio.wait([write])
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Retira la entrada sin persistirla."""
+        entry = self._entries.get(key)
+        self._remove(key, evicted=False)
+        return entry.value if entry is not None else None
+
+    def __contains__(self, key: object) -> bool:
+        entry = self._entries.get(key)  # type: ignore[arg-type]
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    # --- Gestión interna ---
+
+    def _remove(self, key: str, evicted: bool) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry.size
+        if not evicted:
+            return
+        if entry.dirty:
+            # Persistir antes de perder la última versión
+            self._schedule_write(key, entry.value)
+        if self._on_evict is not None:
+            try:
+                self._on_evict(key, entry.value)
+            except Exception as e:
+                logger.error(f"Error al liberar '{key}' desalojado de {self.name}: {e}")
+
+    def _enforce_limits(self) -> None:
+        now = time.monotonic()
+        # Las entradas caducadas están al principio (orden de último acceso)
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if oldest.expires_at > now:
+                break
+            self.stats["expirations"] += 1
+            self._remove(oldest_key, evicted=True)
+        # No desalojar la única entrada aunque supere max_bytes
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            self.stats["evictions"] += 1
+            self._remove(next(iter(self._entries)), evicted=True)
+
+    def _schedule_write(self, key: str, value: Any) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._chain_write(key, value)
+        except RuntimeError:
+            logger.error(f"No hay event loop activo para persistir '{key}' desalojado de {self.name}")
+
+    def _chain_write(self, key: str, value: Any) -> "asyncio.Task[bool]":
+        """Lanza la escritura detrás de la anterior de la misma clave, para que no se reordenen."""
+        previous = self._writes.get(key)
+        task = asyncio.get_running_loop().create_task(self._write_after(previous, key, value))
+        self._writes[key] = task
+
+        def _done(done: "asyncio.Task[bool]") -> None:
+            if self._writes.get(key) is done:
+                del self._writes[key]
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _write_after(self, previous: Optional[asyncio.Task], key: str, value: Any) -> bool:
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await self._write(key, value)
+
+    async def _write(self, key: str, value: Any) -> bool:
+        try:
+            ok = await self._writer(key, value)
+        except Exception as e:
+            logger.error(f"Error al persistir '{key}' desde {self.name}: {e}", exc_info=True)
+            ok = False
+        self.stats["write_backs"] += 1
+        if not ok:
+            self.stats["write_back_errors"] += 1
+        return ok
+
+    async def flush(self) -> int:
+        """
+        Persiste las entradas pendientes y espera a las escrituras de desalojos en curso.
+
+        Returns:
+            Número de entradas persistidas con éxito.
+        """
+        persisted = 0
+        if self._writer is not None:
+            for key, entry in list(self._entries.items()):
+                if not entry.dirty:
+                    continue
+                entry.dirty = False
+                if await self._chain_write(key, entry.value):
+                    persisted += 1
+                else:
+                    entry.dirty = True
+        if self._writes:
+            await asyncio.gather(*list(self._writes.values()), return_exceptions=True)
+        return persisted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores y la ocupación actual."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "dirty": sum(1 for entry in self._entries.values() if entry.dirty),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def get_state_store_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de todos los almacenes creados en el proceso, por nombre."""
+    return {store.name: store.get_stats() for store in list(_stores)}
@@ -0,0 +1,173 @@
+"""
+Registro de eventos analíticos y job incremental de agregación.
+
+Las rutas calientes (webhook de WhatsApp, webhooks de Calendly...) llaman a
+`track_event`, que solo añade el evento a un buffer en memoria. El job
+`AnalyticsRollupJob` inserta el buffer en bloque en `analytics_events` y después
+ejecuta `run_analytics_rollup` hasta vaciar el backlog; esa función SQL pliega
+los eventos nuevos en los buckets horarios/diarios que leen los gráficos de
+admin/dashboard_analytics.py.
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger("mark-assistant.analytics")
+
+# Tipos de evento
+EVENT_MESSAGE_IN = "message_in"
+EVENT_MESSAGE_OUT = "message_out"  # value = segundos hasta la respuesta
+EVENT_CRISIS_ALERT = "crisis_alert"  # category = severidad (high/medium/low)
+EVENT_APPOINTMENT = "appointment"  # category = scheduled/canceled/rescheduled/completed
+EVENT_SENTIMENT = "sentiment"  # category = positive/neutral/negative
+
+MAX_BUFFERED_EVENTS = 10000
+
+_buffer: Deque[Dict[str, Any]] = deque()
+_dropped_events = 0
+
+
+def track_event(
+    event_type: str,
+    language: Optional[str] = None,
+    playbook: Optional[str] = None,
+    category: Optional[str] = None,
+    session_id: Optional[str] = None,
+    value: Optional[float] = None,
+) -> None:
+    """Añade un evento al buffer sin esperar a la base de datos."""
+    global _dropped_events
+    if len(_buffer) >= MAX_BUFFERED_EVENTS:
+        # Sin conexión a la BD durante mucho tiempo: se descartan los más antiguos
+        _buffer.popleft()
+        _dropped_events += 1
+    _buffer.append({
+        "event_type": event_type,
+        "occurred_at": datetime.now(timezone.utc).isoformat(),
+        "language": language,
+        "playbook": playbook,
+        "category": category,
+        "session_id": session_id,
+        "value": value,
+    })
+
+
+def drain_events(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Extrae (y elimina) hasta 'limit' eventos del buffer, en orden de llegada."""
+    count = len(_buffer) if limit is None else min(limit, len(_buffer))
+    return [_buffer.popleft() for _ in range(count)]
+
+
+def requeue_events(events: List[Dict[str, Any]]) -> None:
+    """Devuelve al principio del buffer eventos cuya inserción falló."""
+    for event in reversed(events):
+        if len(_buffer) >= MAX_BUFFERED_EVENTS:
+            break
+        _buffer.appendleft(event)
+
+
+class AnalyticsRollupJob:
+    """
+    Job periódico: vuelca el buffer de eventos y agrega el backlog.
+
+    Args:
+        insert_events: Corrutina que inserta una lista de eventos en bloque.
+        run_rollup: Corrutina `run_rollup(batch_size)` que devuelve {"success", "processed"}.
+        interval: Segundos entre ejecuciones.
+        batch_size: Eventos por inserción y por paso de agregación.
+    """
+
+    def __init__(
+        self,
+        insert_events: Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Any]]],
+        run_rollup: Callable[[int], Awaitable[Dict[str, Any]]],
+        interval: float = 60.0,
+        batch_size: int = 5000,
+    ) -> None:
+        self._insert_events = insert_events
+        self._run_rollup = run_rollup
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "events_inserted": 0, "events_rolled_up": 0, "errors": 0}
+
+    async def flush_events(self) -> int:
+        """Inserta en bloque los eventos pendientes del buffer."""
+        inserted = 0
+        while _buffer:
+            events = drain_events(self.batch_size)
+            result = await self._insert_events(events)
+            if not result.get("success"):
+                requeue_events(events)
+                self.stats["errors"] += 1
+                logger.error(f"No se pudieron insertar {len(events)} eventos analíticos: {result.get('error')}")
+                break
+            inserted += len(events)
+        self.stats["events_inserted"] += inserted
+        return inserted
+
+    async def run_once(self) -> int:
+        """Vuelca el buffer y agrega eventos hasta vaciar el backlog. Devuelve los eventos agregados."""
+        self.stats["runs"] += 1
+        await self.flush_events()
+        rolled_up = 0
+        while True:
+            result = await self._run_rollup(self.batch_size)
+            if not result.get("success"):
+                self.stats["errors"] += 1
+                logger.error(f"Error en la agregación de analítica: {result.get('error')}")
+                break
+            processed = result.get("processed", 0)
+            rolled_up += processed
+            # Un lote incompleto indica que ya no queda backlog
+            if processed < self.batch_size:
+                break
+        self.stats["events_rolled_up"] += rolled_up
+        return rolled_up
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error en el job de agregación de analítica: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        """Inicia el job en segundo plano."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        """Detiene el job y vuelca los eventos que quedan en el buffer."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush_events()
+        except Exception as e:
+            logger.error(f"Error al volcar los eventos analíticos pendientes: {e}", exc_info=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores del job y el tamaño actual del buffer."""
+        return {**self.stats, "buffered": len(_buffer), "dropped": _dropped_events}
+
+
+def create_analytics_rollup_job() -> AnalyticsRollupJob:
+    """Crea el job con las funciones de base de datos de la aplicación."""
+    from core.config import settings
+    from database.d1_client import insert_analytics_events, run_analytics_rollup
+
+    return AnalyticsRollupJob(
+        insert_events=insert_analytics_events,
+        run_rollup=run_analytics_rollup,
+        interval=settings.ANALYTICS_ROLLUP_INTERVAL,
+        batch_size=settings.ANALYTICS_ROLLUP_BATCH_SIZE,
+    )
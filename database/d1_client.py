@@ -3,9 +3,12 @@
 Cliente para interactuar con la base de datos Supabase.
 Proporciona funciones asíncronas para gestionar pacientes, sesiones, etc.
 """
+import asyncio
 import json
+import time
 from typing import Dict, List, Any, Optional # ASEGURAR QUE Dict, List, etc. están importados
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 
 # Importaciones necesarias para el manejo de errores
 from supabase import PostgrestAPIError  # Para errores de PostgREST
@@ -13,7 +16,9 @@ from gotrue.errors import AuthApiError  # Para errores de autenticación
 import httpx # Para errores de red
 
 from database.supabase_client import SupabaseClient 
-from core.config import logger 
+from database.query_executor import run_query
+from database.session_cache import SessionCache
+from core.config import logger, settings
 
 supabase = SupabaseClient()
 
@@ -36,6 +41,9 @@ TABLE_TERAPEUTAS = "terapeutas"
 TABLE_TESTS_PSICOLOGICOS = "tests_psicologicos"
 TABLE_USUARIOS = "usuarios"
 TABLE_SESSIONS_CONVERSATION = "sessions"  # Esta tabla no existe, posiblemente sea historiales
+TABLE_ANALYTICS_EVENTS = "analytics_events"
+TABLE_ANALYTICS_HOURLY = "analytics_rollup_hourly"
+TABLE_ANALYTICS_DAILY = "analytics_rollup_daily"
 
 async def _handle_supabase_response(
     data_payload: Any,
@@ -98,7 +106,7 @@ async def get_user_by_username(username: str) -> Dict[str, Any]:
         await supabase._ensure_initialized()
         search_username = username.lower()
         # Usar admin_client para operaciones de usuario que pueden requerir permisos elevados
-        api_response = supabase.admin_client.from_(table_name).select("*").eq('username', search_username).limit(1).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).select("*").eq('username', search_username).limit(1), operation_name)
         
         # Verificar errores lógicos en la respuesta JSON
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
@@ -124,7 +132,7 @@ async def get_user_by_id(user_id: str) -> Dict[str, Any]:
     table_name = TABLE_USUARIOS
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.admin_client.from_(table_name).select("*").eq('id', user_id).limit(1).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).select("*").eq('id', user_id).limit(1), operation_name)
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -160,7 +168,7 @@ async def update_user_auth_status(username: str, updates: Dict[str, Any]) -> Dic
     try:
         await supabase._ensure_initialized()
         search_username = username.lower()
-        api_response = supabase.admin_client.from_(table_name).update(allowed_updates).eq('username', search_username).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).update(allowed_updates).eq('username', search_username), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -186,9 +194,9 @@ async def get_all_db_users(limit: int = 100, offset: int = 0) -> Dict[str, Any]:
         # Usar el cliente de servicio para listar usuarios (puede requerir permisos elevados)
         # Nota: count='exact' no es un parámetro directo de select en supabase-py v2, 
         # se maneja con .execute(count=CountMethod.exact) o se obtiene de api_response.count
-        api_response = supabase.admin_client.from_(table_name).select(
+        api_response = await run_query(supabase.admin_client.from_(table_name).select(
             "id, username, email, full_name, roles, is_active, is_locked, last_login, created_at, updated_at"
-        ).limit(limit).offset(offset).order("username").execute() # Removido count='exact' de select
+        ).limit(limit).offset(offset).order("username"), operation_name) # Removido count='exact' de select
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -225,7 +233,7 @@ async def create_db_user(user_data: Dict[str, Any]) -> Dict[str, Any]:
     try:
         await supabase._ensure_initialized()
         # Usar el cliente de servicio para operaciones de usuario que requieren permisos elevados
-        api_response = supabase.admin_client.from_(table_name).insert(user_data).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).insert(user_data), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             # Este caso es menos común para insert si hay un error a nivel de DB, usualmente PostgrestAPIError se lanzaría.
@@ -264,7 +272,7 @@ async def update_db_user(user_id: str, update_data: Dict[str, Any]) -> Dict[str,
     try:
         await supabase._ensure_initialized()
         # Usar el cliente de servicio para operaciones de usuario que requieren permisos elevados
-        api_response = supabase.admin_client.from_(table_name).update(update_data).eq("id", user_id).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).update(update_data).eq("id", user_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -293,7 +301,7 @@ async def delete_db_user(user_id: str) -> Dict[str, Any]:
     try:
         await supabase._ensure_initialized()
         # Usar el cliente de servicio para operaciones de usuario que requieren permisos elevados
-        api_response = supabase.admin_client.from_(table_name).delete().eq('id', user_id).execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).delete().eq('id', user_id), operation_name)
         
         # Delete puede devolver datos si se usa `returning` o si la PK no existe (devuelve lista vacía).
         # Si hay un error de DB (ej. foreign key constraint), PostgrestAPIError se lanzaría.
@@ -321,7 +329,7 @@ async def get_all_patients(limit=1000, offset=0, sort_by="nombre", order="asc")
     logger.info(f"Consultando tabla '{table_name}', sort_by={sort_by}, order={order}.")
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").order(sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").order(sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -338,13 +346,71 @@ async def get_all_patients(limit=1000, offset=0, sort_by="nombre", order="asc")
         logger.exception(f"Excepción general en {operation_name}: {e}")
         return {"success": False, "results": [], "total": 0, "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
 
+def _ilike_literal(value: str) -> str:
+    """Escapa los comodines de ILIKE para comparar 'value' literalmente."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+PATIENT_SORT_FIELDS = ("nombre", "created_at")
+
+async def list_patients_page(
+    search: Optional[str] = None,
+    sort_by: str = "nombre",
+    sort_desc: bool = False,
+    cursor: Optional[Dict[str, Any]] = None,
+    limit: int = 25,
+    with_total: bool = False,
+) -> Dict[str, Any]:
+    """
+    Devuelve una página de pacientes con paginación keyset sobre (sort_by, id).
+
+    'cursor' es {"value": ..., "id": ...} de la última fila ya mostrada; para retroceder
+    el llamador invierte 'sort_desc' y da la vuelta al resultado. La búsqueda es por
+    nombre (índice trigram, ver database/sql/patients_listing.sql).
+
+    Returns:
+        {"success", "patients", "has_more", "total" (None si no se pidió), "error"}
+    """
+    operation_name = "list_patients_page"
+    table_name = TABLE_PACIENTES
+    if sort_by not in PATIENT_SORT_FIELDS:
+        sort_by = "nombre"
+    try:
+        await supabase._ensure_initialized()
+        query = supabase.client.from_(table_name).select("*", count="exact" if with_total else None)
+        if search:
+            # Comas y paréntesis tienen significado en los filtros PostgREST
+            term = search.replace(",", " ").replace("(", " ").replace(")", " ").strip()
+            query = query.ilike("nombre", f"%{_ilike_literal(term)}%")
+        if cursor:
+            last_row = {sort_by: cursor.get("value"), "id": cursor.get("id")}
+            query = query.or_(_keyset_filter([sort_by, "id"], last_row, descending=sort_desc))
+        query = query.order(sort_by, desc=sort_desc).order("id", desc=sort_desc).limit(limit + 1)
+
+        api_response = await run_query(query, operation_name)
+        if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+            return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
+
+        rows = api_response.data or []
+        return {"success": True, "patients": rows[:limit], "has_more": len(rows) > limit,
+                "total": api_response.count if with_total else None, "error": None}
+
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name} ({table_name}): {e.message}", exc_info=True)
+        return {"success": False, "patients": [], "has_more": False, "total": 0, "error": f"Error de Supabase API: {e.message}"}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name} ({table_name}): {e}", exc_info=True)
+        return {"success": False, "patients": [], "has_more": False, "total": 0, "error": f"Error de Red: {type(e).__name__}"}
+    except Exception as e:
+        logger.exception(f"Excepción general en {operation_name}: {e}")
+        return {"success": False, "patients": [], "has_more": False, "total": 0, "error": f"Error inesperado: {type(e).__name__}"}
+
 async def get_patient_by_id(patient_id: str) -> Dict[str, Any]:
     if not patient_id: return {"success": False, "patient": None, "error": "Patient ID requerido"}
     operation_name = "get_patient_by_id"
     table_name = TABLE_PACIENTES
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").eq('id', patient_id).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").eq('id', patient_id).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -375,7 +441,7 @@ async def get_patient_by_phone(phone: str) -> Dict[str, Any]:
         if not normalized_phone:
             return {"success": False, "patient": None, "error": "Número de teléfono normalizado inválido"}
 
-        api_response = supabase.client.from_(table_name).select("*").like('telefono', f'%{normalized_phone}%').limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").like('telefono', f'%{normalized_phone}%').limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -399,7 +465,7 @@ async def get_patient_by_email(email: str) -> Dict[str, Any]:
     table_name = TABLE_PACIENTES
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").eq('email', email.lower()).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").eq('email', email.lower()).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -426,7 +492,7 @@ async def insert_patient(name: str, phone: str, email: Optional[str] = None, lan
         normalized_phone = ''.join(filter(str.isdigit, phone))
         patient_data = {"name": name, "phone": normalized_phone, "language": language, "metadata": metadata or {}, "email": email.lower() if email else None, "assigned_therapist_id": assigned_therapist_id}
         
-        api_response = supabase.client.from_(table_name).insert(patient_data).execute()
+        api_response = await run_query(supabase.client.from_(table_name).insert(patient_data), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -459,7 +525,7 @@ async def update_patient(patient_id: str, update_data: Dict[str, Any]) -> Dict[s
 
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).update(update_data).eq('id', patient_id).execute()
+        api_response = await run_query(supabase.client.from_(table_name).update(update_data).eq('id', patient_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -483,7 +549,7 @@ async def delete_patient(patient_id: str) -> Dict[str, Any]:
     logger.info(f"Eliminando paciente ID ({operation_name}): {patient_id}")
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).delete().eq('id', patient_id).execute()
+        api_response = await run_query(supabase.client.from_(table_name).delete().eq('id', patient_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -514,7 +580,7 @@ async def get_all_appointments(limit=1000, offset=0, sort_by="created_at", order
             safe_sort_by = "created_at"
             logger.warning(f"Campo '{sort_by}' no existe en tabla citas, usando 'created_at'")
         
-        api_response = supabase.client.from_(table_name).select("*").order(safe_sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").order(safe_sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -544,7 +610,7 @@ async def insert_appointment_record(appointment_data: Dict[str, Any]) -> Dict[st
 
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).insert(appointment_data).execute()
+        api_response = await run_query(supabase.client.from_(table_name).insert(appointment_data), operation_name)
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -571,7 +637,7 @@ async def get_appointment_by_id(appointment_id: str) -> Dict[str, Any]:
     table_name = TABLE_APPOINTMENTS
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").eq('id', appointment_id).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").eq('id', appointment_id).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -596,7 +662,7 @@ async def update_appointment_record(appointment_id: str, update_data: Dict[str,
     update_data.pop('id', None)
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).update(update_data).eq('id', appointment_id).execute()
+        api_response = await run_query(supabase.client.from_(table_name).update(update_data).eq('id', appointment_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -620,7 +686,7 @@ async def delete_appointment_record(appointment_id: str) -> Dict[str, Any]:
     logger.info(f"Eliminando cita ID ({operation_name}): {appointment_id}")
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).delete().eq('id', appointment_id).execute()
+        api_response = await run_query(supabase.client.from_(table_name).delete().eq('id', appointment_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -644,7 +710,7 @@ async def get_all_notifications(limit: int = 1000, offset: int = 0, sort_by="cre
     logger.info(f"Consultando tabla '{table_name}', sort_by={sort_by}, order={order}.")
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").order(sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").order(sort_by, desc=(order.lower() == "desc")).range(offset, offset + limit - 1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -669,7 +735,7 @@ async def get_pending_notifications(limit: int = 10, table_name: str = TABLE_NOT
         await supabase._ensure_initialized()
         
         # ----- REVERTIDO A CONSULTA ORIGINAL (sin await) ----- # Comentario actualizado para forzar redeploy
-        api_response = supabase.client.from_(table_name).select("*").eq("status", "pendiente").order("created_at", desc=False).limit(limit).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").eq("status", "pendiente").order("created_at", desc=False).limit(limit), operation_name)
         # ----- FIN DE REVERSIÓN -----
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
@@ -697,7 +763,7 @@ async def update_notification_status(notification_id: str, status: str, metadata
         
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).update(update_payload).eq("id", notification_id).execute()
+        api_response = await run_query(supabase.client.from_(table_name).update(update_payload).eq("id", notification_id), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -714,6 +780,145 @@ async def update_notification_status(notification_id: str, status: str, metadata
         logger.error(f"Excepción en {operation_name} para ID {notification_id}: {e}", exc_info=True)
         return {"success": False, "notification": None, "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
 
+async def update_notifications_status_many(updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Actualiza el estado de varias notificaciones en una sola llamada RPC.
+
+    Args:
+        updates: Lista de {"id", "status", "metadata" (opcional)}. Si un ID se
+            repite, prevalece la última actualización.
+
+    Returns:
+        {"success", "results": [{"id", "success", "error"}, ...], "updated", "failed"}
+        con un resultado por notificación, en el orden de entrada.
+    """
+    operation_name = "update_notifications_status_many"
+    table_name = TABLE_NOTIFICATIONS
+    payload: Dict[str, Dict[str, Any]] = {}
+    for update in updates:
+        notification_id = str(update["id"])
+        payload.pop(notification_id, None)
+        payload[notification_id] = {"id": notification_id, "status": update["status"], "metadata": update.get("metadata")}
+    if not payload:
+        return {"success": True, "results": [], "updated": 0, "failed": 0, "error": None}
+
+    logger.info(f"Actualizando estado de {len(payload)} notificaciones en bloque.")
+    try:
+        await supabase._ensure_initialized()
+        try:
+            api_response = await run_query(
+                supabase.client.rpc("update_notifications_status_many", {"p_updates": list(payload.values())}),
+                operation_name
+            )
+            if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+                return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
+            updated_ids = {str(row.get("id")) for row in api_response.data or [] if row.get("updated")}
+            results = [
+                {"id": notification_id, "success": notification_id in updated_ids,
+                 "error": None if notification_id in updated_ids else "Notificación no encontrada"}
+                for notification_id in payload
+            ]
+        except PostgrestAPIError as e:
+            # PGRST202: la función RPC no existe; se recurre a actualizaciones individuales concurrentes
+            if getattr(e, "code", None) != "PGRST202":
+                raise
+            logger.warning("Función RPC update_notifications_status_many no disponible, actualizando fila a fila")
+            single_results = await asyncio.gather(*(
+                update_notification_status(item["id"], item["status"], item["metadata"]) for item in payload.values()
+            ))
+            results = []
+            for notification_id, single in zip(payload, single_results):
+                ok = bool(single.get("success")) and single.get("notification") is not None
+                results.append({"id": notification_id, "success": ok,
+                                "error": None if ok else (single.get("error") or "Notificación no encontrada")})
+
+        updated = sum(1 for result in results if result["success"])
+        return {"success": True, "results": results, "updated": updated, "failed": len(results) - updated, "error": None}
+
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+        error = f"Error de Supabase API: {e.message}"
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name}: {e}", exc_info=True)
+        error = f"Error de Red: {type(e).__name__}"
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        error = f"Error inesperado: {type(e).__name__}"
+    results = [{"id": notification_id, "success": False, "error": error} for notification_id in payload]
+    return {"success": False, "results": results, "updated": 0, "failed": len(results), "error": error}
+
+async def claim_pending_notifications(limit: int = 100, lease_seconds: int = 300, channels: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Reclama (lease) un lote de notificaciones pendientes marcándolas como 'procesando'.
+
+    Usa la función SQL `claim_pending_notifications` (database/sql/notification_dispatch.sql),
+    que bloquea las filas con FOR UPDATE SKIP LOCKED para que varias instancias no
+    envíen la misma notificación. Si la función no existe, se recurre a una
+    reclamación optimista (select + update condicionado al estado).
+    Las notificaciones cuyo lease ha caducado vuelven a ser reclamables.
+    """
+    operation_name = "claim_pending_notifications"
+    table_name = TABLE_NOTIFICATIONS
+    try:
+        await supabase._ensure_initialized()
+        params = {"p_limit": limit, "p_lease_seconds": lease_seconds, "p_channels": channels}
+        try:
+            api_response = await run_query(supabase.client.rpc("claim_pending_notifications", params), operation_name)
+        except PostgrestAPIError as e:
+            # PGRST202: la función RPC no existe en el esquema
+            if getattr(e, "code", None) != "PGRST202":
+                raise
+            logger.warning("Función RPC claim_pending_notifications no disponible, usando reclamación optimista")
+            api_response = await _claim_pending_notifications_optimistic(limit, lease_seconds, channels)
+
+        if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+            return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
+
+        return await _handle_supabase_response(api_response.data, operation_name, table_name, return_key_plural="notifications")
+
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+        return {"success": False, "notifications": [], "error": f"Error de Supabase API: {e.message}", "details": str(e)}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "notifications": [], "error": f"Error de Red: {type(e).__name__}", "details": str(e)}
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "notifications": [], "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
+
+async def _claim_pending_notifications_optimistic(limit: int, lease_seconds: int, channels: Optional[List[str]]) -> Any:
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    lease_until = (now + timedelta(seconds=lease_seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    claimable = f"status.eq.pendiente,and(status.eq.procesando,lease_expires_at.lt.{now_str})"
+
+    query = supabase.client.from_(TABLE_NOTIFICATIONS).select("id, scheduled_at").or_(claimable)
+    if channels:
+        query = query.in_("channel", channels)
+    candidates = await run_query(query.order("created_at", desc=False).limit(limit), "claim_pending_notifications_select")
+
+    ids = []
+    for row in candidates.data or []:
+        scheduled_at = row.get("scheduled_at")
+        if scheduled_at:
+            scheduled_dt = datetime.fromisoformat(str(scheduled_at).replace("Z", "+00:00"))
+            if scheduled_dt.tzinfo is None:
+                scheduled_dt = scheduled_dt.replace(tzinfo=timezone.utc)
+            if scheduled_dt > now:
+                continue
+        ids.append(row["id"])
+    if not ids:
+        candidates.data = []
+        return candidates
+
+    # El filtro de estado se repite en el UPDATE: solo se devuelven las filas que
+    # seguían siendo reclamables, así otra instancia no puede reclamar las mismas
+    update_payload = {"status": "procesando", "lease_expires_at": lease_until, "updated_at": now.isoformat()}
+    return await run_query(
+        supabase.client.from_(TABLE_NOTIFICATIONS).update(update_payload).in_("id", ids).or_(claimable),
+        "claim_pending_notifications_update"
+    )
+
 async def insert_notification(patient_id: str, message: str, channel: str = "whatsapp", status: str = "pending", scheduled_at: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     operation_name = "insert_notification"
     table_name = TABLE_NOTIFICATIONS
@@ -729,7 +934,7 @@ async def insert_notification(patient_id: str, message: str, channel: str = "wha
         
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).insert(notification_data).execute()
+        api_response = await run_query(supabase.client.from_(table_name).insert(notification_data), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -760,7 +965,7 @@ async def get_system_config(key: str) -> Dict[str, Any]:
         
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("value").eq('key', key).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("value").eq('key', key).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -798,7 +1003,7 @@ async def set_system_config(key: str, value: Any) -> Dict[str, Any]:
     try:
         await supabase._ensure_initialized()
         # Upsert para crear o actualizar la configuración
-        api_response = supabase.client.from_(table_name).upsert(config_data).execute()
+        api_response = await run_query(supabase.client.from_(table_name).upsert(config_data), operation_name)
         
         return await _handle_supabase_response(api_response.data, operation_name, table_name, return_key_singular="config_entry")
 
@@ -818,7 +1023,7 @@ async def get_all_configs(limit: int = 100, offset: int = 0) -> Dict[str, Any]:
     logger.info(f"Consultando todas las configuraciones del sistema ({operation_name}).")
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").limit(limit).offset(offset).order("key").execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").limit(limit).offset(offset).order("key"), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -850,7 +1055,7 @@ async def insert_audit_log(user_id: str, action: str, resource_type: Optional[st
     try:
         await supabase._ensure_initialized()
         # Usar service_role para insertar logs, ya que puede ser llamado por el sistema o usuarios autenticados.
-        api_response = supabase.client.from_(table_name).insert(log_data).execute() 
+        api_response = await run_query(supabase.client.from_(table_name).insert(log_data), operation_name) 
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -870,7 +1075,7 @@ async def insert_audit_log(user_id: str, action: str, resource_type: Optional[st
 
 # --- Funciones de Estado de Conversación (Ejemplo, adaptar a tu tabla 'sessions') ---
 # Si 'sessions' es para estado de conversación (no citas)
-async def get_session_data(session_id: str) -> Optional[Dict[str, Any]]:
+async def _fetch_session_data(session_id: str) -> Optional[Dict[str, Any]]:
     operation_name = "get_session_data"
     table_name = TABLE_SESSIONS_CONVERSATION # Usar la constante correcta
     logger.info(f"Obteniendo datos de sesión ({operation_name}): {session_id}")
@@ -878,7 +1083,7 @@ async def get_session_data(session_id: str) -> Optional[Dict[str, Any]]:
         
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("data").eq('session_id', session_id).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("data").eq('session_id', session_id).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data) # Loguea el error
@@ -898,7 +1103,7 @@ async def get_session_data(session_id: str) -> Optional[Dict[str, Any]]:
         logger.error(f"Excepción en {operation_name} para ID {session_id}: {e}", exc_info=True)
         return None
 
-async def save_session_data(session_id: str, data: Dict[str, Any]) -> bool:
+async def _persist_session_data(session_id: str, data: Dict[str, Any]) -> bool:
     operation_name = "save_session_data"
     table_name = TABLE_SESSIONS_CONVERSATION # Usar la constante correcta
     logger.info(f"Guardando datos de sesión ({operation_name}): {session_id}")
@@ -912,7 +1117,7 @@ async def save_session_data(session_id: str, data: Dict[str, Any]) -> bool:
     try:
         await supabase._ensure_initialized()
         # Upsert para crear o actualizar la sesión de conversación
-        api_response = supabase.client.from_(table_name).upsert(session_payload, on_conflict="session_id").execute()
+        api_response = await run_query(supabase.client.from_(table_name).upsert(session_payload, on_conflict="session_id"), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data) # Loguea el error
@@ -932,6 +1137,30 @@ async def save_session_data(session_id: str, data: Dict[str, Any]) -> bool:
         logger.error(f"Excepción en {operation_name} para ID {session_id}: {e}", exc_info=True)
         return False
 
+# Caché de sesiones delante de la tabla 'sessions' (ver database/session_cache.py)
+session_cache = SessionCache(
+    loader=_fetch_session_data,
+    writer=_persist_session_data,
+    max_entries=settings.SESSION_CACHE_MAX_ENTRIES,
+    max_bytes=settings.SESSION_CACHE_MAX_BYTES,
+    ttl_seconds=settings.SESSION_CACHE_TTL_SECONDS,
+    flush_interval=settings.SESSION_CACHE_FLUSH_INTERVAL,
+)
+
+async def get_session_data(session_id: str) -> Optional[Dict[str, Any]]:
+    """Obtiene los datos de sesión, sirviéndolos desde la caché si están en memoria."""
+    if not session_id: return None
+    return await session_cache.get(session_id)
+
+async def save_session_data(session_id: str, data: Dict[str, Any]) -> bool:
+    """
+    Guarda los datos de sesión en la caché; el upsert a la tabla se agrupa y se
+    realiza en el siguiente volcado periódico o al desalojar la entrada.
+    """
+    if not session_id: return False
+    session_cache.put(session_id, data)
+    return True
+
 async def delete_expired_sessions(ttl_seconds: int) -> int:
     operation_name = "delete_expired_sessions"
     table_name = TABLE_SESSIONS_CONVERSATION # Usar la constante correcta
@@ -950,7 +1179,7 @@ async def delete_expired_sessions(ttl_seconds: int) -> int:
         
         # Aquí optamos por borrar y no obtener el conteo de filas borradas directamente de la respuesta de delete.
         # Si necesitas el conteo, tendrás que hacer un SELECT count(*) antes y después si es crítico.
-        api_response = supabase.client.from_(table_name).delete().lt('updated_at', expiration_time.isoformat()).execute()
+        api_response = await run_query(supabase.client.from_(table_name).delete().lt('updated_at', expiration_time.isoformat()), operation_name)
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data) # Loguea el error
@@ -996,7 +1225,7 @@ async def insert_appointment(appointment_data: Dict[str, Any]) -> Dict[str, Any]
 
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).insert(appointment_data).execute() # Asume que appointment_data está listo para la DB
+        api_response = await run_query(supabase.client.from_(table_name).insert(appointment_data), operation_name) # Asume que appointment_data está listo para la DB
 
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -1024,7 +1253,7 @@ async def get_appointment_by_calendly_uri(calendly_event_uri: str) -> Dict[str,
     table_name = TABLE_APPOINTMENTS
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select("*").eq('calendly_event_uri', calendly_event_uri).limit(1).execute()
+        api_response = await run_query(supabase.client.from_(table_name).select("*").eq('calendly_event_uri', calendly_event_uri).limit(1), operation_name)
         
         if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
             return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
@@ -1050,7 +1279,7 @@ async def update_appointment_zoom_details(calendly_event_uri: str, zoom_meeting_
     try:
         await supabase._ensure_initialized()
         update_data = {"zoom_meeting_id": zoom_meeting_id, "zoom_join_url": zoom_join_url}
-        api_response = supabase.client.from_(table_name).update(update_data).eq('calendly_event_uri', calendly_event_uri).execute()
+        api_response = await run_query(supabase.client.from_(table_name).update(update_data).eq('calendly_event_uri', calendly_event_uri), operation_name)
         return await _handle_supabase_response(api_response.data, operation_name, table_name, return_key_singular="appointment")
     except Exception as e: logger.error(f"Excepción en {operation_name}: {e}", exc_info=True); return {"success": False, "error": str(e)}
 
@@ -1061,12 +1290,84 @@ async def update_appointment_status(calendly_event_uri: str, status: str) -> Dic
     if not all([calendly_event_uri, status]): return {"success": False, "error": "Datos incompletos para actualizar estado de cita"}
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).update({"status": status}).eq('calendly_event_uri', calendly_event_uri).execute()
+        api_response = await run_query(supabase.client.from_(table_name).update({"status": status}).eq('calendly_event_uri', calendly_event_uri), operation_name)
         return await _handle_supabase_response(api_response.data, operation_name, table_name, return_key_singular="appointment")
     except Exception as e: logger.error(f"Excepción en {operation_name}: {e}", exc_info=True); return {"success": False, "error": str(e)}
 
+async def upsert_appointments_many(appointments: List[Dict[str, Any]], on_conflict: str = "calendly_event_uri") -> Dict[str, Any]:
+    """
+    Inserta o actualiza un lote de citas en una sola petición PostgREST.
+
+    Las filas se agrupan por conjunto de columnas (PostgREST exige las mismas
+    claves en todo el lote), así que un lote homogéneo cuesta una única petición.
+    Requiere un índice único sobre la columna `on_conflict`
+    (ver database/sql/bulk_updates.sql).
+
+    Returns:
+        {"success", "results": [{"key", "success", "appointment", "error"}, ...], "upserted", "failed"}
+        con un resultado por cita, en el orden de entrada.
+    """
+    operation_name = "upsert_appointments_many"
+    table_name = TABLE_APPOINTMENTS
+    results: List[Dict[str, Any]] = []
+    groups: Dict[tuple, List[int]] = {}
+    for index, appointment in enumerate(appointments):
+        key = appointment.get(on_conflict)
+        results.append({"key": key, "success": False, "appointment": None,
+                        "error": None if key else f"Falta '{on_conflict}' en la cita"})
+        if key:
+            groups.setdefault(tuple(sorted(appointment.keys())), []).append(index)
+    if not groups:
+        return {"success": True, "results": results, "upserted": 0, "failed": len(results), "error": None}
+
+    logger.info(f"Upsert en bloque de {len(appointments)} citas en '{table_name}' ({len(groups)} petición(es)).")
+    request_error = None
+    try:
+        await supabase._ensure_initialized()
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        request_error = f"Error inesperado: {type(e).__name__}"
+        groups = {}
+    for indexes in groups.values():
+        rows = [appointments[index] for index in indexes]
+        try:
+            api_response = await run_query(supabase.client.from_(table_name).upsert(rows, on_conflict=on_conflict), operation_name)
+            if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+                group_error = api_response.data.get("message", "Error desconocido de Supabase")
+                logger.error(f"Supabase API devolvió un error en {operation_name}: {group_error}")
+            else:
+                returned = {str(row.get(on_conflict)): row for row in api_response.data or []}
+                for index in indexes:
+                    row = returned.get(str(results[index]["key"]))
+                    results[index].update(success=row is not None, appointment=row,
+                                          error=None if row is not None else "La cita no fue devuelta por Supabase")
+                continue
+        except (PostgrestAPIError, AuthApiError) as e:
+            logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+            group_error = f"Error de Supabase API: {e.message}"
+        except httpx.RequestError as e:
+            logger.error(f"Error de Red/Conexión en {operation_name}: {e}", exc_info=True)
+            group_error = f"Error de Red: {type(e).__name__}"
+        except Exception as e:
+            logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+            group_error = f"Error inesperado: {type(e).__name__}"
+        request_error = request_error or group_error
+        for index in indexes:
+            results[index]["error"] = group_error
+
+    if request_error:
+        for result in results:
+            if not result["success"] and result["error"] is None:
+                result["error"] = request_error
+    upserted = sum(1 for result in results if result["success"])
+    return {"success": request_error is None, "results": results, "upserted": upserted,
+            "failed": len(results) - upserted, "error": request_error}
+
 
 # --- Funciones de Conteo para Dashboard ---
+# Campo de fecha de la tabla de citas detectado en el primer conteo
+_appointments_date_field: Optional[str] = None
+
 async def count_users() -> Dict[str, Any]:
     """Cuenta el número total de usuarios en el sistema."""
     operation_name = "count_users"
@@ -1075,7 +1376,7 @@ async def count_users() -> Dict[str, Any]:
         await supabase._ensure_initialized()
         # En Supabase, podemos usar count para obtener solo el número
         # Usando select con count=exact
-        api_response = supabase.admin_client.from_(table_name).select('*', count='exact').execute()
+        api_response = await run_query(supabase.admin_client.from_(table_name).select('id', count='exact', head=True), operation_name)
         
         # El count viene en api_response.count
         count = api_response.count if hasattr(api_response, 'count') else len(api_response.data or [])
@@ -1097,7 +1398,7 @@ async def count_patients() -> Dict[str, Any]:
     table_name = TABLE_PACIENTES
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name).select('*', count='exact').execute()
+        api_response = await run_query(supabase.client.from_(table_name).select('id', count='exact', head=True), operation_name)
         
         count = api_response.count if hasattr(api_response, 'count') else len(api_response.data or [])
         
@@ -1114,6 +1415,7 @@ async def count_patients() -> Dict[str, Any]:
 
 async def count_appointments_today() -> Dict[str, Any]:
     """Cuenta el número de citas programadas para hoy."""
+    global _appointments_date_field
     operation_name = "count_appointments_today"
     table_name = TABLE_APPOINTMENTS  # Ahora usa "citas"
     try:
@@ -1123,21 +1425,26 @@ async def count_appointments_today() -> Dict[str, Any]:
         today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
         today_end = today_start + timedelta(days=1)
         
-        # Intentar con diferentes nombres de campos posibles
+        # Intentar con diferentes nombres de campos posibles (primero el que ya funcionó)
         possible_date_fields = ['fecha_hora', 'fecha', 'scheduled_at', 'created_at']
+        if _appointments_date_field:
+            possible_date_fields = [_appointments_date_field] + [f for f in possible_date_fields if f != _appointments_date_field]
         
         for date_field in possible_date_fields:
             try:
                 # Filtrar citas por fecha
-                api_response = supabase.client.from_(table_name)\
-                    .select('*', count='exact')\
-                    .gte(date_field, today_start.isoformat())\
-                    .lt(date_field, today_end.isoformat())\
-                    .execute()
+                api_response = await run_query(
+                    supabase.client.from_(table_name)
+                    .select('id', count='exact', head=True)
+                    .gte(date_field, today_start.isoformat())
+                    .lt(date_field, today_end.isoformat()),
+                    operation_name
+                )
                 
                 count = api_response.count if hasattr(api_response, 'count') else len(api_response.data or [])
                 
                 logger.info(f"Conteo de citas usando campo '{date_field}': {count}")
+                _appointments_date_field = date_field
                 
                 return {
                     "success": True,
@@ -1168,10 +1475,12 @@ async def count_pending_notifications() -> Dict[str, Any]:
     table_name = TABLE_NOTIFICATIONS
     try:
         await supabase._ensure_initialized()
-        api_response = supabase.client.from_(table_name)\
-            .select('*', count='exact')\
-            .eq('status', 'pendiente')\
-            .execute()
+        api_response = await run_query(
+            supabase.client.from_(table_name)
+            .select('id', count='exact', head=True)
+            .eq('status', 'pendiente'),
+            operation_name
+        )
         
         count = api_response.count if hasattr(api_response, 'count') else len(api_response.data or [])
         
@@ -1183,4 +1492,391 @@ async def count_pending_notifications() -> Dict[str, Any]:
         
     except Exception as e:
         logger.error(f"Error en {operation_name}: {e}", exc_info=True)
-        return {"success": False, "count": 0, "error": str(e)}
\ No newline at end of file
+        return {"success": False, "count": 0, "error": str(e)}
+
+# --- Estadísticas agregadas del dashboard ---
+_dashboard_stats_cache: Dict[str, Any] = {"value": None, "expires_at": 0.0}
+_dashboard_stats_lock: Optional[asyncio.Lock] = None
+
+async def _fetch_dashboard_stats() -> Dict[str, Any]:
+    operation_name = "get_dashboard_stats"
+    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {"p_day_start": today_start.isoformat(), "p_day_end": (today_start + timedelta(days=1)).isoformat()}
+    try:
+        await supabase._ensure_initialized()
+        api_response = await run_query(supabase.admin_client.rpc("get_dashboard_stats", params), operation_name)
+        data = api_response.data
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        if isinstance(data, dict) and 'message' in data and 'code' in data:
+            return await _handle_supabase_response(None, operation_name, TABLE_USUARIOS, error_obj=data)
+        stats = {key: int((data or {}).get(key) or 0) for key in ("total_usuarios", "total_pacientes", "citas_hoy", "notificaciones_pendientes")}
+        return {"success": True, "stats": stats, "error": None}
+    except PostgrestAPIError as e:
+        # PGRST202: la función RPC no existe; se usan los conteos individuales en paralelo
+        if getattr(e, "code", None) != "PGRST202":
+            logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+            return {"success": False, "stats": None, "error": f"Error de Supabase API: {e.message}"}
+        logger.warning("Función RPC get_dashboard_stats no disponible, usando conteos individuales")
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "stats": None, "error": f"Error inesperado: {type(e).__name__}"}
+
+    results = await asyncio.gather(count_users(), count_patients(), count_appointments_today(), count_pending_notifications())
+    keys = ("total_usuarios", "total_pacientes", "citas_hoy", "notificaciones_pendientes")
+    stats = {key: result.get("count", 0) or 0 for key, result in zip(keys, results)}
+    errors = [result.get("error") for result in results if not result.get("success")]
+    return {"success": not errors, "stats": stats, "error": "; ".join(str(e) for e in errors) or None}
+
+async def get_dashboard_stats(use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Devuelve los contadores del dashboard (usuarios, pacientes, citas de hoy y
+    notificaciones pendientes) con una sola llamada a la función SQL
+    `get_dashboard_stats` (database/sql/dashboard_stats.sql).
+
+    El resultado se cachea durante DASHBOARD_STATS_CACHE_TTL segundos y las
+    peticiones concurrentes comparten la misma consulta.
+
+    Returns:
+        {"success", "stats": {...}, "cached": bool, "error"}
+    """
+    global _dashboard_stats_lock
+    if use_cache and _dashboard_stats_cache["value"] is not None and _dashboard_stats_cache["expires_at"] > time.monotonic():
+        return {**_dashboard_stats_cache["value"], "cached": True}
+
+    if _dashboard_stats_lock is None:
+        _dashboard_stats_lock = asyncio.Lock()
+    async with _dashboard_stats_lock:
+        # Otra petición pudo refrescar la caché mientras esperábamos el lock
+        if use_cache and _dashboard_stats_cache["value"] is not None and _dashboard_stats_cache["expires_at"] > time.monotonic():
+            return {**_dashboard_stats_cache["value"], "cached": True}
+        result = await _fetch_dashboard_stats()
+        if result.get("success"):
+            _dashboard_stats_cache["value"] = result
+            _dashboard_stats_cache["expires_at"] = time.monotonic() + settings.DASHBOARD_STATS_CACHE_TTL
+        return {**result, "cached": False}
+
+
+# --- Analítica: eventos y agregados (ver database/sql/analytics_rollups.sql) ---
+async def insert_analytics_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Inserta un lote de eventos analíticos en una sola petición."""
+    operation_name = "insert_analytics_events"
+    table_name = TABLE_ANALYTICS_EVENTS
+    if not events:
+        return {"success": True, "inserted": 0, "error": None}
+    try:
+        await supabase._ensure_initialized()
+        api_response = await run_query(supabase.client.from_(table_name).insert(events, returning="minimal"), operation_name)
+        if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+            return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
+        return {"success": True, "inserted": len(events), "error": None}
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+        return {"success": False, "inserted": 0, "error": f"Error de Supabase API: {e.message}", "details": str(e)}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "inserted": 0, "error": f"Error de Red: {type(e).__name__}", "details": str(e)}
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "inserted": 0, "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
+
+async def run_analytics_rollup(batch_size: int = 5000) -> Dict[str, Any]:
+    """
+    Pliega hasta 'batch_size' eventos nuevos en los agregados horarios y diarios
+    (función SQL `run_analytics_rollup`, incremental a partir de la marca de agua).
+
+    Returns:
+        {"success", "processed", "last_event_id", "error"}
+    """
+    operation_name = "run_analytics_rollup"
+    try:
+        await supabase._ensure_initialized()
+        params = {"p_batch_size": batch_size, "p_timezone": settings.ANALYTICS_TIMEZONE}
+        api_response = await run_query(supabase.admin_client.rpc("run_analytics_rollup", params), operation_name)
+        data = api_response.data or {}
+        if isinstance(data, dict) and 'message' in data and 'code' in data:
+            return await _handle_supabase_response(None, operation_name, TABLE_ANALYTICS_EVENTS, error_obj=data)
+        return {"success": True, "processed": int(data.get("processed") or 0), "last_event_id": data.get("last_event_id"), "error": None}
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name}: {e.message}", exc_info=True)
+        return {"success": False, "processed": 0, "error": f"Error de Supabase API: {e.message}", "details": str(e)}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "processed": 0, "error": f"Error de Red: {type(e).__name__}", "details": str(e)}
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "processed": 0, "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
+
+async def get_analytics_buckets(start_date, end_date, granularity: str = "day", event_types: Optional[List[str]] = None, page_size: int = 1000) -> Dict[str, Any]:
+    """
+    Lee los buckets agregados entre dos fechas (inclusive).
+
+    Args:
+        start_date, end_date: Fechas (date) del rango.
+        granularity: "hour" lee la tabla horaria; cualquier otro valor, la diaria.
+            Las fechas son días locales de ANALYTICS_TIMEZONE, como los buckets diarios
+            y 'hour_of_day'.
+        event_types: Filtra por tipos de evento.
+
+    Returns:
+        {"success", "buckets": [...], "error"}
+    """
+    operation_name = "get_analytics_buckets"
+    hourly = granularity == "hour"
+    table_name = TABLE_ANALYTICS_HOURLY if hourly else TABLE_ANALYTICS_DAILY
+    date_column = "bucket_start" if hourly else "bucket_date"
+    if hourly:
+        local_zone = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+        range_start = datetime.combine(start_date, datetime.min.time(), tzinfo=local_zone).isoformat()
+        range_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time(), tzinfo=local_zone).isoformat()
+    else:
+        range_start, range_end = start_date.isoformat(), (end_date + timedelta(days=1)).isoformat()
+    try:
+        await supabase._ensure_initialized()
+        buckets: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            query = supabase.client.from_(table_name).select("*").gte(date_column, range_start).lt(date_column, range_end)
+            if event_types:
+                query = query.in_("event_type", event_types)
+            api_response = await run_query(query.order(date_column).range(offset, offset + page_size - 1), operation_name)
+            if isinstance(api_response.data, dict) and 'message' in api_response.data and 'code' in api_response.data:
+                return await _handle_supabase_response(None, operation_name, table_name, error_obj=api_response.data)
+            page = api_response.data or []
+            buckets.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+        return {"success": True, "buckets": buckets, "error": None}
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name} ({table_name}): {e.message}", exc_info=True)
+        return {"success": False, "buckets": [], "error": f"Error de Supabase API: {e.message}", "details": str(e)}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name} ({table_name}): {e}", exc_info=True)
+        return {"success": False, "buckets": [], "error": f"Error de Red: {type(e).__name__}", "details": str(e)}
+    except Exception as e:
+        logger.error(f"Excepción en {operation_name} ({table_name}): {e}", exc_info=True)
+        return {"success": False, "buckets": [], "error": f"Error inesperado: {type(e).__name__}", "details": str(e)}
+
+async def count_active_sessions(start_date, end_date) -> Dict[str, Any]:
+    """Cuenta las sesiones distintas con actividad entre dos fechas (inclusive)."""
+    operation_name = "count_active_sessions"
+    try:
+        await supabase._ensure_initialized()
+        params = {"p_start": start_date.isoformat(), "p_end": end_date.isoformat()}
+        api_response = await run_query(supabase.client.rpc("count_active_sessions", params), operation_name)
+        return {"success": True, "count": int(api_response.data or 0), "error": None}
+    except Exception as e:
+        logger.error(f"Error en {operation_name}: {e}", exc_info=True)
+        return {"success": False, "count": 0, "error": str(e)}
+
+def _keyset_filter(key_columns: List[str], last_row: Dict[str, Any], descending: bool = False) -> str:
+    """
+    Construye el filtro PostgREST 'or' equivalente a (k1, k2, ...) > (v1, v2, ...)
+    (o '<' si el orden es descendente).
+    Los valores se entrecomillan para admitir comas, paréntesis y cadenas vacías.
+    Los NULL siguen el orden por defecto de PostgreSQL (al final en ascendente, al
+    principio en descendente): un valor NULL en el cursor se compara con 'is.null'
+    en lugar de convertirse en la cadena "None".
+    """
+    operator = "lt" if descending else "gt"
+    def quoted(value: Any) -> str:
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def equals(column: str) -> str:
+        value = last_row.get(column)
+        return f"{column}.is.null" if value is None else f"{column}.eq.{quoted(value)}"
+
+    def after(column: str) -> Optional[str]:
+        value = last_row.get(column)
+        if value is None:
+            # Tras un NULL solo quedan valores no NULL en descendente y ninguno en ascendente
+            return f"{column}.not.is.null" if descending else None
+        condition = f"{column}.{operator}.{quoted(value)}"
+        return condition if descending else f"or({condition},{column}.is.null)"
+
+    conditions = []
+    for i, column in enumerate(key_columns):
+        greater = after(column)
+        if greater is None:
+            continue
+        prefix = [equals(key_columns[j]) for j in range(i)]
+        conditions.append(f"and({','.join(prefix + [greater])})" if prefix else greater)
+    return ",".join(conditions)
+
+async def iter_table_keyset(
+    table_name: str,
+    key_columns: List[str],
+    range_column: Optional[str] = None,
+    range_start: Optional[str] = None,
+    range_end: Optional[str] = None,
+    event_types: Optional[List[str]] = None,
+    page_size: int = 1000,
+    start_after: Optional[Dict[str, Any]] = None,
+):
+    """
+    Recorre una tabla por páginas con paginación keyset (sin OFFSET) sobre 'key_columns'.
+
+    Cada página continúa a partir de la última fila de la anterior, así que el
+    coste por página es constante aunque la tabla sea grande. Es un generador
+    asíncrono que produce listas de filas; los errores se propagan al consumidor.
+    'start_after' (valores de 'key_columns') permite reanudar un recorrido interrumpido.
+    """
+    operation_name = f"iter_table_keyset:{table_name}"
+    await supabase._ensure_initialized()
+    last_row: Optional[Dict[str, Any]] = start_after
+    while True:
+        query = supabase.client.from_(table_name).select("*")
+        if range_column and range_start:
+            query = query.gte(range_column, range_start)
+        if range_column and range_end:
+            query = query.lt(range_column, range_end)
+        if event_types:
+            query = query.in_("event_type", event_types)
+        if last_row is not None:
+            query = query.or_(_keyset_filter(key_columns, last_row))
+        for column in key_columns:
+            query = query.order(column)
+        api_response = await run_query(query.limit(page_size), operation_name)
+        page = api_response.data or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_row = page[-1]
+
+# --- Listado paginado de sesiones (panel de administración) ---
+SESSION_SORT_FIELDS = ("scheduled_at", "status", "patient_name")
+
+async def list_appointments_page(
+    status: Optional[str] = None,
+    session_type: Optional[str] = None,
+    modality: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_until: Optional[datetime] = None,
+    search: Optional[str] = None,
+    sort_by: str = "scheduled_at",
+    sort_desc: bool = True,
+    cursor: Optional[Dict[str, Any]] = None,
+    limit: int = 15,
+    with_total: bool = False,
+) -> Dict[str, Any]:
+    """
+    Devuelve una página de citas con el nombre del paciente, filtrada y ordenada en la base de datos.
+
+    La paginación es keyset: 'cursor' es {"value": <valor de ordenación>, "id": <id>} de la
+    última fila ya mostrada y la página empieza justo después en el orden pedido. Para
+    retroceder, el llamador invierte 'sort_desc', pasa la primera fila como cursor y da
+    la vuelta al resultado. 'date_from' es inclusivo y 'date_until' exclusivo.
+
+    Returns:
+        {"success", "appointments", "has_more", "total" (None si no se pidió),
+         "sort_by" (columna usada realmente para ordenar y construir cursores), "error"}
+    """
+    operation_name = "list_appointments_page"
+    table_name = TABLE_APPOINTMENTS
+    if sort_by not in SESSION_SORT_FIELDS:
+        sort_by = "scheduled_at"
+    try:
+        await supabase._ensure_initialized()
+        params = {
+            "p_status": status or None,
+            "p_session_type": session_type or None,
+            "p_modality": modality or None,
+            "p_date_from": date_from.isoformat() if date_from else None,
+            "p_date_until": date_until.isoformat() if date_until else None,
+            "p_search": search or None,
+            "p_sort_by": sort_by,
+            "p_sort_desc": sort_desc,
+            # Un valor de ordenación NULL viaja como NULL, no como la cadena "None"
+            "p_cursor_value": str(cursor["value"]) if cursor and cursor.get("value") is not None else None,
+            "p_cursor_id": str(cursor["id"]) if cursor else None,
+            # Una fila de más para saber si existe página siguiente
+            "p_limit": limit + 1,
+            "p_with_total": with_total,
+        }
+        try:
+            api_response = await run_query(supabase.client.rpc("list_sessions_page", params), operation_name)
+            data = api_response.data or {}
+            rows, total, effective_sort = data.get("rows") or [], data.get("total"), sort_by
+        except PostgrestAPIError as e:
+            # PGRST202: la función RPC no existe; se pagina con consultas PostgREST
+            if getattr(e, "code", None) != "PGRST202":
+                raise
+            logger.warning("Función RPC list_sessions_page no disponible, usando consultas PostgREST")
+            rows, total, effective_sort = await _list_appointments_page_rest(params, limit + 1)
+
+        return {"success": True, "appointments": rows[:limit], "has_more": len(rows) > limit, "total": total,
+                "sort_by": effective_sort, "error": None}
+
+    except (PostgrestAPIError, AuthApiError) as e:
+        logger.error(f"Error Supabase API en {operation_name} ({table_name}): {e.message}", exc_info=True)
+        return {"success": False, "appointments": [], "has_more": False, "total": 0, "error": f"Error de Supabase API: {e.message}"}
+    except httpx.RequestError as e:
+        logger.error(f"Error de Red/Conexión en {operation_name} ({table_name}): {e}", exc_info=True)
+        return {"success": False, "appointments": [], "has_more": False, "total": 0, "error": f"Error de Red: {type(e).__name__}"}
+    except Exception as e:
+        logger.exception(f"Excepción general en {operation_name}: {e}")
+        return {"success": False, "appointments": [], "has_more": False, "total": 0, "error": f"Error inesperado: {type(e).__name__}"}
+
+async def _list_appointments_page_rest(params: Dict[str, Any], limit: int):
+    """
+    Versión sin RPC de list_sessions_page. PostgREST no permite ordenar por una
+    columna de otra tabla, así que 'patient_name' se ordena por fecha; la búsqueda
+    por nombre se resuelve primero contra 'pacientes' (limitada a 500 coincidencias).
+    """
+    operation_name = "list_appointments_page"
+    sort_column = params["p_sort_by"] if params["p_sort_by"] != "patient_name" else "scheduled_at"
+    descending = params["p_sort_desc"]
+
+    query = supabase.client.from_(TABLE_APPOINTMENTS).select("*", count="exact" if params["p_with_total"] else None)
+    # Igualdad sin distinguir mayúsculas, como en la función RPC
+    if params["p_status"]:
+        query = query.ilike("status", _ilike_literal(params["p_status"]))
+    if params["p_session_type"]:
+        query = query.ilike("session_type", _ilike_literal(params["p_session_type"]))
+    if params["p_modality"]:
+        query = query.ilike("metadata->>modality", _ilike_literal(params["p_modality"]))
+    if params["p_date_from"]:
+        query = query.gte("scheduled_at", params["p_date_from"])
+    if params["p_date_until"]:
+        query = query.lt("scheduled_at", params["p_date_until"])
+    if params["p_search"]:
+        term = params["p_search"].replace(",", " ").replace("(", " ").replace(")", " ")
+        name_matches = await run_query(
+            supabase.client.from_(TABLE_PACIENTES).select("id").ilike("nombre", f"%{_ilike_literal(term)}%").limit(500),
+            operation_name
+        )
+        conditions = [f"status.ilike.*{_ilike_literal(term)}*", f"session_type.ilike.*{_ilike_literal(term)}*"]
+        patient_ids = [str(p["id"]) for p in (name_matches.data or [])]
+        if patient_ids:
+            conditions.append(f"patient_id.in.({','.join(patient_ids)})")
+        search_filter = ",".join(conditions)
+    else:
+        search_filter = None
+    if params["p_cursor_id"] is not None:
+        last_row = {sort_column: params["p_cursor_value"], "id": params["p_cursor_id"]}
+        keyset_filter = _keyset_filter([sort_column, "id"], last_row, descending=descending)
+        # Un solo parámetro 'or': búsqueda y cursor se combinan anidados
+        query = query.or_(f"and(or({search_filter}),or({keyset_filter}))" if search_filter else keyset_filter)
+    elif search_filter:
+        query = query.or_(search_filter)
+    query = query.order(sort_column, desc=descending).order("id", desc=descending).limit(limit)
+
+    api_response = await run_query(query, operation_name)
+    rows = api_response.data or []
+
+    # Nombres de paciente solo para las filas de la página
+    patient_ids = list({str(row["patient_id"]) for row in rows if row.get("patient_id") is not None})
+    names: Dict[str, str] = {}
+    if patient_ids:
+        patients_response = await run_query(
+            supabase.client.from_(TABLE_PACIENTES).select("id, nombre").in_("id", patient_ids),
+            operation_name
+        )
+        names = {str(p["id"]): p.get("nombre") for p in (patients_response.data or [])}
+    for row in rows:
+        row["patient_name"] = names.get(str(row.get("patient_id"))) or "Paciente Desconocido"
+
+    total = api_response.count if params["p_with_total"] else None
+    return rows, total, sort_column
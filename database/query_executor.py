@@ -0,0 +1,105 @@
+"""
+Ejecución no bloqueante de consultas Supabase/PostgREST.
+
+El cliente supabase-py usado en database/d1_client.py es síncrono: cada
+`.execute()` bloquea el hilo durante todo el round-trip HTTP. Este módulo
+descarga esas llamadas a un pool de hilos compartido y acotado, limita la
+concurrencia con un semáforo y registra la duración de cada operación, de modo
+que una consulta lenta no detiene el event loop ni el resto de webhooks en curso.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from core.config import settings, logger
+
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Métricas por operación: {operation_name: {...}}
+_query_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.SUPABASE_MAX_CONCURRENT_QUERIES,
+            thread_name_prefix="supabase-query",
+        )
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # El semáforo se crea dentro del loop en ejecución (asyncio.Semaphore queda ligado a él)
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(settings.SUPABASE_MAX_CONCURRENT_QUERIES)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+def _record(operation_name: str, wait_s: float, run_s: float, failed: bool) -> None:
+    stats = _query_stats.setdefault(operation_name, {
+        "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "total_wait_ms": 0.0,
+    })
+    run_ms = run_s * 1000
+    stats["calls"] += 1
+    stats["total_ms"] += run_ms
+    stats["total_wait_ms"] += wait_s * 1000
+    stats["max_ms"] = max(stats["max_ms"], run_ms)
+    if failed:
+        stats["errors"] += 1
+    if run_ms >= settings.SUPABASE_SLOW_QUERY_MS:
+        logger.warning(f"Consulta lenta en {operation_name}: {run_ms:.0f} ms (espera en cola {wait_s * 1000:.0f} ms)")
+
+
+async def run_query(query_builder: Any, operation_name: str = "query") -> Any:
+    """
+    Ejecuta `query_builder.execute()` en el pool compartido sin bloquear el event loop.
+
+    Args:
+        query_builder: Query builder de supabase-py/postgrest (tabla, rpc, etc.).
+        operation_name: Nombre de la operación, usado para métricas y logs.
+
+    Returns:
+        La respuesta de `.execute()` (APIResponse). Las excepciones se propagan
+        tal cual para que el manejo de errores existente siga funcionando.
+    """
+    queued_at = time.perf_counter()
+    async with _get_semaphore():
+        started_at = time.perf_counter()
+        failed = True
+        try:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(_get_executor(), query_builder.execute)
+            failed = False
+            return response
+        finally:
+            _record(operation_name, started_at - queued_at, time.perf_counter() - started_at, failed)
+
+
+def get_query_stats() -> Dict[str, Any]:
+    """Devuelve las métricas de duración por operación (llamadas, errores, medias y máximos en ms)."""
+    result = {}
+    for operation_name, stats in _query_stats.items():
+        calls = stats["calls"] or 1
+        result[operation_name] = {
+            "calls": int(stats["calls"]),
+            "errors": int(stats["errors"]),
+            "avg_ms": round(stats["total_ms"] / calls, 2),
+            "max_ms": round(stats["max_ms"], 2),
+            "avg_wait_ms": round(stats["total_wait_ms"] / calls, 2),
+        }
+    return result
+
+
+def shutdown_query_executor() -> None:
+    """Libera los hilos del pool de consultas (llamar en el shutdown de la aplicación)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,286 @@
+"""
+Caché en proceso (LRU + TTL) para el estado de conversación de las sesiones.
+
+Se sitúa delante de `get_session_data`/`save_session_data` de database/d1_client.py:
+las lecturas repetidas de la misma sesión se sirven desde memoria y las escrituras
+se marcan como pendientes ("dirty") y se agrupan, de modo que una ráfaga de
+mensajes del mismo paciente cuesta una lectura y como mucho un upsert por
+intervalo de volcado. Las entradas pendientes se persisten antes de ser
+desalojadas (por LRU, tamaño o TTL) y al cerrar la aplicación.
+
+Las escrituras de una misma sesión se encadenan en orden de llegada y una carga
+desde la BD espera a las escrituras en curso de esa sesión, para no leer la fila
+anterior a un desalojo que todavía se está persistiendo.
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("mark-assistant.session_cache")
+
+SessionLoader = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+SessionWriter = Callable[[str, Dict[str, Any]], Awaitable[bool]]
+
+
+def _estimate_size(data: Optional[Dict[str, Any]]) -> int:
+    """Tamaño aproximado en bytes de los datos de sesión (serialización JSON)."""
+    if data is None:
+        return 0
+    try:
+        return len(json.dumps(data, default=str, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Entry:
+    __slots__ = ("data", "size", "expires_at", "dirty", "version")
+
+    def __init__(self, data: Optional[Dict[str, Any]], size: int, expires_at: float) -> None:
+        self.data = data
+        self.size = size
+        self.expires_at = expires_at
+        self.dirty = False
+        self.version = 0
+
+
+class SessionCache:
+    """
+    Caché LRU+TTL con write-back agrupado para datos de sesión.
+
+    Args:
+        loader: Corrutina que lee la sesión de la base de datos.
+        writer: Corrutina que persiste la sesión (upsert). Devuelve True si tuvo éxito.
+        max_entries: Número máximo de sesiones en memoria.
+        max_bytes: Tamaño máximo aproximado (JSON) del total de sesiones en memoria.
+        ttl_seconds: Tiempo de vida de una entrada desde su última escritura o carga.
+        flush_interval: Segundos entre volcados de las entradas pendientes.
+    """
+
+    def __init__(
+        self,
+        loader: SessionLoader,
+        writer: SessionWriter,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: float = 900.0,
+        flush_interval: float = 2.0,
+    ) -> None:
+        self._loader = loader
+        self._writer = writer
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._loading: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        # Última escritura encadenada de cada sesión (espera a las anteriores)
+        self._writes: Dict[str, asyncio.Task] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "writes": 0,
+            "writes_coalesced": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+        }
+
+    # --- Lectura / escritura ---
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia de los datos de la sesión, cargándolos de la BD en caso de fallo."""
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(session_id)
+                self.stats["hits"] += 1
+                return copy.deepcopy(entry.data)
+            self.stats["expirations"] += 1
+            self._remove(session_id, evicted=True)
+
+        # Agrupar lecturas concurrentes de la misma sesión en una sola consulta
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            self.stats["hits"] += 1
+            return copy.deepcopy(await asyncio.shield(pending))
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            while True:
+                # No leer de la BD mientras se persiste una versión más reciente
+                write = self._writes.get(session_id)
+                if write is not None:
+                    await asyncio.wait([write])
+                data = await self._loader(session_id)
+                # Si empezó otra escritura durante la carga, lo leído puede estar obsoleto
+                if session_id not in self._writes:
+                    break
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar el aviso de "exception never retrieved" si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(session_id, None)
+
+        # Una escritura concurrente durante la carga tiene prioridad sobre lo leído
+        if session_id not in self._entries and data is not None:
+            self._insert(session_id, data, dirty=False)
+        if not future.done():
+            future.set_result(data)
+        current = self._entries.get(session_id)
+        return copy.deepcopy(current.data if current is not None else data)
+
+    def put(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Guarda los datos en memoria y los marca como pendientes de persistir."""
+        self.stats["writes"] += 1
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.dirty:
+            # Ya había una escritura pendiente: se sustituye sin nuevo upsert
+            self.stats["writes_coalesced"] += 1
+        self._insert(session_id, copy.deepcopy(data), dirty=True)
+
+    def invalidate(self, session_id: str) -> None:
+        """Descarta la sesión de la caché sin persistirla."""
+        self._remove(session_id, evicted=False)
+
+    # --- Gestión interna ---
+
+    def _insert(self, session_id: str, data: Optional[Dict[str, Any]], dirty: bool) -> None:
+        old = self._entries.pop(session_id, None)
+        version = 0
+        if old is not None:
+            self._total_bytes -= old.size
+            version = old.version
+        entry = _Entry(data, _estimate_size(data), time.monotonic() + self.ttl_seconds)
+        entry.dirty = dirty
+        entry.version = version + 1 if dirty else version
+        self._entries[session_id] = entry
+        self._total_bytes += entry.size
+        self._enforce_limits()
+
+    def _remove(self, session_id: str, evicted: bool) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry.size
+        if evicted and entry.dirty:
+            # Persistir antes de perder la última versión de la sesión
+            self._schedule_write(session_id, entry.data)
+
+    def _enforce_limits(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            # No desalojar la única entrada (la recién insertada) aunque supere max_bytes
+            if len(self._entries) == 1:
+                break
+            oldest_id = next(iter(self._entries))
+            self.stats["evictions"] += 1
+            self._remove(oldest_id, evicted=True)
+
+    def _schedule_write(self, session_id: str, data: Optional[Dict[str, Any]]) -> None:
+        if data is None:
+            return
+        try:
+            self._chain_write(session_id, data)
+        except RuntimeError:
+            logger.error(f"No hay event loop activo para persistir la sesión desalojada {session_id}")
+
+    def _chain_write(self, session_id: str, data: Dict[str, Any]) -> "asyncio.Task[bool]":
+        """Lanza la escritura detrás de la anterior de la misma sesión, para que no se reordenen."""
+        previous = self._writes.get(session_id)
+        task = asyncio.get_running_loop().create_task(self._write_after(previous, session_id, data))
+        self._writes[session_id] = task
+
+        def _done(done: "asyncio.Task[bool]") -> None:
+            if self._writes.get(session_id) is done:
+                del self._writes[session_id]
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _write_after(self, previous: Optional[asyncio.Task], session_id: str, data: Dict[str, Any]) -> bool:
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await self._write(session_id, data)
+
+    async def _write(self, session_id: str, data: Dict[str, Any]) -> bool:
+        try:
+            ok = await self._writer(session_id, data)
+        except Exception as e:
+            logger.error(f"Error al persistir la sesión {session_id} desde la caché: {e}", exc_info=True)
+            ok = False
+        self.stats["flushes"] += 1
+        if not ok:
+            self.stats["flush_errors"] += 1
+        return ok
+
+    async def flush(self) -> int:
+        """
+        Persiste todas las entradas pendientes.
+
+        Returns:
+            Número de sesiones persistidas con éxito.
+        """
+        dirty = [(sid, entry.version, entry.data) for sid, entry in self._entries.items() if entry.dirty]
+        persisted = 0
+        for session_id, version, data in dirty:
+            ok = await self._chain_write(session_id, data)
+            entry = self._entries.get(session_id)
+            # Solo limpiar la marca si no hubo una escritura más reciente durante el upsert
+            if ok and entry is not None and entry.version == version:
+                entry.dirty = False
+            if ok:
+                persisted += 1
+        if self._writes:
+            await asyncio.gather(*list(self._writes.values()), return_exceptions=True)
+        return persisted
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error en el volcado periódico de la caché de sesiones: {e}", exc_info=True)
+
+    async def start(self) -> None:
+        """Inicia la tarea periódica de volcado."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Detiene el volcado periódico y persiste lo pendiente."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores de la caché y su ocupación actual."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "dirty": sum(1 for entry in self._entries.values() if entry.dirty),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
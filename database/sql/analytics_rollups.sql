@@ -0,0 +1,173 @@
+-- Eventos analíticos y tablas de agregados para admin/dashboard_analytics.py
+--
+-- Los eventos (mensajes, citas, alertas de crisis...) se insertan en bloque en
+-- 'analytics_events'. La función run_analytics_rollup los pliega de forma
+-- incremental en buckets horarios y diarios a partir de una marca de agua, de
+-- modo que los gráficos leen O(buckets) filas.
+--
+-- La marca de agua es (txid, id) y solo se agregan eventos de transacciones ya
+-- terminadas: los ids BIGSERIAL se asignan al insertar, no al confirmar, así que
+-- una inserción lenta puede confirmar un id menor que otro ya agregado y una
+-- marca de agua por id se lo saltaría. Requiere PostgreSQL 13+ (xid8).
+
+CREATE TABLE IF NOT EXISTS public.analytics_events (
+    id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    occurred_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    language TEXT,
+    playbook TEXT,
+    category TEXT,
+    session_id TEXT,
+    value DOUBLE PRECISION,
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id()  -- Transacción que insertó el evento
+);
+
+-- Instalaciones anteriores a la marca de agua por transacción
+ALTER TABLE public.analytics_events ADD COLUMN IF NOT EXISTS txid XID8 NOT NULL DEFAULT pg_current_xact_id();
+CREATE INDEX IF NOT EXISTS analytics_events_txid_id_idx ON public.analytics_events (txid, id);
+
+-- Dimensiones: tipo de evento, idioma, playbook y categoría (severidad, estado de cita, sentimiento...)
+CREATE TABLE IF NOT EXISTS public.analytics_rollup_hourly (
+    bucket_start TIMESTAMPTZ NOT NULL,
+    hour_of_day SMALLINT NOT NULL,
+    event_type TEXT NOT NULL,
+    language TEXT NOT NULL DEFAULT '',
+    playbook TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    event_count BIGINT NOT NULL DEFAULT 0,
+    value_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    value_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, event_type, language, playbook, category)
+);
+
+CREATE TABLE IF NOT EXISTS public.analytics_rollup_daily (
+    bucket_date DATE NOT NULL,
+    event_type TEXT NOT NULL,
+    language TEXT NOT NULL DEFAULT '',
+    playbook TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    event_count BIGINT NOT NULL DEFAULT 0,
+    value_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    value_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_date, event_type, language, playbook, category)
+);
+
+-- Sesiones activas por día (los usuarios distintos no se pueden sumar entre buckets)
+CREATE TABLE IF NOT EXISTS public.analytics_daily_sessions (
+    bucket_date DATE NOT NULL,
+    session_id TEXT NOT NULL,
+    PRIMARY KEY (bucket_date, session_id)
+);
+
+CREATE TABLE IF NOT EXISTS public.analytics_rollup_watermarks (
+    job_name TEXT PRIMARY KEY,
+    last_txid XID8 NOT NULL DEFAULT '0',
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE public.analytics_rollup_watermarks ADD COLUMN IF NOT EXISTS last_txid XID8 NOT NULL DEFAULT '0';
+-- Los eventos existentes recibieron el txid de la migración: los ya agregados
+-- (id <= last_event_id) quedan detrás de la marca de agua
+UPDATE public.analytics_rollup_watermarks w
+SET last_txid = e.txid
+FROM public.analytics_events e
+WHERE w.last_txid = '0' AND w.last_event_id > 0 AND e.id = w.last_event_id;
+
+-- Pliega hasta p_batch_size eventos nuevos en los agregados y avanza la marca de agua.
+-- El bloqueo de la fila de la marca de agua serializa ejecuciones concurrentes.
+CREATE OR REPLACE FUNCTION public.run_analytics_rollup(
+    p_batch_size INTEGER DEFAULT 5000,
+    p_timezone TEXT DEFAULT 'Europe/Madrid'
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_last_txid XID8;
+    v_last_id BIGINT;
+    v_max_txid XID8;
+    v_max_id BIGINT;
+    v_processed INTEGER;
+BEGIN
+    INSERT INTO public.analytics_rollup_watermarks (job_name, last_event_id)
+    VALUES ('analytics_rollup', 0)
+    ON CONFLICT (job_name) DO NOTHING;
+
+    SELECT last_txid, last_event_id INTO v_last_txid, v_last_id
+    FROM public.analytics_rollup_watermarks
+    WHERE job_name = 'analytics_rollup'
+    FOR UPDATE;
+
+    CREATE TEMP TABLE IF NOT EXISTS _rollup_batch ON COMMIT DROP AS
+    SELECT * FROM public.analytics_events WHERE FALSE;
+    TRUNCATE _rollup_batch;
+
+    -- Las transacciones con txid por debajo del xmin del snapshot ya terminaron:
+    -- ningún evento nuevo puede aparecer por detrás de la marca de agua
+    INSERT INTO _rollup_batch
+    SELECT * FROM public.analytics_events
+    WHERE (txid, id) > (v_last_txid, v_last_id)
+      AND txid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY txid, id
+    LIMIT p_batch_size;
+
+    SELECT count(*) INTO v_processed FROM _rollup_batch;
+    IF v_processed = 0 THEN
+        RETURN jsonb_build_object('processed', 0, 'last_event_id', v_last_id);
+    END IF;
+
+    INSERT INTO public.analytics_rollup_hourly AS r
+        (bucket_start, hour_of_day, event_type, language, playbook, category, event_count, value_sum, value_count)
+    SELECT date_trunc('hour', occurred_at),
+           extract(hour FROM occurred_at AT TIME ZONE p_timezone)::SMALLINT,
+           event_type, COALESCE(language, ''), COALESCE(playbook, ''), COALESCE(category, ''),
+           count(*), COALESCE(sum(value), 0), count(value)
+    FROM _rollup_batch
+    GROUP BY 1, 2, 3, 4, 5, 6
+    ON CONFLICT (bucket_start, event_type, language, playbook, category) DO UPDATE
+    SET event_count = r.event_count + EXCLUDED.event_count,
+        value_sum = r.value_sum + EXCLUDED.value_sum,
+        value_count = r.value_count + EXCLUDED.value_count;
+
+    INSERT INTO public.analytics_rollup_daily AS r
+        (bucket_date, event_type, language, playbook, category, event_count, value_sum, value_count)
+    SELECT (occurred_at AT TIME ZONE p_timezone)::DATE,
+           event_type, COALESCE(language, ''), COALESCE(playbook, ''), COALESCE(category, ''),
+           count(*), COALESCE(sum(value), 0), count(value)
+    FROM _rollup_batch
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (bucket_date, event_type, language, playbook, category) DO UPDATE
+    SET event_count = r.event_count + EXCLUDED.event_count,
+        value_sum = r.value_sum + EXCLUDED.value_sum,
+        value_count = r.value_count + EXCLUDED.value_count;
+
+    INSERT INTO public.analytics_daily_sessions (bucket_date, session_id)
+    SELECT DISTINCT (occurred_at AT TIME ZONE p_timezone)::DATE, session_id
+    FROM _rollup_batch
+    WHERE session_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    SELECT txid, id INTO v_max_txid, v_max_id
+    FROM _rollup_batch
+    ORDER BY txid DESC, id DESC
+    LIMIT 1;
+
+    UPDATE public.analytics_rollup_watermarks
+    SET last_txid = v_max_txid, last_event_id = v_max_id, updated_at = NOW()
+    WHERE job_name = 'analytics_rollup';
+
+    RETURN jsonb_build_object('processed', v_processed, 'last_event_id', v_max_id);
+END;
+$$;
+
+-- Número de sesiones distintas con actividad entre dos fechas (inclusive)
+CREATE OR REPLACE FUNCTION public.count_active_sessions(p_start DATE, p_end DATE)
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT count(DISTINCT session_id)
+    FROM public.analytics_daily_sessions
+    WHERE bucket_date BETWEEN p_start AND p_end;
+$$;
@@ -0,0 +1,34 @@
+-- Operaciones en bloque usadas por database/d1_client.py
+
+-- Actualiza el estado (y opcionalmente los metadatos) de varias notificaciones.
+-- p_updates: [{"id": ..., "status": ..., "metadata": {...} | null}, ...]
+-- Devuelve una fila por elemento de entrada indicando si se actualizó.
+CREATE OR REPLACE FUNCTION public.update_notifications_status_many(p_updates JSONB)
+RETURNS TABLE(id TEXT, updated BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT u->>'id' AS id,
+               u->>'status' AS status,
+               NULLIF(u->'metadata', 'null'::jsonb) AS metadata,
+               ord
+        FROM jsonb_array_elements(p_updates) WITH ORDINALITY AS t(u, ord)
+    ),
+    changed AS (
+        UPDATE public.notifications n
+        SET status = input.status,
+            metadata = COALESCE(input.metadata, n.metadata),
+            lease_expires_at = NULL,
+            updated_at = NOW()
+        FROM input
+        WHERE n.id::text = input.id
+        RETURNING n.id::text AS id
+    )
+    SELECT input.id, EXISTS (SELECT 1 FROM changed c WHERE c.id = input.id)
+    FROM input
+    ORDER BY input.ord;
+$$;
+
+-- upsert_appointments_many usa ON CONFLICT (calendly_event_uri)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_citas_calendly_event_uri
+    ON public.citas(calendly_event_uri);
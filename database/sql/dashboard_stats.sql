@@ -0,0 +1,42 @@
+-- Contadores del dashboard del panel de administración en una sola llamada
+-- (usada por get_dashboard_stats en database/d1_client.py)
+CREATE OR REPLACE FUNCTION public.get_dashboard_stats(
+    p_day_start TIMESTAMPTZ,
+    p_day_end TIMESTAMPTZ
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_date_field TEXT;
+    v_citas_hoy BIGINT := 0;
+BEGIN
+    -- La columna de fecha de 'citas' ha cambiado de nombre entre versiones del esquema
+    SELECT c.column_name INTO v_date_field
+    FROM information_schema.columns c
+    WHERE c.table_schema = 'public'
+      AND c.table_name = 'citas'
+      AND c.column_name IN ('fecha_hora', 'fecha', 'scheduled_at', 'created_at')
+    ORDER BY array_position(ARRAY['fecha_hora', 'fecha', 'scheduled_at', 'created_at']::TEXT[], c.column_name::TEXT)
+    LIMIT 1;
+
+    IF v_date_field IS NOT NULL THEN
+        EXECUTE format('SELECT count(*) FROM public.citas WHERE %I >= $1 AND %I < $2', v_date_field, v_date_field)
+        INTO v_citas_hoy
+        USING p_day_start, p_day_end;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'total_usuarios', (SELECT count(*) FROM public.usuarios),
+        'total_pacientes', (SELECT count(*) FROM public.pacientes),
+        'citas_hoy', v_citas_hoy,
+        'notificaciones_pendientes', (SELECT count(*) FROM public.notifications WHERE status = 'pendiente')
+    );
+END;
+$$;
+
+-- Índice para el conteo de notificaciones pendientes
+CREATE INDEX IF NOT EXISTS idx_notifications_status ON public.notifications(status);
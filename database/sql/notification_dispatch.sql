@@ -0,0 +1,37 @@
+-- Soporte para el despachador de notificaciones (services/notification_dispatcher.py)
+
+-- Fecha de caducidad del lease de una notificación en estado 'procesando'
+ALTER TABLE public.notifications ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+
+-- Índice parcial para localizar rápidamente las notificaciones reclamables
+CREATE INDEX IF NOT EXISTS idx_notifications_claimable
+    ON public.notifications(created_at)
+    WHERE status IN ('pendiente', 'procesando');
+
+-- Reclama un lote de notificaciones pendientes (o con lease caducado) y las marca
+-- como 'procesando'. FOR UPDATE SKIP LOCKED evita que dos instancias reclamen la
+-- misma fila.
+CREATE OR REPLACE FUNCTION public.claim_pending_notifications(
+    p_limit INTEGER DEFAULT 100,
+    p_lease_seconds INTEGER DEFAULT 300,
+    p_channels TEXT[] DEFAULT NULL
+)
+RETURNS SETOF public.notifications
+LANGUAGE sql
+AS $$
+    UPDATE public.notifications n
+    SET status = 'procesando',
+        lease_expires_at = NOW() + make_interval(secs => p_lease_seconds),
+        updated_at = NOW()
+    WHERE n.id IN (
+        SELECT id
+        FROM public.notifications
+        WHERE (status = 'pendiente' OR (status = 'procesando' AND lease_expires_at < NOW()))
+          AND (scheduled_at IS NULL OR scheduled_at <= NOW())
+          AND (p_channels IS NULL OR channel = ANY(p_channels))
+        ORDER BY created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING n.*;
+$$;
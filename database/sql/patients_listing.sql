@@ -0,0 +1,9 @@
+-- Índices para el listado paginado de pacientes del panel de administración
+-- (list_patients_page en database/d1_client.py: keyset sobre (columna de orden, id)
+-- y búsqueda por nombre con ILIKE '%texto%')
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_pacientes_nombre_id ON public.pacientes(nombre, id);
+CREATE INDEX IF NOT EXISTS idx_pacientes_created_at_id ON public.pacientes(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_pacientes_nombre_trgm ON public.pacientes USING gin (nombre gin_trgm_ops);
@@ -0,0 +1,101 @@
+-- Listado paginado de sesiones (citas) para el panel de administración
+-- (usada por list_appointments_page en database/d1_client.py)
+--
+-- Filtra, busca, ordena y pagina en la base de datos con paginación keyset:
+-- cada página continúa a partir de (valor de ordenación, id) de la última fila
+-- de la anterior, así que leer la página N cuesta lo mismo que leer la primera.
+
+-- Los índices siguen las mismas expresiones (COALESCE, lower) que usa la función
+DROP INDEX IF EXISTS public.idx_citas_scheduled_at_id;
+DROP INDEX IF EXISTS public.idx_citas_status_scheduled_at;
+CREATE INDEX IF NOT EXISTS idx_citas_scheduled_at_sort_id
+    ON public.citas((COALESCE(scheduled_at, '-infinity'::timestamptz)), id);
+CREATE INDEX IF NOT EXISTS idx_citas_lower_status_scheduled_at ON public.citas(lower(status), scheduled_at, id);
+CREATE INDEX IF NOT EXISTS idx_citas_patient_id ON public.citas(patient_id);
+
+-- p_sort_by: 'scheduled_at' | 'status' | 'patient_name'
+-- Cada criterio ordena por una expresión sin NULL (COALESCE) y el cursor se pasa por la
+-- misma expresión, así que un cursor con valor NULL (p_cursor_value) continúa donde toca.
+-- El cursor está presente cuando llega p_cursor_id. patient_name ordena por el mismo
+-- valor que se devuelve en la fila ('Paciente Desconocido' si no hay nombre).
+-- Los filtros de estado, tipo y modalidad no distinguen mayúsculas.
+-- p_date_from incluido, p_date_until excluido
+-- Devuelve {"rows": [...], "total": n | null}; se piden p_limit filas (el llamador pide una de más
+-- para saber si hay página siguiente) y el total solo se calcula con p_with_total.
+CREATE OR REPLACE FUNCTION public.list_sessions_page(
+    p_status TEXT DEFAULT NULL,
+    p_session_type TEXT DEFAULT NULL,
+    p_modality TEXT DEFAULT NULL,
+    p_date_from TIMESTAMPTZ DEFAULT NULL,
+    p_date_until TIMESTAMPTZ DEFAULT NULL,
+    p_search TEXT DEFAULT NULL,
+    p_sort_by TEXT DEFAULT 'scheduled_at',
+    p_sort_desc BOOLEAN DEFAULT TRUE,
+    p_cursor_value TEXT DEFAULT NULL,
+    p_cursor_id TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 15,
+    p_with_total BOOLEAN DEFAULT FALSE
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_sort_column TEXT;
+    v_sort_default TEXT;
+    v_sort_type TEXT;
+    v_id_type TEXT;
+    v_where TEXT;
+    v_rows JSONB;
+    v_total BIGINT;
+BEGIN
+    CASE p_sort_by
+        WHEN 'status' THEN
+            v_sort_column := 'c.status'; v_sort_default := ''''''; v_sort_type := 'text';
+        WHEN 'patient_name' THEN
+            v_sort_column := 'p.nombre'; v_sort_default := '''Paciente Desconocido'''; v_sort_type := 'text';
+        ELSE
+            v_sort_column := 'c.scheduled_at'; v_sort_default := '''-infinity''::timestamptz'; v_sort_type := 'timestamptz';
+    END CASE;
+
+    SELECT format_type(a.atttypid, a.atttypmod) INTO v_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.citas'::regclass AND a.attname = 'id';
+
+    v_where := '($1 IS NULL OR lower(c.status) = lower($1))'
+        || ' AND ($2 IS NULL OR lower(c.session_type) = lower($2))'
+        || ' AND ($3 IS NULL OR lower(c.metadata::jsonb ->> ''modality'') = lower($3))'
+        || ' AND ($4 IS NULL OR c.scheduled_at >= $4)'
+        || ' AND ($5 IS NULL OR c.scheduled_at < $5)'
+        || ' AND ($6 IS NULL OR p.nombre ILIKE ''%'' || $6 || ''%'' OR c.session_type ILIKE ''%'' || $6 || ''%'' OR c.status ILIKE ''%'' || $6 || ''%'')';
+
+    IF p_with_total THEN
+        EXECUTE 'SELECT count(*) FROM public.citas c LEFT JOIN public.pacientes p ON p.id = c.patient_id WHERE ' || v_where
+        INTO v_total
+        USING p_status, p_session_type, p_modality, p_date_from, p_date_until, p_search;
+    END IF;
+
+    EXECUTE format(
+        'SELECT COALESCE(jsonb_agg(t.row), ''[]''::jsonb) FROM ('
+        || ' SELECT to_jsonb(c) || jsonb_build_object(''patient_name'', COALESCE(p.nombre, ''Paciente Desconocido'')) AS row'
+        || ' FROM public.citas c LEFT JOIN public.pacientes p ON p.id = c.patient_id'
+        || ' WHERE ' || v_where
+        || '   AND ($8 IS NULL OR (COALESCE(%1$s, %6$s), c.id) %3$s (COALESCE(CAST($7 AS %4$s), %6$s), CAST($8 AS %5$s)))'
+        || ' ORDER BY COALESCE(%1$s, %6$s) %2$s, c.id %2$s'
+        || ' LIMIT $9) t',
+        v_sort_column,
+        CASE WHEN p_sort_desc THEN 'DESC' ELSE 'ASC' END,
+        CASE WHEN p_sort_desc THEN '<' ELSE '>' END,
+        v_sort_type,
+        v_id_type,
+        v_sort_default
+    )
+    INTO v_rows
+    USING p_status, p_session_type, p_modality, p_date_from, p_date_until, p_search,
+          p_cursor_value, p_cursor_id, p_limit;
+
+    RETURN jsonb_build_object('rows', v_rows, 'total', v_total);
+END;
+$$;
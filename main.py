@@ -9,11 +9,9 @@ from dotenv import load_dotenv
 load_dotenv() # Carga las variables desde .env al entorno del proceso
 # ---------------------------------------------- #
 
-import json
 from datetime import datetime
 # import os # No usado
 # import logging # No usado
-import asyncio
 # import threading # ELIMINADO
 from typing import Optional # Importación añadida
 # from typing import Dict, List, Any, Optional # No usados directamente
@@ -28,10 +26,17 @@ from fastapi.responses import HTMLResponse, PlainTextResponse # Añadido PlainTe
 # from fastapi.responses import JSONResponse # No usado
 
 from core.config import settings, logger, verify_config
+from core.http_client import http_clients
+from ai.llm_client import llm_clients
+from database.query_executor import shutdown_query_executor
+from ai.language_utils import shutdown_language_executor
+from ai.language_detection_ml import get_language_detector_ml, shutdown_language_detector_ml
+from ai.language_ngram_model import get_ngram_language_model
 logger.info(f"[DEBUG] WHATSAPP_ACCESS_TOKEN: {settings.WHATSAPP_ACCESS_TOKEN}")
 logger.info(f"[DEBUG] WHATSAPP_PHONE_NUMBER_ID: {settings.WHATSAPP_PHONE_NUMBER_ID}")
-from database.d1_client import get_pending_notifications, update_notification_status
-from services.whatsapp import send_whatsapp_message
+from database.d1_client import session_cache
+from services.notification_dispatcher import create_notification_dispatcher
+from database.analytics_rollup import create_analytics_rollup_job
 from backend.api_server import apirouter
 # from admin.admin_panel import run_admin_panel # ELIMINADO
 
@@ -42,6 +47,12 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Despachador de notificaciones (arrancado en el evento de startup)
+notification_dispatcher = create_notification_dispatcher()
+
+# Job incremental de agregados para el dashboard analítico
+analytics_rollup_job = create_analytics_rollup_job()
+
 # Montar el router de la API
 app.include_router(apirouter, prefix="/api")
 
@@ -79,87 +90,6 @@ static_dir = Path("static")
 if static_dir.exists() and static_dir.is_dir():
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Tarea en segundo plano para procesar notificaciones pendientes
-async def process_pending_notifications() -> None:
-    """
-    Procesa las notificaciones pendientes y envía mensajes de WhatsApp
-    """
-    try:
-        # Obtener notificaciones pendientes
-        result = await get_pending_notifications(limit=10)
-        
-        if not result.get("success", False):
-            logger.error(f"Error al obtener notificaciones pendientes: {result.get('error')}")
-            return
-        
-        notifications = result.get("results", [])
-        
-        if not notifications:
-            return
-        
-        logger.info(f"Procesando {len(notifications)} notificaciones pendientes")
-        
-        # Procesar cada notificación
-        for notification in notifications:
-            notification_id = notification.get("id")
-            # patient_id = notification.get("patient_id") # ELIMINADO (no usado)
-            message = notification.get("message")
-            channel = notification.get("channel")
-            
-            # Solo procesar notificaciones de WhatsApp por ahora
-            if channel != "whatsapp":
-                continue
-            
-            # Obtener el número de teléfono del paciente
-            # Aquí se debería implementar la lógica para obtener el número del paciente
-            # Por ahora, asumimos que está en los metadatos
-            try:
-                metadata = json.loads(notification.get("metadata", "{}"))
-                phone = metadata.get("phone")
-                
-                if not phone:
-                    logger.error(f"No se encontró número de teléfono para la notificación {notification_id}")
-                    await update_notification_status(
-                        notification_id, 
-                        "failed", 
-                        {"error": "No se encontró número de teléfono"}
-                    )
-                    continue
-                
-                # Enviar mensaje de WhatsApp
-                result = send_whatsapp_message(phone, message)
-                
-                if result.get("success", False):
-                    # Actualizar estado de la notificación a enviado
-                    await update_notification_status(
-                        notification_id, 
-                        "sent", 
-                        {
-                            "message_sid": result.get("message_sid"),
-                            "sent_at": datetime.utcnow().isoformat()
-                        }
-                    )
-                    logger.info(f"Notificación {notification_id} enviada a {phone}")
-                else:
-                    # Actualizar estado de la notificación a fallido
-                    await update_notification_status(
-                        notification_id, 
-                        "failed", 
-                        {"error": result.get("error")}
-                    )
-                    logger.error(f"Error al enviar notificación {notification_id}: {result.get('error')}")
-            
-            except Exception as e:
-                logger.error(f"Error al procesar notificación {notification_id}: {e}")
-                await update_notification_status(
-                    notification_id, 
-                    "failed", 
-                    {"error": str(e)}
-                )
-    
-    except Exception as e:
-        logger.error(f"Error al procesar notificaciones pendientes: {e}")
-
 # Eventos de inicio y cierre de la aplicación
 @app.on_event("startup")
 async def startup_event() -> None:
@@ -177,8 +107,24 @@ async def startup_event() -> None:
         for warning in config_status["warnings"]:
             logger.warning(f"Advertencia de configuración: {warning}")
     
-    # Iniciar tarea periódica para procesar notificaciones
-    asyncio.create_task(periodic_notification_processor())
+    # Crear los clientes HTTP compartidos antes de atender peticiones
+    await http_clients.startup()
+    if settings.LLM_WARMUP:
+        llm_clients.warm_up()
+    
+    # Cargar el clasificador de idioma por n-gramas antes del primer mensaje
+    get_ngram_language_model()
+    if settings.LANGUAGE_ML_WARMUP:
+        await get_language_detector_ml().warm_up_async()
+    
+    # Iniciar el volcado periódico de la caché de sesiones
+    await session_cache.start()
+    
+    # Iniciar el despachador de notificaciones pendientes
+    await notification_dispatcher.start()
+    
+    # Iniciar la agregación periódica de eventos analíticos
+    await analytics_rollup_job.start()
     
     # # Iniciar panel de administración en un hilo separado <--- COMENTADO/ELIMINADO
     # admin_thread = threading.Thread(target=start_admin_panel)
@@ -192,22 +138,16 @@ async def shutdown_event() -> None:
     """
     Evento de cierre de la aplicación
     """
+    await notification_dispatcher.stop()
+    await analytics_rollup_job.stop()
+    await session_cache.close()
+    llm_clients.clear()
+    await http_clients.aclose()
+    shutdown_query_executor()
+    shutdown_language_executor()
+    shutdown_language_detector_ml()
     logger.info("Asistente Mark detenido")
 
-# Tarea periódica para procesar notificaciones
-async def periodic_notification_processor() -> None:
-    """
-    Ejecuta el procesador de notificaciones periódicamente
-    """
-    while True:
-        try:
-            await process_pending_notifications()
-        except Exception as e:
-            logger.error(f"Error en el procesador periódico de notificaciones: {e}")
-        
-        # Esperar 1 minuto antes de la próxima ejecución
-        await asyncio.sleep(60)
-
 # Endpoint de salud
 @app.get("/health")
 async def health_check() -> dict:
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del escaneo de mensajes del detector de amenazas.
+
+Compara el coste por mensaje del escaneo en una sola pasada (regex de frases
+factorizada en trie + una regex temporal, todos los idiomas) con el método
+anterior (comprobación 'in' frase a frase y una regex por patrón, solo el
+idioma del mensaje), mensaje a mensaje y en total.
+
+Uso:
+    python scripts/benchmark_threat_detection.py [--iterations 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+# Añadir el directorio raíz al path para poder importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.security.threat_detection import ThreatDetector
+
+SAMPLE_MESSAGES = [
+    ("es", "Hola, quería saber si mañana hay hueco para una sesión por la tarde."),
+    ("es", "Ya no puedo más, he preparado todo y esta noche lo voy a hacer."),
+    ("ca", "Bon dia! Voldria canviar la cita de dijous, si us plau."),
+    ("ca", "No vull viure més, ja ho tinc tot planejat per aquesta nit."),
+    ("en", "Hi, can I get the invoice for last month's sessions?"),
+    ("en", "Honestly I can't take it anymore, everything is ready, tonight I end it all."),
+    ("ar", "مرحبا، أريد حجز موعد الأسبوع القادم من فضلك"),
+    ("es", "Estoy fatal, I want to kill myself, no veo otra salida. " * 4),
+]
+
+
+def legacy_scan(detector: ThreatDetector, text: str, language: str):
+    """Reproducción del escaneo anterior, para comparar."""
+    lowered = text.lower()
+    lang = language if language in detector.high_risk_keywords else "es"
+    keywords = [k for k in detector.high_risk_keywords[lang] if k.rstrip("*") in lowered]
+    indicators = [i for i in detector.contextual_indicators[lang] if i in lowered]
+    temporal = any(re.search(p, lowered) for p in detector.temporal_indicators[lang])
+    return keywords, indicators, temporal
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark del detector de amenazas")
+    parser.add_argument("--iterations", type=int, default=2000, help="Repeticiones del conjunto de mensajes")
+    args = parser.parse_args()
+
+    build_seconds = timeit.timeit(ThreatDetector, number=1)
+    detector = ThreatDetector()
+    total_messages = args.iterations * len(SAMPLE_MESSAGES)
+
+    def run_new():
+        for _, text in SAMPLE_MESSAGES:
+            detector.scan_message(text)
+
+    def run_legacy():
+        for language, text in SAMPLE_MESSAGES:
+            legacy_scan(detector, text, language)
+
+    new_seconds = min(timeit.repeat(run_new, number=args.iterations, repeat=3))
+    legacy_seconds = min(timeit.repeat(run_legacy, number=args.iterations, repeat=3))
+
+    print(f"Construcción del detector (patrones compilados): {build_seconds * 1000:.2f} ms")
+    print(f"{'nuevo µs':>9} {'anterior µs':>12} {'coincid.':>9}  mensaje")
+    for language, text in SAMPLE_MESSAGES:
+        new_us = min(timeit.repeat(lambda: detector.scan_message(text), number=args.iterations, repeat=3)) / args.iterations * 1e6
+        legacy_us = min(timeit.repeat(lambda: legacy_scan(detector, text, language), number=args.iterations, repeat=3)) / args.iterations * 1e6
+        print(f"{new_us:9.2f} {legacy_us:12.2f} {len(detector.scan_message(text)['matches']):9d}  [{language}] {text[:50]}")
+    print(f"Mensajes por medición: {total_messages}")
+    print(f"Una pasada, todos los idiomas: {new_seconds / total_messages * 1e6:8.2f} µs/mensaje")
+    print(f"Anterior, un solo idioma:      {legacy_seconds / total_messages * 1e6:8.2f} µs/mensaje")
+
+
+if __name__ == "__main__":
+    main()
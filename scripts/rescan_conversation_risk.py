@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Reevalúa el riesgo de las conversaciones guardadas con el detector de amenazas actual.
+
+Útil tras cambiar las palabras clave o indicadores: escanea el histórico en
+paralelo, pasa a Claude solo los mensajes marcados y deja un informe JSON Lines
+más un resumen. Si se interrumpe, volver a lanzarlo con el mismo --output
+continúa desde el último checkpoint (usar --fresh para empezar de cero).
+
+Uso:
+    python scripts/rescan_conversation_risk.py --output reports/risk_rescan.jsonl \\
+        [--since 2025-01-01] [--until 2025-06-01] [--workers 4] [--llm-concurrency 4] [--no-llm]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# Añadir el directorio raíz al path para poder importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.security.risk_rescan import RISK_LEVELS, RetrospectiveRiskScanner, create_session_page_source
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reevaluación retrospectiva del riesgo en conversaciones")
+    parser.add_argument("--output", required=True, help="Fichero del informe (JSON Lines)")
+    parser.add_argument("--since", help="Solo sesiones actualizadas desde esta fecha (ISO, inclusive)")
+    parser.add_argument("--until", help="Solo sesiones actualizadas antes de esta fecha (ISO, exclusive)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para el escaneo local (por defecto, nº de CPUs)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Evaluaciones simultáneas con Claude")
+    parser.add_argument("--escalate-from", choices=RISK_LEVELS[1:], default="medio", help="Nivel mínimo para evaluar con Claude")
+    parser.add_argument("--no-llm", action="store_true", help="Solo escaneo local, sin evaluación con Claude")
+    parser.add_argument("--page-size", type=int, default=500, help="Sesiones por página")
+    parser.add_argument("--fresh", action="store_true", help="Ignorar el checkpoint y empezar de cero")
+    args = parser.parse_args()
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+
+    scanner = RetrospectiveRiskScanner(
+        report_path=args.output,
+        page_source=create_session_page_source(args.since, args.until, args.page_size),
+        workers=args.workers,
+        llm_concurrency=args.llm_concurrency,
+        escalate_from=None if args.no_llm else args.escalate_from,
+        resume=not args.fresh,
+    )
+    result = asyncio.run(scanner.run())
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(0 if result["success"] else 1)
+
+
+if __name__ == "__main__":
+    main()
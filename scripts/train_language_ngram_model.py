@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Entrena el clasificador de idioma por n-gramas (ai/language_ngram_model.py).
+
+Corpus:
+- los catálogos de i18n/json/<idioma>.json (todas las cadenas, sin los
+  marcadores {variable}), y
+- los textos por idioma escritos en el código de ai/ (prompts de los playbooks,
+  listas de palabras clave...): cualquier diccionario literal cuyas claves sean
+  códigos de idioma y cuyos valores sean cadenas o listas de cadenas.
+
+Volver a ejecutarlo después de modificar los catálogos o los prompts.
+
+Uso:
+    python scripts/train_language_ngram_model.py [--output ai/models/language_ngrams.json.gz]
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+from typing import Dict, Iterable, List
+
+# Añadir el directorio raíz al path para poder importar los módulos
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from ai.language_ngram_model import DEFAULT_MODEL_PATH, NgramLanguageModel
+
+LANGUAGES = ("es", "ca", "en", "ar")
+_PLACEHOLDER = re.compile(r"\{[^}]*\}")
+# Restos de expresiones regulares en las listas de patrones (\b, \s, ...)
+_REGEX_ESCAPE = re.compile(r"\\[a-zA-Z]")
+
+
+def _clean(text: str) -> str:
+    return _REGEX_ESCAPE.sub(" ", _PLACEHOLDER.sub(" ", text)).replace("|", " ")
+
+
+def _strings(value) -> Iterable[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def catalog_texts(language: str) -> List[str]:
+    with open(os.path.join(ROOT, "i18n", "json", f"{language}.json"), encoding="utf-8") as f:
+        return [_clean(text) for text in _strings(json.load(f))]
+
+
+def source_texts() -> Dict[str, List[str]]:
+    """Textos de diccionarios literales {"es": ..., "ca": ..., ...} en el código de ai/."""
+    texts: Dict[str, List[str]] = {lang: [] for lang in LANGUAGES}
+    for directory, _, files in os.walk(os.path.join(ROOT, "ai")):
+        for name in files:
+            if not name.endswith(".py"):
+                continue
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                try:
+                    tree = ast.parse(f.read())
+                except SyntaxError:
+                    continue
+            for node in ast.walk(tree):
+                if not isinstance(node, ast.Dict):
+                    continue
+                keys = [k.value for k in node.keys if isinstance(k, ast.Constant)]
+                if len(keys) < 2 or not set(keys) <= set(LANGUAGES):
+                    continue
+                for key, value in zip(keys, node.values):
+                    try:
+                        literal = ast.literal_eval(value)
+                    except ValueError:
+                        continue
+                    texts[key].extend(_clean(text) for text in _strings(literal))
+    return texts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Entrenamiento del modelo de idioma por n-gramas")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="Fichero del modelo (.json.gz)")
+    parser.add_argument("--max-ngrams", type=int, default=3000, help="N-gramas conservados por idioma")
+    args = parser.parse_args()
+
+    extra = source_texts()
+    corpus = {lang: catalog_texts(lang) + extra[lang] for lang in LANGUAGES}
+    for lang in LANGUAGES:
+        print(f"{lang}: {len(corpus[lang])} textos, {sum(len(t) for t in corpus[lang])} caracteres")
+
+    model = NgramLanguageModel.train(corpus, max_ngrams_per_language=args.max_ngrams)
+    model.save(args.output)
+    print(f"Modelo guardado en {args.output}: {len(model.index)} n-gramas, {os.path.getsize(args.output)} bytes")
+
+
+if __name__ == "__main__":
+    main()
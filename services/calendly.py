@@ -5,9 +5,9 @@ Permite obtener horarios disponibles y programar citas.
 import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
-import httpx
 
 from core.config import settings
+from core.http_client import get_http_client
 
 logger = logging.getLogger("mark-assistant.calendly")
 
@@ -32,15 +32,15 @@ async def get_user_info() -> Dict[str, Any]:
         Información del usuario
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.CALENDLY_API_URL}/users/me",
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.get(
+            f"{settings.CALENDLY_API_URL}/users/me",
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        return response.json()
     
     except Exception as e:
         logger.error(f"Error al obtener información del usuario de Calendly: {e}")
@@ -57,17 +57,17 @@ async def get_user_event_types(user_uri: str) -> List[Dict[str, Any]]:
         Lista de tipos de eventos
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.CALENDLY_API_URL}/event_types",
-                params={"user": user_uri},
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.get(
+            f"{settings.CALENDLY_API_URL}/event_types",
+            params={"user": user_uri},
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", [])
+        response.raise_for_status()
+        data = response.json()
+        return data.get("data", [])
     
     except Exception as e:
         logger.error(f"Error al obtener tipos de eventos: {e}")
@@ -92,22 +92,22 @@ async def _fetch_calendly_slots_for_event_type(
         Lista de slots disponibles
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.CALENDLY_API_URL}/event_type_available_times",
-                params={
-                    "event_type": event_type_uri,
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "timezone": timezone
-                },
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.get(
+            f"{settings.CALENDLY_API_URL}/event_type_available_times",
+            params={
+                "event_type": event_type_uri,
+                "start_time": start_time,
+                "end_time": end_time,
+                "timezone": timezone
+            },
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", [])
+        response.raise_for_status()
+        data = response.json()
+        return data.get("data", [])
     
     except Exception as e:
         logger.error(f"Error al obtener slots disponibles: {e}")
@@ -157,16 +157,16 @@ async def schedule_event(
         payload["questions_and_answers"] = questions_answers
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.CALENDLY_API_URL}/scheduling_invitees",
-                json=payload,
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.post(
+            f"{settings.CALENDLY_API_URL}/scheduling_invitees",
+            json=payload,
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        return response.json()
     
     except Exception as e:
         logger.error(f"Error al programar evento: {e}")
@@ -188,16 +188,16 @@ async def cancel_event(event_uri: str, reason: Optional[str] = None) -> bool:
         payload["reason"] = reason
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.CALENDLY_API_URL}/scheduling_cancellations",
-                json={"event": event_uri, **payload},
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.post(
+            f"{settings.CALENDLY_API_URL}/scheduling_cancellations",
+            json={"event": event_uri, **payload},
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            return True
+        response.raise_for_status()
+        return True
     
     except Exception as e:
         logger.error(f"Error al cancelar evento: {e}")
@@ -214,15 +214,15 @@ async def get_event(event_uri: str) -> Dict[str, Any]:
         Información del evento
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.CALENDLY_API_URL}/events/{event_uri}",
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.get(
+            f"{settings.CALENDLY_API_URL}/events/{event_uri}",
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        return response.json()
     
     except Exception as e:
         logger.error(f"Error al obtener información del evento: {e}")
@@ -239,15 +239,15 @@ async def get_invitee(invitee_uri: str) -> Dict[str, Any]:
         Información del invitado
     """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{settings.CALENDLY_API_URL}/invitees/{invitee_uri}",
-                headers=get_headers(),
-                timeout=30
-            )
+        client = get_http_client(settings.CALENDLY_API_URL)
+        response = await client.get(
+            f"{settings.CALENDLY_API_URL}/invitees/{invitee_uri}",
+            headers=get_headers(),
+            timeout=30
+        )
             
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        return response.json()
     
     except Exception as e:
         logger.error(f"Error al obtener información del invitado: {e}")
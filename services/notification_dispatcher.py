@@ -0,0 +1,324 @@
+"""
+Despachador concurrente de notificaciones pendientes.
+
+Sustituye al antiguo bucle de main.py (10 notificaciones por minuto, enviadas y
+actualizadas una a una). En cada ciclo:
+
+1. Reclama un lote de notificaciones con lease (`claim_pending_notifications`),
+   de modo que varias instancias no envían la misma fila y las que quedan
+   colgadas vuelven a estar disponibles al caducar el lease.
+2. Agrupa el lote por destinatario y lo reparte entre un pool de workers: los
+   mensajes de un mismo destinatario se envían en orden y los de destinatarios
+   distintos en paralelo.
+3. Limita el ritmo de envío por canal con un token bucket.
+4. Escribe los estados finales del lote en una sola llamada
+   (`update_notifications_status_many`).
+
+El intervalo de sondeo es adaptativo: si el lote vino lleno se vuelve a reclamar
+inmediatamente; si vino vacío el intervalo se duplica hasta el máximo.
+La entrega es "al menos una vez": si el proceso muere tras enviar y antes de
+escribir el estado, la notificación se reenviará cuando caduque su lease.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("mark-assistant.notifications")
+
+ClaimFunction = Callable[..., Awaitable[Dict[str, Any]]]
+SendFunction = Callable[[str, str], Awaitable[Dict[str, Any]]]
+BulkStatusFunction = Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+
+class RateLimiter:
+    """
+    Token bucket asíncrono.
+
+    Args:
+        rate: Envíos por segundo permitidos (0 o negativo desactiva el límite).
+        burst: Capacidad del bucket (por defecto, un segundo de envíos).
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Espera hasta que haya un token disponible y lo consume."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _parse_metadata(raw: Any) -> Dict[str, Any]:
+    if isinstance(raw, dict):
+        return dict(raw)
+    if isinstance(raw, str) and raw:
+        try:
+            parsed = json.loads(raw)
+            return parsed if isinstance(parsed, dict) else {}
+        except ValueError:
+            return {}
+    return {}
+
+
+class NotificationDispatcher:
+    """
+    Despachador de notificaciones con lease, pool de workers y sondeo adaptativo.
+
+    Args:
+        claim: Corrutina `claim(limit=, lease_seconds=, channels=)` que devuelve
+            {"success": bool, "notifications": [...]}.
+        update_status_many: Corrutina que recibe [{"id", "status", "metadata"}, ...] y
+            devuelve {"success": bool, "results": [{"id", "success", "error"}, ...]}.
+        senders: Corrutinas de envío por canal, `sender(destinatario, mensaje)`.
+        rate_limits: Envíos por segundo por canal.
+        batch_size: Notificaciones reclamadas por ciclo.
+        workers: Número de destinatarios atendidos en paralelo.
+        lease_seconds: Duración del lease de las notificaciones reclamadas.
+        min_interval: Espera mínima entre ciclos cuando el lote no vino lleno.
+        max_interval: Espera máxima entre ciclos cuando no hay trabajo.
+    """
+
+    def __init__(
+        self,
+        claim: ClaimFunction,
+        update_status_many: BulkStatusFunction,
+        senders: Dict[str, SendFunction],
+        rate_limits: Optional[Dict[str, float]] = None,
+        batch_size: int = 100,
+        workers: int = 8,
+        lease_seconds: int = 300,
+        min_interval: float = 1.0,
+        max_interval: float = 60.0,
+    ) -> None:
+        self._claim = claim
+        self._update_status_many = update_status_many
+        self._senders = dict(senders)
+        self._limiters = {
+            channel: RateLimiter(rate) for channel, rate in (rate_limits or {}).items()
+        }
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self._interval = min_interval
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+        self.stats = {
+            "batches": 0,
+            "claimed": 0,
+            "sent": 0,
+            "failed": 0,
+            "claim_errors": 0,
+            "status_update_errors": 0,
+            "last_batch_ms": 0.0,
+        }
+
+    # --- Ciclo de despacho ---
+
+    async def run_once(self) -> int:
+        """
+        Reclama y procesa un lote de notificaciones.
+
+        Returns:
+            Número de notificaciones reclamadas, o -1 si falló la reclamación.
+        """
+        started_at = time.perf_counter()
+        result = await self._claim(
+            limit=self.batch_size,
+            lease_seconds=self.lease_seconds,
+            channels=list(self._senders),
+        )
+        if not result.get("success", False):
+            self.stats["claim_errors"] += 1
+            logger.error(f"Error al reclamar notificaciones pendientes: {result.get('error')}")
+            return -1
+
+        notifications = result.get("notifications") or []
+        if not notifications:
+            return 0
+
+        self.stats["batches"] += 1
+        self.stats["claimed"] += len(notifications)
+        logger.info(f"Procesando {len(notifications)} notificaciones pendientes")
+
+        # Agrupar por destinatario conservando el orden de creación dentro de cada grupo
+        groups: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for notification in sorted(notifications, key=lambda n: str(n.get("created_at") or "")):
+            metadata = _parse_metadata(notification.get("metadata"))
+            recipient = metadata.get("phone") or notification.get("patient_id") or notification.get("id")
+            groups.setdefault(str(recipient), []).append(notification)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for group in groups.values():
+            queue.put_nowait(group)
+
+        outcomes: List[Tuple[str, str, Dict[str, Any]]] = []
+        worker_count = min(self.workers, len(groups))
+        await asyncio.gather(*(self._worker(queue, outcomes) for _ in range(worker_count)))
+
+        await self._write_outcomes(outcomes)
+        self.stats["last_batch_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+        return len(notifications)
+
+    async def _worker(self, queue: asyncio.Queue, outcomes: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        while True:
+            try:
+                group = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for notification in group:
+                outcomes.append(await self._deliver(notification))
+
+    async def _deliver(self, notification: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+        notification_id = notification.get("id")
+        channel = notification.get("channel")
+        metadata = _parse_metadata(notification.get("metadata"))
+        try:
+            phone = metadata.get("phone")
+            if not phone:
+                logger.error(f"No se encontró número de teléfono para la notificación {notification_id}")
+                self.stats["failed"] += 1
+                return notification_id, "failed", {**metadata, "error": "No se encontró número de teléfono"}
+
+            sender = self._senders.get(channel)
+            if sender is None:
+                self.stats["failed"] += 1
+                return notification_id, "failed", {**metadata, "error": f"Canal no soportado: {channel}"}
+
+            limiter = self._limiters.get(channel)
+            if limiter is not None:
+                await limiter.acquire()
+
+            result = await sender(phone, notification.get("message"))
+            if result.get("success", False):
+                self.stats["sent"] += 1
+                logger.info(f"Notificación {notification_id} enviada a {phone}")
+                return notification_id, "sent", {
+                    **metadata,
+                    "message_id": result.get("message_id"),
+                    "sent_at": datetime.now(timezone.utc).isoformat(),
+                }
+
+            self.stats["failed"] += 1
+            logger.error(f"Error al enviar notificación {notification_id}: {result.get('error')}")
+            return notification_id, "failed", {**metadata, "error": result.get("error")}
+
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Error al procesar notificación {notification_id}: {e}", exc_info=True)
+            return notification_id, "failed", {**metadata, "error": str(e)}
+
+    async def _write_outcomes(self, outcomes: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        updates = [
+            {"id": notification_id, "status": status, "metadata": metadata}
+            for notification_id, status, metadata in outcomes
+        ]
+        try:
+            result = await self._update_status_many(updates)
+        except Exception as e:
+            result = {"success": False, "error": str(e), "results": []}
+        if not result.get("success", False):
+            logger.error(f"Error al escribir el estado de {len(updates)} notificaciones: {result.get('error')}")
+        failed = [row for row in result.get("results") or [] if not row.get("success")]
+        if not result.get("success", False) and not failed:
+            failed = [{"id": update["id"], "error": result.get("error")} for update in updates]
+        for row in failed:
+            self.stats["status_update_errors"] += 1
+            logger.error(f"No se pudo actualizar el estado de la notificación {row.get('id')}: {row.get('error')}")
+
+    def _next_interval(self, claimed: int) -> float:
+        if claimed >= self.batch_size:
+            # Hay backlog: reclamar el siguiente lote sin esperar
+            self._interval = self.min_interval
+            return 0.0
+        if claimed > 0:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self.max_interval, max(self.min_interval, self._interval * 2))
+        return self._interval
+
+    async def _run_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Error en el despachador de notificaciones: {e}", exc_info=True)
+                claimed = 0
+            delay = self._next_interval(claimed)
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Ciclo de vida ---
+
+    async def start(self) -> None:
+        """Inicia el bucle de despacho en segundo plano."""
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._interval = self.min_interval
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Detiene el bucle dejando terminar el lote en curso (hasta 'timeout' segundos)."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("El lote de notificaciones en curso no terminó a tiempo; sus leases caducarán")
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores del despachador y el intervalo de sondeo actual."""
+        return {
+            **self.stats,
+            "running": self._task is not None and not self._task.done(),
+            "poll_interval": self._interval,
+            "batch_size": self.batch_size,
+            "workers": self.workers,
+        }
+
+
+def create_notification_dispatcher() -> NotificationDispatcher:
+    """Crea el despachador con las funciones de base de datos y envío de la aplicación."""
+    from core.config import settings
+    from database.d1_client import claim_pending_notifications, update_notifications_status_many
+    from services.whatsapp import send_whatsapp_message
+
+    return NotificationDispatcher(
+        claim=claim_pending_notifications,
+        update_status_many=update_notifications_status_many,
+        senders={"whatsapp": send_whatsapp_message},
+        rate_limits={"whatsapp": settings.NOTIFICATION_WHATSAPP_RATE_PER_SECOND},
+        batch_size=settings.NOTIFICATION_BATCH_SIZE,
+        workers=settings.NOTIFICATION_WORKERS,
+        lease_seconds=settings.NOTIFICATION_LEASE_SECONDS,
+        min_interval=settings.NOTIFICATION_POLL_MIN_INTERVAL,
+        max_interval=settings.NOTIFICATION_POLL_MAX_INTERVAL,
+    )
@@ -0,0 +1,169 @@
+"""
+Envío de respuestas del LLM a WhatsApp a medida que se generan.
+
+En lugar de esperar a la respuesta completa y enviarla en un único mensaje, el
+texto que llega en streaming se acumula en `SentenceChunker` y cada fragmento
+completo (una frase para el primero, para que el paciente vea algo cuanto
+antes; varias frases o un párrafo para los siguientes) se envía en cuanto está
+listo.
+
+Los fragmentos se envían desde una única tarea que los consume en orden, así
+que nunca llegan desordenados y la generación no se detiene mientras se espera
+a la API de Meta. Si un envío falla, ese fragmento y los siguientes se
+acumulan y se intentan en un único mensaje al terminar la generación.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("mark-assistant.reply-streaming")
+
+SendFunction = Callable[[str, str], Awaitable[Dict[str, Any]]]
+
+# Fin de párrafo, o fin de frase (con comillas/paréntesis de cierre) seguido de espacio
+_BOUNDARY_RE = re.compile(r"(?P<paragraph>\n[ \t]*\n\s*)|(?<=[.!?…;؟])[\"'»)\]]*\s+")
+
+
+class SentenceChunker:
+    """
+    Agrupa el texto recibido en fragmentos que terminan en fin de frase o de párrafo.
+
+    Args:
+        first_min_chars: Longitud mínima del primer fragmento.
+        min_chars: Longitud mínima del resto de fragmentos (los párrafos se cortan siempre).
+        max_chars: Si se supera sin fin de frase, se corta en el último espacio.
+    """
+
+    def __init__(self, first_min_chars: int = 40, min_chars: int = 200, max_chars: int = 1500) -> None:
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.emitted = 0
+        self._buffer = ""
+
+    def _next_chunk(self) -> Optional[str]:
+        buffer = self._buffer
+        threshold = self.first_min_chars if self.emitted == 0 else self.min_chars
+        for match in _BOUNDARY_RE.finditer(buffer):
+            candidate = buffer[:match.end()].strip()
+            if candidate and (match.group("paragraph") or len(candidate) >= threshold):
+                self._buffer = buffer[match.end():]
+                return candidate
+        if len(buffer) > self.max_chars:
+            cut = buffer.rfind(" ", 0, self.max_chars)
+            if cut <= 0:
+                cut = self.max_chars
+            self._buffer = buffer[cut:]
+            return buffer[:cut].strip()
+        return None
+
+    def feed(self, text: str) -> List[str]:
+        """Añade texto y devuelve los fragmentos que ya están completos."""
+        self._buffer += text
+        chunks = []
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            if chunk:
+                chunks.append(chunk)
+                self.emitted += 1
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        """Devuelve el texto pendiente al terminar la generación."""
+        text = self._buffer.strip()
+        self._buffer = ""
+        if text:
+            self.emitted += 1
+        return text or None
+
+
+async def send_streamed_reply(
+    to: str,
+    token_stream: AsyncIterator[str],
+    send: SendFunction,
+    first_min_chars: int = 40,
+    min_chars: int = 200,
+    max_chars: int = 1500,
+) -> Dict[str, Any]:
+    """
+    Envía por WhatsApp el texto de 'token_stream' en fragmentos ordenados.
+
+    Args:
+        to: Número del destinatario.
+        token_stream: Texto del modelo a medida que se genera.
+        send: Función de envío (to, texto) -> {"success": ...}.
+
+    Returns:
+        {"success", "text", "chunks_sent", "first_chunk_seconds", "error"}.
+        Si la generación falla se descarta el texto que aún no formaba un
+        fragmento; con chunks_sent == 0 el llamante puede repetir la petición
+        sin streaming.
+    """
+    chunker = SentenceChunker(first_min_chars, min_chars, max_chars)
+    queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    started_at = time.monotonic()
+    result: Dict[str, Any] = {"success": False, "text": "", "chunks_sent": 0, "first_chunk_seconds": None, "error": None}
+    unsent: List[str] = []
+
+    async def sender() -> None:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            # Tras un fallo no se envía nada más para no alterar el orden
+            if unsent:
+                unsent.append(chunk)
+                continue
+            try:
+                response = await send(to, chunk)
+            except Exception as e:
+                response = {"success": False, "error": str(e)}
+            if response.get("success"):
+                result["chunks_sent"] += 1
+                if result["first_chunk_seconds"] is None:
+                    result["first_chunk_seconds"] = round(time.monotonic() - started_at, 3)
+            else:
+                logger.warning(f"Fallo al enviar un fragmento de la respuesta a {to}: {response.get('error')}")
+                unsent.append(chunk)
+
+    sender_task = asyncio.create_task(sender())
+    parts: List[str] = []
+    try:
+        async for text in token_stream:
+            parts.append(text)
+            for chunk in chunker.feed(text):
+                queue.put_nowait(chunk)
+        tail = chunker.flush()
+        if tail:
+            queue.put_nowait(tail)
+    except asyncio.CancelledError:
+        sender_task.cancel()
+        raise
+    except Exception as e:
+        logger.error(f"Error durante la generación en streaming para {to}: {e}")
+        result["error"] = str(e)
+    queue.put_nowait(None)
+    await sender_task
+
+    result["text"] = "".join(parts).strip()
+    if result["error"]:
+        return result
+    if not result["text"]:
+        result["error"] = "Respuesta vacía del modelo"
+        return result
+    if unsent:
+        # Último intento: lo que quedó pendiente, en un solo mensaje
+        try:
+            response = await send(to, "\n\n".join(unsent))
+        except Exception as e:
+            response = {"success": False, "error": str(e)}
+        if not response.get("success"):
+            result["error"] = response.get("error") or "No se pudo enviar la respuesta"
+            return result
+        result["chunks_sent"] += 1
+    result["success"] = True
+    return result
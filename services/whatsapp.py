@@ -8,7 +8,8 @@ import hmac
 import hashlib
 import httpx
 import asyncio # Necesario para asyncio.create_task
-from typing import Dict, Any, Optional, Tuple # Eliminado List
+import time
+from typing import Dict, Any, List, Optional, Tuple
 # import os # Eliminado
 # import requests # Eliminado
 # import logging # ELIMINADO
@@ -17,8 +18,16 @@ from typing import Dict, Any, Optional, Tuple # Eliminado List
 
 # Importar configuración necesaria
 # from core.config import ApiConfig, logger, settings # ApiConfig no usada
-from core.config import logger, settings # ApiConfig eliminada
-from ai.gemma.client import generate_chat_response
+from core.config import logger, settings, get_language_name # ApiConfig eliminada
+from core.http_client import get_http_client
+from database.analytics_rollup import (
+    track_event, EVENT_MESSAGE_IN, EVENT_MESSAGE_OUT, EVENT_CRISIS_ALERT, EVENT_SENTIMENT,
+)
+from ai.gemma.client import generate_chat_response, stream_chat_response
+from ai.language_detection import detect_language_async
+from ai.security.threat_detection import threat_detector
+from ai.sentiment import classify_sentiment
+from services.reply_streaming import send_streamed_reply
 
 # --- Funciones eliminadas relacionadas con Twilio ---
 # TwilioClientSingleton
@@ -121,40 +130,40 @@ async def send_whatsapp_message_meta(
         }
     
     try:
-        # Usar httpx.AsyncClient para la solicitud
-        async with httpx.AsyncClient(timeout=settings.HTTPX_TIMEOUT) as client:
-            response = await client.post(api_url, headers=headers, json=payload)
-            response.raise_for_status() # Lanza excepción para errores HTTP >= 400
-            response_data = response.json()
-
-            # Meta API devuelve 200 OK incluso si hay errores a nivel de mensaje
-            if "messages" in response_data and response_data["messages"]:
-                message_id = response_data["messages"][0].get("id")
-                logger.info(f"Mensaje enviado con éxito a {to}. Respuesta de Meta: {response_data}")
-                return {
-                    "success": True,
-                    "message_id": message_id,
-                    "to": to
-                }
-            elif "error" in response_data:
-                 error_details = response_data["error"]
-                 error_message = error_details.get("message", "Error desconocido")
-                 logger.error(f"Error de API Meta al enviar a {to}: {error_message} (Code: {error_details.get('code')}, Subcode: {error_details.get('error_subcode')}, FBTrace: {error_details.get('fbtrace_id')}) ")
-                 return {
-                     "success": False,
-                     "error": error_message,
-                     "details": error_details, # Incluir detalles del error
-                     "to": to
-                 }
-            else:
-                # Respuesta 200 pero inesperada
-                 logger.error(f"Respuesta inesperada de Meta API (200 OK) al enviar a {to}: {response_data}")
-                 return {
-                     "success": False,
-                     "error": "Respuesta inesperada de la API",
-                     "details": response_data,
-                     "to": to
-                 }
+        # Usar el cliente compartido del host de Graph API (conexiones reutilizadas)
+        client = get_http_client(api_url)
+        response = await client.post(api_url, headers=headers, json=payload)
+        response.raise_for_status() # Lanza excepción para errores HTTP >= 400
+        response_data = response.json()
+
+        # Meta API devuelve 200 OK incluso si hay errores a nivel de mensaje
+        if "messages" in response_data and response_data["messages"]:
+            message_id = response_data["messages"][0].get("id")
+            logger.info(f"Mensaje enviado con éxito a {to}. Respuesta de Meta: {response_data}")
+            return {
+                "success": True,
+                "message_id": message_id,
+                "to": to
+            }
+        elif "error" in response_data:
+             error_details = response_data["error"]
+             error_message = error_details.get("message", "Error desconocido")
+             logger.error(f"Error de API Meta al enviar a {to}: {error_message} (Code: {error_details.get('code')}, Subcode: {error_details.get('error_subcode')}, FBTrace: {error_details.get('fbtrace_id')}) ")
+             return {
+                 "success": False,
+                 "error": error_message,
+                 "details": error_details, # Incluir detalles del error
+                 "to": to
+             }
+        else:
+            # Respuesta 200 pero inesperada
+             logger.error(f"Respuesta inesperada de Meta API (200 OK) al enviar a {to}: {response_data}")
+             return {
+                 "success": False,
+                 "error": "Respuesta inesperada de la API",
+                 "details": response_data,
+                 "to": to
+             }
 
     except httpx.HTTPStatusError as e:
         # Error HTTP (4xx, 5xx)
@@ -340,16 +349,17 @@ async def handle_meta_webhook(request_data: Dict[str, Any]) -> Dict[str, Any]:
                         text_body = message.get("text", {}).get("body")
                         if text_body:
                             logger.info(f"Mensaje de texto de {contact_info.get('profile', {}).get('name', 'Usuario')} ({from_number}): {text_body}")
+                            received_at = time.monotonic()
                             messages = [{"role": "user", "content": text_body}]
-                            ai_response = await generate_chat_response(messages)
-                            if ai_response.get("success"):
-                                respuesta_ia = ai_response["message"]["content"]
-                                logger.info(f"Respuesta generada por la IA: {respuesta_ia}")
-                                await send_whatsapp_message(from_number, respuesta_ia)
+                            language = await _reply_language(from_number, text_body)
+                            playbook = track_incoming_message(from_number, text_body, language)
+                            if await send_ai_reply(from_number, messages, language):
+                                track_event(
+                                    EVENT_MESSAGE_OUT, language=language, playbook=playbook,
+                                    session_id=from_number, value=time.monotonic() - received_at,
+                                )
                                 return {"success": True, "action": "ia_response_sent", "from": from_number}
                             else:
-                                logger.error(f"Error al generar respuesta IA: {ai_response.get('error')}")
-                                await send_whatsapp_message(from_number, "Lo siento, no pude procesar tu mensaje en este momento.")
                                 return {"success": False, "error": "ia_generation_failed", "from": from_number}
                         else:
                             logger.error(f"No se pudo extraer el cuerpo del mensaje de texto de {from_number}")
@@ -435,19 +445,19 @@ async def download_media_meta(media_id: str) -> Tuple[Optional[bytes], Optional[
     mime_type = None
     
     try:
-        async with httpx.AsyncClient(timeout=settings.HTTPX_TIMEOUT) as client:
-            response_info = await client.get(url_info_api, headers=headers)
-            response_info.raise_for_status()
-            media_info = response_info.json()
-            media_url = media_info.get("url")
-            mime_type = media_info.get("mime_type") # Capturar mime_type
-            sha256_hash = media_info.get("sha256") # Capturar hash si se quiere verificar
-            file_size = media_info.get("file_size")
+        client = get_http_client(url_info_api)
+        response_info = await client.get(url_info_api, headers=headers)
+        response_info.raise_for_status()
+        media_info = response_info.json()
+        media_url = media_info.get("url")
+        mime_type = media_info.get("mime_type") # Capturar mime_type
+        sha256_hash = media_info.get("sha256") # Capturar hash si se quiere verificar
+        file_size = media_info.get("file_size")
             
-            if not media_url:
-                logger.error(f"No se pudo obtener la URL para media ID {media_id}. Respuesta: {media_info}")
-                return None, None
-            logger.info(f"URL obtenida para media ID {media_id}: {media_url[:50]}... (Type: {mime_type}, Size: {file_size})")
+        if not media_url:
+            logger.error(f"No se pudo obtener la URL para media ID {media_id}. Respuesta: {media_info}")
+            return None, None
+        logger.info(f"URL obtenida para media ID {media_id}: {media_url[:50]}... (Type: {mime_type}, Size: {file_size})")
 
     except httpx.HTTPStatusError as e:
          logger.error(f"Error HTTP {e.response.status_code} al obtener info de media {media_id}: {e.response.text}")
@@ -465,20 +475,20 @@ async def download_media_meta(media_id: str) -> Tuple[Optional[bytes], Optional[
          
     try:
          # Nota: La URL devuelta por Meta requiere el mismo token de autorización
-         async with httpx.AsyncClient(timeout=settings.HTTPX_TIMEOUT) as download_client:
-             # Usar stream=True si el archivo es grande, pero para muchos casos .content es suficiente
-             # response_download = await download_client.get(media_url, headers=headers, follow_redirects=True)
-             # response_download.raise_for_status()
-             # content = await response_download.aread() # Leer contenido asíncronamente
+         download_client = get_http_client(media_url)
+         # Usar stream=True si el archivo es grande, pero para muchos casos .content es suficiente
+         # response_download = await download_client.get(media_url, headers=headers, follow_redirects=True)
+         # response_download.raise_for_status()
+         # content = await response_download.aread() # Leer contenido asíncronamente
              
-             # Forma más simple si los archivos no son enormes:
-             response_download = await download_client.get(media_url, headers=headers, follow_redirects=True)
-             response_download.raise_for_status()
-             content = response_download.content # Leer contenido (bloqueante si es grande, pero httpx maneja bien) 
-
-             logger.info(f"Media {media_id} descargada con éxito ({len(content)} bytes). Content-Type original: {mime_type}")
-             # Podríamos verificar el hash sha256 aquí si es necesario
-             return content, mime_type # Devolver también el content_type
+         # Forma más simple si los archivos no son enormes:
+         response_download = await download_client.get(media_url, headers=headers, follow_redirects=True)
+         response_download.raise_for_status()
+         content = response_download.content # Leer contenido (bloqueante si es grande, pero httpx maneja bien) 
+
+         logger.info(f"Media {media_id} descargada con éxito ({len(content)} bytes). Content-Type original: {mime_type}")
+         # Podríamos verificar el hash sha256 aquí si es necesario
+         return content, mime_type # Devolver también el content_type
              
     except httpx.HTTPStatusError as e:
          logger.error(f"Error HTTP {e.response.status_code} al descargar media desde {media_url[:50]}...: {e.response.text}")
@@ -514,15 +524,10 @@ async def process_incoming_message(message_data: Dict[str, Any], metadata: Dict[
         if text_body:
             logger.info(f"Mensaje de texto de {contact_name} ({from_number}): {text_body}")
             messages = [{"role": "user", "content": text_body}]
-            ai_response = await generate_chat_response(messages)
-            if ai_response.get("success"):
-                respuesta_ia = ai_response["message"]["content"]
-                logger.info(f"Respuesta generada por la IA: {respuesta_ia}")
-                await send_whatsapp_message(from_number, respuesta_ia)
+            language = await _reply_language(from_number, text_body)
+            if await send_ai_reply(from_number, messages, language):
                 return {"success": True, "action": "ia_response_sent", "from": from_number}
             else:
-                logger.error(f"Error al generar respuesta IA: {ai_response.get('error')}")
-                await send_whatsapp_message(from_number, "Lo siento, no pude procesar tu mensaje en este momento.")
                 return {"success": False, "error": "ia_generation_failed", "from": from_number}
         else:
             logger.error(f"No se pudo extraer el cuerpo del mensaje de texto de {from_number}")
@@ -575,3 +580,79 @@ async def send_whatsapp_message(to: str, message: str) -> Dict[str, Any]:
     # Llama a la función principal de Meta (que ahora es async)
     return await send_whatsapp_message_meta(to=to, message=message, message_type="text")
 
+# Severidad de las alertas de crisis (categoría de EVENT_CRISIS_ALERT) por nivel de riesgo preliminar
+CRISIS_SEVERITY = {"crítico": "high", "alto": "high", "medio": "medium"}
+
+def track_incoming_message(phone: str, text: str, language: str) -> str:
+    """
+    Registra los eventos analíticos de un mensaje entrante: el mensaje (con idioma
+    y PlayBook), su sentimiento y, si el escaneo de riesgo lo indica, una alerta de crisis.
+
+    Returns:
+        PlayBook con el que se atiende el mensaje ("crisis" o "general"), para
+        registrar también la respuesta.
+    """
+    risk_level = threat_detector.preliminary_risk_level(threat_detector.scan_message(text))
+    severity = CRISIS_SEVERITY.get(risk_level)
+    playbook = "crisis" if severity == "high" else "general"
+    track_event(EVENT_MESSAGE_IN, language=language, playbook=playbook, session_id=phone)
+    track_event(EVENT_SENTIMENT, language=language, playbook=playbook, category=classify_sentiment(text), session_id=phone)
+    if severity:
+        track_event(EVENT_CRISIS_ALERT, language=language, playbook=playbook, category=severity, session_id=phone)
+    return playbook
+
+async def _reply_language(phone: str, text: str) -> str:
+    """
+    Idioma de la respuesta (ai/language_detection.py): el ya decidido para este
+    número si es fiable o el detectado en el mensaje, que queda guardado en su sesión.
+    """
+    try:
+        return (await detect_language_async(text, session_id=phone)).language
+    except Exception as e:
+        logger.error(f"Error al detectar el idioma del mensaje de {phone}: {e}", exc_info=True)
+        return settings.DEFAULT_LANGUAGE
+
+async def send_ai_reply(to: str, messages: List[Dict[str, str]], language: Optional[str] = None) -> bool:
+    """
+    Genera la respuesta de la IA y la envía a 'to'.
+    Con 'language' se indica al modelo que responda en ese idioma.
+
+    Con WHATSAPP_STREAM_REPLIES la respuesta se envía por frases a medida que se
+    genera; si el streaming falla antes de enviar nada se repite la petición sin
+    streaming y se envía en un solo mensaje.
+
+    Returns:
+        True si la respuesta se envió completa.
+    """
+    system_prompt = f"Responde siempre en {get_language_name(language)}." if language else None
+    if settings.WHATSAPP_STREAM_REPLIES:
+        result = await send_streamed_reply(
+            to,
+            stream_chat_response(messages, system_prompt=system_prompt),
+            send_whatsapp_message,
+            first_min_chars=settings.WHATSAPP_STREAM_FIRST_CHUNK_CHARS,
+            min_chars=settings.WHATSAPP_STREAM_MIN_CHUNK_CHARS,
+            max_chars=settings.WHATSAPP_STREAM_MAX_CHUNK_CHARS,
+        )
+        if result["success"]:
+            logger.info(
+                f"Respuesta generada por la IA enviada en {result['chunks_sent']} mensajes "
+                f"(primero a los {result['first_chunk_seconds']} s): {result['text']}"
+            )
+            return True
+        if result["chunks_sent"]:
+            # Parte de la respuesta ya llegó al paciente: no se repite, se avisa del corte
+            logger.error(f"Respuesta en streaming interrumpida para {to}: {result['error']}")
+            await send_whatsapp_message(to, "Lo siento, no pude procesar tu mensaje en este momento.")
+            return False
+        logger.warning(f"Streaming no disponible para {to} ({result['error']}); se envía la respuesta completa")
+
+    ai_response = await generate_chat_response(messages, system_prompt=system_prompt)
+    if ai_response.get("success"):
+        respuesta_ia = ai_response["message"]["content"]
+        logger.info(f"Respuesta generada por la IA: {respuesta_ia}")
+        await send_whatsapp_message(to, respuesta_ia)
+        return True
+    logger.error(f"Error al generar respuesta IA: {ai_response.get('error')}")
+    await send_whatsapp_message(to, "Lo siento, no pude procesar tu mensaje en este momento.")
+    return False
@@ -0,0 +1,50 @@
+"""
+Fixtures compartidas de las pruebas
+"""
+import importlib
+import pathlib
+import sys
+import types
+
+import pytest
+
+PACKAGE_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+class FakeClaude:
+    """Sustituye a ai.claude.client.claude; cada prueba define get_response_text con monkeypatch"""
+
+    async def get_response_text(self, messages, **kwargs):
+        raise RuntimeError("Claude no disponible en las pruebas")
+
+
+class FakeLangSmith:
+    def get_tracer(self, **kwargs):
+        return None
+
+    async def evaluate_response(self, **kwargs):
+        return None
+
+
+@pytest.fixture
+def playbook_graph(monkeypatch):
+    """
+    ai/langgraph/playbook_graph.py con sus integraciones externas sustituidas
+    (ai.claude.client no existe en el árbol y el __init__ de ai.langgraph carga
+    el motor completo). El módulo se descarta al terminar la prueba.
+    """
+    def module(name, path=None, **attributes):
+        stub = types.ModuleType(name)
+        if path is not None:
+            stub.__path__ = [str(PACKAGE_ROOT / path)]
+        stub.__dict__.update(attributes)
+        monkeypatch.setitem(sys.modules, name, stub)
+
+    module("ai.langgraph", path="ai/langgraph")
+    module("ai.claude", path="ai/claude")
+    module("ai.claude.client", claude=FakeClaude())
+    module("ai.serper.search", serper=None)
+    module("ai.langsmith.tracing", langsmith=FakeLangSmith())
+    sys.modules.pop("ai.langgraph.playbook_graph", None)
+    yield importlib.import_module("ai.langgraph.playbook_graph")
+    sys.modules.pop("ai.langgraph.playbook_graph", None)
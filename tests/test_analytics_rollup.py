@@ -0,0 +1,80 @@
+"""
+Pruebas para el job incremental de agregación de analítica
+"""
+import asyncio
+
+from database import analytics_rollup
+from database.analytics_rollup import AnalyticsRollupJob, EVENT_MESSAGE_IN, track_event
+
+
+class FakeWarehouse:
+    """Simula la tabla de eventos y la función SQL de agregación con marca de agua"""
+
+    def __init__(self, fail_inserts=False):
+        self.events = []
+        self.watermark = 0
+        self.insert_calls = 0
+        self.rollup_calls = 0
+        self.fail_inserts = fail_inserts
+
+    async def insert(self, events):
+        self.insert_calls += 1
+        if self.fail_inserts:
+            return {"success": False, "error": "sin conexión"}
+        self.events.extend(events)
+        return {"success": True}
+
+    async def rollup(self, batch_size):
+        self.rollup_calls += 1
+        pending = self.events[self.watermark:self.watermark + batch_size]
+        self.watermark += len(pending)
+        return {"success": True, "processed": len(pending)}
+
+
+def setup_function():
+    analytics_rollup.drain_events()
+
+
+def test_run_once_inserts_in_batches_and_drains_backlog():
+    """Los eventos se insertan en bloques y la agregación avanza hasta vaciar el backlog"""
+    for _ in range(25):
+        track_event(EVENT_MESSAGE_IN, language="ca", session_id="34600000000")
+    warehouse = FakeWarehouse()
+    job = AnalyticsRollupJob(warehouse.insert, warehouse.rollup, batch_size=10)
+
+    rolled_up = asyncio.run(job.run_once())
+
+    assert warehouse.insert_calls == 3
+    assert rolled_up == 25
+    assert warehouse.watermark == 25
+    assert warehouse.rollup_calls == 3
+    assert job.get_stats()["buffered"] == 0
+
+
+def test_failed_insert_keeps_events_buffered():
+    """Si la inserción falla los eventos vuelven al buffer para el siguiente ciclo"""
+    for _ in range(3):
+        track_event(EVENT_MESSAGE_IN)
+    job = AnalyticsRollupJob(FakeWarehouse(fail_inserts=True).insert, FakeWarehouse().rollup, batch_size=10)
+
+    asyncio.run(job.flush_events())
+
+    assert job.get_stats()["buffered"] == 3
+    assert job.stats["errors"] == 1
+
+
+def test_incoming_message_events_carry_dimensions():
+    """Cada mensaje entrante registra idioma y PlayBook, su sentimiento y, si hay riesgo, una alerta de crisis"""
+    from services.whatsapp import track_incoming_message
+
+    assert track_incoming_message("34600000000", "Gracias, ya me encuentro mejor", "es") == "general"
+    assert track_incoming_message("34600000001", "I want to kill myself tonight", "en") == "crisis"
+
+    events = [(e["event_type"], e["language"], e["playbook"], e["category"]) for e in analytics_rollup.drain_events()]
+    assert events == [
+        ("message_in", "es", "general", None),
+        ("sentiment", "es", "general", "positive"),
+        ("message_in", "en", "crisis", None),
+        ("sentiment", "en", "crisis", "neutral"),
+        ("crisis_alert", "en", "crisis", "high"),
+    ]
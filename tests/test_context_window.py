@@ -0,0 +1,55 @@
+"""
+Pruebas para la ventana de contexto con presupuesto de tokens
+"""
+from ai.context_window import build_context_window, count_tokens, message_tokens
+
+
+def _conversation(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Mensaje {i} del paciente contando cómo ha ido la semana " * 3})
+        messages.append({"role": "assistant", "content": f"Respuesta {i} de Mark con una pregunta de seguimiento " * 3})
+    return messages
+
+
+def test_window_keeps_recent_messages_within_budget():
+    """Los mensajes recientes caben en el presupuesto y la ventana empieza en un mensaje del usuario"""
+    messages = _conversation(30)
+    system_prompt = "Eres Mark, un asistente psicológico virtual."
+    budget = 600
+
+    window = build_context_window(messages, system_prompt, budget, summary="El paciente tiene ansiedad.")
+
+    assert window.tokens <= budget
+    assert window.messages == messages[window.start:]
+    assert window.messages[0]["role"] == "user"
+    assert 0 < window.start < len(messages)
+    # Con el doble de historial la ventana no crece
+    longer = build_context_window(_conversation(60), system_prompt, budget, summary="El paciente tiene ansiedad.")
+    assert len(longer.messages) == len(window.messages)
+
+
+def test_last_message_always_included():
+    """El último mensaje entra aunque supere el presupuesto por sí solo"""
+    messages = [{"role": "user", "content": "palabra " * 500}]
+    window = build_context_window(messages, "", budget=50)
+
+    assert window.messages == messages
+    assert window.tokens == message_tokens(messages[0])
+    assert count_tokens("") == 0
+
+
+def test_unsummarized_messages_are_still_sent():
+    """Los mensajes que salen de la ventana se siguen enviando hasta que se incorporan al resumen"""
+    messages = _conversation(30)
+    budget = 600
+    window = build_context_window(messages, "", budget, summary="Resumen.")
+
+    pending = build_context_window(messages, "", budget, summary="Resumen.", summarized=window.start - 6)
+    assert pending.start == window.start
+    assert pending.messages == messages[window.start - 6:]
+    assert pending.tokens == window.tokens + sum(message_tokens(m) for m in messages[window.start - 6:window.start])
+
+    # Lo ya resumido no se repite
+    folded = build_context_window(messages, "", budget, summary="Resumen.", summarized=window.start)
+    assert folded.messages == window.messages
@@ -0,0 +1,42 @@
+"""
+Pruebas para el endpoint JSON de estadísticas del dashboard
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import admin.admin_panel as admin_panel
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    async def get_dashboard_stats(use_cache=True):
+        calls.append(use_cache)
+        return {"success": True, "stats": {"patients": 3}, "cached": use_cache}
+
+    monkeypatch.setattr(admin_panel, "get_dashboard_stats", get_dashboard_stats)
+    yield TestClient(admin_panel.app), calls
+    admin_panel.app.dependency_overrides.clear()
+
+
+def _login_as(*roles):
+    user = admin_panel.UserWithRoles(username="usuario", is_active=True, is_locked=False, roles=list(roles))
+    admin_panel.app.dependency_overrides[admin_panel.get_current_active_user_with_roles] = lambda: user
+
+
+def test_stats_require_an_authenticated_admin(client):
+    """Sin sesión no hay estadísticas ni recálculo; un rol sin view_dashboard tampoco accede"""
+    http, calls = client
+    assert http.get("/dashboard/stats?refresh=true").status_code == 401
+    _login_as("therapist")
+    assert http.get("/dashboard/stats?refresh=true").status_code == 403
+    assert calls == []
+
+
+def test_admin_can_refresh_stats(client):
+    http, calls = client
+    _login_as("admin")
+    assert http.get("/dashboard/stats").json()["cached"] is True
+    assert http.get("/dashboard/stats?refresh=true").json() == {"status": "success", "stats": {"patients": 3}, "cached": False}
+    assert calls == [True, False]
@@ -0,0 +1,45 @@
+"""
+Pruebas para los codificadores de exportación en streaming
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+from admin.export_stream import encode_csv, encode_ndjson, gzip_stream
+
+PAGES = [
+    [{"bucket_date": "2025-05-01", "event_type": "message_in", "language": "es", "event_count": 3}],
+    [],
+    [{"bucket_date": "2025-05-02", "event_type": "message_in", "language": "ca", "event_count": 5, "extra": "x"}],
+]
+
+
+async def _pages():
+    for page in PAGES:
+        yield page
+
+
+async def _collect(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+def test_ndjson_and_csv_encode_every_row():
+    """NDJSON emite una línea por fila y CSV respeta la cabecera ignorando columnas extra"""
+    ndjson = asyncio.run(_collect(encode_ndjson(_pages()))).decode("utf-8")
+    rows = [json.loads(line) for line in ndjson.splitlines()]
+    assert [row["event_count"] for row in rows] == [3, 5]
+
+    columns = ["bucket_date", "language", "event_count"]
+    text = asyncio.run(_collect(encode_csv(_pages(), columns))).decode("utf-8")
+    parsed = list(csv.DictReader(io.StringIO(text)))
+    assert list(parsed[0].keys()) == columns
+    assert [row["language"] for row in parsed] == ["es", "ca"]
+
+
+def test_gzip_stream_round_trip():
+    """La salida comprimida por fragmentos es un gzip válido con el contenido original"""
+    raw = asyncio.run(_collect(encode_ndjson(_pages())))
+    compressed = asyncio.run(_collect(gzip_stream(encode_ndjson(_pages()))))
+    assert gzip.decompress(compressed) == raw
@@ -0,0 +1,49 @@
+"""
+Pruebas para el servicio de cifrado de campos con clave cacheada
+"""
+import asyncio
+
+from core import field_encryption as field_encryption_module
+from core.field_encryption import FieldEncryptionService
+
+
+def _service(key="clave-principal", salt="salt-unico"):
+    return FieldEncryptionService(key_provider=lambda: (key, salt), iterations=1000, max_workers=2)
+
+
+def test_key_is_derived_once_and_batches_round_trip(monkeypatch):
+    """La clave se deriva una sola vez y el cifrado en bloque conserva el orden y los vacíos"""
+    derivations = []
+    original = field_encryption_module.derive_fernet_key
+
+    def counting_derive(*args, **kwargs):
+        derivations.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(field_encryption_module, "derive_fernet_key", counting_derive)
+    service = _service()
+
+    async def scenario():
+        await service.startup()
+        encrypted = await service.encrypt_many(["+34600000000", None, "paciente@example.com"])
+        decrypted = await service.decrypt_many(encrypted + ["no-es-un-token"], on_error="")
+        return encrypted, decrypted
+
+    encrypted, decrypted = asyncio.run(scenario())
+    service.shutdown()
+
+    assert len(derivations) == 1
+    assert encrypted[1] is None
+    assert decrypted == ["+34600000000", None, "paciente@example.com", ""]
+
+
+def test_rekey_keeps_previous_key_for_decryption():
+    """Tras rotar la clave los datos antiguos siguen siendo legibles y pueden re-cifrarse"""
+    service = _service()
+    old_token = service.encrypt_sync("notas de sesión")
+
+    service.rekey("clave-nueva", "salt-nuevo")
+    rotated = service.rotate_sync(old_token)
+
+    assert service.decrypt_sync(old_token) == "notas de sesión"
+    assert _service("clave-nueva", "salt-nuevo").decrypt_sync(rotated) == "notas de sesión"
@@ -0,0 +1,41 @@
+"""
+Pruebas para los contadores de los clientes HTTP compartidos
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from core.http_client import HTTPClientRegistry, _HostStats, _InstrumentedTransport
+
+
+def test_in_flight_does_not_drift_on_transport_errors():
+    """Una petición que falla sin respuesta deja de contar como en curso y cuenta como error de red"""
+    def handler(request):
+        if request.url.path == "/down":
+            raise httpx.ConnectError("conexión rechazada", request=request)
+        return httpx.Response(503 if request.url.path == "/busy" else 200)
+
+    stats = _HostStats()
+
+    async def scenario():
+        transport = _InstrumentedTransport(httpx.MockTransport(handler), stats)
+        async with httpx.AsyncClient(transport=transport, base_url="https://api.example.com") as client:
+            await client.get("/ok")
+            await client.get("/busy")
+            with pytest.raises(httpx.ConnectError):
+                await client.get("/down")
+
+    asyncio.run(scenario())
+    assert (stats.requests, stats.responses, stats.in_flight) == (3, 2, 0)
+    assert (stats.errors, stats.transport_errors) == (1, 1)
+
+
+def test_pool_stats_report_counters_per_host():
+    registry = HTTPClientRegistry()
+    registry.get_client("https://graph.facebook.com/v19.0/messages")
+    stats = registry.get_pool_stats()["https://graph.facebook.com"]
+    assert stats["active"] is True
+    assert (stats["requests"], stats["in_flight"], stats["transport_errors"]) == (0, 0, 0)
+    assert stats["pool_connections"] == 0
+    asyncio.run(registry.aclose())
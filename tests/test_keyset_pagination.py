@@ -0,0 +1,53 @@
+"""
+Pruebas para los filtros PostgREST de los listados paginados (keyset y búsqueda)
+"""
+import asyncio
+from types import SimpleNamespace
+
+from database import d1_client
+from database.d1_client import _keyset_filter
+
+
+def test_keyset_filter_values():
+    """Valores no NULL: en ascendente los NULL (al final) siguen detrás; en descendente no"""
+    assert _keyset_filter(["nombre", "id"], {"nombre": "Laia", "id": 7}) == (
+        'or(nombre.gt."Laia",nombre.is.null),and(nombre.eq."Laia",or(id.gt."7",id.is.null))'
+    )
+    assert _keyset_filter(["nombre", "id"], {"nombre": "Laia", "id": 7}, descending=True) == (
+        'nombre.lt."Laia",and(nombre.eq."Laia",id.lt."7")'
+    )
+
+
+def test_keyset_filter_null_cursor_value():
+    """Un cursor con valor NULL no se compara con la cadena "None" """
+    ascending = _keyset_filter(["created_at", "id"], {"created_at": None, "id": 7})
+    descending = _keyset_filter(["created_at", "id"], {"created_at": None, "id": 7}, descending=True)
+    assert "None" not in ascending and "None" not in descending
+    assert ascending == 'and(created_at.is.null,or(id.gt."7",id.is.null))'
+    assert descending == 'created_at.not.is.null,and(created_at.is.null,id.lt."7")'
+
+
+def test_patient_search_escapes_ilike_wildcards(monkeypatch):
+    """'%' y '_' de la búsqueda se comparan literalmente, no como comodines"""
+    calls = []
+
+    class Query:
+        def __getattr__(self, name):
+            def method(*args, **kwargs):
+                calls.append((name, args))
+                return self
+            return method
+
+    async def ensure_initialized():
+        return None
+
+    async def run_query(query, operation_name):
+        return SimpleNamespace(data=[], count=None)
+
+    fake = SimpleNamespace(_ensure_initialized=ensure_initialized, client=SimpleNamespace(from_=lambda table: Query()))
+    monkeypatch.setattr(d1_client, "supabase", fake)
+    monkeypatch.setattr(d1_client, "run_query", run_query)
+
+    result = asyncio.run(d1_client.list_patients_page(search="50%_off"))
+    assert result["success"] is True
+    assert ("ilike", ("nombre", "%50\\%\\_off%")) in calls
@@ -0,0 +1,90 @@
+"""
+Pruebas para la detección de idioma asíncrona con reutilización de la sesión
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ai import language_detection
+from ai.language_detection import LanguageDecision, _decide_language, detect_language_async, score_language
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Sesiones en memoria en lugar de la base de datos"""
+    import database.d1_client as d1_client
+
+    store = {}
+
+    async def get_session_data(session_id):
+        return store.get(session_id)
+
+    async def save_session_data(session_id, data):
+        store[session_id] = dict(data)
+        return True
+
+    monkeypatch.setattr(d1_client, "get_session_data", get_session_data)
+    monkeypatch.setattr(d1_client, "save_session_data", save_session_data)
+    return store
+
+
+@pytest.fixture
+def claude(monkeypatch):
+    """Respuestas de Claude a través del registro de clientes compartido"""
+    calls = []
+    answer = {"content": "ca"}
+
+    async def ainvoke(provider, model, messages, temperature=0.7, config=None):
+        calls.append((provider, messages[0].content))
+        return SimpleNamespace(content=answer["content"])
+
+    monkeypatch.setattr(language_detection.llm_clients, "ainvoke", ainvoke)
+    monkeypatch.setattr(language_detection, "_ngram_decision", lambda text: None)
+    return SimpleNamespace(calls=calls, answer=answer)
+
+
+def test_decide_language_combines_heuristics_and_langdetect():
+    """Consenso con langdetect da confianza alta; sin señales se pide a Claude"""
+    heuristic = score_language("Hola, necesito ayuda porque no puedo dormir")
+    assert _decide_language(heuristic, "es") == (LanguageDecision("es", 0.95, "langdetect+heuristic"), False)
+    assert _decide_language(heuristic, None)[0].language == "es"
+
+    empty = score_language("12345 ...")
+    assert _decide_language(empty, "en") == (LanguageDecision("en", 0.7, "langdetect"), False)
+    assert _decide_language(empty, None) == (None, True)
+
+
+def test_detection_is_saved_and_reused_from_session(sessions, claude):
+    """La decisión se guarda en la sesión y los siguientes mensajes no vuelven a detectar"""
+    async def scenario():
+        first = await detect_language_async("Hola, necesito ayuda porque no puedo dormir", session_id="34600")
+        second = await detect_language_async("ok", session_id="34600")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.language == "es" and first.source == "heuristic"
+    assert sessions["34600"]["language"] == "es"
+    assert second == LanguageDecision("es", sessions["34600"]["language_confidence"], "session")
+    assert claude.calls == []
+
+
+def test_low_confidence_session_is_not_reused(sessions, claude):
+    sessions["34601"] = {"language": "en", "language_confidence": 0.1}
+    decision = asyncio.run(detect_language_async("Hola, necesito ayuda porque no puedo dormir", session_id="34601"))
+    assert decision.language == "es"
+    assert sessions["34601"]["language"] == "es"
+
+
+def test_claude_fallback_goes_through_llm_clients(claude):
+    """Sin señales locales el idioma lo decide Claude con el cliente compartido; si falla, el idioma por defecto"""
+    decision = asyncio.run(detect_language_async("12345 ..."))
+    assert decision == LanguageDecision("ca", 0.9, "claude")
+    assert claude.calls[0][0] == language_detection.PROVIDER_ANTHROPIC
+    assert "12345" in claude.calls[0][1]
+
+    claude.answer["content"] = "no lo sé"
+    decision = asyncio.run(detect_language_async("12345 ..."))
+    assert decision.source == "default"
+    assert asyncio.run(detect_language_async("12345 ...", use_llm=False)).source == "default"
+    assert len(claude.calls) == 2
@@ -0,0 +1,99 @@
+"""
+Pruebas para los micro-lotes y la carga diferida del detector de idioma con ML
+"""
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from ai import language_detection_ml
+from ai.language_detection_ml import LanguageDetectorML, MicroBatcher
+
+
+def test_micro_batcher_groups_concurrent_requests():
+    """Las peticiones concurrentes comparten lote; al llenarse un lote se procesa sin esperar"""
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item.upper() for item in items]
+
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        batcher = MicroBatcher(process, executor=lambda: executor, max_batch_size=3, max_wait=0.01)
+        results = await asyncio.gather(*(batcher.submit(text) for text in ["a", "b", "c", "d"]))
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario())
+    executor.shutdown()
+    assert results == ["A", "B", "C", "D"]
+    assert batches == [["a", "b", "c"], ["d"]]
+    assert (batcher.batches, batcher.items) == (2, 4)
+
+
+def test_micro_batcher_propagates_errors_to_every_request():
+    def process(items):
+        raise RuntimeError("modelo no disponible")
+
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def scenario():
+        batcher = MicroBatcher(process, executor=lambda: executor, max_wait=0.001)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    executor.shutdown()
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+@pytest.fixture
+def fake_fasttext(monkeypatch):
+    """Módulo fasttext que registra en qué hilo se carga y se usa el modelo"""
+    calls = []
+
+    class Model:
+        def predict(self, text, k=1):
+            calls.append(("predict", threading.current_thread()))
+            return ["__label__ca"], [0.9]
+
+    def load_model(path):
+        calls.append(("load", threading.current_thread()))
+        return Model()
+
+    monkeypatch.setitem(sys.modules, "fasttext", SimpleNamespace(load_model=load_model))
+    monkeypatch.setattr(language_detection_ml, "ML_LIBRARIES_AVAILABLE", True)
+    return calls
+
+
+def test_fasttext_loads_lazily_off_the_event_loop(fake_fasttext):
+    """El modelo no se carga al crear el detector y la versión asíncrona lo carga fuera del event loop"""
+    detector = LanguageDetectorML(fast_mode=True)
+    assert fake_fasttext == [] and not detector.models_loaded
+
+    async def scenario():
+        loop_thread = threading.current_thread()
+        first = await detector.detect_language_async("Bon dia, necessito ajuda")
+        second = await detector.detect_language_async("Moltes gràcies per tot")
+        return loop_thread, first, second
+
+    loop_thread, first, second = asyncio.run(scenario())
+    assert (first, second) == ("ca", "ca")
+    assert [name for name, _ in fake_fasttext] == ["load", "predict", "predict"]
+    assert all(thread is not loop_thread for _, thread in fake_fasttext)
+    assert detector.models_loaded
+
+
+def test_shutdown_only_touches_a_created_detector(monkeypatch):
+    monkeypatch.setattr(language_detection_ml, "_language_detector_ml", None)
+    language_detection_ml.shutdown_language_detector_ml()
+    assert language_detection_ml._language_detector_ml is None
+
+    detector = LanguageDetectorML()
+    detector._get_executor()
+    monkeypatch.setattr(language_detection_ml, "_language_detector_ml", detector)
+    language_detection_ml.shutdown_language_detector_ml()
+    assert detector._executor is None
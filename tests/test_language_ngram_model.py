@@ -0,0 +1,33 @@
+"""
+Pruebas para el clasificador de idioma por n-gramas
+"""
+from ai.language_ngram_model import NgramLanguageModel, get_ngram_language_model
+
+
+def test_bundled_model_separates_catalan_and_spanish():
+    """El modelo incluido distingue catalán y castellano en frases habituales"""
+    model = get_ngram_language_model()
+    texts = [
+        "Hola, voldria demanar una cita per demà a la tarda",
+        "Hola, quería pedir una cita para mañana por la tarde",
+        "Hi, I'd like to book a session",
+        "مرحبا، أريد حجز موعد",
+    ]
+    predictions = model.predict_batch(texts)
+
+    assert [p.language for p in predictions] == ["ca", "es", "en", "ar"]
+    assert all(p.confidence > 0.8 for p in predictions)
+    assert predictions[0] == model.predict(texts[0])
+    assert model.predict("").confidence == 0.25
+
+
+def test_train_save_load_round_trip(tmp_path):
+    """Un modelo entrenado y guardado predice igual al volver a cargarlo"""
+    corpus = {"ca": ["bon dia, com estàs? molt bé, gràcies"], "es": ["buenos días, ¿cómo estás? muy bien, gracias"]}
+    model = NgramLanguageModel.train(corpus)
+    path = str(tmp_path / "model.json.gz")
+    model.save(path)
+    loaded = NgramLanguageModel.load(path)
+
+    assert loaded.languages == ("ca", "es")
+    assert loaded.predict("molt bé").probabilities == model.predict("molt bé").probabilities
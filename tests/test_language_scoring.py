@@ -0,0 +1,35 @@
+"""
+Pruebas para el puntuador de idioma en una sola pasada
+"""
+from ai.language_scoring import LanguageScorer
+
+scorer = LanguageScorer(
+    patterns={
+        "es": [r"\b(hola|buenos días|gracias)\b"],
+        "ca": [r"\b(hola|bon dia|gràcies|d'acord)\b"],
+        "ar": [r"(مرحبا|شكرا)"],
+    },
+    specific_words={"es": ["porque", "ahora"], "ca": ["perquè", "ara"], "ar": ["لأن"]},
+    languages=("es", "ca", "en", "ar"),
+)
+
+
+def test_scores_words_phrases_and_punctuation_in_one_pass():
+    """Palabras, expresiones de varias palabras y palabras seguidas de puntuación puntúan igual"""
+    result = scorer.score("Bon dia! D'acord, gràcies, ara... ara no")
+
+    assert result.language == "ca"
+    assert result.pattern_scores == {"es": 0, "ca": 3, "en": 0, "ar": 0}
+    # Las palabras indicadoras cuentan una vez aunque se repitan
+    assert result.word_scores["ca"] == 1
+    assert result.confidence == 1.0
+
+
+def test_shared_words_and_arabic_substrings():
+    """Las palabras comunes puntúan en varios idiomas y el árabe se busca como subcadena"""
+    shared = scorer.score("hola")
+    assert shared.scores["es"] == shared.scores["ca"] == 1
+    assert shared.language == "es" and shared.confidence == 0.5
+
+    assert scorer.score("ومرحبا شكرا").pattern_scores["ar"] == 2
+    assert scorer.score("sin pistas").confidence == 0.0
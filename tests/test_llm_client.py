@@ -0,0 +1,144 @@
+"""
+Pruebas para el registro de clientes LLM compartidos
+"""
+import asyncio
+
+import pytest
+
+from ai.llm_client import LLMClientRegistry
+
+
+class FakeChatModel:
+    def __init__(self, model, temperature):
+        self.model = model
+        self.temperature = temperature
+
+    async def ainvoke(self, messages, config=None):
+        await asyncio.sleep(0.01)
+        if messages == ["falla"]:
+            raise RuntimeError("error del proveedor")
+        return f"{self.model}:{messages[-1]}"
+
+
+def test_clients_are_reused_and_metrics_recorded():
+    """Un cliente por (proveedor, modelo, temperatura) y métricas de cada llamada"""
+    created = []
+
+    def factory(model, temperature):
+        created.append((model, temperature))
+        return FakeChatModel(model, temperature)
+
+    registry = LLMClientRegistry({"fake": factory})
+
+    async def scenario():
+        results = await asyncio.gather(*(registry.ainvoke("fake", "m1", [f"hola {i}"]) for i in range(5)))
+        await registry.ainvoke("fake", "m1", ["hola"], temperature=0.0)
+        with pytest.raises(RuntimeError):
+            await registry.ainvoke("fake", "m1", ["falla"])
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert results[0] == "m1:hola 0"
+    assert created == [("m1", 0.7), ("m1", 0.0)]
+    stats = registry.get_stats()["fake:m1@0.7"]
+    assert stats["calls"] == 6
+    assert stats["errors"] == 1
+    assert stats["in_flight"] == 0
+    assert sum(stats["latency"]["buckets_ms"].values()) == 6
+    assert registry.warm_up([("fake", "m2", 0.7), ("desconocido", "x", 0.7)]) == 3
+
+
+def test_prompt_cache_usage_is_recorded():
+    """Los tokens leídos de la caché de prompts se acumulan por modelo, también en streaming"""
+    from types import SimpleNamespace
+
+    from langchain_core.outputs import LLMResult
+
+    class CachedChatModel:
+        async def ainvoke(self, messages, config=None):
+            # Como Anthropic: el llm_output lleva el objeto usage del SDK
+            usage = SimpleNamespace(input_tokens=100, output_tokens=20, cache_read_input_tokens=1100, cache_creation_input_tokens=0)
+            for callback in config["callbacks"]:
+                await callback.on_llm_end(LLMResult(generations=[], llm_output={"usage": usage}))
+            return SimpleNamespace(content="hola")
+
+        async def astream(self, messages, config=None):
+            yield SimpleNamespace(content="ho", additional_kwargs={})
+            yield SimpleNamespace(content="la", additional_kwargs={})
+            yield SimpleNamespace(content="", additional_kwargs={"usage": {
+                "input_tokens": 1200, "output_tokens": 15, "input_token_details": {"cache_read": 1100}
+            }})
+
+    registry = LLMClientRegistry({"fake": lambda model, temperature: CachedChatModel()})
+
+    async def scenario():
+        await registry.ainvoke("fake", "m1", ["hola"], config={"callbacks": []})
+        return [text async for text in registry.astream("fake", "m1", ["hola"])]
+
+    assert asyncio.run(scenario()) == ["ho", "la"]
+    stats = registry.get_stats()["fake:m1@0.7"]
+    assert stats["tokens"]["input"] == 2400
+    assert stats["tokens"]["output"] == 35
+    assert stats["tokens"]["cache_read"] == 2200
+    assert stats["first_token_latency"]["max_ms"] is not None
+
+
+def test_anthropic_client_sends_cacheable_system_blocks(monkeypatch):
+    """El cliente de Anthropic acepta el prompt del sistema en bloques con cache_control"""
+    pytest.importorskip("langchain_anthropic")
+    from langchain_core.messages import HumanMessage
+
+    from ai.llm_client import DEFAULT_FACTORIES, PROVIDER_ANTHROPIC, build_system_message
+    from core.config import settings
+
+    monkeypatch.setattr(settings, "LLM_PROMPT_CACHE_MIN_TOKENS", 1)
+    system = build_system_message("Eres Mark.", "Resumen: primera visita.")
+    client = DEFAULT_FACTORIES[PROVIDER_ANTHROPIC]("claude-3-5-sonnet-latest", 0.7)
+
+    params = client._format_params(messages=[system, HumanMessage(content="hola")])
+
+    assert params["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert params["system"][1]["text"] == "Resumen: primera visita."
+    assert params["messages"] == [{"role": "user", "content": "hola"}]
+
+
+def test_openrouter_factory_uses_shared_http_client(monkeypatch):
+    """El cliente real de OpenRouter envía las peticiones por el pool compartido y sin parámetros extra"""
+    pytest.importorskip("langchain_openai")
+    import httpx
+    from langchain_core.messages import HumanMessage
+
+    from ai.llm_client import DEFAULT_FACTORIES, PROVIDER_OPENROUTER
+    from core.config import settings
+    from core.http_client import http_clients
+
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={
+            "id": "gen-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "google/gemma-3-27b-it",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hola"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 2, "total_tokens": 14,
+                      "prompt_tokens_details": {"cached_tokens": 8}},
+        })
+
+    shared = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(settings, "OPENROUTER_API_KEY", "sk-test")
+    monkeypatch.setattr(http_clients, "get_client", lambda url: shared)
+
+    registry = LLMClientRegistry({PROVIDER_OPENROUTER: DEFAULT_FACTORIES[PROVIDER_OPENROUTER]})
+    model = "google/gemma-3-27b-it"
+    response = asyncio.run(registry.ainvoke(PROVIDER_OPENROUTER, model, [HumanMessage(content="hola")]))
+
+    assert response.content == "Hola"
+    assert len(requests) == 1
+    assert str(requests[0].url) == "https://openrouter.ai/api/v1/chat/completions"
+    assert requests[0].headers["authorization"] == "Bearer sk-test"
+    assert registry.get_client(PROVIDER_OPENROUTER, model).model_kwargs == {}
+    tokens = registry.get_stats()[f"{PROVIDER_OPENROUTER}:{model}@0.7"]["tokens"]
+    assert (tokens["input"], tokens["cache_read"]) == (12, 8)
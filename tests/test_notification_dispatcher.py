@@ -0,0 +1,109 @@
+"""
+Pruebas para el despachador de notificaciones
+"""
+import asyncio
+
+from services.notification_dispatcher import NotificationDispatcher
+
+
+def make_notification(notification_id, phone, created_at, channel="whatsapp"):
+    return {
+        "id": notification_id,
+        "channel": channel,
+        "message": f"Recordatorio {notification_id}",
+        "created_at": created_at,
+        "metadata": {"phone": phone},
+    }
+
+
+class FakeBackend:
+    """Simula la tabla de notificaciones y el envío por WhatsApp"""
+
+    def __init__(self, notifications, send_delay=0.01):
+        self.pending = list(notifications)
+        self.send_delay = send_delay
+        self.sent = []
+        self.statuses = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.status_calls = 0
+
+    async def claim(self, limit, lease_seconds, channels):
+        batch = [n for n in self.pending if n["channel"] in channels][:limit]
+        self.pending = [n for n in self.pending if n not in batch]
+        return {"success": True, "notifications": batch}
+
+    async def send(self, phone, message):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.send_delay)
+        self.in_flight -= 1
+        self.sent.append((phone, message))
+        return {"success": True, "message_id": f"wamid.{len(self.sent)}"}
+
+    async def update_status_many(self, updates):
+        self.status_calls += 1
+        for update in updates:
+            self.statuses[update["id"]] = (update["status"], update["metadata"])
+        return {"success": True, "results": [{"id": update["id"], "success": True} for update in updates]}
+
+
+def make_dispatcher(backend, **kwargs):
+    return NotificationDispatcher(
+        claim=backend.claim,
+        update_status_many=backend.update_status_many,
+        senders={"whatsapp": backend.send},
+        **kwargs,
+    )
+
+
+def test_batch_is_sent_in_parallel_across_recipients():
+    """Destinatarios distintos se atienden en paralelo y todos los estados se escriben"""
+    notifications = [make_notification(f"n{i}", f"+3460000000{i}", f"2025-01-01T09:00:0{i}") for i in range(8)]
+    backend = FakeBackend(notifications)
+    dispatcher = make_dispatcher(backend, workers=4)
+
+    claimed = asyncio.run(dispatcher.run_once())
+
+    assert claimed == 8
+    assert backend.max_in_flight == 4
+    assert all(status == "sent" for status, _ in backend.statuses.values())
+    assert backend.status_calls == 1
+    assert backend.statuses["n0"][1]["phone"] == "+34600000000"
+    assert backend.statuses["n0"][1]["message_id"].startswith("wamid.")
+
+
+def test_messages_to_same_recipient_keep_order():
+    """Los mensajes de un mismo destinatario se envían en orden de creación"""
+    notifications = [
+        make_notification("b", "+34611111111", "2025-01-01T09:00:02"),
+        make_notification("a", "+34611111111", "2025-01-01T09:00:01"),
+        make_notification("c", "+34611111111", "2025-01-01T09:00:03"),
+    ]
+    backend = FakeBackend(notifications)
+    asyncio.run(make_dispatcher(backend, workers=4).run_once())
+
+    assert [message for _, message in backend.sent] == ["Recordatorio a", "Recordatorio b", "Recordatorio c"]
+    assert backend.max_in_flight == 1
+
+
+def test_missing_phone_fails():
+    """Sin teléfono la notificación se marca como fallida sin intentar el envío"""
+    notification = make_notification("n1", None, "2025-01-01T09:00:00")
+    backend = FakeBackend([notification])
+    asyncio.run(make_dispatcher(backend).run_once())
+
+    status, metadata = backend.statuses["n1"]
+    assert status == "failed"
+    assert "teléfono" in metadata["error"]
+    assert backend.sent == []
+
+
+def test_polling_drains_backlog_and_backs_off_when_empty():
+    """Con lote lleno no se espera; sin trabajo el intervalo crece hasta el máximo"""
+    dispatcher = make_dispatcher(FakeBackend([]), batch_size=10, min_interval=1.0, max_interval=4.0)
+
+    assert dispatcher._next_interval(10) == 0.0
+    assert dispatcher._next_interval(3) == 1.0
+    assert [dispatcher._next_interval(0) for _ in range(3)] == [2.0, 4.0, 4.0]
+    assert dispatcher._next_interval(5) == 1.0
@@ -0,0 +1,70 @@
+"""
+Pruebas para el enrutado de mensajes en un solo paso (route_message)
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def router(playbook_graph, monkeypatch):
+    """route_message con el clasificador de idioma por n-gramas y las respuestas de Claude controladas"""
+    prompts = []
+    answer = {"text": None}
+
+    class NgramModel:
+        def predict(self, text):
+            return SimpleNamespace(language="en" if "I " in text else "es", confidence=0.9)
+
+    async def get_response_text(messages, **kwargs):
+        prompts.append(messages[0]["content"])
+        if answer["text"] is None:
+            raise RuntimeError("sin conexión")
+        return answer["text"]
+
+    monkeypatch.setattr(playbook_graph, "get_ngram_language_model", lambda: NgramModel())
+    monkeypatch.setattr(playbook_graph.claude, "get_response_text", get_response_text)
+
+    def route(message):
+        state = playbook_graph.ConversationState(messages=[{"role": "user", "content": message}])
+        return asyncio.run(playbook_graph.route_message(state))
+
+    return SimpleNamespace(route=route, prompts=prompts, answer=answer)
+
+
+def test_route_message_local_appointment(router):
+    """Una petición de cita clara se enruta sin llamar al LLM"""
+    result = router.route("Quiero pedir cita para el martes")
+    assert result["language"] == "es"
+    assert result["current_playbook"] == "appointment"
+    assert result["appointment_requested"] is True
+    assert result["needs_web_search"] is False
+    assert result["metadata"]["routing"] == "local"
+    assert router.prompts == []
+
+
+@pytest.mark.parametrize("message", [
+    "Necesito cita urgente, tengo ganas de suicidarme",
+    "I can't pay anymore, I want to end my life",
+])
+def test_route_message_risk_phrases_skip_keyword_routing(router, message):
+    """Con frases de riesgo no se enruta a cita o pago por palabras clave: decide el LLM y, si falla, crisis"""
+    result = router.route(message)
+    assert len(router.prompts) == 1
+    assert result["current_playbook"] == "crisis"
+    assert result["metadata"]["routing"] == "fallback"
+    assert "appointment_requested" not in result and "payment_requested" not in result
+
+
+def test_route_message_invalid_llm_json_falls_back_to_crisis(router):
+    """Una respuesta del LLM que no es JSON se trata como fallo: con frases de riesgo, crisis"""
+    router.answer["text"] = "Creo que es una cita"
+    result = router.route("Necesito cita urgente, tengo ganas de suicidarme")
+    assert result["current_playbook"] == "crisis"
+    assert result["metadata"]["routing"] == "fallback"
+
+    router.answer["text"] = '{"language": "ca", "playbook": "info", "needs_web_search": true}'
+    result = router.route("¿Qué horario tiene el centro?")
+    assert (result["language"], result["current_playbook"], result["needs_web_search"]) == ("es", "info", True)
+    assert result["metadata"]["routing"] == "llm"
@@ -0,0 +1,85 @@
+"""
+Pruebas para el envío de respuestas en streaming por fragmentos
+"""
+import asyncio
+
+from services.reply_streaming import SentenceChunker, send_streamed_reply
+
+
+async def _tokens(text, fail_after=None):
+    for i in range(0, len(text), 3):
+        if fail_after is not None and i >= fail_after:
+            raise RuntimeError("conexión cortada")
+        await asyncio.sleep(0)
+        yield text[i:i + 3]
+
+
+def test_chunker_sends_first_sentence_early_and_groups_the_rest():
+    """El primer fragmento es la primera frase; los siguientes agrupan frases o párrafos"""
+    chunker = SentenceChunker(first_min_chars=10, min_chars=60, max_chars=500)
+    text = "Hola, entiendo cómo te sientes. Es normal. Vamos a verlo juntos con calma. ¿Qué ha pasado?\n\nEstoy aquí."
+    chunks = [chunk for i in range(0, len(text), 4) for chunk in chunker.feed(text[i:i + 4])]
+    chunks.append(chunker.flush())
+
+    assert chunks == [
+        "Hola, entiendo cómo te sientes.",
+        "Es normal. Vamos a verlo juntos con calma. ¿Qué ha pasado?",
+        "Estoy aquí.",
+    ]
+
+
+def test_streamed_reply_keeps_order_and_retries_unsent_chunks():
+    """Los fragmentos llegan en orden y los que fallan se reenvían juntos al final"""
+    sent = []
+    failures = {"pending": 1}
+
+    async def send(to, text):
+        await asyncio.sleep(0.001 * (len(sent) % 3))
+        if len(sent) == 1 and failures["pending"]:
+            failures["pending"] -= 1
+            return {"success": False, "error": "429"}
+        sent.append(text)
+        return {"success": True}
+
+    text = "Primera frase completa. Segunda frase bastante larga. Tercera frase. Cuarta frase final."
+    result = asyncio.run(send_streamed_reply("34600000000", _tokens(text), send, first_min_chars=5, min_chars=5))
+
+    assert result["success"] is True
+    assert sent == [
+        "Primera frase completa.",
+        "Segunda frase bastante larga.\n\nTercera frase.\n\nCuarta frase final.",
+    ]
+    assert result["chunks_sent"] == 2
+
+
+def test_streamed_reply_reports_failure_before_first_chunk():
+    """Si la generación falla antes del primer envío, el llamante puede recurrir al envío único"""
+    sent = []
+
+    async def send(to, text):
+        sent.append(text)
+        return {"success": True}
+
+    result = asyncio.run(send_streamed_reply("34600000000", _tokens("Un texto sin punto final", fail_after=6), send))
+
+    assert result["success"] is False
+    assert result["chunks_sent"] == 0
+    assert sent == []
+
+
+def test_streamed_reply_reports_exception_on_final_retry():
+    """Si el reenvío final de lo pendiente lanza una excepción, se informa como fallo en lugar de propagarla"""
+    sent = []
+
+    async def send(to, text):
+        if sent:
+            raise RuntimeError("conexión cortada")
+        sent.append(text)
+        return {"success": False, "error": "429"}
+
+    text = "Primera frase completa. Segunda frase completa."
+    result = asyncio.run(send_streamed_reply("34600000000", _tokens(text), send, first_min_chars=5, min_chars=5))
+
+    assert result["success"] is False
+    assert result["error"] == "conexión cortada"
+    assert result["chunks_sent"] == 0
@@ -0,0 +1,106 @@
+"""
+Pruebas para la caché semántica de respuestas frecuentes
+"""
+from ai.response_cache import SemanticResponseCache
+
+
+def test_paraphrase_hits_and_different_question_misses():
+    """Una variación de la misma pregunta reutiliza la respuesta; una pregunta distinta no"""
+    cache = SemanticResponseCache()
+    entry_id = cache.store("¿Cuánto cuesta una sesión?", "La sesión individual cuesta 60 €.", "es", "payment")
+
+    hit = cache.lookup("Hola, cuanto cuesta la sesion? gracias", "es", "payment")
+    assert hit is not None
+    assert hit.entry_id == entry_id
+    assert hit.answer == "La sesión individual cuesta 60 €."
+
+    assert cache.lookup("¿Cuánto cuesta una sesión de pareja?", "es", "payment") is None
+    assert cache.lookup("¿Cuánto cuesta una sesión?", "ca", "payment") is None
+    assert cache.lookup("¿Cuánto cuesta una sesión?", "es", "info") is None
+    # Una pregunta equivalente no duplica la entrada
+    assert cache.store("cuanto cuesta una sesion", "Otra respuesta", "es", "payment") == entry_id
+    assert cache.get_stats()["entries"] == 1
+
+
+def test_negation_does_not_match_affirmative_question():
+    """Una pregunta negada no reutiliza la respuesta de la afirmativa aunque comparta casi todos los n-gramas"""
+    cache = SemanticResponseCache()
+    entry_id = cache.store("¿Puedo pagar con tarjeta?", "Sí, aceptamos tarjeta.", "es", "payment")
+
+    assert cache.lookup("¿No puedo pagar con tarjeta?", "es", "payment") is None
+    assert cache.lookup("Can't I pay by card?", "es", "payment") is None
+    # Se guarda como entrada propia en lugar de deduplicarse con la afirmativa
+    negated_id = cache.store("¿No puedo pagar con tarjeta?", "Sí que puedes.", "es", "payment")
+    assert negated_id != entry_id
+    assert cache.lookup("no puedo pagar con tarjeta", "es", "payment").entry_id == negated_id
+    assert cache.lookup("puedo pagar con tarjeta", "es", "payment").entry_id == entry_id
+
+
+def test_expired_entries_are_not_served():
+    cache = SemanticResponseCache(ttl=60)
+    entry_id = cache.store("¿Cuál es el horario del centro?", "De 9 a 20 h.", "es", "info")
+    cache._find(entry_id)[1].created_at -= 61
+
+    assert cache.lookup("¿Cuál es el horario del centro?", "es", "info") is None
+    assert cache.get_stats()["expired"] == 1
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_approval_and_invalidation():
+    """Con aprobación obligatoria solo se sirven entradas aprobadas; se pueden invalidar por ID o por PlayBook"""
+    cache = SemanticResponseCache(require_approval=True)
+    entry_id = cache.store("¿Dónde está el centro?", "En la calle Jaume I.", "es", "info")
+    cache.store("¿Cómo puedo pagar?", "Con tarjeta o Bizum.", "es", "payment")
+
+    assert cache.lookup("¿Dónde está el centro?", "es", "info") is None
+    assert cache.approve(entry_id)
+    assert cache.lookup("¿Dónde está el centro?", "es", "info").entry_id == entry_id
+
+    assert cache.invalidate(playbook="payment") == 1
+    assert cache.invalidate(entry_id=entry_id) == 1
+    assert cache.invalidate(entry_id=entry_id) == 0
+    assert cache.list_entries() == []
+
+
+def test_pending_entry_does_not_hide_an_approved_one():
+    """Con aprobación obligatoria, una entrada pendiente más parecida no impide servir la aprobada"""
+    vectors = {"a": {0: 1.0}, "b": {0: 0.6, 1: 0.8}, "q": {0: 0.8, 1: 0.6}}
+    cache = SemanticResponseCache(threshold=0.7, require_approval=True, embed=lambda text: vectors[text])
+    approved_id = cache.store("a", "Respuesta aprobada", "es", "info")
+    pending_id = cache.store("b", "Respuesta pendiente", "es", "info")
+    assert pending_id != approved_id
+    assert cache.approve(approved_id)
+
+    assert cache.lookup("q", "es", "info").entry_id == approved_id
+    # La deduplicación al guardar prefiere también la entrada aprobada
+    assert cache.store("q", "Otra respuesta", "es", "info") == approved_id
+    assert cache.store("b", "Otra respuesta", "es", "info") == pending_id
+
+
+def test_response_cache_only_uses_first_turn_questions(playbook_graph):
+    """Solo la pregunta que abre la conversación se busca o guarda en la caché de respuestas"""
+    from ai.context_window import SUMMARY_KEY
+
+    State, cacheable = playbook_graph.ConversationState, playbook_graph._cacheable_question
+    first = {"role": "user", "content": "¿Cuánto cuesta una sesión?"}
+    assert cacheable(State(messages=[first], current_playbook="payment")) == first["content"]
+    follow_up = [first, {"role": "assistant", "content": "60 €."}, {"role": "user", "content": "¿Y con tarjeta?"}]
+    assert cacheable(State(messages=follow_up, current_playbook="payment")) is None
+    summarized = State(messages=[first], current_playbook="payment", context={SUMMARY_KEY: "Paciente de ansiedad"})
+    assert cacheable(summarized) is None
+    assert cacheable(State(messages=[first], current_playbook="crisis")) is None
+
+
+def test_web_search_answers_are_never_stored(playbook_graph, monkeypatch):
+    """Una respuesta que depende de una búsqueda web no se guarda en la caché"""
+    cache = SemanticResponseCache()
+    monkeypatch.setattr(playbook_graph, "get_response_cache", lambda: cache)
+    question = "¿Cuánto cuesta una sesión?"
+    state = playbook_graph.ConversationState(
+        messages=[{"role": "user", "content": question}], current_playbook="payment", search_results="Tarifas 2025: ..."
+    )
+    playbook_graph._store_cached_response(state, question, "La sesión cuesta 60 €.")
+    assert cache.list_entries() == []
+
+    playbook_graph._store_cached_response(state.copy(update={"search_results": None}), question, "La sesión cuesta 60 €.")
+    assert len(cache.list_entries()) == 1
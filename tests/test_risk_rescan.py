@@ -0,0 +1,58 @@
+"""
+Pruebas para la reevaluación retrospectiva del riesgo
+"""
+import asyncio
+import json
+
+from ai.security.risk_rescan import RetrospectiveRiskScanner
+
+SESSIONS = [
+    {"session_id": "s1", "data": {"messages": [
+        {"role": "user", "content": "Hola, quiero pedir cita"},
+        {"role": "assistant", "content": "Claro, ¿qué día te va bien?"},
+    ]}},
+    {"session_id": "s2", "data": {"language": "en", "messages": [
+        {"role": "user", "content": "I want to kill myself tonight"},
+    ]}},
+    {"session_id": "s3", "data": json.dumps({"history": ["Ya no puedo más, quiero morir"]})},
+]
+
+
+def _make_source(pages, fail_after=None):
+    def source(start_after):
+        async def iterate():
+            start = start_after["session_id"] if start_after else None
+            for number, page in enumerate(pages):
+                if fail_after is not None and number >= fail_after:
+                    raise RuntimeError("conexión perdida")
+                if start is None or page[-1]["session_id"] > start:
+                    yield page
+        return iterate()
+    return source
+
+
+def test_rescan_resumes_from_checkpoint_without_duplicates(tmp_path):
+    """Una ejecución interrumpida se reanuda sin repetir sesiones ni hallazgos"""
+    report_path = str(tmp_path / "risk.jsonl")
+    pages = [SESSIONS[:1], SESSIONS[1:2], SESSIONS[2:]]
+
+    def scanner(source):
+        instance = RetrospectiveRiskScanner(report_path, source, workers=0)
+
+        async def fake_request(text):
+            return {"nivel_alerta": "alto"}
+
+        instance._severity_detector._request_severity_from_claude = fake_request
+        return instance
+
+    failed = asyncio.run(scanner(_make_source(pages, fail_after=2)).run())
+    assert failed["success"] is False and failed["sessions_scanned"] == 2
+
+    result = asyncio.run(scanner(_make_source(pages)).run())
+    assert result["success"] is True
+    assert (result["sessions_scanned"], result["messages_scanned"], result["flagged"]) == (3, 3, 2)
+
+    with open(report_path, encoding="utf-8") as f:
+        findings = [json.loads(line) for line in f]
+    assert [(f["session_id"], f["risk_level"]) for f in findings] == [("s2", "crítico"), ("s3", "medio")]
+    assert findings[0]["detailed_assessment"] == {"nivel_alerta": "alto"}
@@ -0,0 +1,126 @@
+"""
+Pruebas para la caché de sesiones de conversación
+"""
+import asyncio
+
+from database.session_cache import SessionCache
+
+
+class FakeSessionStore:
+    """Almacén en memoria que cuenta lecturas y escrituras"""
+
+    def __init__(self, initial=None, write_delay=None):
+        self.rows = dict(initial or {})
+        self.reads = 0
+        self.writes = 0
+        # Retardo de una escritura según los datos (en iteraciones del event loop)
+        self.write_delay = write_delay or (lambda data: 0)
+
+    async def load(self, session_id):
+        self.reads += 1
+        await asyncio.sleep(0)
+        return self.rows.get(session_id)
+
+    async def save(self, session_id, data):
+        self.writes += 1
+        for _ in range(self.write_delay(data)):
+            await asyncio.sleep(0)
+        self.rows[session_id] = data
+        return True
+
+
+def test_burst_costs_one_read_and_one_upsert():
+    """Una ráfaga de mensajes de la misma sesión produce una lectura y un upsert"""
+    async def scenario():
+        store = FakeSessionStore({"34600000000": {"messages": []}})
+        cache = SessionCache(store.load, store.save)
+
+        for i in range(5):
+            data = await cache.get("34600000000")
+            data["messages"].append({"role": "user", "content": f"mensaje {i}"})
+            cache.put("34600000000", data)
+
+        assert store.reads == 1
+        assert store.writes == 0
+        await cache.flush()
+        return store, cache
+
+    store, cache = asyncio.run(scenario())
+    assert store.writes == 1
+    assert len(store.rows["34600000000"]["messages"]) == 5
+    stats = cache.get_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 4
+    assert stats["writes_coalesced"] == 4
+    assert stats["dirty"] == 0
+
+
+def test_concurrent_misses_are_coalesced():
+    """Lecturas simultáneas de una sesión no cacheada comparten una sola consulta"""
+    async def scenario():
+        store = FakeSessionStore({"s1": {"language": "ca"}})
+        cache = SessionCache(store.load, store.save)
+        results = await asyncio.gather(*(cache.get("s1") for _ in range(10)))
+        return store, results
+
+    store, results = asyncio.run(scenario())
+    assert store.reads == 1
+    assert all(result == {"language": "ca"} for result in results)
+
+
+def test_dirty_entry_is_persisted_on_eviction():
+    """Una entrada pendiente se persiste antes de ser desalojada por LRU"""
+    async def scenario():
+        store = FakeSessionStore()
+        cache = SessionCache(store.load, store.save, max_entries=2)
+        cache.put("a", {"n": 1})
+        cache.put("b", {"n": 2})
+        cache.put("c", {"n": 3})
+        await cache.flush()
+        return store, cache
+
+    store, cache = asyncio.run(scenario())
+    assert store.rows["a"] == {"n": 1}
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get_stats()["entries"] == 2
+
+
+def test_returned_data_is_isolated_from_cache():
+    """Modificar los datos devueltos no altera la copia en caché"""
+    async def scenario():
+        store = FakeSessionStore({"s1": {"messages": []}})
+        cache = SessionCache(store.load, store.save)
+        data = await cache.get("s1")
+        data["messages"].append("sin guardar")
+        return await cache.get("s1")
+
+    assert asyncio.run(scenario()) == {"messages": []}
+
+
+def test_miss_waits_for_in_flight_eviction_write():
+    """Tras desalojar una sesión pendiente, la siguiente lectura no carga la fila anterior de la BD"""
+    async def scenario():
+        store = FakeSessionStore({"a": {"n": 0}}, write_delay=lambda data: 5)
+        cache = SessionCache(store.load, store.save, max_entries=1)
+        cache.put("a", {"n": 1})
+        cache.put("b", {"n": 2})  # Desaloja "a" y lanza su escritura
+        return await cache.get("a"), store
+
+    data, store = asyncio.run(scenario())
+    assert data == {"n": 1}
+    assert store.rows["a"] == {"n": 1}
+
+
+def test_writes_of_one_session_keep_their_order():
+    """Una escritura lenta no sobrescribe a otra posterior de la misma sesión"""
+    async def scenario():
+        store = FakeSessionStore(write_delay=lambda data: 5 if data == {"n": 1} else 0)
+        cache = SessionCache(store.load, store.save, max_entries=1)
+        cache.put("a", {"n": 1})
+        cache.put("b", {})  # Desaloja a={"n": 1} (escritura lenta)
+        cache.put("a", {"n": 2})  # Desaloja b; a={"n": 2} queda pendiente
+        await cache.flush()
+        return store
+
+    store = asyncio.run(scenario())
+    assert store.rows["a"] == {"n": 2}
@@ -0,0 +1,127 @@
+"""
+Pruebas para el almacén acotado de estado en memoria
+"""
+import asyncio
+
+from core.state_store import BoundedStateStore, get_state_store_stats
+
+
+def test_lru_eviction_writes_back_dirty_entries():
+    """Al superar el límite se desaloja la entrada menos usada y, si estaba pendiente, se persiste"""
+    async def scenario():
+        written = {}
+        released = []
+
+        async def writer(key, value):
+            written[key] = value
+            return True
+
+        store = BoundedStateStore("test_lru", max_entries=2, writer=writer, on_evict=lambda k, v: released.append(k))
+        store.put("a", {"n": 1}, dirty=True)
+        store.put("b", {"n": 2})
+        assert store.get("a") == {"n": 1}  # "b" pasa a ser la menos usada
+        store.put("c", {"n": 3})
+        store.put("d", {"n": 4})
+        await store.flush()
+        return store, written, released
+
+    store, written, released = asyncio.run(scenario())
+    assert released == ["b", "a"]
+    assert written == {"a": {"n": 1}}
+    assert list(store) == ["c", "d"]
+    stats = get_state_store_stats()["test_lru"]
+    assert stats["evictions"] == 2
+    assert stats["write_backs"] == 1
+    assert stats["entries"] == 2
+
+
+def test_byte_limit_and_ttl():
+    store = BoundedStateStore("test_bytes", max_bytes=100, ttl_seconds=60, sizer=lambda value: len(value))
+    store.put("a", "x" * 60)
+    store.put("b", "y" * 30)
+    store.resize("b", 50)  # Crece en su sitio: ya no caben las dos
+    assert "a" not in store
+    assert store.get_stats()["bytes"] == 50
+
+    store._entries["b"].expires_at -= 61
+    assert store.get("b") is None
+    assert store.get_stats()["expirations"] == 1
+    assert len(store) == 0
+
+
+def test_failed_flush_keeps_entry_dirty():
+    async def scenario():
+        async def failing_writer(key, value):
+            return False
+
+        store = BoundedStateStore("test_flush", writer=failing_writer)
+        store.put("a", {"n": 1}, dirty=True)
+        persisted = await store.flush()
+        return store, persisted
+
+    store, persisted = asyncio.run(scenario())
+    assert persisted == 0
+    assert store.get_stats()["dirty"] == 1
+    assert store.get_stats()["write_back_errors"] == 1
+
+
+def test_writes_are_ordered_and_awaitable_per_key():
+    """Las escrituras de una clave no se reordenan y wait_for_write espera a la desalojada en curso"""
+    async def scenario():
+        written = []
+
+        async def slow_writer(key, value):
+            for _ in range(5 if value == {"n": 1} else 0):
+                await asyncio.sleep(0)
+            written.append((key, value))
+            return True
+
+        store = BoundedStateStore("test_order", max_entries=1, writer=slow_writer)
+        store.put("a", {"n": 1}, dirty=True)
+        store.put("b", {"n": 0})  # Desaloja "a" con una escritura lenta
+        await store.wait_for_write("a")
+        assert written == [("a", {"n": 1})]
+
+        store.put("a", {"n": 1}, dirty=True)
+        store.put("b", {"n": 0})
+        store.put("a", {"n": 2})
+        assert await store.write("a")  # Espera a la escritura lenta anterior
+        return written, store
+
+    written, store = asyncio.run(scenario())
+    assert written[-2:] == [("a", {"n": 1}), ("a", {"n": 2})]
+    assert store.get_stats()["dirty"] == 0
+
+
+def test_saving_an_evicted_patient_memory_keeps_the_update(monkeypatch):
+    """Si la memoria se desaloja entre get y save, el save persiste el objeto modificado"""
+    from ai.conversation.enhanced_memory import EnhancedMemoryService
+    import database.d1_client as d1_client
+
+    rows = {}
+
+    class FakeDB:
+        async def get_patient_memory(self, user_id):
+            await asyncio.sleep(0)
+            return rows.get(user_id)
+
+        async def save_patient_memory(self, user_id, data):
+            await asyncio.sleep(0)
+            rows[user_id] = data
+            return True
+
+    monkeypatch.setattr(d1_client, "db_client", FakeDB(), raising=False)
+
+    async def scenario():
+        service = EnhancedMemoryService()
+        service.patient_memories.max_entries = 1
+        memory = await service.get_patient_memory("p1")
+        memory.update_personal_info("nombre", "Laia")
+        await service.get_patient_memory("p2")  # Desaloja "p1" (no estaba pendiente)
+        assert await service.save_patient_memory("p1", memory)
+        await service.get_patient_memory("p2")
+        return service, await service.get_patient_memory("p1")
+
+    service, reloaded = asyncio.run(scenario())
+    assert rows["p1"]["personal_info"]["nombre"] == "Laia"
+    assert reloaded.personal_info["nombre"] == "Laia"
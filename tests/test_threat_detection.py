@@ -0,0 +1,96 @@
+"""
+Pruebas para el escaneo en una sola pasada del detector de amenazas
+"""
+import asyncio
+
+from ai.security.threat_detection import ThreatDetector
+
+detector = ThreatDetector()
+
+
+def test_scan_folds_accents_and_respects_word_boundaries():
+    """Las frases se encuentran sin acentos ni mayúsculas, pero no dentro de otras palabras"""
+    scan = detector.scan_message("Ya NO PUEDO MAS, sono la alarma y pense en el suicidio")
+
+    assert scan["high_risk_keywords"] == ["no puedo más", "suicidio"]
+    assert "arma" not in scan["high_risk_keywords"]
+    first = scan["matches"][0]
+    assert (first["start"], first["end"]) == (3, 15)
+
+
+def test_scan_covers_all_languages_and_overlapping_phrases():
+    """Un mensaje con cambio de idioma activa frases de cada idioma, incluidas las solapadas"""
+    message = "Estic fatal, I want to kill myself tonight, ja no aguanto més"
+    scan = detector.scan_message(message)
+
+    assert {"kill myself", "kill"} <= set(scan["high_risk_keywords"])
+    assert {"tonight", "ja no aguanto més"} <= set(scan["contextual_indicators"])
+    assert scan["temporal_urgency"] is True
+    assert {m["language"] for m in scan["matches"]} >= {"en", "ca"}
+
+
+def test_scan_recalls_inflected_forms():
+    """Las formas flexionadas y las raíces ('suicid*') se detectan pese al límite de palabra"""
+    for message, expected in [
+        ("I am thinking about killing myself", {"killing myself", "killing"}),
+        ("I keep hurting myself", {"hurting myself", "hurting"}),
+        ("I feel suicidal", {"suicid"}),
+        ("I'm thinking of jumping off the bridge", {"jumping"}),
+        ("Tengo pensamientos suicidas", {"suicid"}),
+    ]:
+        scan = detector.scan_message(message)
+        assert expected <= set(scan["high_risk_keywords"]), message
+        assert detector.preliminary_risk_level(scan) != "bajo", message
+
+    # La raíz tampoco salta dentro de otra palabra
+    assert detector.scan_message("Es un parasuicidio")["high_risk_keywords"] == []
+
+
+def test_phrases_that_fold_alike_count_once():
+    """Las variantes de una misma frase normalizada ('suicid*'/'suïcid*') no suman dos palabras clave"""
+    for message in ["I feel suicidal", "Tengo pensamientos suicidas", "Tinc idees suïcides"]:
+        scan = detector.scan_message(message)
+        assert len(scan["high_risk_keywords"]) == 1, message
+        assert scan["contextual_indicators"] == [], message
+        assert detector.preliminary_risk_level(scan) == "medio", message
+
+    # Misma frase árabe como palabra clave (sin hamza) y como indicador contextual (con hamza)
+    scan = detector.scan_message("لا أستطيع تحمل المزيد")
+    assert len(scan["high_risk_keywords"]) == 1
+    assert scan["contextual_indicators"] == []
+    assert detector.preliminary_risk_level(scan) == "medio"
+
+
+def test_temporal_words_need_word_boundaries():
+    """'ara' (catalán) no debe activarse dentro de 'para'"""
+    assert detector.scan_message("Esto es para ti")["temporal_urgency"] is False
+
+
+def test_severity_cache_coalesces_and_skips_fallbacks():
+    """Textos equivalentes comparten una sola llamada a Claude y los fallos no se guardan"""
+    local = ThreatDetector()
+    calls = []
+
+    async def fake_request(text):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return None if "error" in text else {"nivel_alerta": "alto"}
+
+    local._request_severity_from_claude = fake_request
+
+    async def scenario():
+        first = await asyncio.gather(
+            local.evaluate_severity_with_claude("Quiero  MORIR"),
+            local.evaluate_severity_with_claude("quiero morir"),
+        )
+        cached = await local.evaluate_severity_with_claude("quiero morír")
+        failed = [await local.evaluate_severity_with_claude("error quiero morir") for _ in range(2)]
+        return first, cached, failed
+
+    first, cached, failed = asyncio.run(scenario())
+
+    assert first == [{"nivel_alerta": "alto"}] * 2 and cached == {"nivel_alerta": "alto"}
+    assert failed[0]["origen"] == "local"
+    assert len(calls) == 3
+    stats = local.get_severity_stats()
+    assert (stats["coalesced"], stats["cache_hits"], stats["local_fallbacks"]) == (1, 1, 2)